@@ -0,0 +1,102 @@
+""" Backups of a synthetic world (region files of compressed chunks, player data): how long saving has to stay
+off while it's staged, and how fast snapshots are stored, first in full and then after some chunks changed.
+Staging uses reflinks if the temporary directory's filesystem has them. Run from the repository root:
+
+    python benchmarks/bench_backup.py [--quick] [--json results.json] [--workers 4]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import zlib
+
+from benchlib import Results
+from minecraft.serverwrapper.backup.repository import REGION_HEADER_SIZE, SECTOR_SIZE, BackupRepository
+from minecraft.serverwrapper.backup.staging import Staging
+
+
+def random_chunk(rng: random.Random) -> bytes:
+    """ Compresses about as well as real chunk NBT does: some noise, many repeated block states
+    """
+    data = rng.randbytes(rng.randint(2000, 6000)) + bytes(rng.randint(20000, 60000))
+    return zlib.compress(data)
+
+
+def write_region(path: str, chunks: dict[int, bytes]) -> None:
+    header = bytearray(REGION_HEADER_SIZE)
+    body = bytearray()
+    sector = REGION_HEADER_SIZE // SECTOR_SIZE
+    for index, data in sorted(chunks.items()):
+        payload = (len(data) + 1).to_bytes(4, 'big') + b'\x02' + data
+        sectors = -(-len(payload) // SECTOR_SIZE)
+        header[index * 4:index * 4 + 4] = ((sector << 8) | sectors).to_bytes(4, 'big')
+        body += payload.ljust(sectors * SECTOR_SIZE, b'\0')
+        sector += sectors
+    with open(path, 'wb') as f:
+        f.write(header + body)
+
+
+def write_world(world_dir: str, regions: int, rng: random.Random) -> dict[str, dict[int, bytes]]:
+    os.makedirs(os.path.join(world_dir, 'region'))
+    os.makedirs(os.path.join(world_dir, 'playerdata'))
+    with open(os.path.join(world_dir, 'level.dat'), 'wb') as f:
+        f.write(rng.randbytes(3000))
+    for i in range(100):
+        with open(os.path.join(world_dir, 'playerdata', f'{i:d}.dat'), 'wb') as f:
+            f.write(rng.randbytes(rng.randint(500, 3000)))
+    world = {}
+    for r in range(regions):
+        path = os.path.join(world_dir, 'region', f'r.{r:d}.0.mca')
+        world[path] = {i: random_chunk(rng) for i in range(1024)}
+        write_region(path, world[path])
+    return world
+
+
+def backup(results: Results, name: str, repository: BackupRepository, staging: Staging) -> None:
+    previous = repository.latest_snapshot()
+    start = time.perf_counter()
+    files = staging.stage(previous)
+    results.add(f'{name}.stage', (time.perf_counter() - start) * 1000, 'ms')
+    start = time.perf_counter()
+    snapshot, stats = repository.store(files, previous)
+    elapsed = time.perf_counter() - start
+    staging.cleanup()
+    results.add(f'{name}.store', elapsed * 1000, 'ms')
+    results.add(f'{name}.store.throughput', stats.bytes_read / (1 << 20) / max(elapsed, 1e-6), 'MiB/s', better='higher')
+    results.add(f'{name}.new', stats.new_bytes / (1 << 20), 'MiB')
+    results.add(f'{name}.stored', stats.stored_bytes / (1 << 20), 'MiB')
+    print('{:s}: {:d} files ({:d} reflinked, {:d} copied, {:d} unchanged), {:d} of {:d} blocks new'.format(
+        name, stats.files, staging.reflinked, staging.copied, staging.unchanged, stats.new_blocks, stats.blocks))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='Smaller runs, for a quick check')
+    parser.add_argument('--workers', type=int, help='Threads for staging, hashing and compressing (default: all CPUs)')
+    parser.add_argument('--json', metavar='PATH', help='Write the results to a JSON file')
+    args = parser.parse_args()
+
+    results = Results('backup')
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory(prefix='bench-backup-') as tmp:
+        world_dir = os.path.join(tmp, 'world')
+        world = write_world(world_dir, 4 if args.quick else 32, rng)
+        # Like the wrapper, which keeps the repository (and staging) in the working directory next to the world
+        repository = BackupRepository(os.path.join(tmp, 'backups'), workers=args.workers)
+        staging = Staging(world_dir, os.path.join(tmp, 'backups', 'staging'), workers=args.workers)
+        backup(results, 'full', repository, staging)
+
+        # A play session: a few percent of the chunks of some regions changed
+        for path, chunks in list(world.items())[::2]:
+            for index in rng.sample(sorted(chunks), 40):
+                chunks[index] = random_chunk(rng)
+            write_region(path, chunks)
+        backup(results, 'incremental', repository, staging)
+        backup(results, 'unchanged', repository, staging)
+    if args.json:
+        results.write_json(args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+""" Startup time of the command line interface, with a budget
+Health checks and cron jobs run the CLI constantly, so commands that don't need the whole wrapper must not import
+it. This measures import time (python -X importtime) and wall time per command, and exits with 1 if a command
+goes over its budget or imports something it shouldn't. Run from the repository root:
+
+    python benchmarks/bench_cli_startup.py [--runs 5] [--budget-scale 1.0] [--top 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Import time budgets in milliseconds. Generous enough for slow CI machines, tight enough to catch the whole
+# wrapper (or pkg_resources) sneaking back into the hot path.
+SCENARIOS = [
+    # name, python arguments, import budget (ms)
+    ('import cli', ['-c', 'import minecraft.serverwrapper.cli'], 120),
+    ('version', ['-m', 'minecraft.serverwrapper.cli', 'version'], 150),
+    ('status', ['-m', 'minecraft.serverwrapper.cli', 'status'], 200),
+    ('config show-default', ['-m', 'minecraft.serverwrapper.cli', 'config', 'show-default'], 150),
+]
+
+# Modules that none of the scenarios above need
+FORBIDDEN_MODULES = [
+    'pkg_resources',
+    'asyncio',
+    'minecraft.serverwrapper.serverwrapper',
+    'minecraft.serverwrapper.serverloop.serverloop',
+]
+
+
+def parse_importtime(stderr: str) -> tuple[float, dict[str, float]]:
+    """ Returns the total import time and the cumulative time per module, in milliseconds
+    """
+    total = 0.0
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        cumulative_ms = int(cumulative) / 1000
+        # Top level imports are indented by a single space
+        if not name.startswith('  '):
+            total += cumulative_ms
+        modules[name.strip()] = cumulative_ms
+    return total, modules
+
+
+def measure(args: list[str], runs: int, cwd: str) -> tuple[float, float, dict[str, float]]:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')])))
+    import_times, wall_times = [], []
+    modules = {}
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-X', 'importtime'] + args, capture_output=True, text=True, env=env, cwd=cwd)
+        total, modules = parse_importtime(result.stderr)
+        import_times.append(total)
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, capture_output=True, env=env, cwd=cwd)
+        wall_times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(import_times), statistics.median(wall_times), modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-scale', type=float, default=1.0, help='Multiply all budgets, for slow machines')
+    parser.add_argument('--top', type=int, default=0, help='Show the slowest imports of each command')
+    args = parser.parse_args()
+
+    # A directory without a minecraft.yaml, so "status" reads the default configuration
+    cwd = os.path.join(os.getcwd(), 'benchmarks')
+    failures = []
+    print('{:22s} {:>10s} {:>10s} {:>10s}'.format('', 'import ms', 'budget', 'wall ms'))
+    for name, python_args, budget in SCENARIOS:
+        import_ms, wall_ms, modules = measure(python_args, args.runs, cwd)
+        budget *= args.budget_scale
+        print('{:22s} {:10.1f} {:10.0f} {:10.1f}'.format(name, import_ms, budget, wall_ms))
+        if import_ms > budget:
+            failures.append(f'{name}: imports take {import_ms:.1f}ms, budget is {budget:.0f}ms')
+        for module in FORBIDDEN_MODULES:
+            if module in modules:
+                failures.append(f'{name}: imports {module}')
+        if args.top:
+            for module, ms in sorted(modules.items(), key=lambda x: -x[1])[:args.top]:
+                print('    {:50s} {:8.1f}'.format(module, ms))
+    for failure in failures:
+        print('FAIL ' + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
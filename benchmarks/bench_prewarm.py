@@ -0,0 +1,105 @@
+""" Cold server startup with and without page cache prewarming: a synthetic instance (launcher jar, libraries,
+mods and a world with player data) is evicted from the page cache with posix_fadvise(DONTNEED), then read like
+a starting server does, in small reads with some work in between, once plainly and once while the Prewarmer
+runs next to it. Only meaningful on a real disk: a filesystem in memory has nothing to gain. Run from the
+repository root:
+
+    python benchmarks/bench_prewarm.py [--quick] [--json results.json] [--work-us 20]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from benchlib import Results
+from minecraft.serverwrapper.prewarm import Prewarmer
+from minecraft.serverwrapper.world.region import write_region
+
+READ_SIZE = 64 * 1024
+
+
+def write_file(path: str, size: int, rng: random.Random) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(rng.randbytes(size))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def write_instance(working_dir: str, mibs: int, rng: random.Random) -> list[str]:
+    """ The files a starting server reads, in the order it reads them
+    """
+    files = [os.path.join(working_dir, 'server.jar')]
+    write_file(files[0], 1 << 20, rng)
+    for i in range(mibs // 4):
+        files.append(os.path.join(working_dir, 'libraries', f'lib{i:03d}.jar'))
+        write_file(files[-1], 1 << 20, rng)
+    for i in range(mibs // 2):
+        files.append(os.path.join(working_dir, 'mods', f'mod{i:03d}.jar'))
+        write_file(files[-1], 1 << 20, rng)
+    world_dir = os.path.join(working_dir, 'world')
+    os.makedirs(os.path.join(world_dir, 'region'))
+    for x in (-1, 0):
+        for z in (-1, 0):
+            path = os.path.join(world_dir, 'region', f'r.{x:d}.{z:d}.mca')
+            # Chunks of 8 KiB, the spawn is at the corner of these four regions
+            write_region(path, [(i, (8191).to_bytes(4, 'big') + b'\x02' + rng.randbytes(8187), 0) for i in range(1024)])
+            with open(path, 'rb+') as f:
+                os.fsync(f.fileno())
+            files.append(path)
+    return files
+
+
+def evict(files: list[str]) -> None:
+    for path in files:
+        with open(path, 'rb') as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def start_server(files: list[str], work_us: float) -> float:
+    """ Reads the files like a starting server would, returns how long that took
+    """
+    start = time.perf_counter()
+    for path in files:
+        with open(path, 'rb') as f:
+            while f.read(READ_SIZE):
+                end = time.perf_counter() + work_us / 1e6
+                while time.perf_counter() < end:
+                    pass
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='Smaller runs, for a quick check')
+    parser.add_argument('--work-us', type=float, default=20.0, help='Busy time after each 64 KiB read, in µs')
+    parser.add_argument('--json', metavar='PATH', help='Write the results to a JSON file')
+    args = parser.parse_args()
+
+    results = Results('prewarm')
+    rng = random.Random(1)
+    runs = 2 if args.quick else 5
+    # Next to the benchmarks rather than in /tmp, which often is in memory
+    with tempfile.TemporaryDirectory(prefix='bench-prewarm-', dir=os.path.dirname(os.path.abspath(__file__))) as tmp:
+        files = write_instance(tmp, 32 if args.quick else 256, rng)
+        prewarmer = Prewarmer(tmp, files[0], os.path.join(tmp, 'world'), 1 << 40, radius=12, max_players=0)
+        cold = []
+        prewarmed = []
+        for _ in range(runs):
+            evict(files)
+            cold.append(start_server(files, args.work_us))
+            evict(files)
+            thread = threading.Thread(target=prewarmer.run)
+            thread.start()
+            prewarmed.append(start_server(files, args.work_us))
+            thread.join()
+        results.add_samples('cold', [seconds * 1000 for seconds in cold], 'ms')
+        results.add_samples('prewarmed', [seconds * 1000 for seconds in prewarmed], 'ms')
+    if args.json:
+        results.write_json(args.json)
+
+
+if __name__ == '__main__':
+    main()
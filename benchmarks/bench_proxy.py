@@ -0,0 +1,144 @@
+""" Throughput and latency of the game port relay, compared to a direct connection
+A local echo server stands in for the minecraft server. Run from the repository root:
+
+    python benchmarks/bench_proxy.py [--mibs 256] [--pings 5000]
+"""
+import argparse
+import logging
+import socket
+import statistics
+import threading
+import time
+
+from minecraft.serverwrapper.frontend.proxy import HAVE_SPLICE, Relay
+from minecraft.serverwrapper.serverloop.objects import WaitingObject
+from minecraft.serverwrapper.serverloop.serverloop import ServerLoop
+
+CHUNK = 1 << 16
+
+
+def listen() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(16)
+    return sock
+
+
+def echo_server(sock: socket.socket) -> None:
+    def handle(conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with conn:
+            while data := conn.recv(CHUNK):
+                conn.sendall(data)
+
+    while True:
+        try:
+            conn, _ = sock.accept()
+        except OSError:
+            return
+        threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+
+class Acceptor(WaitingObject):
+    def __init__(self, serverloop: ServerLoop, sock: socket.socket, upstream: tuple[str, int], zero_copy: bool):
+        super().__init__(name='bench-acceptor')
+        self._serverloop = serverloop
+        self._sock = sock
+        self._upstream = upstream
+        self._zero_copy = zero_copy
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def is_waiting_to_receive(self):
+        return True
+
+    def do_receive(self):
+        conn, _ = self._sock.accept()
+        Relay(self._serverloop, conn, self._upstream, zero_copy=self._zero_copy)
+
+
+def start_proxy(upstream: tuple[str, int], zero_copy: bool) -> tuple[tuple[str, int], ServerLoop]:
+    sock = listen()
+    sl = ServerLoop()
+    sl.add_waiting_object(Acceptor(sl, sock, upstream, zero_copy))
+    threading.Thread(target=sl.run, daemon=True).start()
+    return sock.getsockname(), sl
+
+
+def stop_proxy(address: tuple[str, int], sl: ServerLoop) -> None:
+    sl.stop()
+    # Wake up the loop
+    socket.create_connection(address).close()
+
+
+def measure_throughput(address: tuple[str, int], mibs: int) -> float:
+    total = mibs << 20
+    payload = b'x' * CHUNK
+    sock = socket.create_connection(address)
+
+    def sender():
+        sent = 0
+        while sent < total:
+            sent += sock.send(payload[:min(CHUNK, total - sent)])
+
+    start = time.perf_counter()
+    thread = threading.Thread(target=sender)
+    thread.start()
+    received = 0
+    while received < total:
+        received += len(sock.recv(CHUNK))
+    elapsed = time.perf_counter() - start
+    thread.join()
+    sock.close()
+    return mibs / elapsed
+
+
+def measure_latency(address: tuple[str, int], pings: int) -> list[float]:
+    sock = socket.create_connection(address)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    message = b'p' * 64
+    rtts = []
+    for _ in range(pings):
+        start = time.perf_counter()
+        sock.sendall(message)
+        received = 0
+        while received < len(message):
+            received += len(sock.recv(len(message)))
+        rtts.append((time.perf_counter() - start) * 1e6)
+    sock.close()
+    return rtts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mibs', type=int, default=256, help='MiB to echo for the throughput test')
+    parser.add_argument('--pings', type=int, default=5000, help='Round trips for the latency test')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    echo = listen()
+    threading.Thread(target=echo_server, args=(echo,), daemon=True).start()
+    upstream = echo.getsockname()
+
+    variants = [('direct', None), ('relay (buffers)', False)]
+    if HAVE_SPLICE:
+        variants.append(('relay (splice)', True))
+
+    print('{:18s} {:>12s} {:>10s} {:>10s} {:>10s}'.format('', 'MiB/s', 'p50 us', 'p99 us', 'max us'))
+    for name, zero_copy in variants:
+        if zero_copy is None:
+            address, sl = upstream, None
+        else:
+            address, sl = start_proxy(upstream, zero_copy)
+        throughput = measure_throughput(address, args.mibs)
+        rtts = sorted(measure_latency(address, args.pings))
+        print('{:18s} {:12.1f} {:10.1f} {:10.1f} {:10.1f}'.format(
+            name, throughput, statistics.median(rtts), rtts[int(len(rtts) * 0.99)], rtts[-1]))
+        if sl is not None:
+            stop_proxy(address, sl)
+
+
+if __name__ == '__main__':
+    main()
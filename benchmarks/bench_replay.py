@@ -0,0 +1,113 @@
+""" Replays recorded server output (wrapper.record-output) through the line buffers, the log parser and the
+wrapper's handlers, to measure them against real traffic. Without a recording, replays a synthetic one.
+Run from the repository root:
+
+    python benchmarks/bench_replay.py [recording.rec.gz] [--speed 10] [--json results.json]
+
+The recording is replayed at maximum speed, and with --speed also at that many times its recorded speed on a
+server loop, to see whether the wrapper keeps up with the traffic.
+"""
+import argparse
+import collections
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+from bench_serverloop import synthetic_log
+from benchlib import Results
+from minecraft.serverwrapper.logparser import MinecraftLogParser
+from minecraft.serverwrapper.serverloop.buffers import LineInputBuffer
+from minecraft.serverwrapper.serverloop.recording import STDERR, STDOUT, Replay, StreamRecorder, feed_recording, \
+    read_recording
+from minecraft.serverwrapper.serverloop.serverloop import ServerLoop
+from minecraft.serverwrapper.serverwrapper import MinecraftServerWrapper
+
+
+def write_synthetic_recording(path: str, lines: int, seed: int = 1) -> None:
+    """ Bursts of a few to a few hundred lines, as a pipe would deliver them, over about a minute per 10k lines
+    """
+    rng = random.Random(seed)
+    log = synthetic_log(lines, seed)
+    recorder = StreamRecorder(path)
+    offset_ns = 0
+    pos = 0
+    while pos < len(log):
+        burst = rng.choice([1, 2, 5, 20, 200])
+        recorder.record(STDOUT, ''.join(line + '\n' for line in log[pos:pos + burst]), offset_ns)
+        pos += burst
+        offset_ns += int(rng.expovariate(1 / (6e6 * burst)))
+    recorder.close()
+
+
+def parser_targets(callback) -> dict:
+    parser = MinecraftLogParser(callback)
+    stdout = LineInputBuffer(None, parser.add_line, name='replay-stdout')
+    stderr = LineInputBuffer(None, lambda line: None, name='replay-stderr')
+    return {STDOUT: stdout.feed, STDERR: stderr.feed}
+
+
+def wrapper_targets(working_dir: str) -> dict:
+    wrapper = MinecraftServerWrapper({
+        'minecraft': {'server': {'broadcast-to-lan': False}},
+        'wrapper': {'java-executable-path': sys.executable, 'working-directory': working_dir, 'reload-config': False},
+    })
+    stdout = LineInputBuffer(None, wrapper.handle_minecraft_server_output, name='replay-stdout')
+    stderr = LineInputBuffer(None, wrapper.handle_minecraft_server_stderr, name='replay-stderr')
+    return {STDOUT: stdout.feed, STDERR: stderr.feed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording', nargs='?', help='Recording to replay (default: a synthetic one)')
+    parser.add_argument('--lines', type=int, default=200000, help='Lines of the synthetic recording')
+    parser.add_argument('--speed', type=float, help='Also replay at this many times the recorded speed')
+    parser.add_argument('--json', metavar='PATH', help='Write the results to a JSON file')
+    args = parser.parse_args()
+    # The wrapper logs every server line, like it would to a terminal
+    logging.basicConfig(level=logging.INFO, stream=open(os.devnull, 'w'))
+
+    results = Results('replay')
+    with tempfile.TemporaryDirectory(prefix='bench-replay-') as tmp:
+        path = args.recording
+        if path is None:
+            path = os.path.join(tmp, 'synthetic.rec')
+            write_synthetic_recording(path, args.lines)
+        start = time.perf_counter()
+        chunks = list(read_recording(path))
+        results.add('read', len(chunks) / (time.perf_counter() - start), 'chunks/s', better='higher')
+        lines = sum(chunk.data.count('\n') for chunk in chunks)
+        duration = chunks[-1].offset if chunks else 0.0
+        print('{:d} chunks, {:d} lines, {:.1f}s recorded'.format(len(chunks), lines, duration))
+
+        # The same recording always gives the same messages, check that while measuring
+        kinds = collections.Counter()
+        targets = parser_targets(lambda message: kinds.update([type(message).__name__]))
+        start = time.perf_counter()
+        feed_recording(chunks, targets)
+        results.add('max_speed.parser', lines / (time.perf_counter() - start), 'lines/s', better='higher')
+        print(', '.join('{:s}: {:d}'.format(kind, count) for kind, count in sorted(kinds.items())))
+
+        targets = wrapper_targets(os.path.join(tmp, 'server'))
+        start = time.perf_counter()
+        feed_recording(chunks, targets)
+        results.add('max_speed.wrapper', lines / (time.perf_counter() - start), 'lines/s', better='higher')
+
+        if args.speed is not None:
+            sl = ServerLoop()
+            targets = wrapper_targets(os.path.join(tmp, 'server'))
+            replay = sl.add_waiting_object(Replay(chunks, targets, speed=args.speed, name='bench-replay'))
+            start = time.perf_counter()
+            sl.run()
+            elapsed = time.perf_counter() - start
+            results.add(f'speed={args.speed:g}.lag.max', replay.max_lag * 1000, 'ms')
+            # Above 1 if the wrapper couldn't keep up
+            results.add(f'speed={args.speed:g}.slowdown', elapsed / max(duration / args.speed, 1e-3), 'x')
+    if args.json:
+        results.write_json(args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+""" Hot paths of the server loop: loop overhead, timer accuracy, pipe buffers, console output, the log parser and metrics
+Writes the results as JSON with --json, compare two runs with benchlib.py. Run from the repository root:
+
+    python benchmarks/bench_serverloop.py [--quick] [--json results.json] [--only timers] [--log latest.log]
+"""
+import argparse
+import fcntl
+import logging
+import os
+import random
+import socket
+import threading
+import time
+
+from benchlib import Results
+from minecraft.serverwrapper.logparser import MinecraftLogParser
+from minecraft.serverwrapper.metrics import WrapperMetrics
+from minecraft.serverwrapper.serverloop.buffers import ConsoleBuffer, LineInputBuffer, OutputBuffer
+from minecraft.serverwrapper.serverloop.objects import WaitingObject
+from minecraft.serverwrapper.serverloop.serverloop import ServerLoop
+from minecraft.serverwrapper.util.logging import ConsoleLogHandler
+
+F_SETPIPE_SZ = 1031
+
+
+class Spinner(WaitingObject):
+    """ Always readable, so every loop iteration calls it without waiting in select
+    """
+    def __init__(self, serverloop: ServerLoop, iterations: int):
+        super().__init__(name='bench-spinner')
+        self._serverloop = serverloop
+        self._iterations = iterations
+        self._count = 0
+        self._a, self._b = socket.socketpair()
+        self._b.send(b'x')
+        self.started = None
+        self.elapsed = None
+
+    def fileno(self):
+        return self._a.fileno()
+
+    def is_waiting_to_receive(self):
+        return True
+
+    def do_receive(self):
+        if self._count == 0:
+            self.started = time.perf_counter()
+        self._count += 1
+        if self._count > self._iterations:
+            self.elapsed = time.perf_counter() - self.started
+            self._serverloop.stop()
+
+    def close(self):
+        self._a.close()
+        self._b.close()
+
+
+class IdleSocket(WaitingObject):
+    """ Waits for data that never comes
+    """
+    def __init__(self):
+        super().__init__(name='bench-idle')
+        self._a, self._b = socket.socketpair()
+
+    def fileno(self):
+        return self._a.fileno()
+
+    def is_waiting_to_receive(self):
+        return True
+
+    def ignore_when_idle(self):
+        return True
+
+    def close(self):
+        self._a.close()
+        self._b.close()
+
+
+def bench_loop_overhead(results: Results, quick: bool) -> None:
+    iterations = 2000 if quick else 20000
+    for kind, counts in (('timers', [0, 10, 100, 1000]), ('sockets', [10, 100, 250])):
+        for n in counts:
+            sl = ServerLoop()
+            idle = []
+            for _ in range(n):
+                if kind == 'timers':
+                    sl.call_repeatedly(3600.0, lambda: None, name='bench-timer')
+                else:
+                    idle.append(sl.add_waiting_object(IdleSocket()))
+            spinner = sl.add_waiting_object(Spinner(sl, iterations))
+            sl.run()
+            results.add(f'loop.iteration.{kind}={n}', spinner.elapsed / iterations * 1e6, 'us')
+            spinner.close()
+            for obj in idle:
+                obj.close()
+
+
+def bench_timers(results: Results, quick: bool) -> None:
+    count = 3 if quick else 10
+    for delay in (0.01, 0.05, 0.2, 0.5):
+        sl = ServerLoop()
+        lateness = []
+
+        def schedule():
+            target = time.time() + delay
+
+            def fire():
+                lateness.append((time.time() - target) * 1000)
+                if len(lateness) < count:
+                    schedule()
+            sl.call_after(delay, fire, name='bench-call-after')
+        schedule()
+        sl.run()
+        results.add_samples(f'timer.call_after.{delay * 1000:.0f}ms.late', lateness, 'ms')
+
+    for interval in (0.05, 0.25):
+        firings = 10 if quick else 40
+        sl = ServerLoop()
+        times = []
+
+        def tick():
+            times.append(time.time())
+            if len(times) > firings:
+                return False
+        start = time.time()
+        sl.call_repeatedly(interval, tick, name='bench-repeatedly')
+        sl.run()
+        periods = [(b - a) * 1000 for a, b in zip([start] + times, times)]
+        results.add_samples(f'timer.call_repeatedly.{interval * 1000:.0f}ms.period', periods, 'ms')
+        # The next target is set when a callback fires, so lateness accumulates
+        results.add(f'timer.call_repeatedly.{interval * 1000:.0f}ms.drift', ((times[-1] - start) / len(times) - interval) * 1000, 'ms/firing')
+
+
+def bench_line_input(results: Results, quick: bool) -> None:
+    total_bytes = (1 if quick else 8) << 20
+    for line_length in (40, 200, 2000):
+        for burst in (1, 100, 1000):
+            line = ('x' * (line_length - 1) + '\n').encode()
+            lines = max(burst, total_bytes // line_length // burst * burst)
+            if burst == 1:
+                lines = min(lines, 20000 if quick else 100000)
+            chunk = line * burst
+            r, w = os.pipe()
+            received = 0
+
+            def on_line(_):
+                nonlocal received
+                received += 1
+
+            def writer():
+                for _ in range(lines // burst):
+                    os.write(w, chunk)
+                os.close(w)
+
+            sl = ServerLoop()
+            sl.add_waiting_object(LineInputBuffer(os.fdopen(r, 'r'), on_line, name='bench-input'))
+            start = time.perf_counter()
+            thread = threading.Thread(target=writer)
+            thread.start()
+            sl.run()
+            elapsed = time.perf_counter() - start
+            thread.join()
+            assert received == lines, (received, lines)
+            results.add(f'line_input.{line_length}b.burst={burst}', lines / elapsed, 'lines/s', better='higher')
+
+
+def bench_output(results: Results, quick: bool) -> None:
+    total_bytes = (2 if quick else 16) << 20
+    time_limit = 10.0 if quick else 30.0
+    loop_logger = logging.getLogger('minecraft.serverwrapper.serverloop.serverloop')
+    for chunk_size, pipe_size, slow_reader in ((100, None, False), (4096, None, False), (100, 4096, True), (65536, 4096, True)):
+        chunk = 'y' * (chunk_size - 1) + '\n'
+        chunks = total_bytes // chunk_size
+        r, w = os.pipe()
+        if pipe_size is not None:
+            fcntl.fcntl(w, F_SETPIPE_SZ, pipe_size)
+        received = 0
+
+        def reader():
+            nonlocal received
+            while data := os.read(r, 4096 if slow_reader else 1 << 16):
+                received += len(data)
+            os.close(r)
+
+        sent = 0
+        errors = 0
+        # Like the server's stdin
+        handle = os.fdopen(w, 'w', buffering=1)
+        output = OutputBuffer(handle, name='bench-output')
+
+        def refill():
+            # Like a console: commands are added while earlier ones are still being written
+            nonlocal sent
+            while output.buffer_size() < 1 << 16 and sent < chunks:
+                output.send(chunk)
+                sent += 1
+            if sent == chunks:
+                output.close()
+        output._callback = refill
+
+        class ErrorCounter(logging.Handler):
+            def emit(self, record):
+                nonlocal errors
+                errors += 1
+        counter = ErrorCounter(logging.ERROR)
+        loop_logger.addHandler(counter)
+        loop_logger.setLevel(logging.ERROR)
+        loop_logger.propagate = False
+        sl = ServerLoop()
+        sl.add_waiting_object(output)
+        deadline = time.time() + time_limit
+        sl.call_repeatedly(0.1, lambda: (output.is_done() or time.time() > deadline) and sl.stop(), name='bench-deadline')
+        refill()
+        thread = threading.Thread(target=reader)
+        start = time.perf_counter()
+        thread.start()
+        sl.run()
+        try:
+            handle.close()
+        except OSError:
+            # Closes the pipe anyway, just couldn't flush
+            pass
+        thread.join()
+        elapsed = time.perf_counter() - start
+        loop_logger.removeHandler(counter)
+        loop_logger.propagate = True
+        name = f'output.{chunk_size}b' + (f'.pipe={pipe_size}' if pipe_size else '') + ('.slow_reader' if slow_reader else '')
+        results.add(name + '.throughput', min(received, total_bytes) / elapsed / (1 << 20), 'MiB/s', better='higher')
+        # Anything but 0 means lost or repeated data
+        results.add(name + '.mismatch', abs(received - total_bytes) / (1 << 20), 'MiB')
+        results.add(name + '.send_errors', errors, 'errors')
+
+
+def bench_console(results: Results, quick: bool) -> None:
+    lines = 20000 if quick else 200000
+    batch = 100
+    formatter = logging.Formatter(style='{', fmt='{asctime} {levelname:10} {message}')
+    record = logging.LogRecord('bench', logging.INFO, __file__, 1, 'Saving chunks for level \'ServerLevel[world]\'', None, None)
+    # direct: a StreamHandler writing to the pipe, as without the console buffer. It would hang when stalled.
+    for mode in ('direct', 'buffered', 'stalled'):
+        r, w = os.pipe()
+        stream = os.fdopen(w, 'w')
+        thread = threading.Thread(target=lambda: all(iter(lambda: os.read(r, 1 << 16), b'')))
+        if mode != 'stalled':
+            thread.start()
+        if mode == 'direct':
+            handler = logging.StreamHandler(stream)
+        else:
+            console = ConsoleBuffer(stream, name='bench-console')
+            handler = ConsoleLogHandler(console)
+        handler.setFormatter(formatter)
+        sl = ServerLoop()
+        emitted = 0
+
+        def emit():
+            # Like the log lines of one read from the server's stdout
+            nonlocal emitted
+            for _ in range(batch):
+                handler.handle(record)
+            emitted += batch
+            return emitted < lines
+        sl.call_repeatedly(0.0, emit, name='bench-emit')
+        if mode != 'direct':
+            sl.add_waiting_object(console)
+        sl.run()
+        # Busy time of the loop (formatting and writing), not the waits between iterations
+        results.add(f'console.{mode}', sl.stats.busy_seconds / lines * 1e6, 'us/line')
+        if mode == 'stalled':
+            results.add('console.stalled.dropped', console.dropped_lines / lines * 100, '%')
+            thread.start()
+        if mode != 'direct':
+            console.drain(10.0)
+            console.close()
+        stream.close()
+        thread.join()
+
+
+def synthetic_log(lines: int, seed: int = 1) -> list[str]:
+    """ A server log with a plausible mix of lines: startup noise, chatter, players and the odd warning
+    """
+    rng = random.Random(seed)
+    log = ['Starting net.fabricmc.loader.impl.game.minecraft.BundlerClassPathCapture']
+    players = ['Steve', 'Alex', 'Notch_', 'xX_Builder_Xx']
+    templates = [
+        (60, 'Server thread/INFO', '<{player}> {chat}'),
+        (15, 'Server thread/INFO', 'Saving chunks for level \'ServerLevel[world]\'/minecraft:overworld'),
+        (8, 'Worker-Main-3/WARN', 'Received passengers for unknown entity'),
+        (4, 'Server thread/WARN', 'Can\'t keep up! Is the server overloaded? Running {ms}ms or {ticks} ticks behind'),
+        (4, 'User Authenticator #1/INFO', 'UUID of player {player} is 8667ba71-b85a-4004-af54-457a9734eed7'),
+        (4, 'Server thread/INFO', '{player} joined the game'),
+        (4, 'Server thread/INFO', '{player} left the game'),
+        (1, 'Server thread/INFO', 'Done (12.345s)! For help, type "help"'),
+    ]
+    weights = [t[0] for t in templates]
+    for _ in range(lines - 1):
+        _, thread, text = rng.choices(templates, weights)[0]
+        text = text.format(player=rng.choice(players), chat='hello ' * rng.randint(1, 12), ms=rng.randint(2000, 9000),
+            ticks=rng.randint(40, 180))
+        log.append(f'[12:34:56] [{thread}]: {text}')
+        if rng.random() < 0.01:
+            # Stack traces and other continuation lines
+            log.append('\tat net.minecraft.server.MinecraftServer.runServer(MinecraftServer.java:123)')
+    return log
+
+
+def bench_log_parser(results: Results, quick: bool, log_path: str = None) -> None:
+    if log_path is not None:
+        with open(log_path, 'r', errors='replace') as f:
+            lines = f.read().splitlines()
+        name = 'logparser.recorded'
+    else:
+        lines = synthetic_log(50000 if quick else 300000)
+        name = 'logparser.synthetic'
+    parser = MinecraftLogParser(lambda message: None)
+    start = time.perf_counter()
+    for line in lines:
+        parser.add_line(line)
+    elapsed = time.perf_counter() - start
+    results.add(name, len(lines) / elapsed, 'lines/s', better='higher')
+
+
+def bench_metrics(results: Results, quick: bool) -> None:
+    iterations = 2000 if quick else 20000
+    metrics = WrapperMetrics('1.19.2')
+    metrics.set_state('running')
+    for level in ('INFO', 'WARN', 'ERROR'):
+        metrics.log_messages.inc(1, level)
+    for name, change in (('cached', lambda i: None), ('one_change', lambda i: metrics.log_messages.inc(1, 'INFO')),
+            ('polled_change', lambda i: metrics.wrapper_cpu.set(float(i)))):
+        start = time.perf_counter()
+        for i in range(iterations):
+            change(i)
+            metrics.render()
+        results.add(f'metrics.render.{name}', (time.perf_counter() - start) / iterations * 1e6, 'us')
+
+
+BENCHMARKS = {
+    'loop': bench_loop_overhead,
+    'timers': bench_timers,
+    'line-input': bench_line_input,
+    'output': bench_output,
+    'console': bench_console,
+    'logparser': bench_log_parser,
+    'metrics': bench_metrics,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='Smaller runs, for a quick check')
+    parser.add_argument('--json', metavar='PATH', help='Write the results to a JSON file')
+    parser.add_argument('--only', action='append', choices=list(BENCHMARKS), help='Run only these benchmarks')
+    parser.add_argument('--log', metavar='PATH', help='Recorded server log for the log parser benchmark')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+
+    results = Results('serverloop')
+    for name, benchmark in BENCHMARKS.items():
+        if args.only and name not in args.only:
+            continue
+        if name == 'logparser':
+            benchmark(results, args.quick, args.log)
+        else:
+            benchmark(results, args.quick)
+    if args.json:
+        results.write_json(args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+""" Analyzing and pruning a synthetic world (region files of compressed chunks with an InhabitedTime): reports
+only read the mapped region headers, pruning decompresses every chunk in a pool of processes. Also reading
+player data, lazily (only what's asked for is decoded) against decoding all of it. Run from the repository root:
+
+    python benchmarks/bench_world.py [--quick] [--json results.json]
+"""
+import argparse
+import gzip
+import os
+import random
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+
+from benchlib import Results
+from minecraft.serverwrapper.world import nbt
+from minecraft.serverwrapper.world.analyze import analyze_world, region_age_map
+from minecraft.serverwrapper.world.level import read_players
+from minecraft.serverwrapper.world.prune import prune_world
+from minecraft.serverwrapper.world.region import write_region
+
+
+def tag_name(name: str) -> bytes:
+    return len(name).to_bytes(2, 'big') + name.encode('utf-8')
+
+
+def random_chunk(rng: random.Random, ticks: int) -> bytes:
+    """ A chunk as stored in a region file: length, compression type and zlib compressed NBT
+    """
+    noise = rng.randbytes(rng.randint(2000, 6000)) + bytes(rng.randint(20000, 60000))
+    data = (b'\x0a' + tag_name('') + b'\x04' + tag_name('InhabitedTime') + struct.pack('>q', ticks)
+        + b'\x07' + tag_name('Sections') + struct.pack('>i', len(noise)) + noise + b'\x00')
+    compressed = zlib.compress(data)
+    return (len(compressed) + 1).to_bytes(4, 'big') + b'\x02' + compressed
+
+
+def write_world(world_dir: str, regions: int, rng: random.Random) -> None:
+    os.makedirs(os.path.join(world_dir, 'region'))
+    now = int(time.time())
+    for r in range(regions):
+        # Mostly chunks players only passed through
+        chunks = [(i, random_chunk(rng, rng.choice((0, 0, 40, 200, 20000))), now - rng.randint(0, 400 * 86400))
+            for i in range(1024)]
+        write_region(os.path.join(world_dir, 'region', f'r.{r % 8:d}.{r // 8:d}.mca'), chunks)
+
+
+def player_data(rng: random.Random, i: int) -> bytes:
+    """ Roughly the shape of a real player's file: a few values, a full inventory with item tags and a large
+    recipe book
+    """
+    def item(slot: int) -> bytes:
+        lore = b'\x09' + tag_name('Lore') + b'\x08' + struct.pack('>i', 10) + b''.join(tag_name('x' * rng.randint(20, 80)) for _ in range(10))
+        return (b'\x01' + tag_name('Slot') + bytes([slot]) + b'\x08' + tag_name('id') + tag_name('minecraft:stone')
+            + b'\x01' + tag_name('Count') + bytes([64]) + b'\x0a' + tag_name('tag') + lore + b'\x00\x00')
+    recipes = [tag_name(f'minecraft:recipe_{k:d}') for k in range(1000)]
+    data = (b'\x0a' + tag_name('')
+        + b'\x08' + tag_name('Dimension') + tag_name('minecraft:overworld')
+        + b'\x09' + tag_name('Pos') + b'\x06' + struct.pack('>i3d', 3, i * 1.5, 64.0, -i * 2.5)
+        + b'\x05' + tag_name('Health') + struct.pack('>f', 20.0)
+        + b'\x03' + tag_name('XpLevel') + struct.pack('>i', i)
+        + b'\x09' + tag_name('Inventory') + b'\x0a' + struct.pack('>i', 36) + b''.join(item(slot) for slot in range(36))
+        + b'\x0a' + tag_name('recipeBook') + b'\x09' + tag_name('recipes') + b'\x08' + struct.pack('>i', len(recipes))
+        + b''.join(recipes) + b'\x00'
+        + b'\x00')
+    return gzip.compress(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='Smaller runs, for a quick check')
+    parser.add_argument('--json', metavar='PATH', help='Write the results to a JSON file')
+    args = parser.parse_args()
+
+    results = Results('world')
+    rng = random.Random(1)
+    regions = 4 if args.quick else 32
+    with tempfile.TemporaryDirectory(prefix='bench-world-') as tmp:
+        original = os.path.join(tmp, 'original')
+        write_world(original, regions, rng)
+
+        start = time.perf_counter()
+        reports = analyze_world(original)
+        region_age_map(reports[0], time.time())
+        results.add('analyze', (time.perf_counter() - start) * 1000 / regions, 'ms/region')
+
+        for workers in sorted({1, os.cpu_count() or 1}):
+            start = time.perf_counter()
+            prune_world(original, 1200, [], workers=workers)
+            results.add(f'prune.scan.{workers:d}', (time.perf_counter() - start) * 1000 / regions, 'ms/region')
+
+        world_dir = os.path.join(tmp, 'world')
+        shutil.copytree(original, world_dir)
+        start = time.perf_counter()
+        pruned = prune_world(world_dir, 1200, [], dry_run=False)
+        results.add('prune.apply', (time.perf_counter() - start) * 1000 / regions, 'ms/region')
+        results.add('prune.freed', sum(r.bytes_before - r.bytes_after for r in pruned) / (1 << 20), 'MiB', better='higher')
+
+        os.makedirs(os.path.join(world_dir, 'playerdata'))
+        players = 50 if args.quick else 500
+        for i in range(players):
+            with open(os.path.join(world_dir, 'playerdata', f'{i:08x}-0000-0000-0000-000000000000.dat'), 'wb') as f:
+                f.write(player_data(rng, i))
+        paths = [os.path.join(world_dir, 'playerdata', name) for name in os.listdir(os.path.join(world_dir, 'playerdata'))]
+        start = time.perf_counter()
+        for path in paths:
+            nbt.to_python(nbt.load(path))
+        results.add('players.full-decode', (time.perf_counter() - start) * 1000 / players, 'ms/player')
+        for workers in sorted({1, os.cpu_count() or 1}):
+            start = time.perf_counter()
+            read_players(world_dir, items=False, workers=workers)
+            results.add(f'players.positions.{workers:d}', (time.perf_counter() - start) * 1000 / players, 'ms/player')
+        start = time.perf_counter()
+        read_players(world_dir)
+        results.add('players.inventories', (time.perf_counter() - start) * 1000 / players, 'ms/player')
+    if args.json:
+        results.write_json(args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+""" End-to-end: the whole wrapper running the fake server (minecraft.serverwrapper.fakeserver) instead of java
+Measures startup overhead, command round trips (idle and under log load), the sustained log line rate the
+wrapper keeps up with, stack trace storms, its CPU and memory use, and how long it takes to notice a crash.
+Run from the repository root:
+
+    python benchmarks/bench_wrapper.py [--quick] [--json results.json]
+"""
+import argparse
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from benchlib import Results
+from minecraft.serverwrapper.fakeserver import write_shim
+from minecraft.serverwrapper.logparser import MinecraftServerDoneMessage
+from minecraft.serverwrapper.serverwrapper import MinecraftServerWrapper, fabric_server_jar_name
+from minecraft.serverwrapper.statusfile import process_rss_bytes
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss_bytes() -> int:
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def message_is(text: str):
+    return lambda message: message.message == text
+
+
+class BenchWrapper(MinecraftServerWrapper):
+    """ Skips the downloads and reports every log message and the server's exit to the benchmark script
+    """
+    script: 'Script' = None
+    crashed_at: float = None
+    stopped_at: float = None
+
+    def sync_instance(self):
+        self.sync_config()
+        self._current_jar_path = fabric_server_jar_name('1.19.2', '0.14.21', '0.11.2')
+
+    def handle_minecraft_log_message(self, message):
+        super().handle_minecraft_log_message(message)
+        self.script.on_message(message)
+
+    def handle_minecraft_server_stop(self, rc=None):
+        self.stopped_at = time.perf_counter()
+        super().handle_minecraft_server_stop(rc)
+
+
+class Script:
+    """ Runs a generator that sends commands and yields predicates for the log message it waits for next
+    """
+    def __init__(self, generator, deadline: float, wrapper: BenchWrapper):
+        self._generator = generator
+        self._waiting = next(generator)
+        self._deadline = deadline
+        self._wrapper = wrapper
+        self.failed = None
+
+    def on_message(self, message):
+        if self._waiting is not None and self._waiting(message):
+            try:
+                self._waiting = self._generator.send(message)
+            except StopIteration:
+                self._waiting = None
+
+    def check_deadline(self):
+        if self._waiting is not None and time.time() > self._deadline:
+            self.failed = 'timed out'
+            self._waiting = None
+            self._wrapper.stop_minecraft_server()
+
+
+def benchmark(wrapper: BenchWrapper, results: Results, quick: bool):
+    launched = time.perf_counter()
+    done = yield lambda message: isinstance(message, MinecraftServerDoneMessage)
+    # Everything but the (fake) server's own startup time
+    results.add('startup.overhead', (time.perf_counter() - launched - done.seconds) * 1000, 'ms')
+
+    round_trips = 50 if quick else 500
+    for load in (None, (2000, 20)):
+        if load is not None:
+            wrapper.execute('fake rate {:d} {:d}'.format(*load))
+        rtts = []
+        for i in range(round_trips):
+            start = time.perf_counter()
+            wrapper.execute(f'say rtt-{i}')
+            yield message_is(f'[Server] rtt-{i}')
+            rtts.append((time.perf_counter() - start) * 1000)
+        name = 'command.round_trip' + ('.idle' if load is None else '.load={:d}lps'.format(load[0]))
+        results.add_samples(name, rtts, 'ms')
+    wrapper.execute('fake rate 0')
+
+    lines = 20000 if quick else 200000
+    for burst in (1, 100):
+        cpu, start = cpu_seconds(), time.perf_counter()
+        wrapper.execute(f'fake flood {lines} {burst}')
+        yield message_is(f'Flood of {lines} lines done')
+        elapsed = time.perf_counter() - start
+        results.add(f'flood.burst={burst}.throughput', lines / elapsed, 'lines/s', better='higher')
+        results.add(f'flood.burst={burst}.cpu', (cpu_seconds() - cpu) / elapsed * 100, '% of a core')
+
+    traces, depth = (200 if quick else 2000), 40
+    cpu, start = cpu_seconds(), time.perf_counter()
+    wrapper.execute(f'fake storm {traces} {depth}')
+    yield message_is(f'Storm of {traces} traces done')
+    elapsed = time.perf_counter() - start
+    results.add('storm.throughput', traces * (depth + 2) / elapsed, 'lines/s', better='higher')
+    results.add('storm.cpu', (cpu_seconds() - cpu) / elapsed * 100, '% of a core')
+
+    results.add('memory.rss', process_rss_bytes(os.getpid()) / (1 << 20), 'MiB')
+    results.add('memory.peak_rss', peak_rss_bytes() / (1 << 20), 'MiB')
+
+    wrapper.crashed_at = time.perf_counter()
+    wrapper.execute('fake crash')
+    # Nothing to wait for, the wrapper stops when the server is gone
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='Smaller runs, for a quick check')
+    parser.add_argument('--json', metavar='PATH', help='Write the results to a JSON file')
+    parser.add_argument('--time-limit', type=float, default=600.0, help='Give up after this many seconds')
+    args = parser.parse_args()
+
+    # The wrapper logs every server line, like it would to a terminal
+    logging.basicConfig(level=logging.INFO, stream=open(os.devnull, 'w'))
+    results = Results('wrapper')
+    with tempfile.TemporaryDirectory(prefix='bench-wrapper-') as tmp:
+        java = os.path.join(tmp, 'java')
+        write_shim(java)
+        os.environ['FAKE_SERVER_ARGS'] = '--startup-seconds 0.5 --mods 40'
+        wrapper = BenchWrapper({
+            'minecraft': {'server': {'broadcast-to-lan': False}, 'modpack': {'auto-load': False}},
+            'wrapper': {
+                'java-executable-path': java,
+                'working-directory': os.path.join(tmp, 'server'),
+                'java-args': {'app-cds': False},
+                'gc-log': {'enabled': False},
+                'reload-config': False,
+                'rcon': {'enabled': False},
+            },
+        })
+        sys.stdin = open(os.devnull, 'r')
+        original_start = wrapper.start_minecraft_server
+
+        def start_minecraft_server():
+            # Startup overhead counts from here, not the wrapper's own start delay
+            wrapper.script = Script(benchmark(wrapper, results, args.quick), time.time() + args.time_limit, wrapper)
+            wrapper._serverloop.call_repeatedly(1.0, wrapper.script.check_deadline, name='bench-deadline')
+            original_start()
+        wrapper.start_minecraft_server = start_minecraft_server
+        wrapper.start()
+    if wrapper.crashed_at is None:
+        reason = wrapper.script.failed if wrapper.script is not None and wrapper.script.failed else 'server stopped early'
+        print(f'Benchmark failed: {reason}', file=sys.stderr)
+        sys.exit(1)
+    results.add('crash.detect', (wrapper.stopped_at - wrapper.crashed_at) * 1000, 'ms')
+    if args.json:
+        results.write_json(args.json)
+
+
+if __name__ == '__main__':
+    main()
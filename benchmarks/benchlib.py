@@ -0,0 +1,109 @@
+""" Shared helpers for the benchmark scripts: collecting results, writing them as JSON, comparing two runs
+Results are only comparable between runs on the same machine. To compare two runs (e.g. before and after a
+change), from the repository root:
+
+    python benchmarks/benchlib.py compare before.json after.json [--threshold 10]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def git_commit() -> str or None:
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+class Results:
+    """ Named measurements with unit and direction ("lower" or "higher" is better)
+    """
+    _benchmark: str = None
+    _results: dict[str, dict] = None
+
+    def __init__(self, benchmark: str):
+        self._benchmark = benchmark
+        self._results = {}
+
+    def add(self, name: str, value: float, unit: str, better: str = 'lower') -> None:
+        self._results[name] = {'value': value, 'unit': unit, 'better': better}
+        print('{:56s} {:>14.3f} {:s}'.format(name, value, unit))
+        sys.stdout.flush()
+
+    def add_samples(self, name: str, samples: list[float], unit: str) -> None:
+        """ Adds median, p99 and max of samples where lower is better (latencies, errors)
+        """
+        self.add(name + '.p50', statistics.median(samples), unit)
+        self.add(name + '.p99', percentile(samples, 99), unit)
+        self.add(name + '.max', max(samples), unit)
+
+    def to_dict(self) -> dict:
+        return {
+            'benchmark': self._benchmark,
+            'meta': {
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+            },
+            'results': self._results,
+        }
+
+    def write_json(self, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write('\n')
+
+
+def compare(before: dict, after: dict, threshold: float) -> int:
+    """ Prints the change of every measurement in both runs, returns the number of regressions
+    """
+    regressions = 0
+    print('{:56s} {:>12s} {:>12s} {:>8s}'.format('', 'before', 'after', 'change'))
+    for name, result in after['results'].items():
+        old = before['results'].get(name)
+        if old is None or old['value'] == 0:
+            continue
+        change = (result['value'] - old['value']) / abs(old['value']) * 100
+        worse = change > threshold if result['better'] == 'lower' else change < -threshold
+        regressions += worse
+        print('{:56s} {:12.3f} {:12.3f} {:+7.1f}%{:s}'.format(
+            name, old['value'], result['value'], change, '  REGRESSION' if worse else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compare_parser = subparsers.add_parser('compare', help='Compare two result files')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=10.0, help='Change in percent that counts as a regression')
+    args = parser.parse_args()
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    for run in (before, after):
+        print('{:8s} {:s} on {:s}'.format(str(run['meta']['commit']), run['meta']['time'], run['meta']['platform']))
+    print('')
+    sys.exit(1 if compare(before, after, args.threshold) > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
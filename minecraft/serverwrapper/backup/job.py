@@ -0,0 +1,210 @@
+""" A backup of the world of a (possibly running) server, driven from the server loop
+
+With the server running: "save-off" and "save-all flush", then wait until it says "Saved the game" (the log
+line, or the RCON response). Now the world on disk is complete and stays as it is, so it's staged on a thread
+of its own, and "save-on" is sent as soon as that's done. Storing the snapshot, retention and pruning run on
+another thread afterwards, while the server saves again as usual. Without a running server, the world is
+staged right away.
+"""
+from concurrent.futures import Future
+import logging
+import os
+import time
+from typing import Callable
+
+from minecraft.serverwrapper.backup.repository import BackupRepository, RetentionPolicy, Snapshot, StagedFile, StoreStats
+from minecraft.serverwrapper.backup.staging import Staging
+from minecraft.serverwrapper.logparser import MinecraftLogMessage, MinecraftServerSavedMessage
+from minecraft.serverwrapper.serverloop.objects import WaitingOnetimeCallback
+from minecraft.serverwrapper.serverloop.serverloop import ServerLoop
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+
+logger = logging.getLogger(__name__)
+
+
+class BackupResult:
+    snapshot: Snapshot = None
+    stats: StoreStats = None
+    # From "save-off" to "save-on", None if the server wasn't running
+    save_off_seconds: float = None
+    # How long staging took, part of the save-off window if the server was running
+    stage_seconds: float = 0.0
+    store_seconds: float = 0.0
+    total_seconds: float = 0.0
+    reflinked: int = 0
+    copied: int = 0
+    copied_bytes: int = 0
+    removed_snapshots: list[str] = None
+    pruned_blocks: int = 0
+    pruned_bytes: int = 0
+
+    def summary(self) -> str:
+        s = 'Backup {:s}: {:d} files, {:.1f} MiB new ({:.1f} MiB stored) in {:.1f}s'.format(
+            self.snapshot.id, self.stats.files, self.stats.new_bytes / (1 << 20), self.stats.stored_bytes / (1 << 20),
+            self.total_seconds)
+        if self.save_off_seconds is not None:
+            s += ', saving was off for {:.2f}s'.format(self.save_off_seconds)
+        s += ' ({:d} files reflinked, {:d} copied, {:d} unchanged)'.format(
+            self.reflinked, self.copied, self.stats.files_unchanged)
+        if self.removed_snapshots:
+            s += ', removed {:d} old snapshots ({:.1f} MiB freed)'.format(
+                len(self.removed_snapshots), self.pruned_bytes / (1 << 20))
+        return s
+
+    def as_event(self) -> dict:
+        return {'type': 'event', 'event': 'backup-done', 'snapshot': self.snapshot.id,
+            'save-off-seconds': self.save_off_seconds, 'stage-seconds': self.stage_seconds,
+            'store-seconds': self.store_seconds, 'total-seconds': self.total_seconds,
+            'removed-snapshots': self.removed_snapshots} | self.stats.to_dict()
+
+
+class BackupJob:
+    """ Calls done_callback with the BackupResult, or with the exception that stopped the backup. Forward the
+    server's log messages to handle_log_message() and its exit to handle_server_stop(). staged_callback is called
+    once the world has been staged (or staging failed), from then on the server may write to it again.
+    """
+    _serverloop: ServerLoop = None
+    _execute: Callable[[str], Future] = None
+    _repository: BackupRepository = None
+    _staging: Staging = None
+    _retention: RetentionPolicy = None
+    _save_timeout: float = None
+    _done_callback: Callable[[BackupResult or Exception], None] = None
+    _staged_callback: Callable[[], None] = None
+    _result: BackupResult = None
+    _started_at: float = None
+    _save_off_at: float = None
+    _waiting_for_save: bool = False
+    # While the world is being copied to the staging directory
+    _stage_running: bool = False
+    _wo_save_timeout: WaitingOnetimeCallback = None
+
+    def __init__(self, serverloop: ServerLoop, execute: Callable[[str], Future], world_dir: str,
+            repository: BackupRepository, retention: RetentionPolicy, save_timeout: float,
+            done_callback: Callable[[BackupResult or Exception], None], workers: int = None,
+            staged_callback: Callable[[], None] = None):
+        self._serverloop = serverloop
+        self._execute = execute
+        self._repository = repository
+        self._staging = Staging(world_dir, os.path.join(repository.path(), 'staging'), workers)
+        self._retention = retention
+        self._save_timeout = save_timeout
+        self._done_callback = done_callback
+        self._staged_callback = staged_callback
+        self._result = BackupResult()
+        if not os.path.isdir(world_dir):
+            raise MinecraftServerWrapperException(f'No world to back up in {world_dir}.')
+
+    def start(self, server_running: bool) -> None:
+        self._started_at = time.monotonic()
+        if not server_running:
+            self._stage()
+            return
+        self._save_off_at = time.monotonic()
+        self._waiting_for_save = True
+        self._wo_save_timeout = self._serverloop.call_after(self._save_timeout, self._handle_save_timeout,
+            name='backup-save-timeout')
+        try:
+            self._execute('save-off')
+            self._execute('save-all flush').add_done_callback(self._handle_save_response)
+        except Exception as e:
+            self._fail(e)
+
+    def is_staging(self) -> bool:
+        return self._stage_running
+
+    def handle_log_message(self, message: MinecraftLogMessage) -> None:
+        if self._waiting_for_save and isinstance(message, MinecraftServerSavedMessage):
+            self._stage()
+
+    def handle_server_stop(self) -> None:
+        # The server saved everything on its way out, and nothing needs to be turned back on
+        self._save_off_at = None
+        if self._waiting_for_save:
+            self._stage()
+
+    def _handle_save_response(self, future: Future) -> None:
+        if not self._waiting_for_save:
+            return
+        try:
+            response = future.result()
+        except Exception as e:
+            return self._fail(e)
+        # Through RCON, the response is the only place it says so. Through the console, it's the log.
+        if response is not None and 'Saved the game' in response:
+            self._stage()
+
+    def _handle_save_timeout(self) -> None:
+        if self._waiting_for_save:
+            self._fail(MinecraftServerWrapperException('The server did not finish saving within {:g}s.'.format(
+                self._save_timeout)))
+
+    def _stage(self) -> None:
+        self._waiting_for_save = False
+        if self._wo_save_timeout is not None:
+            self._wo_save_timeout.cancel()
+        self._stage_running = True
+        self._serverloop.call_in_thread(self._run_stage, self._handle_staged, name='backup-stage')
+
+    def _run_stage(self) -> tuple[Snapshot, list[StagedFile]]:
+        start = time.monotonic()
+        previous = self._repository.latest_snapshot()
+        files = self._staging.stage(previous)
+        self._result.stage_seconds = time.monotonic() - start
+        return previous, files
+
+    def _handle_staged(self, future: Future) -> None:
+        self._stage_running = False
+        self._save_on()
+        if self._staged_callback is not None:
+            self._staged_callback()
+        try:
+            previous, files = future.result()
+        except Exception as e:
+            self._staging.cleanup()
+            return self._fail(e)
+        self._result.reflinked = self._staging.reflinked
+        self._result.copied = self._staging.copied
+        self._result.copied_bytes = self._staging.copied_bytes
+        self._serverloop.call_in_thread(lambda: self._run_store(previous, files), self._handle_stored, name='backup-store')
+
+    def _run_store(self, previous: Snapshot, files: list[StagedFile]) -> BackupResult:
+        result = self._result
+        start = time.monotonic()
+        try:
+            result.snapshot, result.stats = self._repository.store(files, previous, {
+                'save-off-seconds': result.save_off_seconds,
+                'stage-seconds': result.stage_seconds,
+            })
+        finally:
+            self._staging.cleanup()
+        result.store_seconds = time.monotonic() - start
+        result.removed_snapshots = self._repository.apply_retention(self._retention)
+        if result.removed_snapshots:
+            result.pruned_blocks, result.pruned_bytes = self._repository.prune()
+        return result
+
+    def _handle_stored(self, future: Future) -> None:
+        try:
+            result = future.result()
+        except Exception as e:
+            return self._fail(e)
+        result.total_seconds = time.monotonic() - self._started_at
+        self._done_callback(result)
+
+    def _save_on(self) -> None:
+        if self._save_off_at is None:
+            return
+        self._result.save_off_seconds = time.monotonic() - self._save_off_at
+        self._save_off_at = None
+        try:
+            self._execute('save-on')
+        except Exception as e:
+            logger.error(f'Could not turn saving back on: {e}')
+
+    def _fail(self, e: Exception) -> None:
+        self._waiting_for_save = False
+        if self._wo_save_timeout is not None:
+            self._wo_save_timeout.cancel()
+        self._save_on()
+        self._done_callback(e)
@@ -0,0 +1,390 @@
+""" A local repository of world snapshots, deduplicated by block
+
+Files are split into blocks, and every block is stored once, under the sha256 of its content. Region files
+(chunks, entities and POI, all .mca) are split at their chunks, so a snapshot only adds the chunks that changed
+since any earlier snapshot. Other files are split into blocks of BLOCK_SIZE, which in a world means that most
+of them are one block. A snapshot is a JSON manifest listing the blocks of every file.
+
+    objects/ab/cdef...      blocks: a byte for the encoding (RAW or ZLIB), then the data
+    snapshots/<id>.json     manifests, the id is the local time the snapshot was taken (%Y%m%d-%H%M%S)
+
+Hashing and compressing blocks runs on a thread pool: hashlib and zlib release the GIL for large buffers.
+"""
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Iterable, NamedTuple
+import zlib
+
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+from minecraft.serverwrapper.world.region import REGION_HEADER_SIZE, SECTOR_SIZE
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 1 << 20
+RAW = 0
+ZLIB = 1
+# Data of files read but not yet stored, before waiting for the blocks of the oldest one
+MAX_PENDING_BYTES = 64 << 20
+
+
+def region_cut_points(data: bytes or memoryview) -> list[int] or None:
+    """ Where the chunks of a region file start, or None if it doesn't look like one. Blocks between the cut
+    points are a chunk and any unused sectors after it, so joining them gives back the file.
+    """
+    if len(data) < REGION_HEADER_SIZE or len(data) % SECTOR_SIZE != 0:
+        return None
+    cuts = {0, REGION_HEADER_SIZE}
+    for i in range(0, SECTOR_SIZE, 4):
+        location = int.from_bytes(data[i:i + 4], 'big')
+        offset = (location >> 8) * SECTOR_SIZE
+        if location == 0:
+            continue
+        if offset < REGION_HEADER_SIZE or offset >= len(data):
+            return None
+        cuts.add(offset)
+    return sorted(cuts)
+
+
+def split_blocks(path: str, data: bytes) -> list[memoryview]:
+    view = memoryview(data)
+    cuts = region_cut_points(view) if path.endswith('.mca') else None
+    if cuts is None:
+        cuts = list(range(0, len(data), BLOCK_SIZE)) or [0]
+    return [view[start:end] for start, end in zip(cuts, cuts[1:] + [len(data)])]
+
+
+def snapshot_id(created: float) -> str:
+    return time.strftime('%Y%m%d-%H%M%S', time.localtime(created))
+
+
+class StagedFile(NamedTuple):
+    # Relative to the world directory, with forward slashes
+    path: str
+    size: int
+    mtime_ns: int
+    mode: int
+    # The copy to store, or None if the file is unchanged since the previous snapshot
+    staged_path: str or None
+
+
+class FileEntry(NamedTuple):
+    # Relative to the world directory, with forward slashes
+    path: str
+    size: int
+    mtime_ns: int
+    mode: int
+    blocks: list[str]
+
+
+class Snapshot:
+    id: str = None
+    created: float = None
+    files: dict[str, FileEntry] = None
+    # Anything else worth keeping with the snapshot, like how long saves were off
+    info: dict = None
+
+    def __init__(self, id: str, created: float, files: Iterable[FileEntry], info: dict = None):
+        self.id = id
+        self.created = created
+        self.files = {entry.path: entry for entry in files}
+        self.info = info or {}
+
+    def size(self) -> int:
+        return sum(entry.size for entry in self.files.values())
+
+    def to_dict(self) -> dict:
+        return {'id': self.id, 'created': self.created, 'info': self.info,
+            'files': [entry._asdict() for entry in self.files.values()]}
+
+    @staticmethod
+    def from_dict(d: dict) -> 'Snapshot':
+        return Snapshot(d['id'], d['created'], [FileEntry(**entry) for entry in d['files']], d.get('info'))
+
+
+class StoreStats:
+    files: int = 0
+    # Files taken over from the previous snapshot without reading them
+    files_unchanged: int = 0
+    blocks: int = 0
+    new_blocks: int = 0
+    bytes_read: int = 0
+    new_bytes: int = 0
+    # Size of the new blocks in the repository, after compression
+    stored_bytes: int = 0
+
+    def to_dict(self) -> dict:
+        return {key.replace('_', '-'): getattr(self, key) for key in StoreStats.__annotations__}
+
+
+class RetentionPolicy(NamedTuple):
+    """ Which snapshots to keep: the newest keep_last ones, and the newest one of each of the last keep_hourly
+    hours, keep_daily days and keep_weekly weeks that have snapshots
+    """
+    keep_last: int = 0
+    keep_hourly: int = 0
+    keep_daily: int = 0
+    keep_weekly: int = 0
+
+    def retained(self, snapshots: list[tuple[str, float]]) -> set[str]:
+        """ snapshots are (id, created) pairs, the result are the ids to keep
+        """
+        newest_first = sorted(snapshots, key=lambda snapshot: snapshot[1], reverse=True)
+        keep = {snapshot_id for snapshot_id, _ in newest_first[:self.keep_last]}
+        for count, period in ((self.keep_hourly, '%Y-%m-%d %H'), (self.keep_daily, '%Y-%m-%d'), (self.keep_weekly, '%G-%V')):
+            periods = set()
+            for snapshot_id, created in newest_first:
+                if len(periods) >= count:
+                    break
+                key = time.strftime(period, time.localtime(created))
+                if key not in periods:
+                    periods.add(key)
+                    keep.add(snapshot_id)
+        return keep
+
+
+class BackupRepository:
+    _path: str = None
+    _compression_level: int = 6
+    _workers: int = None
+    _fsync: bool = True
+    # Hashes of the stored blocks, while storing a snapshot
+    _known: set[str] = None
+    _known_lock: threading.Lock = None
+
+    def __init__(self, path: str, compression_level: int = 6, workers: int = None, fsync: bool = True):
+        if not 0 <= compression_level <= 9:
+            raise MinecraftServerWrapperException('Backup compression level must be between 0 and 9.')
+        self._path = path
+        self._compression_level = compression_level
+        self._workers = workers or os.cpu_count() or 1
+        self._fsync = fsync
+        self._known_lock = threading.Lock()
+
+    def path(self) -> str:
+        return self._path
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self._path, 'objects', digest[:2], digest[2:])
+
+    def _snapshot_path(self, snapshot_id: str) -> str:
+        return os.path.join(self._path, 'snapshots', snapshot_id + '.json')
+
+    def snapshot_ids(self) -> list[str]:
+        try:
+            names = os.listdir(os.path.join(self._path, 'snapshots'))
+        except FileNotFoundError:
+            return []
+        return sorted(name.removesuffix('.json') for name in names if name.endswith('.json'))
+
+    def load_snapshot(self, snapshot_id: str) -> Snapshot:
+        try:
+            with open(self._snapshot_path(snapshot_id), 'r') as f:
+                return Snapshot.from_dict(json.load(f))
+        except FileNotFoundError:
+            raise MinecraftServerWrapperException(f'No snapshot {snapshot_id} in {self._path}.')
+        except (ValueError, KeyError, TypeError) as e:
+            raise MinecraftServerWrapperException(f'Snapshot {snapshot_id} is damaged: {e}')
+
+    def latest_snapshot(self) -> Snapshot or None:
+        ids = self.snapshot_ids()
+        return self.load_snapshot(ids[-1]) if ids else None
+
+    def _load_known(self) -> set[str]:
+        known = set()
+        try:
+            with os.scandir(os.path.join(self._path, 'objects')) as prefixes:
+                for prefix in prefixes:
+                    if prefix.is_dir():
+                        known.update(prefix.name + name for name in os.listdir(prefix.path) if '.' not in name)
+        except FileNotFoundError:
+            pass
+        return known
+
+    def _store_block(self, block: memoryview) -> tuple[str, int]:
+        """ Runs on the pool. Returns the hash and the bytes written, 0 if the block was already there.
+        """
+        digest = hashlib.sha256(block).hexdigest()
+        with self._known_lock:
+            if digest in self._known:
+                return digest, 0
+            self._known.add(digest)
+        compressed = zlib.compress(block, self._compression_level) if self._compression_level > 0 else None
+        # Region chunks are compressed already, most of them don't get any smaller
+        if compressed is not None and len(compressed) < len(block) * 0.95:
+            data = [bytes([ZLIB]), compressed]
+        else:
+            data = [bytes([RAW]), block]
+        path = self._object_path(digest)
+        tmp = f'{path}.tmp-{threading.get_ident():d}'
+        try:
+            try:
+                f = open(tmp, 'wb')
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                f = open(tmp, 'wb')
+            with f:
+                f.writelines(data)
+            os.replace(tmp, path)
+        except BaseException:
+            with self._known_lock:
+                self._known.discard(digest)
+            raise
+        return digest, len(data[0]) + len(data[1])
+
+    def read_block(self, digest: str) -> bytes:
+        with open(self._object_path(digest), 'rb') as f:
+            data = f.read()
+        if data[:1] == bytes([ZLIB]):
+            block = zlib.decompress(data[1:])
+        elif data[:1] == bytes([RAW]):
+            block = data[1:]
+        else:
+            raise MinecraftServerWrapperException(f'Block {digest} is damaged.')
+        if hashlib.sha256(block).hexdigest() != digest:
+            raise MinecraftServerWrapperException(f'Block {digest} is damaged.')
+        return block
+
+    def store(self, files: Iterable[StagedFile], previous: Snapshot = None, info: dict = None,
+            created: float = None) -> tuple[Snapshot, StoreStats]:
+        """ Stores a snapshot of staged files. Files without a staged copy are unchanged since previous and
+        keep its blocks.
+        """
+        created = time.time() if created is None else created
+        stats = StoreStats()
+        entries = []
+        # Read ahead while the pool works on the blocks of earlier files, up to MAX_PENDING_BYTES
+        pending: deque[tuple[StagedFile, list[tuple[Future, int]], int]] = deque()
+        pending_bytes = 0
+
+        def finish_oldest():
+            nonlocal pending_bytes
+            file, futures, size = pending.popleft()
+            blocks = []
+            for future, block_size in futures:
+                digest, written = future.result()
+                blocks.append(digest)
+                if written:
+                    stats.new_blocks += 1
+                    stats.new_bytes += block_size
+                    stats.stored_bytes += written
+            entries.append(FileEntry(file.path, size, file.mtime_ns, file.mode, blocks))
+            pending_bytes -= size
+
+        self._known = self._load_known()
+        try:
+            with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='backup') as pool:
+                for file in files:
+                    stats.files += 1
+                    if file.staged_path is None:
+                        entry = previous.files[file.path]
+                        entries.append(entry)
+                        stats.files_unchanged += 1
+                        stats.blocks += len(entry.blocks)
+                        continue
+                    with open(file.staged_path, 'rb') as f:
+                        data = f.read()
+                    stats.bytes_read += len(data)
+                    futures = [(pool.submit(self._store_block, block), len(block)) for block in split_blocks(file.path, data)]
+                    stats.blocks += len(futures)
+                    pending.append((file, futures, len(data)))
+                    pending_bytes += len(data)
+                    while pending_bytes > MAX_PENDING_BYTES:
+                        finish_oldest()
+                while pending:
+                    finish_oldest()
+        finally:
+            self._known = None
+        if self._fsync and stats.new_blocks > 0:
+            # The manifest must not list blocks that aren't on disk. One sync is much quicker than an fsync per block.
+            os.sync()
+        snapshot = Snapshot(self.new_snapshot_id(created), created, entries, info)
+        self.write_snapshot(snapshot)
+        return snapshot, stats
+
+    def new_snapshot_id(self, created: float) -> str:
+        base = snapshot_id(created)
+        ids = set(self.snapshot_ids())
+        result, n = base, 1
+        while result in ids:
+            n += 1
+            result = f'{base}-{n:d}'
+        return result
+
+    def write_snapshot(self, snapshot: Snapshot) -> None:
+        path = self._snapshot_path(snapshot.id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(snapshot.to_dict(), f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def apply_retention(self, policy: RetentionPolicy) -> list[str]:
+        """ Deletes the manifests of snapshots the policy doesn't keep, returns their ids. Their blocks stay
+        until prune().
+        """
+        snapshots = []
+        for snapshot_id in self.snapshot_ids():
+            try:
+                with open(self._snapshot_path(snapshot_id), 'r') as f:
+                    snapshots.append((snapshot_id, json.load(f)['created']))
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f'Not applying retention to snapshot {snapshot_id}: {e}')
+        keep = policy.retained(snapshots)
+        removed = []
+        for snapshot_id, _ in snapshots:
+            if snapshot_id not in keep:
+                os.unlink(self._snapshot_path(snapshot_id))
+                removed.append(snapshot_id)
+        return removed
+
+    def prune(self) -> tuple[int, int]:
+        """ Deletes blocks no snapshot refers to (and leftovers of interrupted writes). Returns the number of
+        blocks and bytes freed.
+        """
+        referenced = set()
+        for snapshot_id in self.snapshot_ids():
+            # A damaged manifest raises here, rather than losing the blocks of that snapshot
+            for entry in self.load_snapshot(snapshot_id).files.values():
+                referenced.update(entry.blocks)
+        removed, freed = 0, 0
+        try:
+            prefixes = list(os.scandir(os.path.join(self._path, 'objects')))
+        except FileNotFoundError:
+            return 0, 0
+        for prefix in prefixes:
+            if not prefix.is_dir():
+                continue
+            with os.scandir(prefix.path) as blocks:
+                for block in blocks:
+                    if prefix.name + block.name not in referenced:
+                        freed += block.stat().st_size
+                        os.unlink(block.path)
+                        removed += 1
+        return removed, freed
+
+    def restore(self, snapshot_id: str, target: str) -> Snapshot:
+        """ Writes the files of a snapshot to target, which must not exist or be empty
+        """
+        snapshot = self.load_snapshot(snapshot_id)
+        if os.path.exists(target) and os.listdir(target):
+            raise MinecraftServerWrapperException(f'Not restoring into {target}, it is not empty.')
+        for entry in snapshot.files.values():
+            parts = entry.path.split('/')
+            if entry.path.startswith('/') or '..' in parts:
+                raise MinecraftServerWrapperException(f'Snapshot {snapshot_id} is damaged: bad path {entry.path!r}.')
+            path = os.path.join(target, *parts)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                for digest in entry.blocks:
+                    f.write(self.read_block(digest))
+            os.chmod(path, entry.mode & 0o7777)
+            os.utime(path, ns=(entry.mtime_ns, entry.mtime_ns))
+        return snapshot
@@ -0,0 +1,128 @@
+""" Staging of a world for a backup, while the server doesn't save: a copy of every file that changed since the
+previous snapshot, so saving can be turned back on before the (much slower) hashing and compression.
+
+Copies are reflinks where the filesystem supports them (btrfs, XFS, bcachefs), which take about as long as
+opening the files, and plain copies (copy_file_range or sendfile, in the kernel) elsewhere. Hard links would
+be as quick, but aren't snapshots: the server writes region files in place. Files with the size and mtime
+they had in the previous snapshot aren't copied at all.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import fcntl
+import logging
+import os
+import shutil
+from typing import Iterator
+
+from minecraft.serverwrapper.backup.repository import Snapshot, StagedFile
+
+logger = logging.getLogger(__name__)
+
+# ioctl to share the extents of another file, from linux/fs.h
+FICLONE = 0x40049409
+# Errors of FICLONE on filesystems (or pairs of them) that can't share extents
+REFLINK_UNSUPPORTED = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS}
+# Held open by the running server, and meaningless in a backup
+EXCLUDED = {'session.lock'}
+
+
+def walk_world(world_dir: str, prefix: str = '') -> Iterator[tuple[str, os.stat_result]]:
+    """ Regular files below world_dir as (relative path, stat) pairs, in a stable order
+    """
+    with os.scandir(os.path.join(world_dir, prefix) if prefix else world_dir) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    for entry in entries:
+        path = prefix + entry.name
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_world(world_dir, path + '/')
+            elif entry.is_file(follow_symlinks=False) and path not in EXCLUDED:
+                yield path, entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            # Deleted while walking, e.g. a temporary file of the server
+            continue
+
+
+def reflink(source: str, target: str) -> bool:
+    """ Returns False if the filesystem can't, without creating target
+    """
+    with open(source, 'rb') as src:
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            fcntl.ioctl(fd, FICLONE, src.fileno())
+            return True
+        except OSError as e:
+            if e.errno not in REFLINK_UNSUPPORTED:
+                raise
+        finally:
+            os.close(fd)
+    os.unlink(target)
+    return False
+
+
+class Staging:
+    """ Stages the files of world_dir into directory. stage() runs while saving is off, on a thread of its own.
+    """
+    _world_dir: str = None
+    _directory: str = None
+    _workers: int = None
+    # Cleared after the first failed reflink, the rest would fail just the same
+    _try_reflink: bool = True
+    files: list[StagedFile] = None
+    reflinked: int = 0
+    copied: int = 0
+    copied_bytes: int = 0
+    unchanged: int = 0
+
+    def __init__(self, world_dir: str, directory: str, workers: int = None):
+        self._world_dir = world_dir
+        self._directory = directory
+        self._workers = workers or os.cpu_count() or 1
+
+    def stage(self, previous: Snapshot = None) -> list[StagedFile]:
+        self.reflinked = self.copied = self.copied_bytes = self.unchanged = 0
+        self.cleanup()
+        os.makedirs(self._directory)
+        unchanged = {}
+        if previous is not None:
+            unchanged = {entry.path: (entry.size, entry.mtime_ns) for entry in previous.files.values()}
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='backup-stage') as pool:
+            items = []
+            for path, st in walk_world(self._world_dir):
+                if unchanged.get(path) == (st.st_size, st.st_mtime_ns):
+                    items.append((StagedFile(path, st.st_size, st.st_mtime_ns, st.st_mode, None), None))
+                else:
+                    staged = StagedFile(path, st.st_size, st.st_mtime_ns, st.st_mode, os.path.join(self._directory, path))
+                    items.append((staged, pool.submit(self._copy, staged)))
+            self.files = []
+            for staged, future in items:
+                how = 'unchanged' if future is None else future.result()
+                if how == 'unchanged':
+                    self.unchanged += 1
+                elif how == 'reflink':
+                    self.reflinked += 1
+                elif how == 'copy':
+                    self.copied += 1
+                    self.copied_bytes += staged.size
+                else:
+                    continue
+                self.files.append(staged)
+        return self.files
+
+    def _copy(self, staged: StagedFile) -> str or None:
+        """ Runs on the pool. Returns how the file was staged, or None if it is gone by now.
+        """
+        source = os.path.join(self._world_dir, staged.path)
+        os.makedirs(os.path.dirname(staged.staged_path), exist_ok=True)
+        try:
+            if self._try_reflink:
+                if reflink(source, staged.staged_path):
+                    return 'reflink'
+                self._try_reflink = False
+            shutil.copyfile(source, staged.staged_path)
+        except FileNotFoundError:
+            return None
+        return 'copy'
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self._directory, ignore_errors=True)
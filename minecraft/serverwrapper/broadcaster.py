@@ -1,11 +1,26 @@
 
+from collections.abc import Mapping
+import fcntl
 import logging
 import socket
+import struct
 import time
 from minecraft.serverwrapper.serverloop.serverloop import WaitingObject
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
 
 logger = logging.getLogger(__name__)
 
+BROADCAST_IP = '255.255.255.255'
+# Vanilla clients listen for LAN games on this multicast group
+MULTICAST_IP = '224.0.2.60'
+LAN_PORT = 4445
+MODES = ('broadcast', 'multicast')
+
+# From linux/sockios.h
+_SIOCGIFADDR = 0x8915
+_SIOCGIFBRDADDR = 0x8919
+
+
 class MinecraftServerInfo:
     name = None
     port = None
@@ -23,38 +38,161 @@ class MinecraftServerInfo:
     def __str__(self):
         return '%s (*:%d)' % (self.name, self.port)
 
+    def encode(self) -> bytes:
+        return bytes("[MOTD]%s[/MOTD][AD]%d[/AD]" % (self.name, self.port), 'UTF-8')
+
+
+def interface_addresses(interface: str) -> tuple[str, str]:
+    """ Returns the IPv4 address and broadcast address of a network interface (Linux only)
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        request = struct.pack('256s', interface[:15].encode('utf-8'))
+        try:
+            address = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), _SIOCGIFADDR, request)[20:24])
+            broadcast = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), _SIOCGIFBRDADDR, request)[20:24])
+        except OSError as e:
+            raise MinecraftServerWrapperException(f'Cannot get IPv4 address of interface {interface}: {e}')
+    if broadcast == '0.0.0.0':
+        # Point-to-point and loopback interfaces have no broadcast address
+        broadcast = BROADCAST_IP
+    return address, broadcast
+
+
+class BroadcastChannel:
+    """ A long-lived UDP socket announcing servers on one interface (or the default route)
+    """
+    interface: str = None
+    interval: float = None
+    target: float = None
+    _modes: tuple[str] = None
+    _ttl: int = None
+    _sock: socket.socket = None
+    _destinations: list[tuple[str, int]] = None
+    _failing: bool = False
+
+    def __init__(self, interface: str = None, modes: tuple[str] = MODES, ttl: int = 1, interval: float = 1.0):
+        for mode in modes:
+            if mode not in MODES:
+                raise MinecraftServerWrapperException(f'Unknown LAN broadcast mode "{mode}", expected one of {", ".join(MODES)}.')
+        self.interface = interface
+        self.interval = interval
+        self.target = time.time() + interval
+        self._modes = tuple(modes)
+        self._ttl = ttl
+
+    def _open(self) -> None:
+        address = None
+        broadcast = BROADCAST_IP
+        if self.interface is not None:
+            address, broadcast = interface_addresses(self.interface)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, self._ttl)
+            self._destinations = []
+            if 'broadcast' in self._modes:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                self._destinations.append((broadcast, LAN_PORT))
+            if 'multicast' in self._modes:
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self._ttl)
+                # Clients on this host should see the server, too
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+                if address is not None:
+                    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(address))
+                self._destinations.append((MULTICAST_IP, LAN_PORT))
+            if address is not None:
+                # Makes the packets leave through this interface, with its address as source
+                sock.bind((address, 0))
+        except BaseException:
+            sock.close()
+            raise
+        self._sock = sock
+        logger.debug(f'{self}: sending to {self._destinations}')
+
+    def send(self, payloads: list[bytes]) -> None:
+        self.target = time.time() + self.interval
+        try:
+            if self._sock is None:
+                self._open()
+            for destination in self._destinations:
+                for payload in payloads:
+                    self._sock.sendto(payload, destination)
+            if self._failing:
+                logger.info(f'{self}: sending broadcasts again.')
+                self._failing = False
+        except (OSError, MinecraftServerWrapperException) as e:
+            # Log once per failure streak, the network might just not be up yet
+            if not self._failing:
+                logger.error(f'{self}: Failed to send broadcast: {e}')
+                self._failing = True
+            self.close()
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def __str__(self):
+        return 'BroadcastChannel({:s})'.format(self.interface or 'default')
+
+
 class MinecraftServerLANBroadcaster(WaitingObject):
-    _servers: list[MinecraftServerInfo] = []
-    _broadcast_ip = "255.255.255.255"
-    _broadcast_port = 4445
-    # Similar to RepeatedCallback
-    _interval = None
-    _target = None
+    """ Announces servers to LAN clients
+    Holds one socket per interface, and sends all servers' pre-encoded announcements in one burst per tick.
+    """
+    _servers: list[MinecraftServerInfo] = None
+    _payloads: list[bytes] = None
+    _channels: list[BroadcastChannel] = None
 
-    def __init__(self, interval=1.0):
-        self._interval = interval
-        self._target = time.time() + interval
+    def __init__(self, interval=1.0, interfaces: list = None, modes=MODES, ttl=1, name=None):
+        """ interfaces: list of interface names, or mappings with "name" and optionally "interval-seconds",
+        "modes" and "ttl". If empty, broadcasts are sent via the default route.
+        """
+        super().__init__(name=name or 'lan-broadcaster')
+        self._servers = []
+        self._payloads = []
+        self._channels = []
+        for interface in interfaces or [None]:
+            if isinstance(interface, Mapping):
+                self._channels.append(BroadcastChannel(
+                    interface=interface['name'],
+                    modes=interface.get('modes', modes),
+                    ttl=int(interface.get('ttl', ttl)),
+                    interval=float(interface.get('interval-seconds', interval)),
+                ))
+            else:
+                self._channels.append(BroadcastChannel(interface, modes=modes, ttl=ttl, interval=interval))
 
     def is_waiting_for_timeout(self):
-        return self._target
+        return min(channel.target for channel in self._channels)
 
     def do_timeout(self):
-        self._target = time.time() + self._interval
-        self.send_broadcasts()
+        now = time.time()
+        for channel in self._channels:
+            if channel.target <= now:
+                self.send_broadcasts(channel)
 
-    def send_broadcasts(self):
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-                sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-                for server in self._servers:
-                    msg = "[MOTD]%s[/MOTD][AD]%d[/AD]" % (server.name, server.port)
-                    sock.sendto(bytes(msg, 'UTF-8'), (self._broadcast_ip, self._broadcast_port))
-        except OSError as e:
-            logger.error("Failed to send broadcast: %s" % e)
+    def send_broadcasts(self, channel: BroadcastChannel):
+        if len(self._payloads) == 0:
+            channel.target = time.time() + channel.interval
+            return
+        channel.send(self._payloads)
+
+    def close(self):
+        for channel in self._channels:
+            channel.close()
+        self._is_done = True
 
+    def _rebuild_payloads(self):
+        self._payloads = [server.encode() for server in self._servers]
 
     def add_server(self, server: MinecraftServerInfo):
         self._servers.append(server)
+        self._rebuild_payloads()
 
     def remove_server(self, server: MinecraftServerInfo):
         self._servers.remove(server)
+        self._rebuild_payloads()
+
+    def servers(self) -> list[MinecraftServerInfo]:
+        return list(self._servers)
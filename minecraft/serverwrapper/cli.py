@@ -2,13 +2,18 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import math
+import os
+import sys
+import time
 import click
 import click_log
-import pkg_resources  # part of setuptools
-from minecraft.serverwrapper.config import get_default_config_string
-from minecraft.serverwrapper.serverwrapper import MinecraftServerWrapper
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
 from minecraft.serverwrapper.util.logging import setup_root_logger
 
+# Keep imports of the rest of the package inside the commands: the CLI is run a lot (health checks, cron jobs),
+# and most commands only need a small part of it. benchmarks/bench_cli_startup.py checks this.
+
 # Set up logging
 root_logger = setup_root_logger()
 logger = logging.getLogger(__name__)
@@ -22,17 +27,367 @@ class NotYetImplementedError(click.ClickException):
     def __init__(self, message):
         super().__init__(message)
 
+
+def server_wrapper():
+    from minecraft.serverwrapper.serverwrapper import MinecraftServerWrapper
+    return MinecraftServerWrapper()
+
+
+def require_stopped_server():
+    """ For commands that change files the running server uses
+    """
+    from minecraft.serverwrapper.config import load_config, working_directory
+    from minecraft.serverwrapper.statusfile import read_status, status_file_path
+    record = read_status(status_file_path(working_directory(load_config())))
+    if record is not None and not record.is_stale() and record.state != 'stopped':
+        raise click.ClickException(f'The server is {record.state}, stop the wrapper first.')
+
+
 @click.command()
 @click_log.simple_verbosity_option(root_logger)
 def run():
     """Runs the server in the foreground
     """
-    MinecraftServerWrapper().start()
+    server_wrapper().start()
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f'{seconds}s'
+    if seconds < 3600:
+        return f'{seconds // 60}m {seconds % 60}s'
+    return f'{seconds // 3600}h {seconds // 60 % 60}m'
+
+
+@click.command()
+@click.option('--json', 'as_json', is_flag=True, help='Print the status as JSON')
+def status(as_json):
+    """Shows the status of the running server (exits with 1 if the wrapper isn't running)
+    """
+    import json
+    from minecraft.serverwrapper.config import load_config, working_directory
+    from minecraft.serverwrapper.statusfile import read_status, status_file_path
+    record = read_status(status_file_path(working_directory(load_config())))
+    alive = record is not None and not record.is_stale()
+    if as_json:
+        print(json.dumps(record.to_dict() | {'wrapper-running': alive} if record is not None else {'wrapper-running': False}))
+    elif not alive:
+        print('Wrapper is not running.')
+    else:
+        now = time.time()
+        state = record.state
+        if record.server_pid:
+            state += f' (pid {record.server_pid}, up {format_duration(now - record.server_started_at)})'
+        print(f'State:    {state}')
+        print(f'Version:  {record.version}')
+        players = f'{record.players_online}/{record.players_max}'
+        if record.players:
+            players += ' ' + ', '.join(record.players)
+        print(f'Players:  {players}')
+        if record.rss_bytes:
+            print('Memory:   {:.2f} GiB RSS'.format(record.rss_bytes / (1 << 30)))
+        if not math.isnan(record.tps):
+            tps = f'{record.tps:.1f}'
+            if record.lag_events:
+                tps += ' (last lag {:s} ago, {:.0f}ms behind)'.format(format_duration(now - record.last_lag_at), record.last_lag_ms)
+            print(f'TPS:      {tps}')
+        if not math.isnan(record.gc_p99_pause_ms):
+            print(f'GC p99:   {record.gc_p99_pause_ms:.1f} ms')
+    if not as_json and (not alive or record.state in ('stopped', 'sleeping')):
+        # No server to ask, but the world's level.dat tells what it was last saved as
+        from minecraft.serverwrapper.world.level import read_level
+        try:
+            level = read_level(world_settings()[0])
+        except MinecraftServerWrapperException:
+            pass
+        else:
+            world = f'{level.name} ({level.version})'
+            if level.last_played:
+                world += ', last played ' + time.strftime('%Y-%m-%d %H:%M', time.localtime(level.last_played / 1000))
+            print(f'World:    {world}')
+    sys.exit(0 if alive else 1)
+
+
+@click.command()
+def attach():
+    """Shows the log of the running server and sends typed lines as commands
+    """
+    from minecraft.serverwrapper import control
+    from minecraft.serverwrapper.config import load_config
+    try:
+        control.attach(control.socket_path(load_config()))
+    except MinecraftServerWrapperException as e:
+        raise click.ClickException(str(e))
+
+
+@click.command()
+@click.option('--mode', type=click.Choice(['sample', 'cprofile']), help='Profiler to use (default: wrapper.profiling.mode)')
+@click.option('--seconds', type=float, help='How long to profile (default: wrapper.profiling.duration-seconds)')
+@click.option('--memory/--no-memory', default=None, help='Also trace allocations (default: wrapper.profiling.memory)')
+@click.option('--stop', is_flag=True, help='Stop the running profile now and write its reports')
+@click.option('--status', 'show_status', is_flag=True, help='Only show whether a profile is running')
+def profile(mode, seconds, memory, stop, show_status):
+    """Profiles the running wrapper itself, reports go to profiles/ in the working directory
+    """
+    from minecraft.serverwrapper import control
+    from minecraft.serverwrapper.config import load_config
+    if stop:
+        message = {'type': 'profile', 'action': 'stop'}
+    elif show_status:
+        message = {'type': 'profile', 'action': 'status'}
+    else:
+        message = {'type': 'profile', 'action': 'start', 'mode': mode, 'seconds': seconds, 'memory': memory}
+    try:
+        response = control.request(control.socket_path(load_config()), message)
+    except MinecraftServerWrapperException as e:
+        raise click.ClickException(str(e))
+    for report in response['reports']:
+        print(report)
+    if response['running']:
+        print('Profiling ({:s}) until {:s}, reports go to {:s}'.format(
+            response['mode'], time.strftime('%H:%M:%S', time.localtime(response['ends-at'])), response['directory']))
+    elif not response['reports']:
+        print('No profile is running.')
+
+
+def backup_repository():
+    from minecraft.serverwrapper.backup.repository import BackupRepository
+    from minecraft.serverwrapper.config import compile_config, load_config, working_directory
+    config = load_config()
+    return BackupRepository(os.path.join(working_directory(config), compile_config(config).wrapper.backup.directory))
+
+
+@click.command(name='now')
+def backup_now():
+    """Backs up the world of the running server and waits until it's done
+    """
+    from minecraft.serverwrapper import control
+    from minecraft.serverwrapper.config import load_config
+    try:
+        response = control.request(control.socket_path(load_config()), {'type': 'backup', 'action': 'start'}, timeout=3600.0)
+    except MinecraftServerWrapperException as e:
+        raise click.ClickException(str(e))
+    result = response['result']
+    print('Snapshot {:s}: {:d} files, {:.1f} MiB new in {:.1f}s'.format(
+        result['snapshot'], result['files'], result['new-bytes'] / (1 << 20), result['total-seconds']))
+    if result['save-off-seconds'] is not None:
+        print('Saving was off for {:.2f}s'.format(result['save-off-seconds']))
+
+
+@click.command(name='list')
+def list_backups():
+    """Lists the snapshots in the backup repository
+    """
+    repository = backup_repository()
+    for snapshot_id in repository.snapshot_ids():
+        try:
+            snapshot = repository.load_snapshot(snapshot_id)
+        except MinecraftServerWrapperException as e:
+            print(f'{snapshot_id}  {e}')
+            continue
+        print('{:17s}  {:s}  {:6d} files  {:10.1f} MiB'.format(snapshot_id,
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot.created)), len(snapshot.files),
+            snapshot.size() / (1 << 20)))
+
+
+@click.command(name='restore')
+@click.argument('snapshot')
+@click.argument('target', type=click.Path(file_okay=False))
+def restore_backup(snapshot, target):
+    """Writes the world of a snapshot to an empty or new directory
+    """
+    try:
+        restored = backup_repository().restore(snapshot, target)
+    except MinecraftServerWrapperException as e:
+        raise click.ClickException(str(e))
+    print('Restored {:d} files to {:s}'.format(len(restored.files), target))
+
+
+@click.group()
+def backup():
+    """Commands for backing up the world
+    """
+    pass
+
+
+backup.add_command(backup_now)
+backup.add_command(list_backups)
+backup.add_command(restore_backup)
+
+
+def world_settings():
+    from minecraft.serverwrapper.config import compile_config, load_config, working_directory
+    from minecraft.serverwrapper.world.analyze import world_directory
+    config = load_config()
+    return world_directory(working_directory(config)), compile_config(config)
+
+
+@click.command(name='info')
+@click.option('--dimension', help='Only this dimension, e.g. minecraft:the_nether')
+@click.option('--map', 'map_kind', type=click.Choice(['age', 'chunks']),
+    help='Also draw a map of the regions, by the age of their newest chunk or by how many chunks they have')
+@click.option('--region', metavar='X,Z', help='Draw the chunk ages of a single region of the dimension (default: the overworld)')
+@click.option('--json', 'as_json', is_flag=True, help='Print the report as JSON')
+def world_info(dimension, map_kind, region, as_json):
+    """Shows how much space the world's dimensions take, and how long ago their chunks were saved
+    """
+    import json
+    from minecraft.serverwrapper.world.analyze import AGE_LABELS, analyze_world, chunk_age_map, region_age_map, \
+        region_density_map
+    world_dir, _ = world_settings()
+    now = time.time()
+    if region is not None:
+        reports = {report.name: report for report in analyze_world(world_dir, now)}
+        report = reports.get(dimension or 'minecraft:overworld')
+        if report is None:
+            raise click.ClickException('No such dimension, the world has ' + ', '.join(reports) + '.')
+        try:
+            x, z = (int(part) for part in region.split(','))
+        except ValueError:
+            raise click.BadParameter('expected X,Z, e.g. -1,0', param_hint='--region')
+        path = os.path.join(report.directory, 'region', f'r.{x:d}.{z:d}.mca')
+        if not os.path.exists(path):
+            raise click.ClickException(f'There is no region {x:d},{z:d} in {report.name}.')
+        for line in chunk_age_map(path, now):
+            print(line)
+        return
+    reports = [report for report in analyze_world(world_dir, now) if dimension is None or report.name == dimension]
+    if as_json:
+        print(json.dumps({'world': world_dir, 'dimensions': [report.to_dict() for report in reports]}))
+        return
+    for report in reports:
+        print(f'{report.name}:')
+        print('    {:d} regions, {:d} chunks, {:.1f} MiB ({:.1f} MiB free in region files)'.format(
+            len(report.regions), report.chunks(), report.size() / (1 << 20), report.free_bytes() / (1 << 20)))
+        print('    Entities {:.1f} MiB, points of interest {:.1f} MiB'.format(
+            report.entities_bytes / (1 << 20), report.poi_bytes / (1 << 20)))
+        print('    Chunks last saved within ' + ', '.join(f'{label}: {count:d}' for label, count in zip(AGE_LABELS, report.ages())))
+        if map_kind is not None:
+            for line in region_age_map(report, now) if map_kind == 'age' else region_density_map(report):
+                print('    ' + line)
+
+
+@click.command(name='level')
+@click.option('--json', 'as_json', is_flag=True, help='Print the level data as JSON')
+def world_level(as_json):
+    """Shows the world's seed, version, spawn and game rules from level.dat, without starting the server
+    """
+    import json
+    from minecraft.serverwrapper.world.level import read_level
+    world_dir, _ = world_settings()
+    try:
+        level = read_level(world_dir)
+    except MinecraftServerWrapperException as e:
+        raise click.ClickException(str(e))
+    if as_json:
+        print(json.dumps(level.to_dict()))
+        return
+    print(f'Name:        {level.name}')
+    print(f'Version:     {level.version} (data version {level.data_version})')
+    print(f'Seed:        {level.seed}')
+    print('Spawn:       {}, {}, {}'.format(*level.spawn))
+    print(f'Game type:   {level.game_type}' + (' (hardcore)' if level.hardcore else ''))
+    print(f'Difficulty:  {level.difficulty}')
+    if level.time is not None:
+        day = f' (day {level.day_time // 24000 + 1:d})' if level.day_time is not None else ''
+        print(f'Played:      {format_duration(level.time / 20)}{day}')
+    if level.last_played:
+        print('Last played: ' + time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(level.last_played / 1000)))
+    if level.game_rules:
+        print('Game rules:')
+        for rule, value in sorted(level.game_rules.items()):
+            print(f'    {rule:32s} {value}')
+
+
+@click.command(name='players')
+@click.argument('player', required=False)
+@click.option('--items', is_flag=True, help='Also show inventories and ender chests')
+@click.option('--json', 'as_json', is_flag=True, help='Print the players as JSON')
+def world_players(player, items, as_json):
+    """Shows where players are, from the saved player data (as of the last save for online players)
+    """
+    import json
+    from minecraft.serverwrapper.config import load_config, working_directory
+    from minecraft.serverwrapper.world.level import player_names, read_players
+    world_dir, _ = world_settings()
+    players = read_players(world_dir, player_names(working_directory(load_config())), items=items)
+    if player is not None:
+        players = [p for p in players if player in (p.uuid, p.name)]
+        if not players:
+            raise click.ClickException(f'There is no player data for {player}.')
+    if as_json:
+        print(json.dumps([p.to_dict(items) for p in players]))
+        return
+    for p in players:
+        position = ', '.join(f'{v:.0f}' for v in p.position) if p.position else 'unknown'
+        print(f'{p.name or p.uuid}: {p.dimension} at {position}, health {p.health or 0:.0f}, level {p.xp_level or 0:d}, {p.game_type}')
+        if items:
+            for title, stacks in (('Inventory', p.inventory), ('Ender chest', p.ender_items)):
+                counts = {}
+                for stack in stacks:
+                    counts[stack.id] = counts.get(stack.id, 0) + stack.count
+                print(f'    {title}: ' + (', '.join(f'{count:d} {item}' for item, count in counts.items()) or 'empty'))
+
+
+@click.command(name='prune')
+@click.option('--max-inhabited-seconds', type=float,
+    help='Remove chunks players spent less time in (default: wrapper.world-prune.max-inhabited-seconds)')
+@click.option('--dimension', 'dimensions', multiple=True, help='Only prune this dimension (can be repeated)')
+@click.option('--apply', is_flag=True, help='Remove the chunks, without it only shows what would be removed')
+@click.option('--compact', is_flag=True, help='Also rewrite region files that only have free space to give back')
+@click.option('--workers', type=int, help='Processes scanning regions (default: wrapper.world-prune.workers)')
+def world_prune(max_inhabited_seconds, dimensions, apply, compact, workers):
+    """Removes chunks players have hardly been in, so they're generated again (only while the server is stopped)
+    """
+    from minecraft.serverwrapper.world.prune import TICKS_PER_SECOND, locked_world, protected_areas, prune_world, \
+        world_spawn
+    require_stopped_server()
+    world_dir, settings = world_settings()
+    prune_config = settings.wrapper.world_prune
+    if max_inhabited_seconds is None:
+        max_inhabited_seconds = prune_config.max_inhabited_seconds
+    spawn = world_spawn(world_dir)
+    if spawn is None and prune_config.spawn_radius_blocks > 0:
+        raise click.ClickException(f'Could not read the spawn point from {world_dir}/level.dat.')
+    try:
+        areas = protected_areas(prune_config.protected_areas, spawn, prune_config.spawn_radius_blocks)
+        with locked_world(world_dir):
+            results = prune_world(world_dir, int(max_inhabited_seconds * TICKS_PER_SECOND), areas,
+                dimensions=list(dimensions) or None, dry_run=not apply, compact=compact,
+                workers=workers or prune_config.workers or None,
+                progress=lambda result: logger.debug('{:s}: {:d} of {:d} chunks'.format(result.path, result.removed, result.chunks)))
+    except MinecraftServerWrapperException as e:
+        raise click.ClickException(str(e))
+    chunks = sum(result.chunks for result in results)
+    removed = sum(result.removed for result in results)
+    freed = sum(result.bytes_before - result.bytes_after for result in results)
+    print('{:s} {:d} of {:d} chunks in {:d} regions, {:.1f} MiB{:s}'.format('Removed' if apply else 'Would remove',
+        removed, chunks, len(results), freed / (1 << 20), '' if apply else ' (run with --apply to remove them)'))
+    protected = sum(result.protected for result in results)
+    unreadable = sum(result.unreadable for result in results)
+    print(f'Kept {protected:d} chunks in protected areas and {unreadable:d} whose inhabited time could not be read')
+
+
+@click.group()
+def world():
+    """Commands for inspecting and trimming the world
+    """
+    pass
+
+
+world.add_command(world_info)
+world.add_command(world_level)
+world.add_command(world_players)
+world.add_command(world_prune)
 
 
 def format_version(package):
-    version = pkg_resources.require(package)[0].version
-    return '{:40} {:}'.format(package, version)
+    from importlib.metadata import PackageNotFoundError, version
+    try:
+        return '{:40} {:}'.format(package, version(package))
+    except PackageNotFoundError:
+        return '{:40} {:}'.format(package, 'not installed')
 
 @click.command()
 @click_log.simple_verbosity_option(root_logger)
@@ -51,19 +406,20 @@ def version():
 def show_default_config():
     """Prints the default configuration
     """
+    from minecraft.serverwrapper.config import get_default_config_string
     print(get_default_config_string())
 
 @click.command(name='show')
 def show_current_config():
     """Prints the current configuration
     """
-    print(MinecraftServerWrapper()._config.to_yaml())
+    print(server_wrapper()._config.to_yaml())
 
 @click.command(name='sync')
 def sync_instance():
     """Prepares the instance working directory and synchronizes mods & config
     """
-    sw = MinecraftServerWrapper()
+    sw = server_wrapper()
     sw.create_working_dir()
     sw.sync_instance()
 
@@ -81,9 +437,17 @@ config.add_command(sync_instance)
 
 @click.command(name='sync')
 def sync_modpack():
-    """Synchronizes provided modpack with the server
+    """Stages the provided modpack, it is used at the next server start
     """
-    MinecraftServerWrapper().sync_modpack()
+    server_wrapper().sync_modpack()
+
+
+@click.command(name='rollback')
+def rollback_modpack():
+    """Restores the previous mod set (only while the server is stopped)
+    """
+    require_stopped_server()
+    server_wrapper().rollback_mods()
 
 
 @click.group()
@@ -94,6 +458,36 @@ def modpack():
 
 
 modpack.add_command(sync_modpack)
+modpack.add_command(rollback_modpack)
+
+
+@click.command(name='tune')
+def show_jvm_tuning():
+    """Prints the JVM tuning profile and the reasoning behind it
+    """
+    try:
+        tuning = server_wrapper().java_tuning()
+    except MinecraftServerWrapperException as e:
+        raise click.ClickException(str(e))
+    print(f'Profile: {tuning.name}')
+    print('')
+    print('Reasoning:')
+    for reason in tuning.reasons:
+        print(f'    {reason}')
+    print('')
+    print('Java arguments:')
+    for arg in tuning.java_args:
+        print(f'    {arg}')
+
+
+@click.group()
+def jvm():
+    """Commands for inspecting the JVM configuration
+    """
+    pass
+
+
+jvm.add_command(show_jvm_tuning)
 
 
 @click.group()
@@ -103,10 +497,16 @@ def cli():
     pass
 
 
+cli.add_command(attach)
+cli.add_command(backup)
 cli.add_command(config)
+cli.add_command(jvm)
 cli.add_command(modpack)
+cli.add_command(profile)
 cli.add_command(run)
+cli.add_command(status)
 cli.add_command(version)
+cli.add_command(world)
 
 if __name__ == '__main__':
     cli()
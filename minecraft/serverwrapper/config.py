@@ -1,29 +1,52 @@
-from pkg_resources import resource_string, resource_listdir
+from functools import lru_cache
+from importlib.resources import files
+import logging
+import os
+from types import MappingProxyType
 import yaml
 
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+
+logger = logging.getLogger(__name__)
+
+# libyaml's loader is much faster, if pyyaml was built with it
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+class ConfigError(MinecraftServerWrapperException):
+    path: str = None
+
+    def __init__(self, path: str, message: str):
+        super().__init__(f'Invalid configuration: {path}: {message}' if path else f'Invalid configuration: {message}')
+        self.path = path
+
 
 def deep_merge(value1, value2):
     if isinstance(value1, dict) and isinstance(value2, dict):
-        return ConfigDict(**{k: deep_merge_key(value1, value2, k) for k in set(value1) | set(value2)})
+        # Keeps the order of value1, new keys from value2 go at the end
+        merged = ConfigDict()
+        for k, v in value1.items():
+            dict.__setitem__(merged, k, deep_merge(v, value2[k]) if k in value2 else v)
+        for k, v in value2.items():
+            if k not in value1:
+                merged[k] = v
+        return merged
+    if isinstance(value1, dict) and value2 is None:
+        # An empty section in a yaml file (e.g. with all entries commented out) doesn't override anything
+        return value1
     return value2
 
 
-def deep_merge_key(dict1, dict2, key):
-    if key in dict1:
-        if key in dict2:
-            return deep_merge(dict1[key], dict2[key])
-        return dict1[key]
-    return dict2[key]
-
-
 class ConfigDict(dict):
     """ A dictionary that can be used as a configuration
-    Can be (deeply) merged with other dictionaries
+    Can be (deeply) merged with other dictionaries. Nested dictionaries are converted once, on construction.
     """
-    yaml_loader = yaml.SafeLoader
+    yaml_loader = YamlLoader
 
     def __init__(self, **kw) -> None:
-        super().__init__(**kw)
+        super().__init__()
+        for k, v in kw.items():
+            self[k] = v
 
     def __repr__(self) -> str:
         return super().__repr__()
@@ -43,17 +66,8 @@ class ConfigDict(dict):
     # Override all the default dict operations to return a ConfigDict
     # override merging operations to merge the values instead of replacing them
 
-    def __getitem__(self, key):
-        value = super().__getitem__(key)
-        if isinstance(value, dict):
-            cd = ConfigDict(**value)
-            super().__setitem__(key, cd)
-            return cd
-        else:
-            return value
-
     def __setitem__(self, key, value):
-        if isinstance(value, dict):
+        if isinstance(value, dict) and not isinstance(value, ConfigDict):
             super().__setitem__(key, ConfigDict(**value))
         else:
             super().__setitem__(key, value)
@@ -73,38 +87,280 @@ class ConfigDict(dict):
         return self | other
 
     def to_yaml(self):
-        return yaml.dump(self.to_dict(), default_flow_style=False)
+        return yaml.dump(self.to_dict(), default_flow_style=False, sort_keys=False)
 
     @staticmethod
     def load_from_yaml_string(string):
-        return ConfigDict(**yaml.safe_load(string))
+        return ConfigDict(**(yaml.load(string, Loader=YamlLoader) or {}))
 
     @staticmethod
     def load_from_yaml_file(filename):
-        stream = open(filename, 'r')
-        return ConfigDict(**yaml.safe_load(stream))
+        return ConfigDict(**load_yaml_file(filename))
 
     @staticmethod
-    def load_from_yaml_resource(package_or_requirement, resource_name):
-        bytes = resource_string(
-            package_or_requirement=package_or_requirement,
-            resource_name=resource_name
-        )
-        return ConfigDict.load_from_yaml_string(bytes.decode('utf-8'))
+    def load_from_yaml_resource(package, resource_name):
+        return ConfigDict(**_load_yaml_resource(package, resource_name))
 
     @staticmethod
     def default_config():
         return ConfigDict.load_from_yaml_resource('minecraft.serverwrapper', 'default-config.yaml')
 
 
+# Parsed yaml files by path, with the (mtime, size) they were parsed at
+_yaml_cache: dict[str, tuple[tuple[int, int], dict]] = {}
+
+
+def load_yaml_file(filename) -> dict:
+    """ Parses a yaml file, reusing the result while the file is unchanged
+    The result is shared, callers must not modify it (ConfigDict makes its own copy of the dictionaries).
+    """
+    path = os.path.abspath(filename)
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _yaml_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with open(path, 'r') as stream:
+        try:
+            data = yaml.load(stream, Loader=YamlLoader) or {}
+        except yaml.YAMLError as e:
+            raise ConfigError('', f'{filename}: {e}')
+    if not isinstance(data, dict):
+        raise ConfigError('', f'{filename} does not contain a mapping')
+    _yaml_cache[path] = (key, data)
+    return data
+
+
+@lru_cache(maxsize=None)
+def _load_yaml_resource(package, resource_name) -> dict:
+    return yaml.load(files(package).joinpath(resource_name).read_text(encoding='utf-8'), Loader=YamlLoader) or {}
+
+
+def load_config(config: dict = None) -> ConfigDict:
+    """ The default configuration, merged with the given one or with minecraft.yaml if it exists
+    """
+    if config is None and os.path.exists('minecraft.yaml'):
+        config = ConfigDict.load_from_yaml_file('minecraft.yaml')
+    return ConfigDict.default_config() | (config or {})
+
+
+def working_directory(config: ConfigDict) -> str:
+    return config['wrapper']['working-directory'] or os.getcwd() + '/.minecraft-server'
+
+
 def get_default_config_string():
-    return resource_string('minecraft.serverwrapper', 'default-config.yaml').decode('utf-8')
+    return files('minecraft.serverwrapper').joinpath('default-config.yaml').read_text(encoding='utf-8')
+
+
+# Compiled configuration: the merged ConfigDict is validated against a schema once, and turned into an immutable
+# snapshot with plain attributes (kebab-case keys become snake_case), e.g. settings.wrapper.java_args.profile.
+# The schema is derived from default-config.yaml, with a few refinements below.
+
+class ConfigSection:
+    """ Base class of the (generated) snapshot classes, one per section of the configuration
+    """
+    __slots__ = ()
+    _keys: tuple[str] = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Configuration snapshots are read-only')
+
+    def __delattr__(self, name):
+        raise AttributeError('Configuration snapshots are read-only')
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        return getattr(self, attribute_name(key))
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(self[k] == other[k] for k in self._keys)
+
+    def __hash__(self):
+        return hash(tuple(self[k] for k in self._keys))
+
+    def keys(self):
+        return self._keys
+
+    def to_dict(self) -> dict:
+        return {k: _thaw(self[k]) for k in self._keys}
+
+    def __repr__(self):
+        return '{:s}({:s})'.format(type(self).__name__, ', '.join(f'{attribute_name(k)}={self[k]!r}' for k in self._keys))
+
+
+def attribute_name(key: str) -> str:
+    return key.replace('-', '_')
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, ConfigSection):
+        return value.to_dict()
+    if isinstance(value, MappingProxyType):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+
+class Field:
+    def compile(self, value, path: str):
+        return _freeze(value)
+
+    def describe(self) -> str:
+        return 'anything'
+
+
+class Scalar(Field):
+    _types: tuple[type] = None
+    _name: str = None
+
+    def __init__(self, types: tuple[type], name: str):
+        self._types = types
+        self._name = name
+
+    def compile(self, value, path: str):
+        # bool is an int in python, but not in a config file
+        if isinstance(value, bool) and bool not in self._types or not isinstance(value, self._types):
+            raise ConfigError(path, f'expected {self.describe()}, got {value!r}')
+        return float(value) if float in self._types else value
+
+    def describe(self) -> str:
+        return self._name
+
+
+class Optional(Field):
+    _inner: Field = None
+
+    def __init__(self, inner: Field):
+        self._inner = inner
+
+    def compile(self, value, path: str):
+        return None if value is None else self._inner.compile(value, path)
+
+    def describe(self) -> str:
+        return self._inner.describe() + ' or nothing'
+
+
+class Choice(Field):
+    _choices: tuple = None
+
+    def __init__(self, *choices):
+        self._choices = choices
+
+    def compile(self, value, path: str):
+        if value not in self._choices:
+            raise ConfigError(path, f'expected {self.describe()}, got {value!r}')
+        return value
+
+    def describe(self) -> str:
+        return 'one of ' + ', '.join(repr(c) for c in self._choices)
+
+
+class ListOf(Field):
+    _item: Field = None
+
+    def __init__(self, item: Field = None):
+        self._item = item or Field()
+
+    def compile(self, value, path: str):
+        if not isinstance(value, (list, tuple)):
+            raise ConfigError(path, f'expected a list, got {value!r}')
+        return tuple(self._item.compile(v, f'{path}[{i}]') for i, v in enumerate(value))
+
+    def describe(self) -> str:
+        return 'a list'
+
+
+class Section(Field):
+    _fields: dict[str, Field] = None
+    _class: type = None
+
+    def __init__(self, fields: dict[str, Field], name: str = 'Config'):
+        self._fields = fields
+        self._class = type(name, (ConfigSection,), {
+            '__slots__': tuple(attribute_name(k) for k in fields),
+            '_keys': tuple(fields),
+        })
+
+    def compile(self, value, path: str):
+        if value is None:
+            value = {}
+        if not isinstance(value, dict):
+            raise ConfigError(path, f'expected a section, got {value!r}')
+        for key in value:
+            if key not in self._fields:
+                logger.warning('Unknown configuration key {:s}, ignoring it.'.format(_join(path, key)))
+        section = object.__new__(self._class)
+        for key, field in self._fields.items():
+            object.__setattr__(section, attribute_name(key), field.compile(value.get(key), _join(path, key)))
+        return section
+
+    def describe(self) -> str:
+        return 'a section'
+
+
+def _join(path: str, key) -> str:
+    return f'{path}.{key}' if path else str(key)
+
+
+# Where the default value doesn't tell enough about what's allowed
+_schema_refinements = {
+    'minecraft.type': Choice('fabric'),
+    'minecraft.server.lan-broadcast.modes': ListOf(Choice('broadcast', 'multicast')),
+    'wrapper.java-args.profile': Choice('auto', 'aikar-g1', 'zgc-large', 'low-mem'),
+    'wrapper.profiling.mode': Choice('sample', 'cprofile'),
+}
+
+
+def _infer_field(default, path: str) -> Field:
+    if path in _schema_refinements:
+        return _schema_refinements[path]
+    if isinstance(default, dict):
+        name = 'Config' + ''.join(part.title().replace('-', '') for part in path.split('.') if part)
+        return Section({k: _infer_field(v, _join(path, k)) for k, v in default.items()}, name=name)
+    if isinstance(default, bool):
+        return Scalar((bool,), 'true or false')
+    if isinstance(default, float) or isinstance(default, int) and path.endswith('-seconds'):
+        return Scalar((int, float), 'a number')
+    if isinstance(default, int):
+        return Scalar((int,), 'an integer')
+    if isinstance(default, str):
+        return Scalar((str,), 'a string')
+    if isinstance(default, list):
+        return ListOf()
+    # Empty by default: paths, urls, hosts and the like
+    return Optional(Scalar((str,), 'a string'))
+
+
+@lru_cache(maxsize=None)
+def config_schema() -> Section:
+    return _infer_field(_load_yaml_resource('minecraft.serverwrapper', 'default-config.yaml'), '')
+
+
+def compile_config(config: dict) -> ConfigSection:
+    """ Validates a (merged) configuration and returns an immutable snapshot of it
+    Raises ConfigError for values of the wrong type; unknown keys are only logged.
+    """
+    return config_schema().compile(config, '')
+
 
 if __name__ == '__main__':
-    # print(resource_listdir('minecraft.serverwrapper', '.'))
     default_config = ConfigDict.default_config()
     config = default_config | ConfigDict.load_from_yaml_resource('minecraft.serverwrapper', 'example-config.yaml')
     print(type(default_config))
     print(type(config))
     print(config)
     print(config.to_yaml())
+    print(compile_config(config))
@@ -0,0 +1,189 @@
+import ctypes
+import logging
+import os
+import struct
+import time
+from typing import Callable
+
+from minecraft.serverwrapper.serverloop.objects import WaitingObject
+
+logger = logging.getLogger(__name__)
+
+# inotify(7), through libc. The directory is watched rather than the file: editors tend to replace files
+# (write a new one and rename it over the old one), which ends a watch on the file itself.
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ATTRIB | IN_MOVED_FROM | IN_DELETE
+
+_event = struct.Struct('iIII')
+
+# Wait this long after the last event before reading the file, editors may write it in several steps
+SETTLE_DELAY = 0.2
+POLL_INTERVAL = 2.0
+
+_libc = None
+
+
+def _inotify_libc():
+    global _libc
+    if _libc is None:
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            _libc = libc
+        except (OSError, AttributeError):
+            _libc = False
+    return _libc or None
+
+
+def file_signature(path: str) -> tuple[int, int, int] or None:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class ConfigWatcher(WaitingObject):
+    """ Calls back when a (configuration) file has changed
+    Uses inotify where available, otherwise checks the file's mtime every few seconds. Deleting the file doesn't
+    count as a change, the callback only runs when there is something to read.
+    """
+    _path: str = None
+    _callback: Callable[[], None] = None
+    _fd: int = None
+    _signature: tuple = None
+    _target: float = None
+    _poll_interval: float = POLL_INTERVAL
+
+    def __init__(self, path: str, callback: Callable[[], None], poll_interval: float = POLL_INTERVAL, use_inotify: bool = True, name=None):
+        super().__init__(name=name or 'config-watch')
+        self._path = os.path.abspath(path)
+        self._callback = callback
+        self._poll_interval = poll_interval
+        self._signature = file_signature(self._path)
+        libc = _inotify_libc() if use_inotify else None
+        if libc is not None:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0 and libc.inotify_add_watch(fd, os.path.dirname(self._path).encode(), WATCH_MASK) >= 0:
+                self._fd = fd
+            else:
+                logger.debug(f'{self}: inotify failed ({os.strerror(ctypes.get_errno())}), polling instead')
+                if fd >= 0:
+                    os.close(fd)
+        if self._fd is None:
+            self._target = time.time() + self._poll_interval
+
+    def uses_inotify(self) -> bool:
+        return self._fd is not None
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def is_waiting_to_receive(self) -> bool:
+        return self._fd is not None
+
+    def is_waiting_for_timeout(self):
+        return self._target
+
+    def ignore_when_idle(self) -> bool:
+        return True
+
+    def do_receive(self) -> None:
+        try:
+            data = os.read(self._fd, 65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        name = os.path.basename(self._path).encode()
+        offset = 0
+        while offset + _event.size <= len(data):
+            _, _, _, length = _event.unpack_from(data, offset)
+            event_name = data[offset + _event.size:offset + _event.size + length].rstrip(b'\0')
+            offset += _event.size + length
+            if event_name == name:
+                self._target = time.time() + SETTLE_DELAY
+
+    def do_timeout(self) -> None:
+        self._target = None if self._fd is not None else time.time() + self._poll_interval
+        signature = file_signature(self._path)
+        if signature == self._signature:
+            return
+        self._signature = signature
+        if signature is None:
+            logger.debug(f'{self}: {self._path} was removed, keeping the current configuration')
+            return
+        self._callback()
+
+    def close(self) -> None:
+        self._is_done = True
+        self._target = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class ConfigChange:
+    """ A changed setting, with its key path (like ('wrapper', 'java-args', 'profile'))
+    """
+    path: tuple[str] = None
+    old = None
+    new = None
+
+    def __init__(self, path: tuple[str], old, new):
+        self.path = path
+        self.old = old
+        self.new = new
+
+    @property
+    def key(self) -> str:
+        return '.'.join(self.path)
+
+    def __str__(self) -> str:
+        return f'{self.key}: {self.old!r} -> {self.new!r}'
+
+    def __repr__(self) -> str:
+        return f'ConfigChange({self})'
+
+
+def diff_config(old: dict, new: dict, path: tuple[str] = ()) -> list[ConfigChange]:
+    """ The settings that differ between two configurations, down to single values (lists count as values)
+    """
+    changes = []
+    for key in list(old) + [key for key in new if key not in old]:
+        old_value = old.get(key)
+        new_value = new.get(key)
+        if isinstance(old_value, dict) and isinstance(new_value, dict):
+            changes.extend(diff_config(old_value, new_value, path + (key,)))
+        elif old_value != new_value:
+            changes.append(ConfigChange(path + (key,), old_value, new_value))
+    return changes
+
+
+def match_rule(rules: dict[str, object], key: str, default=None):
+    """ The rule for the longest key prefix (at dots) that has one
+    """
+    while True:
+        if key in rules:
+            return rules[key]
+        if '.' not in key:
+            return default
+        key = key.rsplit('.', 1)[0]
+
+
+def with_values(config: dict, changes: list[ConfigChange], attribute: str) -> dict:
+    """ A copy of the configuration with the old (or new) values of the given changes
+    """
+    config = {k: with_values(v, [], attribute) if isinstance(v, dict) else v for k, v in config.items()}
+    for change in changes:
+        section = config
+        for key in change.path[:-1]:
+            section = section.setdefault(key, {})
+        section[change.path[-1]] = getattr(change, attribute)
+    return config
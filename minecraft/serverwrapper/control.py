@@ -0,0 +1,320 @@
+from collections import deque
+import json
+import logging
+import os
+import select
+import socket
+import sys
+from typing import Callable
+
+from minecraft.serverwrapper.config import ConfigDict, working_directory
+from minecraft.serverwrapper.serverloop.objects import WaitingObject
+from minecraft.serverwrapper.serverloop.serverloop import ServerLoop
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+
+logger = logging.getLogger(__name__)
+
+# The control socket speaks JSON lines. Requests from clients:
+#   {"type": "command", "command": "say hi", "id": 1}   -> {"type": "response", "id": 1, "result": "..."}
+#   {"type": "subscribe"} / {"type": "unsubscribe"}     -> events like {"type": "log", "level": "INFO", ...}
+# Anything else goes to the request handler, which may answer with client.send().
+
+MAX_REQUEST_LINE = 1 << 16
+SEND_BATCH = 64
+
+
+def socket_path(config: ConfigDict) -> str:
+    return config['wrapper']['control']['socket-path'] or working_directory(config) + '/control.sock'
+
+
+def encode_message(message: dict) -> bytes:
+    return (json.dumps(message, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+class ControlConnection(WaitingObject):
+    """ A client of the control socket
+    Outgoing messages are queued as (shared) encoded lines, up to max_queued_bytes. A subscriber that falls
+    further behind is disconnected, instead of slowing down the server or using up memory.
+    """
+    _sock: socket.socket = None
+    _server: 'ControlServer' = None
+    _in: bytearray = None
+    _out: deque = None
+    _out_offset: int = 0
+    _queued_bytes: int = 0
+    _max_queued_bytes: int = None
+    _close_after_send: bool = False
+    subscribed: bool = False
+
+    def __init__(self, sock: socket.socket, server: 'ControlServer', max_queued_bytes: int, name=None):
+        super().__init__(name=name)
+        self._sock = sock
+        self._server = server
+        self._max_queued_bytes = max_queued_bytes
+        self._in = bytearray()
+        self._out = deque()
+        sock.setblocking(False)
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def ignore_when_idle(self) -> bool:
+        return True
+
+    def is_waiting_to_receive(self) -> bool:
+        return not self._close_after_send
+
+    def is_waiting_to_send(self) -> bool:
+        return len(self._out) > 0
+
+    def send(self, message: dict) -> None:
+        self.send_encoded(encode_message(message))
+
+    def send_encoded(self, data: bytes) -> None:
+        if self._is_done or self._close_after_send:
+            return
+        if self._queued_bytes + len(data) > self._max_queued_bytes:
+            logger.warning(f'{self}: client is not keeping up ({self._queued_bytes} bytes queued), disconnecting')
+            return self.close()
+        self._out.append(data)
+        self._queued_bytes += len(data)
+
+    def do_receive(self) -> None:
+        try:
+            data = self._sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            return self.close()
+        if not data:
+            # The client may only have closed its sending side, deliver what's queued
+            self._close_after_send = True
+            if len(self._out) == 0:
+                self.close()
+            return
+        self._in += data
+        while (end := self._in.find(b'\n')) >= 0:
+            line = bytes(self._in[:end])
+            del self._in[:end + 1]
+            self._handle_line(line)
+        if len(self._in) > MAX_REQUEST_LINE:
+            self.send({'type': 'error', 'error': 'request too long'})
+            self._close_after_send = True
+
+    def _handle_line(self, line: bytes) -> None:
+        if line.strip() == b'':
+            return
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('request must be an object')
+        except ValueError as e:
+            return self.send({'type': 'error', 'error': f'invalid request: {e}'})
+        if request.get('type') == 'subscribe':
+            self.subscribed = True
+            self.send({'type': 'subscribed', 'id': request.get('id')})
+        elif request.get('type') == 'unsubscribe':
+            self.subscribed = False
+            self.send({'type': 'unsubscribed', 'id': request.get('id')})
+        else:
+            try:
+                self._server.request_handler(request, self)
+            except MinecraftServerWrapperException as e:
+                self.send({'type': 'error', 'id': request.get('id'), 'error': str(e)})
+
+    def do_send(self) -> None:
+        # Send queued lines in one go, without joining them first
+        buffers = [memoryview(self._out[0])[self._out_offset:]]
+        buffers.extend(self._out[i] for i in range(1, min(len(self._out), SEND_BATCH)))
+        try:
+            sent = self._sock.sendmsg(buffers)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            return self.close()
+        self._queued_bytes -= sent
+        sent += self._out_offset
+        while self._out and sent >= len(self._out[0]):
+            sent -= len(self._out.popleft())
+        self._out_offset = sent
+        if len(self._out) == 0 and self._close_after_send:
+            self.close()
+
+    def close(self) -> None:
+        if self._is_done:
+            return
+        self._is_done = True
+        self._sock.close()
+        self._out.clear()
+        self._server.remove_connection(self)
+
+
+class ControlServer(WaitingObject):
+    """ Local control socket (unix domain) for tools like "minecraft-serverwrapper attach"
+    Events are serialized once and shared by all subscribers.
+    """
+    _serverloop: ServerLoop = None
+    _path: str = None
+    _sock: socket.socket = None
+    _connections: list[ControlConnection] = None
+    _max_queued_bytes: int = None
+    _client_count: int = 0
+    request_handler: Callable[[dict, ControlConnection], None] = None
+
+    def __init__(self, serverloop: ServerLoop, path: str, request_handler: Callable[[dict, ControlConnection], None],
+            max_queued_bytes: int = 1 << 20, name=None):
+        super().__init__(name=name or 'control')
+        self._serverloop = serverloop
+        self._path = path
+        self.request_handler = request_handler
+        self._max_queued_bytes = max_queued_bytes
+        self._connections = []
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                raise MinecraftServerWrapperException(f'Another wrapper is already listening on {path}.')
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left over from a wrapper that didn't shut down cleanly
+                os.unlink(path)
+            finally:
+                probe.close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            sock.bind(path)
+        finally:
+            os.umask(old_umask)
+        sock.listen(16)
+        sock.setblocking(False)
+        self._sock = sock
+        logger.info(f'Control socket listening on {path}')
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def is_waiting_to_receive(self) -> bool:
+        return True
+
+    def ignore_when_idle(self) -> bool:
+        return True
+
+    def do_receive(self) -> None:
+        try:
+            sock, _ = self._sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        self._client_count += 1
+        connection = ControlConnection(sock, self, self._max_queued_bytes, name=f'control-{self._client_count}')
+        self._connections.append(connection)
+        self._serverloop.add_waiting_object(connection)
+
+    def remove_connection(self, connection: ControlConnection) -> None:
+        if connection in self._connections:
+            self._connections.remove(connection)
+
+    def publish(self, event: dict) -> None:
+        """ Sends an event to all subscribers
+        """
+        data = None
+        for connection in self._connections[:]:
+            if connection.subscribed:
+                if data is None:
+                    data = encode_message(event)
+                connection.send_encoded(data)
+
+    def subscriber_count(self) -> int:
+        return sum(1 for connection in self._connections if connection.subscribed)
+
+    def close(self) -> None:
+        self._is_done = True
+        for connection in self._connections[:]:
+            connection.close()
+        self._sock.close()
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+
+
+def request(path: str, message: dict, timeout: float = 10.0) -> dict:
+    """ Sends one request and returns the response to it. Error responses raise MinecraftServerWrapperException.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        raise MinecraftServerWrapperException(f'No server wrapper is listening on {path}.')
+    message = message | {'id': 1}
+    buffer = bytearray()
+    with sock:
+        try:
+            sock.sendall(encode_message(message))
+            while True:
+                while (end := buffer.find(b'\n')) >= 0:
+                    response = json.loads(buffer[:end])
+                    del buffer[:end + 1]
+                    if response.get('id') != message['id']:
+                        continue
+                    if response.get('type') == 'error':
+                        raise MinecraftServerWrapperException(response.get('error', 'unknown error'))
+                    return response
+                data = sock.recv(65536)
+                if not data:
+                    raise MinecraftServerWrapperException('The server wrapper closed the connection.')
+                buffer += data
+        except socket.timeout:
+            raise MinecraftServerWrapperException('No response from the server wrapper.')
+
+
+def attach(path: str) -> None:
+    """ Shows the server's log and sends lines typed on stdin as commands, until either side closes
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        raise MinecraftServerWrapperException(f'No server wrapper is listening on {path}.')
+    sock.sendall(encode_message({'type': 'subscribe'}))
+    stdin = sys.stdin.fileno()
+    buffer = bytearray()
+    input_buffer = bytearray()
+    next_id = 1
+    stdin_open = True
+    with sock:
+        while True:
+            readable, _, _ = select.select([sock, stdin] if stdin_open else [sock], [], [])
+            if stdin in readable:
+                data = os.read(stdin, 4096)
+                if not data:
+                    stdin_open = False
+                    sock.shutdown(socket.SHUT_WR)
+                input_buffer += data
+                while (end := input_buffer.find(b'\n')) >= 0:
+                    command = input_buffer[:end].decode('utf-8', errors='replace').strip()
+                    del input_buffer[:end + 1]
+                    if command != '':
+                        sock.sendall(encode_message({'type': 'command', 'command': command, 'id': next_id}))
+                        next_id += 1
+            if sock in readable:
+                data = sock.recv(65536)
+                if not data:
+                    return
+                buffer += data
+                while (end := buffer.find(b'\n')) >= 0:
+                    print_message(json.loads(buffer[:end]))
+                    del buffer[:end + 1]
+
+
+def print_message(message: dict) -> None:
+    if message.get('type') == 'log':
+        print('[{:s}] {:s}'.format(message.get('level', ''), message.get('message', '')))
+    elif message.get('type') == 'response':
+        if message.get('result') is not None:
+            print(message['result'])
+    elif message.get('type') == 'error':
+        print('Error: {:s}'.format(message.get('error', '')), file=sys.stderr)
+    elif message.get('type') not in ('subscribed', 'unsubscribed'):
+        print(json.dumps(message))
+    sys.stdout.flush()
@@ -0,0 +1,365 @@
+""" A stand-in for "java -jar server.jar nogui", for testing and benchmarking the wrapper without Java
+Point wrapper.java-executable-path at a script that runs it, which this writes with:
+
+    python -m minecraft.serverwrapper.fakeserver --write-shim /tmp/fake-java
+
+It answers "java -version", ignores JVM options and logs like a Fabric server. Its behaviour is set through the
+FAKE_SERVER_ARGS environment variable (see --help), and while running through console commands:
+
+    fake rate <lines/s> [burst]     background chatter, in bursts of lines
+    fake flood <lines> [burst]      lines as fast as the wrapper takes them, then "Flood of <lines> lines done"
+    fake storm <traces> [depth]     a storm of stack traces, then "Storm of <traces> traces done"
+    fake join <name> / fake leave <name>
+    fake crash / fake hang
+
+Vanilla commands that the wrapper uses (stop, say, list, save-all, save-off, save-on) answer like the real ones.
+"""
+import argparse
+import os
+import random
+import re
+import select
+import shlex
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+
+from minecraft.serverwrapper.frontend import protocol
+from minecraft.serverwrapper.util.properties import read_properties
+
+DEFAULT_MINECRAFT_VERSION = '1.19.2'
+DEFAULT_LOADER_VERSION = '0.14.21'
+
+_chatter = [
+    (60, 'Server thread/INFO', '<{player}> {chat}'),
+    (15, 'Server thread/INFO', 'Saving chunks for level \'ServerLevel[world]\'/minecraft:overworld'),
+    (8, 'Worker-Main-3/WARN', 'Received passengers for unknown entity'),
+    (5, 'Server thread/WARN', '{player} moved too quickly! {dx},{dy},{dz}'),
+    (2, 'Server thread/WARN', 'Can\'t keep up! Is the server overloaded? Running {ms}ms or {ticks} ticks behind'),
+]
+_chatter_weights = [weight for weight, _, _ in _chatter]
+_fake_players = ['Steve', 'Alex', 'Notch_', 'xX_Builder_Xx']
+
+
+def parse_options(args: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='FAKE_SERVER_ARGS', description='Options of the fake Minecraft server')
+    parser.add_argument('--java-version', default='17.0.8', help='Version reported by -version')
+    parser.add_argument('--startup-seconds', type=float, default=2.0, help='Time from launch to "Done"')
+    parser.add_argument('--mods', type=int, default=40, help='Number of mods in the startup log')
+    parser.add_argument('--lines-per-second', type=float, default=0.0, help='Background chatter after startup')
+    parser.add_argument('--burst', type=int, default=1, help='Chatter lines written at once')
+    parser.add_argument('--stacktrace-every', type=int, default=0, help='Add a stack trace every N chatter lines')
+    parser.add_argument('--stacktrace-depth', type=int, default=30, help='Frames per stack trace')
+    parser.add_argument('--crash-after', type=float, help='Crash this many seconds after launch')
+    parser.add_argument('--hang-after', type=float, help='Stop responding this many seconds after launch')
+    parser.add_argument('--hang-ignores-sigterm', action='store_true', help='A hung server only goes away with SIGKILL')
+    parser.add_argument('--listen', action='store_true', help='Listen on the game port, answer status pings and log logins')
+    parser.add_argument('--players', type=int, default=0, help='Players joining right after startup')
+    parser.add_argument('--exit-code', type=int, default=1, help='Exit code after a crash')
+    return parser.parse_args(args)
+
+
+class FakeServer:
+    _options: argparse.Namespace = None
+    _minecraft_version: str = None
+    _loader_version: str = None
+    _started: float = None
+    _host: str = None
+    _port: int = None
+    _lock: threading.Lock = None
+    _players: dict[str, str] = None
+    _rng: random.Random = None
+    _stdin: bytearray = None
+    _rate: float = 0.0
+    _burst: int = 1
+    _next_chatter: float = None
+    _chatter_count: int = 0
+    _hung: bool = False
+
+    def __init__(self, options: argparse.Namespace, jar: str = None):
+        self._options = options
+        m = re.search(r'mc\.([0-9.]+)-loader\.([0-9.]+)', jar or '')
+        self._minecraft_version = m.group(1) if m else DEFAULT_MINECRAFT_VERSION
+        self._loader_version = m.group(2) if m else DEFAULT_LOADER_VERSION
+        self._lock = threading.Lock()
+        self._players = {}
+        self._rng = random.Random(1)
+        self._stdin = bytearray()
+        self._rate = options.lines_per_second
+        self._burst = max(1, options.burst)
+
+    def write(self, lines: list[str]) -> None:
+        if self._hung:
+            return
+        data = ''.join(line + '\n' for line in lines).encode('utf-8')
+        with self._lock:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(1, view):]
+
+    def log_lines(self, thread: str, level: str, messages: list[str]) -> list[str]:
+        prefix = time.strftime('[%H:%M:%S]') + f' [{thread}/{level}]: '
+        # Lines starting with a tab continue a multi-line message
+        return [message if message.startswith('\t') else prefix + message for message in messages]
+
+    def log(self, message: str, thread: str = 'Server thread', level: str = 'INFO') -> None:
+        self.write(self.log_lines(thread, level, [message]))
+
+    def elapsed(self) -> float:
+        return time.time() - self._started
+
+    def stack_trace(self, exception: str, depth: int) -> list[str]:
+        frames = [
+            'net.minecraft.server.MinecraftServer.tickChildren(MinecraftServer.java:{n})',
+            'net.minecraft.server.level.ServerLevel.tick(ServerLevel.java:{n})',
+            'net.minecraft.world.level.Level.guardEntityTick(Level.java:{n})',
+            'net.fabricmc.fabric.impl.event.lifecycle.LifecycleEventsImpl.lambda$init$0(LifecycleEventsImpl.java:{n})',
+        ]
+        return [exception] + ['\tat ' + self._rng.choice(frames).format(n=self._rng.randint(100, 2000)) for _ in range(depth)]
+
+    def chatter(self, count: int) -> list[str]:
+        lines = []
+        for _ in range(count):
+            _, thread, text = self._rng.choices(_chatter, _chatter_weights)[0]
+            text = text.format(player=self._rng.choice(_fake_players), chat='hello ' * self._rng.randint(1, 12),
+                ms=self._rng.randint(2000, 9000), ticks=self._rng.randint(40, 180), dx=self._rng.random(),
+                dy=self._rng.random(), dz=self._rng.random())
+            lines.append(time.strftime('[%H:%M:%S]') + f' [{thread}]: {text}')
+            self._chatter_count += 1
+            if self._options.stacktrace_every and self._chatter_count % self._options.stacktrace_every == 0:
+                lines[-1:] = self.log_lines('Server thread', 'ERROR', ['Error executing task'])
+                lines.extend(self.stack_trace('java.lang.NullPointerException: Cannot invoke "Object.hashCode()"',
+                    self._options.stacktrace_depth))
+        return lines
+
+    def check_timers(self) -> None:
+        if self._options.crash_after is not None and self.elapsed() >= self._options.crash_after:
+            self.crash()
+        if self._options.hang_after is not None and self.elapsed() >= self._options.hang_after:
+            self.hang()
+
+    def startup(self) -> None:
+        mods = [f'\t- fake-mod-{i} 1.0.{i}' for i in range(self._options.mods)]
+        steps = [
+            ('main', [f'Loading Minecraft {self._minecraft_version} with Fabric Loader {self._loader_version}',
+                f'Loading {len(mods) + 3} mods:', f'\t- fabricloader {self._loader_version}', '\t- java 17',
+                f'\t- minecraft {self._minecraft_version}'] + mods),
+            ('main', ['SpongePowered MIXIN Subsystem Version=0.8.5 Source=file:fabric-loader.jar Service=Knot/Fabric Env=SERVER']),
+            ('main', ['Environment: authHost=\'https://authserver.mojang.com\', accountsHost=\'https://api.mojang.com\'']),
+            ('Worker-Main-1', ['Loaded 7 recipes', 'Loaded 1179 advancements']),
+            ('Server thread', [f'Starting minecraft server version {self._minecraft_version}', 'Loading properties',
+                'Default game type: SURVIVAL', 'Generating keypair']),
+            ('Server thread', ['Starting Minecraft server on {:s}:{:d}'.format(self._host or '*', self._port)]),
+            ('Server thread', ['Using epoll channel type', 'Preparing level "world"',
+                'Preparing start region for dimension minecraft:overworld']),
+        ] + [('Worker-Main-2', [f'Preparing spawn area: {p}%']) for p in (0, 18, 47, 83)]
+        self.write(['Starting net.fabricmc.loader.impl.game.minecraft.BundlerClassPathCapture'])
+        for i, (thread, messages) in enumerate(steps):
+            target = self._started + self._options.startup_seconds * (i + 1) / (len(steps) + 1)
+            while time.time() < target:
+                time.sleep(min(0.05, target - time.time()))
+                self.check_timers()
+            self.write(self.log_lines(thread, 'INFO', messages))
+        while self.elapsed() < self._options.startup_seconds:
+            time.sleep(min(0.05, self._options.startup_seconds - self.elapsed()))
+            self.check_timers()
+        # Preparing the spawn area is the last part of the startup
+        self.log('Time elapsed: {:.0f} ms'.format(self._options.startup_seconds * 1000 * 0.3))
+        self.log('Done ({:.3f}s)! For help, type "help"'.format(self.elapsed()))
+
+    def join(self, name: str) -> None:
+        self._players[name] = str(uuid.uuid3(uuid.NAMESPACE_OID, name))
+        self.log(f'UUID of player {name} is {self._players[name]}', thread='User Authenticator #1')
+        self.log(f'{name}[/127.0.0.1:{self._rng.randint(30000, 60000)}] logged in with entity id {self._rng.randint(100, 9999)} at (0.5, 64.0, 0.5)')
+        self.log(f'{name} joined the game')
+
+    def leave(self, name: str) -> None:
+        if self._players.pop(name, None) is not None:
+            self.log(f'{name} lost connection: Disconnected')
+            self.log(f'{name} left the game')
+
+    def stop(self, code: int = 0) -> None:
+        for message in ['Stopping the server', 'Stopping server', 'Saving players', 'Saving worlds',
+                'Saving chunks for level \'ServerLevel[world]\'/minecraft:overworld',
+                'ThreadedAnvilChunkStorage (world): All chunks are saved']:
+            self.log(message)
+        sys.exit(code)
+
+    def crash(self) -> None:
+        self.log('Encountered an unexpected exception', level='ERROR')
+        self.write(self.stack_trace('java.lang.IllegalStateException: Fake crash', self._options.stacktrace_depth))
+        self.log('This crash report has been saved to: ./crash-reports/crash-fake-server.txt', level='ERROR')
+        os._exit(self._options.exit_code)
+
+    def hang(self) -> None:
+        self._hung = True
+        if self._options.hang_ignores_sigterm:
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        while True:
+            time.sleep(3600)
+
+    def command(self, line: str) -> None:
+        args = line.strip().removeprefix('/').split()
+        if not args:
+            return
+        name = args[0]
+        if name == 'stop':
+            self.stop()
+        elif name == 'say':
+            self.log('[Server] ' + line.strip().removeprefix('/')[4:])
+        elif name == 'list':
+            self.log('There are {:d} of a max of 20 players online: {:s}'.format(len(self._players), ', '.join(self._players)))
+        elif name == 'save-all':
+            self.log('Saving the game (this may take a moment!)')
+            self.log('Saved the game')
+        elif name == 'save-off':
+            self.log('Automatic saving is now disabled')
+        elif name == 'save-on':
+            self.log('Automatic saving is now enabled')
+        elif name == 'fake' and len(args) >= 2:
+            self.fake_command(args[1], args[2:])
+        else:
+            self.log('Unknown or incomplete command, see below for error')
+            self.log(line.strip().removeprefix('/') + '<--[HERE]')
+
+    def fake_command(self, name: str, args: list[str]) -> None:
+        if name == 'rate':
+            self._rate = float(args[0])
+            self._burst = max(1, int(args[1])) if len(args) > 1 else 1
+            self._next_chatter = time.time()
+        elif name == 'flood':
+            lines = int(args[0])
+            burst = int(args[1]) if len(args) > 1 else 100
+            for start in range(0, lines, burst):
+                self.write(self.chatter(min(burst, lines - start)))
+            self.log(f'Flood of {lines} lines done')
+        elif name == 'storm':
+            traces = int(args[0])
+            depth = int(args[1]) if len(args) > 1 else self._options.stacktrace_depth
+            for _ in range(traces):
+                self.write(self.log_lines('Server thread', 'ERROR', ['Error executing task'])
+                    + self.stack_trace('java.lang.NullPointerException: Cannot invoke "Object.hashCode()"', depth))
+            self.log(f'Storm of {traces} traces done')
+        elif name == 'join':
+            self.join(args[0])
+        elif name == 'leave':
+            self.leave(args[0])
+        elif name == 'crash':
+            self.crash()
+        elif name == 'hang':
+            self.hang()
+
+    def listen(self) -> None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self._host, self._port))
+        sock.listen(16)
+        threading.Thread(target=self._accept, args=(sock,), daemon=True).start()
+
+    def _accept(self, sock: socket.socket) -> None:
+        while True:
+            conn, _ = sock.accept()
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn: socket.socket) -> None:
+        """ Answers status pings, logs players in and out (the rest of a login is just echoed)
+        """
+        data = bytearray()
+        with conn:
+            handshake = None
+            while chunk := conn.recv(65536):
+                data += chunk
+                while (packet := protocol.split_packet(data)) is not None:
+                    packet_id, payload, end = packet
+                    del data[:end]
+                    if handshake is None:
+                        handshake = protocol.Handshake.decode(payload)
+                    elif handshake.next_state == 1 and packet_id == 0x00:
+                        conn.sendall(protocol.status_response({
+                            'version': {'name': self._minecraft_version, 'protocol': handshake.protocol_version},
+                            'players': {'max': 20, 'online': len(self._players)},
+                            'description': {'text': 'A Fake Minecraft Server'},
+                        }))
+                    elif handshake.next_state == 1 and packet_id == 0x01:
+                        conn.sendall(protocol.pong(payload))
+                    elif handshake.next_state == 2 and packet_id == 0x00:
+                        name, _ = protocol.decode_string(payload, 0)
+                        self.join(name)
+                        try:
+                            while chunk := conn.recv(65536):
+                                conn.sendall(chunk)
+                        except OSError:
+                            pass
+                        self.leave(name)
+                        return
+
+    def run(self) -> int:
+        self._started = time.time()
+        properties = read_properties('server.properties')
+        self._host = properties.get('server-ip', '')
+        self._port = int(properties.get('server-port') or 25565)
+        signal.signal(signal.SIGTERM, lambda *_: self.stop(143))
+        self.startup()
+        if self._options.listen:
+            self.listen()
+        for i in range(self._options.players):
+            self.join(f'Player{i}')
+        os.set_blocking(0, False)
+        self._next_chatter = time.time()
+        while True:
+            self.check_timers()
+            now = time.time()
+            if self._rate > 0 and now >= self._next_chatter:
+                self.write(self.chatter(self._burst))
+                # Skip what couldn't be written in time, rather than catching up in a burst
+                self._next_chatter = max(self._next_chatter + self._burst / self._rate, now - 1.0)
+            timeout = 0.5
+            if self._rate > 0:
+                timeout = max(0.0, min(timeout, self._next_chatter - time.time()))
+            readable, _, _ = select.select([0], [], [], timeout)
+            if readable:
+                data = os.read(0, 65536)
+                if not data:
+                    # Like the real server, keep running without a console
+                    os.set_blocking(0, True)
+                    while True:
+                        self.check_timers()
+                        time.sleep(0.5)
+                self._stdin += data
+                while (end := self._stdin.find(b'\n')) >= 0:
+                    line = self._stdin[:end].decode('utf-8', errors='replace')
+                    del self._stdin[:end + 1]
+                    self.command(line)
+
+
+def write_shim(path: str) -> None:
+    """ Writes an executable that runs the fake server with this python, usable as the java executable
+    """
+    package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\n')
+        f.write(f'PYTHONPATH={shlex.quote(package_root)}${{PYTHONPATH:+:$PYTHONPATH}} '
+            f'exec {shlex.quote(sys.executable)} -m minecraft.serverwrapper.fakeserver "$@"\n')
+    os.chmod(path, 0o755)
+
+
+def main(argv: list[str] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['--write-shim'] and len(argv) == 2:
+        write_shim(argv[1])
+        return 0
+    options = parse_options(shlex.split(os.environ.get('FAKE_SERVER_ARGS', '')))
+    if '-version' in argv:
+        print(f'openjdk version "{options.java_version}" 2023-07-18', file=sys.stderr)
+        print(f'OpenJDK Runtime Environment (build {options.java_version}+7)', file=sys.stderr)
+        print(f'OpenJDK 64-Bit Server VM (build {options.java_version}+7, mixed mode, sharing)', file=sys.stderr)
+        return 0
+    jar = argv[argv.index('-jar') + 1] if '-jar' in argv[:-1] else None
+    return FakeServer(options, jar).run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
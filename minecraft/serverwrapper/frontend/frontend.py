@@ -0,0 +1,308 @@
+import logging
+import socket
+import time
+from typing import Callable
+
+from minecraft.serverwrapper.frontend import protocol
+from minecraft.serverwrapper.frontend.proxy import Relay
+from minecraft.serverwrapper.frontend.status import StatusCache
+from minecraft.serverwrapper.serverloop.objects import WaitingObject
+from minecraft.serverwrapper.serverloop.serverloop import ServerLoop
+
+logger = logging.getLogger(__name__)
+
+# Connections that don't finish their handshake (or status exchange) in time are dropped
+CONNECTION_TIMEOUT = 10.0
+MAX_ACCEPTS_PER_TICK = 64
+# Connections that haven't said what they want yet. Beyond this, new ones wait in the listen backlog.
+MAX_PENDING_CONNECTIONS = 512
+# A held login only sends its login start packet, anything beyond this is not a well-behaved client
+MAX_HELD_BYTES = 1 << 16
+
+
+class FrontendConnection(WaitingObject):
+    """ A client connection to the game port, until it's clear what the client wants
+    Status requests and pings are answered directly, logins are handed to the frontend's login handler.
+    """
+    _sock: socket.socket = None
+    _frontend: 'GamePortFrontend' = None
+    _peer: str = None
+    _in: bytearray = None
+    _out: bytearray = None
+    _handshake: protocol.Handshake = None
+    _close_after_send: bool = False
+    _held: bool = False
+    _target: float = None
+
+    def __init__(self, sock: socket.socket, peer, frontend: 'GamePortFrontend'):
+        super().__init__(name=f'frontend-{peer[0]}:{peer[1]}')
+        self._sock = sock
+        self._peer = peer
+        self._frontend = frontend
+        self._in = bytearray()
+        self._out = bytearray()
+        self._target = time.time() + CONNECTION_TIMEOUT
+        sock.setblocking(False)
+
+    @property
+    def handshake(self) -> protocol.Handshake:
+        return self._handshake
+
+    @property
+    def peer(self) -> tuple[str, int]:
+        return self._peer
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def ignore_when_idle(self) -> bool:
+        return True
+
+    def is_waiting_to_receive(self) -> bool:
+        return not self._close_after_send
+
+    def is_waiting_to_send(self) -> bool:
+        return len(self._out) > 0
+
+    def is_waiting_for_timeout(self):
+        return self._target
+
+    def do_timeout(self) -> None:
+        if self._held:
+            self._held = False
+            logger.info(f'{self}: server did not become available in time, disconnecting')
+            self.disconnect(self._frontend.hold_timeout_message)
+            # Give the message a moment to go out
+            self._target = time.time() + CONNECTION_TIMEOUT
+            return
+        logger.debug(f'{self}: timed out')
+        self.close()
+
+    def do_receive(self) -> None:
+        try:
+            data = self._sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            return self.close()
+        if not data:
+            return self.close()
+        self._in += data
+        if self._held:
+            # Kept for the server, which gets everything once the login is forwarded
+            if len(self._in) > MAX_HELD_BYTES:
+                logger.debug(f'{self}: too much data while held')
+                self.close()
+            return
+        try:
+            self._process()
+        except protocol.ProtocolError as e:
+            logger.debug(f'{self}: {e}')
+            self.close()
+
+    def _process(self) -> None:
+        if self._handshake is None:
+            if protocol.is_legacy_ping(self._in):
+                # 0xFE alone is a pre-1.4 ping, newer legacy clients send 0xFE 0x01 ...
+                self.reply(self._frontend.status_cache.legacy_response(pre_1_4=len(self._in) == 1), close=True)
+                return
+            if len(self._in) > protocol.MAX_HANDSHAKE_LENGTH:
+                raise protocol.ProtocolError('handshake too long')
+            packet = protocol.split_packet(self._in)
+            if packet is None:
+                return
+            packet_id, payload, end = packet
+            if packet_id != 0x00:
+                raise protocol.ProtocolError(f'expected handshake, got packet {packet_id}')
+            self._handshake = protocol.Handshake.decode(payload)
+            if self._handshake.next_state != protocol.STATE_STATUS:
+                # Everything read so far (including the handshake) goes to the server as well
+                self._frontend.handle_login(self)
+                return
+            del self._in[:end]
+
+        while not self._close_after_send:
+            packet = protocol.split_packet(self._in)
+            if packet is None:
+                return
+            packet_id, payload, end = packet
+            if packet_id == 0x00:
+                self.reply(self._frontend.status_cache.encoded_response())
+            elif packet_id == 0x01:
+                self.reply(protocol.pong(payload), close=True)
+            else:
+                raise protocol.ProtocolError(f'unexpected status packet {packet_id}')
+            del self._in[:end]
+
+    def hold(self, seconds: float) -> None:
+        """ Keeps a login waiting (e.g. while the server starts), until it's forwarded or the time runs out
+        """
+        self._held = True
+        self._target = time.time() + seconds
+
+    def is_held(self) -> bool:
+        return self._held and not self._is_done
+
+    def reply(self, data: bytes, close: bool = False) -> None:
+        self._out += data
+        self._close_after_send = self._close_after_send or close
+
+    def disconnect(self, text: str) -> None:
+        """ Rejects a login with a message shown to the player
+        """
+        self._held = False
+        self.reply(protocol.login_disconnect(text), close=True)
+
+    def do_send(self) -> None:
+        try:
+            sent = self._sock.send(self._out)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            return self.close()
+        del self._out[:sent]
+        if len(self._out) == 0 and self._close_after_send:
+            self.close()
+
+    def take_over(self) -> tuple[socket.socket, bytes]:
+        """ Hands the socket and everything received so far over to someone else
+        """
+        self._is_done = True
+        self._held = False
+        self._target = None
+        sock, self._sock = self._sock, None
+        data = bytes(self._in)
+        self._in = bytearray()
+        return sock, data
+
+    def close(self) -> None:
+        self._is_done = True
+        self._target = None
+        if self._sock is not None:
+            self._sock.close()
+
+
+class GamePortFrontend(WaitingObject):
+    """ Listens on the game port in place of the server
+    Answers server list pings from a StatusCache, and relays logins to the server (the backend). If the backend
+    isn't available, logins are rejected with a message, unless a login handler takes care of them (e.g. by
+    holding them until the backend is available).
+    """
+    _serverloop: ServerLoop = None
+    _sock: socket.socket = None
+    _backend_address: tuple[str, int] = None
+    _backend_available: bool = False
+    _held: list[FrontendConnection] = None
+    _relays: list[Relay] = None
+    # Open FrontendConnections, handed over or closed ones are pruned when accepting
+    _connections: list[FrontendConnection] = None
+    _proxy_protocol: bool = False
+    status_cache: StatusCache = None
+    # Logins beyond this many relayed connections are turned away, 0 for no limit
+    max_relays: int = 0
+    login_handler: Callable[[FrontendConnection], bool] = None
+    unavailable_message: str = 'The server is not running right now, please try again in a moment.'
+    hold_timeout_message: str = 'The server is still starting, please try again in a moment.'
+    full_message: str = 'The server has too many connections right now, please try again later.'
+
+    def __init__(self, serverloop: ServerLoop, address: tuple[str, int], backend_address: tuple[str, int],
+            status_cache: StatusCache, proxy_protocol: bool = False, name=None):
+        super().__init__(name=name or 'game-port')
+        self._serverloop = serverloop
+        self._proxy_protocol = proxy_protocol
+        self._backend_address = backend_address
+        self.status_cache = status_cache
+        self._held = []
+        self._relays = []
+        self._connections = []
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        sock.listen(128)
+        sock.setblocking(False)
+        self._sock = sock
+        logger.info(f'Listening on {address[0] or "*"}:{address[1]}, forwarding logins to {backend_address[0]}:{backend_address[1]}')
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def is_waiting_to_receive(self) -> bool:
+        self._connections = [c for c in self._connections if not c.is_done()]
+        return len(self._connections) < MAX_PENDING_CONNECTIONS
+
+    def ignore_when_idle(self) -> bool:
+        return True
+
+    def do_receive(self) -> None:
+        for _ in range(min(MAX_ACCEPTS_PER_TICK, MAX_PENDING_CONNECTIONS - len(self._connections))):
+            try:
+                sock, peer = self._sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.warning(f'{self}: accept failed: {e}')
+                return
+            self._connections.append(self._serverloop.add_waiting_object(FrontendConnection(sock, peer, self)))
+
+    def set_backend_available(self, available: bool) -> None:
+        self._backend_available = available
+        if available:
+            held, self._held = self._held, []
+            for connection in held:
+                if connection.is_held():
+                    logger.info(f'{connection}: server is available, forwarding held login')
+                    self.forward(connection)
+
+    def is_backend_available(self) -> bool:
+        return self._backend_available
+
+    def handle_login(self, connection: FrontendConnection) -> None:
+        logger.debug(f'{connection}: login as {connection.handshake}')
+        if self.login_handler is not None and self.login_handler(connection):
+            return
+        if self._backend_available:
+            self.forward(connection)
+        else:
+            connection.disconnect(self.unavailable_message)
+
+    def hold(self, connection: FrontendConnection, seconds: float) -> None:
+        """ Holds a login until the backend becomes available
+        """
+        connection.hold(seconds)
+        self._held.append(connection)
+
+    def extend_held(self, seconds: float) -> None:
+        """ Gives the held logins another seconds to wait, from now
+        """
+        for connection in self._held:
+            if connection.is_held():
+                connection.hold(seconds)
+
+    def reject_held(self, text: str) -> None:
+        held, self._held = self._held, []
+        for connection in held:
+            if connection.is_held():
+                connection.disconnect(text)
+
+    def held_count(self) -> int:
+        self._held = [c for c in self._held if c.is_held()]
+        return len(self._held)
+
+    def relay_count(self) -> int:
+        self._relays = [relay for relay in self._relays if not relay.is_closed()]
+        return len(self._relays)
+
+    def forward(self, connection: FrontendConnection) -> Relay or None:
+        if self.max_relays > 0 and self.relay_count() >= self.max_relays:
+            logger.warning(f'{connection}: {self.max_relays:d} connections relayed already, turning the login away')
+            connection.disconnect(self.full_message)
+            return None
+        sock, data = connection.take_over()
+        relay = Relay(self._serverloop, sock, self._backend_address, initial_data=data, name=connection._name,
+            proxy_protocol=self._proxy_protocol)
+        self._relays.append(relay)
+        return relay
+
+    def close(self) -> None:
+        self._is_done = True
+        self._sock.close()
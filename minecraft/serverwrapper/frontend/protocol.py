@@ -0,0 +1,152 @@
+import json
+import struct
+
+# Minecraft java edition protocol basics, see https://wiki.vg/Protocol and https://wiki.vg/Server_List_Ping
+
+STATE_STATUS = 1
+STATE_LOGIN = 2
+STATE_TRANSFER = 3
+
+MAX_HANDSHAKE_LENGTH = 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_varint(value: int) -> bytes:
+    value &= 0xFFFFFFFF
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def decode_varint(data, offset: int = 0) -> tuple[int, int] or None:
+    """ Returns (value, new offset), or None if data ends before the varint does
+    """
+    result = 0
+    for i in range(5):
+        if offset + i >= len(data):
+            return None
+        byte = data[offset + i]
+        result |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            if result & 0x80000000:
+                result -= 1 << 32
+            return result, offset + i + 1
+    raise ProtocolError('VarInt is too big')
+
+
+def encode_string(value: str) -> bytes:
+    data = value.encode('utf-8')
+    return encode_varint(len(data)) + data
+
+
+def decode_string(data, offset: int) -> tuple[str, int]:
+    r = decode_varint(data, offset)
+    if r is None:
+        raise ProtocolError('Truncated string')
+    length, offset = r
+    if length < 0 or offset + length > len(data):
+        raise ProtocolError('Truncated string')
+    return bytes(data[offset:offset + length]).decode('utf-8'), offset + length
+
+
+def encode_packet(packet_id: int, payload: bytes = b'') -> bytes:
+    body = encode_varint(packet_id) + payload
+    return encode_varint(len(body)) + body
+
+
+def split_packet(data, offset: int = 0) -> tuple[int, bytes, int] or None:
+    """ Returns (packet id, payload, offset after the packet), or None if the packet is incomplete
+    """
+    r = decode_varint(data, offset)
+    if r is None:
+        return None
+    length, start = r
+    if length <= 0 or length > 1 << 21:
+        raise ProtocolError(f'Invalid packet length {length}')
+    end = start + length
+    if end > len(data):
+        return None
+    r = decode_varint(data, start)
+    if r is None or r[1] > end:
+        raise ProtocolError('Truncated packet id')
+    packet_id, payload_start = r
+    # A copy, so the caller can consume its input buffer while still holding the payload
+    return packet_id, bytes(data[payload_start:end]), end
+
+
+class Handshake:
+    protocol_version: int = None
+    server_address: str = None
+    server_port: int = None
+    next_state: int = None
+
+    def __init__(self, protocol_version: int, server_address: str, server_port: int, next_state: int):
+        self.protocol_version = protocol_version
+        self.server_address = server_address
+        self.server_port = server_port
+        self.next_state = next_state
+
+    @staticmethod
+    def decode(payload) -> 'Handshake':
+        r = decode_varint(payload, 0)
+        if r is None:
+            raise ProtocolError('Truncated handshake')
+        protocol_version, offset = r
+        server_address, offset = decode_string(payload, offset)
+        if offset + 2 > len(payload):
+            raise ProtocolError('Truncated handshake')
+        server_port = struct.unpack_from('>H', payload, offset)[0]
+        r = decode_varint(payload, offset + 2)
+        if r is None:
+            raise ProtocolError('Truncated handshake')
+        return Handshake(protocol_version, server_address, server_port, r[0])
+
+    def encode(self) -> bytes:
+        return encode_packet(0x00,
+            encode_varint(self.protocol_version)
+            + encode_string(self.server_address)
+            + struct.pack('>H', self.server_port)
+            + encode_varint(self.next_state))
+
+    def __str__(self):
+        return f'Handshake({self.protocol_version}, {self.server_address}:{self.server_port}, state={self.next_state})'
+
+
+def status_request() -> bytes:
+    return encode_packet(0x00)
+
+
+def status_response(status: dict) -> bytes:
+    return encode_packet(0x00, encode_string(json.dumps(status, separators=(',', ':'))))
+
+
+def pong(payload) -> bytes:
+    return encode_packet(0x01, bytes(payload))
+
+
+def login_disconnect(text: str) -> bytes:
+    return encode_packet(0x00, encode_string(json.dumps({'text': text})))
+
+
+def is_legacy_ping(data) -> bool:
+    # Pre-1.7 clients (and some monitoring tools) start with 0xFE instead of a handshake
+    return len(data) > 0 and data[0] == 0xFE
+
+
+def legacy_ping_response(protocol_version: int, version_name: str, motd: str, online: int, max_players: int,
+        pre_1_4: bool = False) -> bytes:
+    if pre_1_4:
+        text = f'{motd}§{online}§{max_players}'
+    else:
+        text = '§1\0{:d}\0{:s}\0{:s}\0{:d}\0{:d}'.format(protocol_version, version_name, motd, online, max_players)
+    encoded = text.encode('utf-16-be')
+    return b'\xff' + struct.pack('>H', len(encoded) // 2) + encoded
@@ -0,0 +1,292 @@
+import errno
+import fcntl
+import ipaddress
+import logging
+import os
+import socket
+import struct
+import sys
+
+from minecraft.serverwrapper.serverloop.objects import WaitingObject
+from minecraft.serverwrapper.serverloop.serverloop import ServerLoop
+
+logger = logging.getLogger(__name__)
+
+# Stop reading from one side while this much data is still waiting to be sent to the other side
+MAX_BUFFERED_BYTES = 1 << 18
+
+# On linux, data is moved between the sockets with splice() through a pipe, without copying it into python
+HAVE_SPLICE = sys.platform.startswith('linux') and hasattr(os, 'splice')
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+PROXY_V2_SIGNATURE = b'\r\n\r\n\x00\r\nQUIT\n'
+
+
+def proxy_protocol_v2_header(source: tuple, destination: tuple) -> bytes:
+    """ A PROXY protocol v2 header, telling the server the client's real address
+    See https://www.haproxy.org/download/2.9/doc/proxy-protocol.txt
+    """
+    source_ip = ipaddress.ip_address(source[0])
+    destination_ip = ipaddress.ip_address(destination[0])
+    if source_ip.version != destination_ip.version:
+        # Both addresses need the same family, use IPv4-mapped IPv6 addresses
+        source_ip, destination_ip = (ipaddress.IPv6Address(f'::ffff:{ip}') if ip.version == 4 else ip
+            for ip in (source_ip, destination_ip))
+    # Version 2, PROXY command; address family and TCP
+    family = 0x11 if source_ip.version == 4 else 0x21
+    addresses = source_ip.packed + destination_ip.packed + struct.pack('>HH', source[1], destination[1])
+    return PROXY_V2_SIGNATURE + struct.pack('>BBH', 0x21, family, len(addresses)) + addresses
+
+
+class BufferPipe:
+    """ Data on its way from one socket to the other, in a preallocated buffer
+    Data to send ahead of the relayed data (like a PROXY header) can be queued with add_prefix.
+    """
+    _buffer: bytearray = None
+    _view: memoryview = None
+    _start: int = 0
+    _end: int = 0
+    _prefix: bytes = b''
+
+    def __init__(self, capacity: int = MAX_BUFFERED_BYTES):
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+
+    def add_prefix(self, data: bytes) -> None:
+        self._prefix += data
+
+    def has_space(self) -> bool:
+        return self._end < len(self._buffer)
+
+    def pending(self) -> int:
+        return len(self._prefix) + self._end - self._start
+
+    def fill(self, sock: socket.socket) -> int:
+        """ Reads from sock, returns 0 at the end of the stream
+        """
+        n = sock.recv_into(self._view[self._end:])
+        self._end += n
+        return n
+
+    def drain(self, sock: socket.socket) -> int:
+        sent = 0
+        if self._prefix:
+            n = sock.send(self._prefix)
+            self._prefix = self._prefix[n:]
+            sent += n
+            if self._prefix:
+                return sent
+        if self._end > self._start:
+            n = sock.send(self._view[self._start:self._end])
+            self._start += n
+            sent += n
+            if self._start == self._end:
+                self._start = self._end = 0
+        return sent
+
+    def close(self) -> None:
+        self._view.release()
+
+
+class SplicePipe(BufferPipe):
+    """ Data on its way from one socket to the other, in a kernel pipe
+    The data is moved with splice() and never copied into userspace.
+    """
+    _r: int = None
+    _w: int = None
+    _capacity: int = None
+    _buffered: int = 0
+    # The pipe ran out of slots (every write takes one, however small) before reaching its capacity in bytes
+    _full: bool = False
+
+    def __init__(self, capacity: int = MAX_BUFFERED_BYTES):
+        self._r, self._w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        try:
+            self._capacity = fcntl.fcntl(self._w, F_SETPIPE_SZ, capacity)
+        except OSError:
+            # Limited by /proc/sys/fs/pipe-max-size, the default of 64k works as well
+            self._capacity = 1 << 16
+
+    def has_space(self) -> bool:
+        return not self._full and self._buffered < self._capacity
+
+    def pending(self) -> int:
+        return len(self._prefix) + self._buffered
+
+    def fill(self, sock: socket.socket) -> int:
+        try:
+            n = os.splice(sock.fileno(), self._w, self._capacity - self._buffered,
+                flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+        except BlockingIOError:
+            # The socket was readable, so it's the pipe that is full. Wait for drain() to make room, instead of
+            # trying again right away. (An empty pipe can't be full, that was a spurious wakeup.)
+            if self._buffered > 0:
+                self._full = True
+            raise
+        self._buffered += n
+        return n
+
+    def drain(self, sock: socket.socket) -> int:
+        sent = 0
+        if self._prefix:
+            n = sock.send(self._prefix)
+            self._prefix = self._prefix[n:]
+            sent += n
+            if self._prefix:
+                return sent
+        if self._buffered > 0:
+            n = os.splice(self._r, sock.fileno(), self._buffered, flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+            self._buffered -= n
+            sent += n
+            if n > 0:
+                self._full = False
+        return sent
+
+    def close(self) -> None:
+        os.close(self._r)
+        os.close(self._w)
+
+
+class RelayEnd(WaitingObject):
+    """ One socket of a relayed TCP connection
+    Reads from its socket into the pipe towards the peer, and sends whatever the peer's pipe holds. Reading stops
+    while the pipe is full, so a slow receiver slows down the sender instead of filling up memory.
+    """
+    _sock: socket.socket = None
+    _peer: 'RelayEnd' = None
+    _relay: 'Relay' = None
+    _to_peer: BufferPipe = None
+    _connecting: bool = False
+    _read_closed: bool = False
+    _write_closed: bool = False
+
+    def __init__(self, sock: socket.socket, relay: 'Relay', to_peer: BufferPipe, connecting: bool = False, name=None):
+        super().__init__(name=name)
+        self._sock = sock
+        self._relay = relay
+        self._to_peer = to_peer
+        self._connecting = connecting
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def ignore_when_idle(self) -> bool:
+        return True
+
+    def is_waiting_to_receive(self) -> bool:
+        return not self._read_closed and self._to_peer.has_space()
+
+    def is_waiting_to_send(self) -> bool:
+        return self._connecting or (self._peer._to_peer.pending() > 0 and not self._write_closed)
+
+    def do_receive(self) -> None:
+        if self._is_done:
+            # Closed by the peer earlier in this round of the loop, the fds may already be reused
+            return
+        try:
+            n = self._to_peer.fill(self._sock)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            return self._relay.close(f'{self}: {e}')
+        if n == 0:
+            self._read_closed = True
+            self._peer._maybe_shutdown_write()
+            self._relay.check_done()
+            return
+        self._relay.bytes_relayed += n
+        # Pass it on right away, instead of waiting for the next round of the loop
+        self._peer._flush()
+
+    def do_send(self) -> None:
+        if self._is_done:
+            return
+        if self._connecting:
+            rc = self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if rc != 0:
+                return self._relay.close(f'{self}: connect failed: {os.strerror(rc)}')
+            self._connecting = False
+            self._relay.connected()
+        self._flush()
+
+    def _flush(self) -> None:
+        if self._connecting or self._write_closed or self._is_done:
+            return
+        try:
+            self._peer._to_peer.drain(self._sock)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            return self._relay.close(f'{self}: {e}')
+        self._maybe_shutdown_write()
+
+    def _maybe_shutdown_write(self) -> None:
+        # Pass on a half-close once everything the peer sent is delivered
+        if self._peer._read_closed and self._peer._to_peer.pending() == 0 and not self._write_closed \
+                and not self._connecting:
+            self._write_closed = True
+            try:
+                self._sock.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+            self._relay.check_done()
+
+    def close(self) -> None:
+        self._is_done = True
+        self._sock.close()
+        self._to_peer.close()
+
+
+class Relay:
+    """ Relays a client connection to an upstream address, using the server loop
+    Uses splice() where available (zero_copy=None), and preallocated buffers otherwise. With proxy_protocol, the
+    upstream gets a PROXY protocol v2 header with the client's address first.
+    """
+    _serverloop: ServerLoop = None
+    _client: RelayEnd = None
+    _upstream: RelayEnd = None
+    _closed: bool = False
+    bytes_relayed: int = 0
+
+    def __init__(self, serverloop: ServerLoop, client_sock: socket.socket, upstream_address: tuple[str, int],
+            initial_data: bytes = b'', name: str = None, proxy_protocol: bool = False, zero_copy: bool = None):
+        name = name or 'relay'
+        pipe_class = SplicePipe if (HAVE_SPLICE if zero_copy is None else zero_copy) else BufferPipe
+        upstream_sock = socket.socket(socket.AF_INET6 if ':' in upstream_address[0] else socket.AF_INET, socket.SOCK_STREAM)
+        upstream_sock.setblocking(False)
+        upstream_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client_sock.setblocking(False)
+        client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._serverloop = serverloop
+        to_upstream = pipe_class()
+        self._client = RelayEnd(client_sock, self, to_upstream, name=name + '-client')
+        self._upstream = RelayEnd(upstream_sock, self, pipe_class(), connecting=True, name=name + '-upstream')
+        self._client._peer = self._upstream
+        self._upstream._peer = self._client
+        if proxy_protocol:
+            to_upstream.add_prefix(proxy_protocol_v2_header(client_sock.getpeername(), client_sock.getsockname()))
+        to_upstream.add_prefix(initial_data)
+        serverloop.add_waiting_object(self._client)
+        serverloop.add_waiting_object(self._upstream)
+        rc = upstream_sock.connect_ex(upstream_address)
+        if rc not in (0, errno.EINPROGRESS):
+            self.close(f'connect to {upstream_address} failed: {os.strerror(rc)}')
+
+    def connected(self) -> None:
+        logger.debug(f'{self._upstream}: connected')
+
+    def check_done(self) -> None:
+        if self._client._write_closed and self._upstream._write_closed:
+            self.close()
+
+    def close(self, reason: str = None) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if reason is not None:
+            logger.debug(f'Closing relay: {reason}')
+        self._client.close()
+        self._upstream.close()
+
+    def is_closed(self) -> bool:
+        return self._closed
@@ -0,0 +1,191 @@
+import errno
+import json
+import logging
+import os
+from pathlib import Path
+import socket
+import time
+from typing import Callable
+
+from minecraft.serverwrapper.frontend import protocol
+from minecraft.serverwrapper.serverloop.objects import WaitingObject
+
+logger = logging.getLogger(__name__)
+
+# Vanilla servers show at most this many players in the server list
+MAX_SAMPLE_PLAYERS = 12
+NO_UUID = '00000000-0000-0000-0000-000000000000'
+
+
+class StatusCache:
+    """ The server's status, as shown in the server list
+    The last status reported by the server itself is the base (it has the protocol version, favicon and anything
+    mods add). Players are kept current from log events in between queries. The encoded responses are cached and
+    only rebuilt after a change. The base is kept on disk, so it's available before the server is up.
+    """
+    _base: dict = None
+    _players: list[tuple[str, str]] = None
+    _motd_override: str = None
+    _encoded: bytes = None
+    _legacy_encoded: dict[bool, bytes] = None
+    _path: Path = None
+
+    def __init__(self, version_name: str, motd: str, max_players: int, path: str or Path = None):
+        self._path = Path(path) if path is not None else None
+        self._base = {
+            'version': {'name': version_name, 'protocol': -1},
+            'players': {'max': max_players, 'online': 0},
+            'description': {'text': motd},
+        }
+        self._players = []
+        self._legacy_encoded = {}
+        if self._path is not None:
+            try:
+                with open(self._path, 'r') as f:
+                    self._base = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def _changed(self) -> None:
+        self._encoded = None
+        self._legacy_encoded = {}
+
+    def update_from_server(self, status: dict) -> None:
+        if status == self._base:
+            return
+        self._base = status
+        self._changed()
+        if self._path is not None:
+            tmp = self._path.with_name(self._path.name + '.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(status, f)
+            os.replace(tmp, self._path)
+
+    def set_players(self, players: list[tuple[str, str]]) -> None:
+        """ Sets the online players as (name, uuid) pairs, the uuid may be None
+        """
+        if players != self._players:
+            self._players = list(players)
+            self._changed()
+
+    def set_motd_override(self, text: str or None) -> None:
+        """ Replaces the MOTD, e.g. while the server is starting
+        """
+        if text != self._motd_override:
+            self._motd_override = text
+            self._changed()
+
+    def motd(self) -> str:
+        if self._motd_override is not None:
+            return self._motd_override
+        description = self._base.get('description', '')
+        if isinstance(description, dict):
+            return description.get('text', '') + ''.join(e.get('text', '') for e in description.get('extra', []) if isinstance(e, dict))
+        return str(description)
+
+    def status(self) -> dict:
+        status = dict(self._base)
+        players = dict(status.get('players', {}))
+        players['online'] = len(self._players)
+        players['sample'] = [{'name': name, 'id': uuid or NO_UUID} for name, uuid in self._players[:MAX_SAMPLE_PLAYERS]]
+        status['players'] = players
+        if self._motd_override is not None:
+            status['description'] = {'text': self._motd_override}
+        return status
+
+    def encoded_response(self) -> bytes:
+        if self._encoded is None:
+            self._encoded = protocol.status_response(self.status())
+        return self._encoded
+
+    def legacy_response(self, pre_1_4: bool = False) -> bytes:
+        if pre_1_4 not in self._legacy_encoded:
+            version = self._base.get('version', {})
+            self._legacy_encoded[pre_1_4] = protocol.legacy_ping_response(
+                version.get('protocol', -1), version.get('name', ''), self.motd(),
+                len(self._players), self._base.get('players', {}).get('max', 0), pre_1_4=pre_1_4)
+        return self._legacy_encoded[pre_1_4]
+
+
+class StatusQuery(WaitingObject):
+    """ Asks a server for its status with a Server List Ping, without blocking the loop
+    The callback is called once, with the status or with None on failure.
+    """
+    _sock: socket.socket = None
+    _address: tuple[str, int] = None
+    _callback: Callable[[dict or None], None] = None
+    _out: bytes = b''
+    _in: bytearray = None
+    _connected: bool = False
+    _target: float = None
+
+    def __init__(self, address: tuple[str, int], callback: Callable[[dict or None], None], timeout: float = 5.0, name=None):
+        super().__init__(name=name or 'status-query')
+        self._address = address
+        self._callback = callback
+        self._in = bytearray()
+        self._target = time.time() + timeout
+        handshake = protocol.Handshake(-1, address[0], address[1], protocol.STATE_STATUS)
+        self._out = handshake.encode() + protocol.status_request()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setblocking(False)
+        rc = self._sock.connect_ex(address)
+        if rc not in (0, errno.EINPROGRESS):
+            self._finish(None, f'connect failed: {os.strerror(rc)}')
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def is_waiting_to_receive(self) -> bool:
+        return self._connected and not self._is_done
+
+    def is_waiting_to_send(self) -> bool:
+        return not self._connected and not self._is_done
+
+    def is_waiting_for_timeout(self):
+        return self._target
+
+    def ignore_when_idle(self) -> bool:
+        return True
+
+    def do_send(self) -> None:
+        rc = self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if rc != 0:
+            return self._finish(None, f'connect failed: {os.strerror(rc)}')
+        # The request is tiny, it fits into the socket buffer of a fresh connection
+        self._sock.send(self._out)
+        self._connected = True
+
+    def do_receive(self) -> None:
+        try:
+            data = self._sock.recv(65536)
+        except OSError as e:
+            return self._finish(None, str(e))
+        if not data:
+            return self._finish(None, 'connection closed')
+        self._in += data
+        try:
+            packet = protocol.split_packet(self._in)
+            if packet is None:
+                return
+            packet_id, payload, _ = packet
+            if packet_id != 0x00:
+                raise protocol.ProtocolError(f'unexpected packet {packet_id}')
+            text, _ = protocol.decode_string(payload, 0)
+            status = json.loads(text)
+        except (protocol.ProtocolError, ValueError) as e:
+            return self._finish(None, f'invalid response: {e}')
+        self._finish(status)
+
+    def do_timeout(self) -> None:
+        self._finish(None, 'timeout')
+
+    def _finish(self, status: dict or None, error: str = None) -> None:
+        if self._is_done:
+            return
+        self._is_done = True
+        self._target = None
+        self._sock.close()
+        if error is not None:
+            logger.debug(f'{self}: {error}')
+        self._callback(status)
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from minecraft.serverwrapper.jvm.tuning import JavaVersion
+
+logger = logging.getLogger(__name__)
+
+CDS_DIR_NAME = '.cds'
+
+# Dynamic archives (-XX:ArchiveClassesAtExit) exist since JDK 13, -XX:+AutoCreateSharedArchive since JDK 19
+MIN_DYNAMIC_ARCHIVE_JAVA = 13
+MIN_AUTO_CREATE_JAVA = 19
+
+
+class ClassDataSharing:
+    """ Manages a dynamic AppCDS archive for the launcher jar and the current mod set
+    Archives are keyed by the java version and the contents of the launcher jar and the mods directory,
+    so any change to those selects a new archive. Old archives are removed.
+    """
+    _dir: Path = None
+    _mods_dir: Path = None
+    _java_version: JavaVersion = None
+
+    def __init__(self, working_dir: str or Path, java_version: JavaVersion = None):
+        self._dir = Path(working_dir) / CDS_DIR_NAME
+        self._mods_dir = Path(working_dir) / 'mods'
+        self._java_version = java_version
+
+    def is_supported(self) -> bool:
+        return self._java_version.major >= MIN_DYNAMIC_ARCHIVE_JAVA
+
+    def _load_hash_cache(self) -> dict:
+        try:
+            with open(self._dir / 'hashes.json', 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _store_hash_cache(self, cache: dict) -> None:
+        tmp = self._dir / 'hashes.json.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp, self._dir / 'hashes.json')
+
+    def _file_hash(self, path: Path, cache: dict, new_cache: dict) -> str:
+        # Hashing a few hundred MiB of jars on every start is noticeable, so reuse hashes of unchanged files
+        st = path.stat()
+        fingerprint = [st.st_size, st.st_mtime_ns]
+        key = str(path)
+        entry = cache.get(key)
+        if entry is not None and entry[:2] == fingerprint:
+            digest = entry[2]
+        else:
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            digest = h.hexdigest()
+        new_cache[key] = fingerprint + [digest]
+        return digest
+
+    def key(self, launcher_jar: str or Path) -> str:
+        self._dir.mkdir(exist_ok=True)
+        cache = self._load_hash_cache()
+        new_cache = {}
+        h = hashlib.sha256()
+        h.update(self._java_version.version.encode('utf-8') + b'\0')
+        h.update(self._file_hash(Path(launcher_jar), cache, new_cache).encode('ascii') + b'\0')
+        if self._mods_dir.is_dir():
+            for mod in sorted(x for x in self._mods_dir.iterdir() if x.is_file()):
+                h.update(mod.name.encode('utf-8') + b'\0')
+                h.update(self._file_hash(mod, cache, new_cache).encode('ascii') + b'\0')
+        if new_cache != cache:
+            self._store_hash_cache(new_cache)
+        return h.hexdigest()[:16]
+
+    def archive_path(self, launcher_jar: str or Path) -> Path:
+        return self._dir / f'app-{self.key(launcher_jar)}.jsa'
+
+    def java_args(self, launcher_jar: str or Path) -> tuple[list[str], bool]:
+        """ Returns the java arguments and whether an existing archive will be used
+        """
+        if not self.is_supported():
+            logger.info(f'AppCDS: Not supported on JDK {self._java_version.major}, needs {MIN_DYNAMIC_ARCHIVE_JAVA} or later.')
+            return [], False
+        archive = self.archive_path(launcher_jar)
+        self._remove_stale_archives(keep=archive)
+        exists = archive.exists()
+        if self._java_version.major >= MIN_AUTO_CREATE_JAVA:
+            # The JVM validates the archive itself and re-creates it at exit if it's missing or unusable
+            args = ['-XX:+AutoCreateSharedArchive', f'-XX:SharedArchiveFile={archive}']
+        elif exists:
+            args = [f'-XX:SharedArchiveFile={archive}']
+        else:
+            args = [f'-XX:ArchiveClassesAtExit={archive}']
+        if exists:
+            logger.info(f'AppCDS: Using archive {archive.name}')
+        else:
+            logger.info(f'AppCDS: No archive for the current launcher and mods yet, {archive.name} is created when the server stops.')
+        return args, exists
+
+    def _remove_stale_archives(self, keep: Path = None) -> None:
+        if not self._dir.is_dir():
+            return
+        for archive in self._dir.glob('app-*.jsa'):
+            if archive != keep:
+                logger.info(f'AppCDS: Removing stale archive {archive.name}')
+                os.remove(archive)
+
+    def invalidate(self) -> None:
+        self._remove_stale_archives()
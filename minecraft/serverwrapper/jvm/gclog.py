@@ -0,0 +1,199 @@
+import logging
+import os
+import re
+import time
+
+from minecraft.serverwrapper.serverloop.objects import WaitingObject
+from minecraft.serverwrapper.util.stats import Histogram, RingBuffer
+
+logger = logging.getLogger(__name__)
+
+# Unified logging (-Xlog) exists since JDK 9
+MIN_UNIFIED_LOGGING_JAVA = 9
+
+PAUSE_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+_units = {'K': 1.0 / 1024, 'M': 1.0, 'G': 1024.0}
+
+
+def gc_log_args(path: str, file_count: int = 5, file_size_mibs: int = 20) -> list[str]:
+    return [f'-Xlog:gc*:file={path}:uptime,level,tags:filecount={file_count},filesize={file_size_mibs}M']
+
+
+class GCStats:
+    """ Pause and heap statistics from unified GC log lines
+    Works with G1 ("Pause Young (Normal) (G1 Evacuation Pause) 512M->128M(2048M) 12.345ms") and
+    ZGC ("Pause Mark Start 0.015ms", "Garbage Collection (Warmup) 90M(4%)->40M(2%)").
+    """
+    # [12.345s][info][gc] GC(12) Pause Young (Normal) (G1 Evacuation Pause) 512M->128M(2048M) 12.345ms
+    _line_pattern = re.compile(r'^\[([0-9.]+)s\]\[(\w+)\s*\]\[([\w,]+)\s*\] GC\((\d+)\) (.*)$')
+    _pause_pattern = re.compile(r'^(?:[YyOo]: )?(Pause .*?) ([0-9.]+)ms$')
+    _heap_pattern = re.compile(r'([0-9]+)([KMG])(?:\([0-9]+%\))?->([0-9]+)([KMG])(?:\([0-9]+%\))?')
+    _humongous_regions_pattern = re.compile(r'^Humongous regions: ([0-9]+)->([0-9]+)')
+
+    pauses: Histogram = None
+    recent_pauses_ms: RingBuffer = None
+    heap_after_gc_mibs: RingBuffer = None
+    allocation_rate_mibs: RingBuffer = None
+    humongous_allocations: int = 0
+    humongous_regions: int = 0
+    max_pause_ms: float = 0.0
+
+    _last_uptime: float = None
+    _last_heap_after: float = None
+
+    def __init__(self, window: int = 1024):
+        self.pauses = Histogram(PAUSE_BUCKETS_MS)
+        self.recent_pauses_ms = RingBuffer(window)
+        self.heap_after_gc_mibs = RingBuffer(window)
+        self.allocation_rate_mibs = RingBuffer(window)
+
+    def add_line(self, line: str) -> None:
+        m = self._line_pattern.match(line)
+        if not m:
+            return
+        uptime = float(m.group(1))
+        tags = m.group(3)
+        message = m.group(5)
+
+        if tags == 'gc,heap':
+            m = self._humongous_regions_pattern.match(message)
+            if m:
+                self.humongous_regions = int(m.group(2))
+            return
+
+        m = self._pause_pattern.match(message)
+        if m:
+            self.add_pause(float(m.group(2)))
+            if 'Humongous' in m.group(1):
+                self.humongous_allocations += 1
+        if tags != 'gc':
+            return
+        # Summary line of a collection: heap before and after
+        m = self._heap_pattern.search(message)
+        if m:
+            before = int(m.group(1)) * _units[m.group(2)]
+            after = int(m.group(3)) * _units[m.group(4)]
+            self.add_heap_change(uptime, before, after)
+
+    def add_pause(self, pause_ms: float) -> None:
+        self.pauses.observe(pause_ms)
+        self.recent_pauses_ms.append(pause_ms)
+        self.max_pause_ms = max(self.max_pause_ms, pause_ms)
+
+    def add_heap_change(self, uptime: float, before_mibs: float, after_mibs: float) -> None:
+        # Everything above the heap after the last collection was allocated since then
+        if self._last_uptime is not None and uptime > self._last_uptime:
+            allocated = max(0.0, before_mibs - self._last_heap_after)
+            self.allocation_rate_mibs.append(allocated / (uptime - self._last_uptime))
+        self.heap_after_gc_mibs.append(after_mibs)
+        self._last_uptime = uptime
+        self._last_heap_after = after_mibs
+
+    def p99_pause_ms(self) -> float or None:
+        return self.recent_pauses_ms.percentile(99)
+
+    def summary(self) -> dict:
+        return {
+            'pauses': self.pauses.count,
+            'p50-pause-ms': self.recent_pauses_ms.percentile(50),
+            'p99-pause-ms': self.p99_pause_ms(),
+            'max-pause-ms': self.max_pause_ms,
+            'heap-after-gc-mibs': self.heap_after_gc_mibs.last(),
+            'allocation-rate-mibs': self.allocation_rate_mibs.mean(),
+            'humongous-allocations': self.humongous_allocations,
+            'humongous-regions': self.humongous_regions,
+        }
+
+
+class GCLogTailer(WaitingObject):
+    """ Follows the JVM's GC log, reading only appended bytes, and feeds it into GCStats
+    Handles the log being rotated (or re-created by a restarted JVM) by finishing the old file first.
+    """
+    _path: str = None
+    _stats: GCStats = None
+    _file = None
+    _inode: int = None
+    _buffer: bytes = b''
+    _pause_target_ms: float = None
+    _warn_interval: float = None
+    _last_warning: float = None
+    _min_pauses_for_warning: int = 20
+    # Similar to RepeatedCallback
+    _interval: float = None
+    _target: float = None
+
+    def __init__(self, path: str, stats: GCStats, pause_target_ms: float = None, interval: float = 1.0,
+            warn_interval: float = 300.0, name=None):
+        super().__init__(name=name or 'gc-log')
+        self._path = path
+        self._stats = stats
+        self._pause_target_ms = pause_target_ms
+        self._interval = interval
+        self._warn_interval = warn_interval
+        self._target = time.time() + interval
+        if os.path.exists(path):
+            # Left over from an earlier run: only follow what is appended from now on
+            self._file = open(path, 'rb')
+            self._file.seek(0, os.SEEK_END)
+            self._inode = os.fstat(self._file.fileno()).st_ino
+
+    def is_waiting_for_timeout(self):
+        return self._target
+
+    def ignore_when_idle(self) -> bool:
+        return True
+
+    def do_timeout(self):
+        self._target = time.time() + self._interval
+        self.poll()
+        self.check_pause_target()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._read_appended()
+            self._file.close()
+            self._file = None
+        self._target = None
+        self._is_done = True
+
+    def poll(self) -> None:
+        try:
+            st = os.stat(self._path)
+        except FileNotFoundError:
+            return
+        if self._file is not None and st.st_ino != self._inode:
+            # Rotated: read what's left of the old file, then switch over
+            self._read_appended()
+            self._file.close()
+            self._file = None
+        if self._file is None:
+            self._file = open(self._path, 'rb')
+            self._inode = os.fstat(self._file.fileno()).st_ino
+            self._buffer = b''
+        elif st.st_size < self._file.tell():
+            # Truncated in place
+            self._file.seek(0)
+            self._buffer = b''
+        self._read_appended()
+
+    def _read_appended(self) -> None:
+        data = self._file.read()
+        if not data:
+            return
+        lines = (self._buffer + data).split(b'\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            self._stats.add_line(line.decode('utf-8', errors='replace').rstrip('\r'))
+
+    def check_pause_target(self) -> None:
+        if self._pause_target_ms is None or len(self._stats.recent_pauses_ms) < self._min_pauses_for_warning:
+            return
+        now = time.time()
+        if self._last_warning is not None and now - self._last_warning < self._warn_interval:
+            return
+        p99 = self._stats.p99_pause_ms()
+        if p99 > self._pause_target_ms:
+            self._last_warning = now
+            logger.warning('GC: p99 pause {:.1f}ms exceeds the target of {:.0f}ms (max {:.1f}ms over the last {:d} pauses)'.format(
+                p99, self._pause_target_ms, max(self._stats.recent_pauses_ms.values()), len(self._stats.recent_pauses_ms)))
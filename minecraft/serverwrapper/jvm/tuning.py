@@ -0,0 +1,377 @@
+import logging
+import math
+import os
+from pathlib import Path
+import re
+import subprocess
+
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+
+logger = logging.getLogger(__name__)
+
+PROFILES = ['aikar-g1', 'zgc-large', 'low-mem']
+
+# Heap size classes used by profile selection
+LOW_MEM_HEAP_MIBS = 2048
+LARGE_HEAP_MIBS = 12288
+MIN_HEAP_MIBS = 512
+
+####################################################################################################
+# JDK detection
+
+
+class JavaVersion:
+    version: str = None
+    major: int = None
+    description: str = None
+
+    def __init__(self, version: str, major: int, description: str = None):
+        self.version = version
+        self.major = major
+        self.description = description
+
+    def __str__(self):
+        return self.description or f'Java {self.version}'
+
+
+_java_version_pattern = re.compile(r'version "([^"]+)"')
+_java_version_cache: dict[tuple[str, int], JavaVersion] = {}
+
+
+def parse_java_version(output: str) -> JavaVersion:
+    """ Parses the output of "java -version"
+    Handles both old style ("1.8.0_382") and new style ("17.0.8", "21") version strings.
+    """
+    m = _java_version_pattern.search(output)
+    if not m:
+        raise MinecraftServerWrapperException(f'Cannot parse java version from: {output!r}')
+    version = m.group(1)
+    parts = re.split(r'[._+-]', version)
+    if parts[0] == '1' and len(parts) > 1:
+        major = int(parts[1])
+    else:
+        major = int(parts[0])
+    return JavaVersion(version, major, output.strip().splitlines()[0])
+
+
+def detect_java_version(java_executable: str) -> JavaVersion:
+    """ Runs "java -version", cached per executable (until it changes on disk)
+    """
+    path = os.path.realpath(java_executable)
+    key = (path, os.stat(path).st_mtime_ns)
+    if key not in _java_version_cache:
+        result = subprocess.run([java_executable, '-version'], capture_output=True, text=True, timeout=30)
+        # java -version prints to stderr
+        _java_version_cache[key] = parse_java_version(result.stderr or result.stdout)
+    return _java_version_cache[key]
+
+
+####################################################################################################
+# Host & container detection
+
+
+class HostResources:
+    memory_mibs: int = None
+    cpus: int = None
+    cgroup_version: int = None
+    cgroup_memory_mibs: int = None
+    cgroup_cpu_quota: float = None
+
+    def __init__(self, memory_mibs: int, cpus: int, cgroup_version: int = None,
+            cgroup_memory_mibs: int = None, cgroup_cpu_quota: float = None):
+        self.memory_mibs = memory_mibs
+        self.cpus = cpus
+        self.cgroup_version = cgroup_version
+        self.cgroup_memory_mibs = cgroup_memory_mibs
+        self.cgroup_cpu_quota = cgroup_cpu_quota
+
+    @property
+    def effective_memory_mibs(self) -> int:
+        if self.cgroup_memory_mibs is not None:
+            return min(self.memory_mibs, self.cgroup_memory_mibs)
+        return self.memory_mibs
+
+    @property
+    def effective_cpus(self) -> int:
+        if self.cgroup_cpu_quota is not None:
+            return max(1, min(self.cpus, math.ceil(self.cgroup_cpu_quota)))
+        return self.cpus
+
+    def __str__(self):
+        s = f'{self.memory_mibs} MiB, {self.cpus} CPUs'
+        if self.cgroup_version is not None:
+            s += f', cgroup v{self.cgroup_version}'
+            if self.cgroup_memory_mibs is not None:
+                s += f' memory limit {self.cgroup_memory_mibs} MiB'
+            if self.cgroup_cpu_quota is not None:
+                s += f' cpu quota {self.cgroup_cpu_quota:.2f}'
+        return s
+
+
+def _read_first_line(path: Path) -> str or None:
+    try:
+        with open(path, 'r') as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_paths(proc_root: Path) -> dict[str, str]:
+    """ Maps cgroup v1 controllers (and "" for v2) to the path of this process' cgroup
+    """
+    paths = {}
+    try:
+        with open(proc_root / 'self' / 'cgroup', 'r') as f:
+            for line in f:
+                parts = line.strip().split(':', 2)
+                if len(parts) != 3:
+                    continue
+                for controller in parts[1].split(','):
+                    paths[controller] = parts[2]
+    except OSError:
+        pass
+    return paths
+
+
+def _ancestors(base: Path, cgroup_path: str) -> list[Path]:
+    # Inside a container the cgroup namespace root is usually mounted at base, so the path may not exist.
+    # Limits of parent cgroups apply as well, so walk up to the root and let the caller take the minimum.
+    parts = [p for p in cgroup_path.split('/') if p]
+    return [base.joinpath(*parts[:i]) for i in range(len(parts), -1, -1)]
+
+
+def _min_limit(files: list[Path], parse) -> float or None:
+    limits = [limit for limit in (parse(_read_first_line(f)) for f in files) if limit is not None]
+    return min(limits) if len(limits) > 0 else None
+
+
+def _parse_v2_memory(value: str) -> int or None:
+    if value is None or value == 'max':
+        return None
+    return int(value) >> 20
+
+
+def _parse_v2_cpu(value: str) -> float or None:
+    if value is None:
+        return None
+    quota, _, period = value.partition(' ')
+    if quota == 'max':
+        return None
+    return int(quota) / int(period or 100000)
+
+
+def _parse_v1_memory(value: str) -> int or None:
+    if value is None:
+        return None
+    limit = int(value)
+    # "Unlimited" is reported as a huge page-aligned number
+    if limit >= (1 << 62):
+        return None
+    return limit >> 20
+
+
+def _v1_cpu_quota(cpu_dirs: list[Path]) -> float or None:
+    quotas = []
+    for cpu_dir in cpu_dirs:
+        quota = _read_first_line(cpu_dir / 'cpu.cfs_quota_us')
+        period = _read_first_line(cpu_dir / 'cpu.cfs_period_us')
+        if quota is None or period is None or int(quota) <= 0:
+            continue
+        quotas.append(int(quota) / int(period))
+    return min(quotas) if len(quotas) > 0 else None
+
+
+def detect_host_resources(cgroup_root: str or Path = '/sys/fs/cgroup', proc_root: str or Path = '/proc') -> HostResources:
+    cgroup_root = Path(cgroup_root)
+    proc_root = Path(proc_root)
+    memory_mibs = (os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')) >> 20
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    resources = HostResources(memory_mibs, cpus)
+
+    paths = _cgroup_paths(proc_root)
+    if (cgroup_root / 'cgroup.controllers').exists():
+        resources.cgroup_version = 2
+        dirs = _ancestors(cgroup_root, paths.get('', '/'))
+        resources.cgroup_memory_mibs = _min_limit([d / 'memory.max' for d in dirs], _parse_v2_memory)
+        resources.cgroup_cpu_quota = _min_limit([d / 'cpu.max' for d in dirs], _parse_v2_cpu)
+    elif (cgroup_root / 'memory').is_dir() or (cgroup_root / 'cpu').is_dir():
+        resources.cgroup_version = 1
+        memory_dirs = _ancestors(cgroup_root / 'memory', paths.get('memory', '/'))
+        resources.cgroup_memory_mibs = _min_limit([d / 'memory.limit_in_bytes' for d in memory_dirs], _parse_v1_memory)
+        resources.cgroup_cpu_quota = _v1_cpu_quota(_ancestors(cgroup_root / 'cpu', paths.get('cpu', '/')))
+    return resources
+
+
+####################################################################################################
+# Tuning profiles
+
+
+class TuningProfile:
+    name: str = None
+    heap_mibs: int = None
+    java_args: list[str] = None
+    reasons: list[str] = None
+
+    def __init__(self, name: str, heap_mibs: int, java_args: list[str], reasons: list[str]):
+        self.name = name
+        self.heap_mibs = heap_mibs
+        self.java_args = java_args
+        self.reasons = reasons
+
+    def __str__(self):
+        return f'TuningProfile({self.name}, {self.heap_mibs} MiB heap)'
+
+
+def gc_thread_counts(cpus: int) -> tuple[int, int]:
+    """ Parallel and concurrent GC thread counts, using the same formula as HotSpot but based on the effective CPUs
+    """
+    if cpus <= 8:
+        parallel = cpus
+    else:
+        parallel = 8 + (cpus - 8) * 5 // 8
+    return parallel, max(1, (parallel + 2) // 4)
+
+
+def off_heap_headroom_mibs(profile: str, heap_mibs: int) -> int:
+    """ Memory the JVM needs beside the heap (metaspace, code cache, thread stacks, GC data structures, direct buffers)
+    """
+    if profile == 'zgc-large':
+        return 768 + heap_mibs // 5
+    return 512 + heap_mibs // 10
+
+
+def fit_heap(profile: str, heap_mibs: int, available_mibs: int) -> int:
+    """ Largest heap up to heap_mibs that fits into available_mibs together with its off-heap headroom. Raises
+    an exception if not even MIN_HEAP_MIBS fit.
+    """
+    if heap_mibs + off_heap_headroom_mibs(profile, heap_mibs) <= available_mibs:
+        return heap_mibs
+    # Inverse of off_heap_headroom_mibs
+    if profile == 'zgc-large':
+        fitted = (available_mibs - 768) * 5 // 6
+    else:
+        fitted = (available_mibs - 512) * 10 // 11
+    needed = MIN_HEAP_MIBS + off_heap_headroom_mibs(profile, MIN_HEAP_MIBS)
+    if needed > available_mibs:
+        raise MinecraftServerWrapperException(f'{available_mibs} MiB of memory is too little for the server, it needs '
+            f'at least {needed} MiB ({MIN_HEAP_MIBS} MiB heap and its off-heap memory). Raise the (container) memory limit.')
+    return max(MIN_HEAP_MIBS, fitted)
+
+
+def _g1_args(heap_mibs: int, max_gc_pause_millis: int, pre_touch: bool = True) -> list[str]:
+    # See https://docs.papermc.io/paper/aikars-flags
+    large = heap_mibs >= LARGE_HEAP_MIBS
+    args = [
+        '-XX:+UseG1GC',
+        '-XX:+ParallelRefProcEnabled',
+        f'-XX:MaxGCPauseMillis={max_gc_pause_millis}',
+        '-XX:+UnlockExperimentalVMOptions',
+        '-XX:+DisableExplicitGC',
+    ]
+    if pre_touch:
+        args.append('-XX:+AlwaysPreTouch')
+    args += [
+        '-XX:G1NewSizePercent={:d}'.format(40 if large else 30),
+        '-XX:G1MaxNewSizePercent={:d}'.format(50 if large else 40),
+        '-XX:G1HeapRegionSize={:s}'.format('16M' if large else '8M'),
+        '-XX:G1ReservePercent={:d}'.format(15 if large else 20),
+        '-XX:G1HeapWastePercent=5',
+        '-XX:G1MixedGCCountTarget=4',
+        '-XX:InitiatingHeapOccupancyPercent={:d}'.format(20 if large else 15),
+        '-XX:G1MixedGCLiveThresholdPercent=90',
+        '-XX:G1RSetUpdatingPauseTimePercent=5',
+        '-XX:SurvivorRatio=32',
+        '-XX:+PerfDisableSharedMem',
+        '-XX:MaxTenuringThreshold=1',
+    ]
+    return args
+
+
+def select_profile(
+    requested_heap_mibs: int,
+    java_version: JavaVersion,
+    resources: HostResources,
+    profile: str = 'auto',
+    max_gc_pause_millis: int = 50,
+    pre_touch: bool = True,
+) -> TuningProfile:
+    """ Derives heap size, GC and GC thread settings from the JDK and the (container) resources
+    Without pre_touch, the large heap profiles leave out -XX:+AlwaysPreTouch, which makes every start touch the
+    whole heap first.
+    """
+    reasons = [f'JDK: {java_version}', f'Host: {resources}']
+    available = resources.effective_memory_mibs
+    cpus = resources.effective_cpus
+    requested = int(requested_heap_mibs)
+
+    if profile == 'auto':
+        # Size classes are based on the heap that actually fits
+        heap = fit_heap('aikar-g1', requested, available)
+        if heap < LOW_MEM_HEAP_MIBS:
+            profile = 'low-mem'
+            reasons.append(f'Profile low-mem: heap below {LOW_MEM_HEAP_MIBS} MiB')
+        elif heap >= LARGE_HEAP_MIBS and java_version.major < 17:
+            profile = 'aikar-g1'
+            reasons.append(f'Profile aikar-g1: JDK {java_version.major} is too old for zgc-large (needs 17)')
+        elif heap >= LARGE_HEAP_MIBS and fit_heap('zgc-large', requested, available) < LARGE_HEAP_MIBS:
+            profile = 'aikar-g1'
+            reasons.append('Profile aikar-g1: not enough off-heap headroom for zgc-large')
+        elif heap >= LARGE_HEAP_MIBS:
+            profile = 'zgc-large'
+            reasons.append(f'Profile zgc-large: heap of at least {LARGE_HEAP_MIBS} MiB on JDK {java_version.major}')
+        else:
+            profile = 'aikar-g1'
+            reasons.append(f'Profile aikar-g1: heap between {LOW_MEM_HEAP_MIBS} and {LARGE_HEAP_MIBS} MiB')
+    elif profile in PROFILES:
+        reasons.append(f'Profile {profile}: configured explicitly')
+    else:
+        raise MinecraftServerWrapperException(f'Unknown JVM tuning profile "{profile}", expected auto or one of {", ".join(PROFILES)}.')
+    if profile == 'zgc-large' and java_version.major < 15:
+        raise MinecraftServerWrapperException(f'Profile zgc-large needs JDK 15 or later, found {java_version.major}.')
+
+    heap = fit_heap(profile, requested, available)
+    if heap < requested:
+        reasons.append(f'Heap reduced from {requested} MiB to {heap} MiB: {available} MiB available, '
+            f'{off_heap_headroom_mibs(profile, heap)} MiB reserved for off-heap memory')
+    else:
+        reasons.append(f'Heap {heap} MiB + {off_heap_headroom_mibs(profile, heap)} MiB off-heap headroom fits into {available} MiB')
+
+    parallel, concurrent = gc_thread_counts(cpus)
+    reasons.append(f'GC threads: {parallel} parallel, {concurrent} concurrent for {cpus} effective CPUs')
+    thread_args = [f'-XX:ParallelGCThreads={parallel}', f'-XX:ConcGCThreads={concurrent}']
+    if resources.cgroup_cpu_quota is not None and cpus < resources.cpus:
+        # Make the JVM size its other thread pools for the quota, not for all visible cores
+        thread_args.append(f'-XX:ActiveProcessorCount={cpus}')
+        reasons.append(f'ActiveProcessorCount={cpus} because of the cgroup CPU quota')
+
+    if profile == 'aikar-g1':
+        args = [f'-Xms{heap}m', f'-Xmx{heap}m'] + _g1_args(heap, max_gc_pause_millis, pre_touch) + thread_args
+        reasons.append('G1 with region size {:s} for a {:s} heap'.format(
+            '16M' if heap >= LARGE_HEAP_MIBS else '8M', 'large' if heap >= LARGE_HEAP_MIBS else 'medium'))
+    elif profile == 'zgc-large':
+        args = [f'-Xms{heap}m', f'-Xmx{heap}m', '-XX:+UseZGC']
+        if 21 <= java_version.major < 23:
+            # Generational ZGC is the default from JDK 23 on, and the only mode from JDK 24 on
+            args.append('-XX:+ZGenerational')
+            reasons.append('Generational ZGC enabled explicitly')
+        args += (['-XX:+AlwaysPreTouch'] if pre_touch else []) + ['-XX:+DisableExplicitGC', '-XX:+PerfDisableSharedMem'] \
+            + thread_args
+    else:
+        # Don't commit the whole heap up front, and give memory back to the host when idle
+        initial = max(MIN_HEAP_MIBS // 2, heap // 2)
+        args = [f'-Xms{initial}m', f'-Xmx{heap}m']
+        if cpus < 2:
+            args += ['-XX:+UseSerialGC']
+            reasons.append('SerialGC: a single CPU gains nothing from a concurrent collector')
+        else:
+            args += ['-XX:+UseG1GC', f'-XX:MaxGCPauseMillis={max_gc_pause_millis}', '-XX:+DisableExplicitGC'] + thread_args
+            if java_version.major >= 12:
+                args.append('-XX:G1PeriodicGCInterval=60000')
+                reasons.append('G1 with periodic GC to uncommit unused heap')
+        args += ['-XX:+PerfDisableSharedMem']
+    if not pre_touch and profile in ('aikar-g1', 'zgc-large'):
+        reasons.append('No AlwaysPreTouch: with hibernation, every wake would touch the whole heap while logins wait')
+    return TuningProfile(profile, heap, args, reasons)
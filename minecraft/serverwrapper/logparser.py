@@ -37,6 +37,11 @@ class MinecraftLogMessage:
     def __str__(self):
         return '%s: %s' % (self.level[1], self.message)
 
+    def as_event(self) -> dict:
+        """ The message as a JSON-compatible event, e.g. for the control socket
+        """
+        return {'type': 'log', 'level': self.level[1], 'message': self.message}
+
 
 class MinecraftServerStartMessage(MinecraftLogMessage):
     host: str = None
@@ -50,6 +55,78 @@ class MinecraftServerStartMessage(MinecraftLogMessage):
     def __str__(self):
         return '%s: %s (%s:%d)' % (self.level[1], self.message, self.host, self.port)
 
+    def as_event(self) -> dict:
+        return super().as_event() | {'event': 'server-start', 'host': self.host, 'port': self.port}
+
+
+class MinecraftServerDoneMessage(MinecraftLogMessage):
+    seconds: float = None
+
+    def __init__(self, level: tuple[int, str] or str or None, message: str, seconds: float):
+        super().__init__(level, message)
+        self.seconds = seconds
+
+    def __str__(self):
+        return '%s: %s (%.3fs)' % (self.level[1], self.message, self.seconds)
+
+    def as_event(self) -> dict:
+        return super().as_event() | {'event': 'server-done', 'seconds': self.seconds}
+
+
+class MinecraftServerSavedMessage(MinecraftLogMessage):
+    """ After "save-all", when the world is completely on disk
+    """
+
+    def as_event(self) -> dict:
+        return super().as_event() | {'event': 'server-saved'}
+
+
+class MinecraftServerLagMessage(MinecraftLogMessage):
+    millis: int = None
+    ticks: int = None
+
+    def __init__(self, level: tuple[int, str] or str or None, message: str, millis: int, ticks: int):
+        super().__init__(level, message)
+        self.millis = millis
+        self.ticks = ticks
+
+    def as_event(self) -> dict:
+        return super().as_event() | {'event': 'server-lag', 'millis': self.millis, 'ticks': self.ticks}
+
+
+class MinecraftPlayerMessage(MinecraftLogMessage):
+    player: str = None
+
+    def __init__(self, level: tuple[int, str] or str or None, message: str, player: str):
+        super().__init__(level, message)
+        self.player = player
+
+    def as_event(self) -> dict:
+        return super().as_event() | {'player': self.player}
+
+
+class MinecraftPlayerUUIDMessage(MinecraftPlayerMessage):
+    uuid: str = None
+
+    def __init__(self, level: tuple[int, str] or str or None, message: str, player: str, uuid: str):
+        super().__init__(level, message, player)
+        self.uuid = uuid
+
+    def as_event(self) -> dict:
+        return super().as_event() | {'event': 'player-uuid', 'uuid': self.uuid}
+
+
+class MinecraftPlayerJoinMessage(MinecraftPlayerMessage):
+
+    def as_event(self) -> dict:
+        return super().as_event() | {'event': 'player-join'}
+
+
+class MinecraftPlayerLeaveMessage(MinecraftPlayerMessage):
+
+    def as_event(self) -> dict:
+        return super().as_event() | {'event': 'player-leave'}
+
 
 class MinecraftLogParser:
     # state
@@ -65,6 +142,17 @@ class MinecraftLogParser:
     _normal_line_pattern = re.compile('\[([0-9]{2}:[0-9]{2}:[0-9]{2})\] \[(.*)/(.*)\]: (.*)')
     # Starting Minecraft server on *:25565
     _server_start_pattern = re.compile('Starting Minecraft server on ([^:]*):([0-9]*)')
+    # Done (12.345s)! For help, type "help"
+    _server_done_pattern = re.compile(r'Done \(([0-9.]+)s\)!')
+    # Can't keep up! Is the server overloaded? Running 2345ms or 46 ticks behind
+    # Saved the game
+    _server_saved_pattern = re.compile(r'Saved the game$')
+    _server_lag_pattern = re.compile(r"Can't keep up! .*Running ([0-9]+)ms or ([0-9]+) ticks behind")
+    # UUID of player Steve is 8667ba71-b85a-4004-af54-457a9734eed7
+    _player_uuid_pattern = re.compile(r'UUID of player ([A-Za-z0-9_]{1,16}) is ([0-9a-f-]{36})$')
+    # Steve joined the game / Steve left the game
+    _player_join_pattern = re.compile(r'([A-Za-z0-9_]{1,16}) joined the game$')
+    _player_leave_pattern = re.compile(r'([A-Za-z0-9_]{1,16}) left the game$')
 
     def __init__(self, cb: callable):
         self._state = 0
@@ -95,4 +183,18 @@ class MinecraftLogParser:
         m = self._server_start_pattern.match(message.message)
         if m:
             message = MinecraftServerStartMessage(message.level, message.message, m.group(1), int(m.group(2)))
+        else:
+            m = self._server_done_pattern.match(message.message)
+            if m:
+                message = MinecraftServerDoneMessage(message.level, message.message, float(m.group(1)))
+            elif self._server_saved_pattern.match(message.message):
+                message = MinecraftServerSavedMessage(message.level, message.message)
+            elif (m := self._server_lag_pattern.match(message.message)):
+                message = MinecraftServerLagMessage(message.level, message.message, int(m.group(1)), int(m.group(2)))
+            elif (m := self._player_uuid_pattern.match(message.message)):
+                message = MinecraftPlayerUUIDMessage(message.level, message.message, m.group(1), m.group(2))
+            elif (m := self._player_join_pattern.match(message.message)):
+                message = MinecraftPlayerJoinMessage(message.level, message.message, m.group(1))
+            elif (m := self._player_leave_pattern.match(message.message)):
+                message = MinecraftPlayerLeaveMessage(message.level, message.message, m.group(1))
         self._cb(message)
@@ -0,0 +1,353 @@
+""" Metrics in the Prometheus text exposition format, served over HTTP from the server loop
+
+Each metric family caches its rendered text until one of its values changes, and the page is cached until any
+family changes, so scrapes in between send the same bytes again. Values that are polled (memory, CPU, TPS) are
+updated once a second, not per scrape.
+"""
+import errno
+import logging
+import math
+import socket
+import time
+
+from minecraft.serverwrapper.backup.job import BackupResult
+from minecraft.serverwrapper.serverloop.objects import WaitingObject
+from minecraft.serverwrapper.serverloop.serverloop import LoopStats, ServerLoop
+from minecraft.serverwrapper.statusfile import STATES
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+MAX_REQUEST_HEAD = 8192
+# Clients that don't finish their request within this time are disconnected
+REQUEST_TIMEOUT = 10.0
+
+
+def format_value(value: float) -> str:
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _same(a: float or None, b: float) -> bool:
+    return a == b or (a is not None and math.isnan(a) and math.isnan(b))
+
+
+class MetricFamily:
+    """ A counter or gauge, with one value per combination of label values (in the order of label_names)
+    """
+    _registry: 'MetricsRegistry' = None
+    _name: str = None
+    _type: str = None
+    _help: str = None
+    _label_names: tuple[str, ...] = None
+    _values: dict[tuple[str, ...], float] = None
+    _rendered: bytes = None
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, metric_type: str, help: str, label_names: tuple[str, ...] = ()):
+        self._registry = registry
+        self._name = name
+        self._type = metric_type
+        self._help = help
+        self._label_names = tuple(label_names)
+        self._values = {}
+
+    def _changed(self) -> None:
+        self._rendered = None
+        self._registry._rendered = None
+
+    def set(self, value: float, *labels: str) -> None:
+        if not _same(self._values.get(labels), value):
+            self._values[labels] = value
+            self._changed()
+
+    def inc(self, amount: float = 1.0, *labels: str) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+        self._changed()
+
+    def get(self, *labels: str) -> float or None:
+        return self._values.get(labels)
+
+    def clear(self) -> None:
+        if self._values:
+            self._values.clear()
+            self._changed()
+
+    def _label_text(self, labels: tuple[str, ...], extra: str = None) -> str:
+        pairs = ['{:s}="{:s}"'.format(name, escape_label_value(value)) for name, value in zip(self._label_names, labels)]
+        if extra is not None:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def _sample_lines(self) -> list[str]:
+        return [f'{self._name}{self._label_text(labels)} {format_value(value)}' for labels, value in self._values.items()]
+
+    def render(self) -> bytes:
+        if self._rendered is None:
+            lines = [f'# HELP {self._name} {self._help}', f'# TYPE {self._name} {self._type}'] + self._sample_lines()
+            self._rendered = ('\n'.join(lines) + '\n').encode('utf-8')
+        return self._rendered
+
+
+class Histogram(MetricFamily):
+    """ A histogram without labels, set as a whole from counts per bucket (not cumulative, the last one for
+    values above all bounds)
+    """
+    _bounds: tuple[float, ...] = ()
+    _counts: tuple[int, ...] = ()
+    _sum: float = 0.0
+
+    def set_buckets(self, bounds: tuple[float, ...], counts: list[int], total: float) -> None:
+        counts = tuple(counts)
+        if counts != self._counts or bounds != self._bounds:
+            self._bounds, self._counts, self._sum = bounds, counts, total
+            self._changed()
+
+    def _sample_lines(self) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self._bounds + (math.inf,), self._counts):
+            cumulative += count
+            lines.append('{:s}_bucket{{le="{:s}"}} {:d}'.format(self._name, format_value(bound), cumulative))
+        lines.append(f'{self._name}_sum {format_value(self._sum)}')
+        lines.append(f'{self._name}_count {cumulative:d}')
+        return lines
+
+
+class MetricsRegistry:
+    _families: list[MetricFamily] = None
+    _rendered: bytes = None
+
+    def __init__(self):
+        self._families = []
+
+    def _add(self, family: MetricFamily) -> MetricFamily:
+        self._families.append(family)
+        self._rendered = None
+        return family
+
+    def counter(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> MetricFamily:
+        return self._add(MetricFamily(self, name, 'counter', help, label_names))
+
+    def gauge(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> MetricFamily:
+        return self._add(MetricFamily(self, name, 'gauge', help, label_names))
+
+    def histogram(self, name: str, help: str) -> Histogram:
+        return self._add(Histogram(self, name, 'histogram', help))
+
+    def render(self) -> bytes:
+        if self._rendered is None:
+            self._rendered = b''.join(family.render() for family in self._families)
+        return self._rendered
+
+
+class WrapperMetrics(MetricsRegistry):
+    """ What the wrapper knows about itself and the server
+    """
+    def __init__(self, version: str):
+        super().__init__()
+        self.info = self.gauge('minecraft_server_info', 'Minecraft version of the server.', ('version',))
+        self.info.set(1, version)
+        self.state = self.gauge('minecraft_server_state', 'Current state of the server (1 for the current one).', ('state',))
+        self.up = self.gauge('minecraft_server_up', 'Whether the server process is running.')
+        self.ready = self.gauge('minecraft_server_ready', 'Whether the server has finished starting.')
+        self.starts = self.counter('minecraft_server_starts_total', 'Times the server process was started.')
+        self.exits = self.counter('minecraft_server_exits_total', 'Times the server process exited, by exit code.', ('code',))
+        self.start_time = self.gauge('minecraft_server_start_time_seconds',
+            'Start time of the running server process since the epoch (uptime is time() minus this).')
+        self.wrapper_start_time = self.gauge('minecraft_wrapper_start_time_seconds', 'Start time of the wrapper since the epoch.')
+        self.wrapper_start_time.set(time.time())
+        self.startup_seconds = self.gauge('minecraft_server_startup_seconds', 'Startup time the server reported last ("Done").')
+        self.log_messages = self.counter('minecraft_server_log_messages_total', 'Log messages of the server, by level.', ('level',))
+        self.stderr_lines = self.counter('minecraft_server_stderr_lines_total', 'Lines the server wrote to stderr.')
+        self.tps = self.gauge('minecraft_server_tps', 'Ticks per second, estimated from "Can\'t keep up!" messages.')
+        self.lag_events = self.counter('minecraft_server_lag_events_total', '"Can\'t keep up!" messages of the server.')
+        self.lag_ticks = self.counter('minecraft_server_lag_ticks_total', 'Ticks the server reported to be behind.')
+        self.players_online = self.gauge('minecraft_server_players_online', 'Players online.')
+        self.players_max = self.gauge('minecraft_server_players_max', 'Maximum number of players (max-players).')
+        self.server_rss = self.gauge('minecraft_server_resident_memory_bytes', 'Resident memory of the server process (JVM).')
+        self.server_cpu = self.counter('minecraft_server_cpu_seconds_total', 'CPU time of the running server process (JVM).')
+        self.gc_p99_pause = self.gauge('minecraft_server_gc_pause_p99_seconds', 'p99 GC pause of the server, from its GC log.')
+        self.wrapper_rss = self.gauge('minecraft_wrapper_resident_memory_bytes', 'Resident memory of the wrapper.')
+        self.wrapper_cpu = self.counter('minecraft_wrapper_cpu_seconds_total', 'CPU time of the wrapper.')
+        self.console_dropped = self.counter('minecraft_wrapper_console_dropped_lines_total',
+            'Log lines not written to the terminal because it was too slow.')
+        self.backups = self.counter('minecraft_wrapper_backups_total', 'Backups of the world, by result.', ('result',))
+        self.backup_last_success = self.gauge('minecraft_wrapper_backup_last_success_time_seconds',
+            'When the last successful backup finished, since the epoch.')
+        self.backup_duration = self.gauge('minecraft_wrapper_backup_duration_seconds', 'How long the last backup took.')
+        self.backup_save_off = self.gauge('minecraft_wrapper_backup_save_off_seconds',
+            'How long saving was turned off for the last backup.')
+        self.backup_new_bytes = self.gauge('minecraft_wrapper_backup_new_bytes',
+            'Data the last backup added to the repository, after deduplication and before compression.')
+        self.loop_busy = self.histogram('minecraft_wrapper_loop_iteration_seconds',
+            'Time per server loop iteration spent handling events, i.e. how late the wrapper handles new ones.')
+
+    def set_state(self, state: str) -> None:
+        for name in STATES:
+            self.state.set(1 if name == state else 0, name)
+
+    def set_backup(self, result: BackupResult) -> None:
+        self.backups.inc(1, 'success')
+        self.backup_last_success.set(time.time())
+        self.backup_duration.set(result.total_seconds)
+        if result.save_off_seconds is not None:
+            self.backup_save_off.set(result.save_off_seconds)
+        self.backup_new_bytes.set(result.stats.new_bytes)
+
+    def set_loop_stats(self, stats: LoopStats) -> None:
+        self.loop_busy.set_buckets(LoopStats.BUCKETS, stats.bucket_counts, stats.busy_seconds)
+
+
+class MetricsConnection(WaitingObject):
+    """ One HTTP request: reads it, sends the response and closes the connection
+    """
+    _sock: socket.socket = None
+    _server: 'MetricsServer' = None
+    _request: bytearray = None
+    _response: memoryview = None
+    _deadline: float = None
+
+    def __init__(self, sock: socket.socket, server: 'MetricsServer', name=None):
+        super().__init__(name=name)
+        self._sock = sock
+        self._server = server
+        self._request = bytearray()
+        self._deadline = time.time() + REQUEST_TIMEOUT
+        sock.setblocking(False)
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def ignore_when_idle(self) -> bool:
+        return True
+
+    def is_waiting_to_receive(self) -> bool:
+        return self._response is None
+
+    def is_waiting_to_send(self) -> bool:
+        return self._response is not None
+
+    def is_waiting_for_timeout(self) -> float:
+        return self._deadline
+
+    def do_timeout(self) -> None:
+        self.close()
+
+    def do_receive(self) -> None:
+        try:
+            data = self._sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            return self.close()
+        if not data:
+            return self.close()
+        self._request += data
+        end = self._request.find(b'\r\n\r\n')
+        if end < 0:
+            end = self._request.find(b'\n\n')
+        if end >= 0:
+            self._response = memoryview(self._server.respond(bytes(self._request[:end])))
+        elif len(self._request) > MAX_REQUEST_HEAD:
+            self._response = memoryview(self._server.error_response(431, 'Request Header Fields Too Large'))
+
+    def do_send(self) -> None:
+        try:
+            sent = self._sock.send(self._response)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            return self.close()
+        self._response = self._response[sent:]
+        if len(self._response) == 0:
+            self.close()
+
+    def close(self) -> None:
+        if self._is_done:
+            return
+        self._is_done = True
+        self._sock.close()
+
+
+class MetricsServer(WaitingObject):
+    """ Serves a registry on GET /metrics. The full response is cached along with the registry's page.
+    """
+    _serverloop: ServerLoop = None
+    _sock: socket.socket = None
+    _registry: MetricsRegistry = None
+    _body: bytes = None
+    _response: bytes = None
+    _client_count: int = 0
+    scrapes: int = 0
+
+    def __init__(self, serverloop: ServerLoop, address: tuple[str, int], registry: MetricsRegistry, name=None):
+        super().__init__(name=name or 'metrics')
+        self._serverloop = serverloop
+        self._registry = registry
+        try:
+            self._sock = socket.create_server(address, family=socket.AF_INET6 if ':' in address[0] else socket.AF_INET,
+                backlog=16)
+        except OSError as e:
+            if e.errno == errno.EADDRINUSE:
+                raise MinecraftServerWrapperException('Metrics port {:s}:{:d} is already in use.'.format(*address))
+            raise
+        self._sock.setblocking(False)
+        logger.info('Serving metrics on http://{:s}:{:d}/metrics'.format(*address))
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def is_waiting_to_receive(self) -> bool:
+        return True
+
+    def ignore_when_idle(self) -> bool:
+        return True
+
+    def do_receive(self) -> None:
+        try:
+            sock, _ = self._sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            logger.warning(f'{self}: accept failed: {e}')
+            return
+        self._client_count += 1
+        self._serverloop.add_waiting_object(MetricsConnection(sock, self, name=f'metrics-{self._client_count}'))
+
+    def respond(self, head: bytes) -> bytes:
+        try:
+            method, path, _ = head.split(b'\r\n', 1)[0].split(b'\n', 1)[0].decode('latin-1').split(' ', 2)
+        except ValueError:
+            return self.error_response(400, 'Bad Request')
+        if path.split('?', 1)[0] not in ('/metrics', '/'):
+            return self.error_response(404, 'Not Found')
+        if method not in ('GET', 'HEAD'):
+            return self.error_response(405, 'Method Not Allowed')
+        self.scrapes += 1
+        body = self._registry.render()
+        if body is not self._body:
+            self._body = body
+            self._response = ('HTTP/1.1 200 OK\r\nContent-Type: {:s}\r\nContent-Length: {:d}\r\nConnection: close\r\n\r\n'
+                .format(CONTENT_TYPE, len(body)).encode('latin-1') + body)
+        if method == 'HEAD':
+            return self._response[:len(self._response) - len(body)]
+        return self._response
+
+    def error_response(self, status: int, reason: str) -> bytes:
+        body = f'{status:d} {reason:s}\n'.encode('latin-1')
+        return (f'HTTP/1.1 {status:d} {reason:s}\r\nContent-Type: text/plain\r\nContent-Length: {len(body):d}\r\n'
+            'Connection: close\r\n\r\n').encode('latin-1') + body
+
+    def close(self) -> None:
+        self._is_done = True
+        self._sock.close()
@@ -0,0 +1,195 @@
+""" Reads what the server is about to need into the page cache while the JVM starts: after a reboot or a long
+sleep, the launcher, its libraries, the mods and the chunks around the spawn and the players would otherwise be
+read from disk one at a time, as the server gets to them.
+
+Files are asked for with posix_fadvise(WILLNEED), which has the kernel read them in the background, up to a
+byte budget. Where there is no posix_fadvise they are read (and thrown away).
+"""
+from collections import defaultdict
+import logging
+import math
+import os
+import time
+from typing import NamedTuple
+
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+from minecraft.serverwrapper.util.properties import read_properties
+from minecraft.serverwrapper.world.analyze import dimension_directories
+from minecraft.serverwrapper.world.level import read_level, read_players
+from minecraft.serverwrapper.world.region import REGION_HEADER_SIZE, SECTOR_SIZE, RegionFile
+
+logger = logging.getLogger(__name__)
+
+# Where the launcher keeps the game and its libraries: libraries/ and versions/ for the server's bundler,
+# .fabric/ for Fabric's remapped game jar
+LAUNCHER_DIRECTORIES = ('libraries', 'versions', '.fabric')
+READ_SIZE = 1 << 20
+DEFAULT_VIEW_DISTANCE = 10
+
+
+class FileRange(NamedTuple):
+    path: str
+    offset: int
+    # 0 for up to the end of the file
+    length: int
+
+
+class PrewarmResult(NamedTuple):
+    files: int
+    bytes: int
+    seconds: float
+    # Whether the budget ran out before everything was prewarmed
+    truncated: bool
+
+    def summary(self) -> str:
+        return 'Prewarmed {:.1f} MiB in {:d} files in {:.2f}s{:s}'.format(self.bytes / (1 << 20), self.files,
+            self.seconds, ', up to the budget' if self.truncated else '')
+
+
+def tree_ranges(directory: str) -> list[FileRange]:
+    """ All files below directory, in full
+    """
+    ranges = []
+    for parent, dirs, names in os.walk(directory):
+        dirs.sort()
+        for name in sorted(names):
+            ranges.append(FileRange(os.path.join(parent, name), 0, 0))
+    return ranges
+
+
+def area_chunks(x: float, z: float, radius: int) -> dict[tuple[int, int], set[int]]:
+    """ Region coordinates -> chunk indices within radius chunks of block x, z
+    """
+    center_x, center_z = math.floor(x) >> 4, math.floor(z) >> 4
+    regions = defaultdict(set)
+    for chunk_x in range(center_x - radius, center_x + radius + 1):
+        for chunk_z in range(center_z - radius, center_z + radius + 1):
+            regions[(chunk_x >> 5, chunk_z >> 5)].add((chunk_z & 31) * 32 + (chunk_x & 31))
+    return regions
+
+
+def chunk_ranges(path: str, indices: set[int], header: bool = True) -> list[FileRange]:
+    """ The sectors of the given chunks of a region file (and its header), adjacent ones merged
+    """
+    try:
+        with RegionFile(path) as region:
+            sectors = sorted((location >> 8, location & 0xff) for location in
+                (region.locations[index] for index in indices) if location)
+    except (OSError, MinecraftServerWrapperException):
+        return []
+    ranges = [FileRange(path, 0, REGION_HEADER_SIZE)] if header else []
+    for start, count in sectors:
+        last = ranges[-1] if ranges else None
+        if last is not None and last.offset + last.length == start * SECTOR_SIZE:
+            ranges[-1] = FileRange(path, last.offset, last.length + count * SECTOR_SIZE)
+        else:
+            ranges.append(FileRange(path, start * SECTOR_SIZE, count * SECTOR_SIZE))
+    return ranges
+
+
+class Prewarmer:
+    """ Plans what to prewarm, most urgent first (the launcher is needed before the mods, the mods before the
+    world), and prewarms it up to the budget. Meant to run in a thread of its own.
+    """
+    _working_dir: str = None
+    _jar_path: str = None
+    _world_dir: str = None
+    _max_bytes: int = 0
+    _radius: int = 0
+    _max_players: int = 0
+
+    def __init__(self, working_dir: str, jar_path: str, world_dir: str, max_bytes: int, radius: int = 0,
+            max_players: int = 20):
+        self._working_dir = working_dir
+        self._jar_path = jar_path
+        self._world_dir = world_dir
+        self._max_bytes = max_bytes
+        self._radius = radius
+        self._max_players = max_players
+
+    def _view_distance(self) -> int:
+        value = read_properties(self._working_dir + '/server.properties').get('view-distance')
+        return int(value) if value and value.isdigit() else DEFAULT_VIEW_DISTANCE
+
+    def world_areas(self) -> list[tuple[str, float, float]]:
+        """ (dimension, x, z) of the spawn and of the players who played last
+        """
+        areas = []
+        try:
+            spawn = read_level(self._world_dir).spawn
+            if spawn[0] is not None and spawn[2] is not None:
+                areas.append(('minecraft:overworld', spawn[0], spawn[2]))
+        except MinecraftServerWrapperException as e:
+            logger.debug(f'No spawn to prewarm: {e}')
+        if self._max_players > 0:
+            players = read_players(self._world_dir, items=False)
+            modified = {}
+            for player in players:
+                try:
+                    modified[player.uuid] = os.stat(os.path.join(self._world_dir, 'playerdata', player.uuid + '.dat')).st_mtime
+                except OSError:
+                    modified[player.uuid] = 0
+            players.sort(key=lambda player: modified[player.uuid], reverse=True)
+            areas += [(player.dimension, player.position[0], player.position[2])
+                for player in players[:self._max_players] if player.position is not None and player.dimension]
+        return areas
+
+    def plan(self) -> list[FileRange]:
+        ranges = []
+        if self._jar_path:
+            ranges.append(FileRange(self._jar_path, 0, 0))
+        for name in LAUNCHER_DIRECTORIES + ('mods',):
+            ranges += tree_ranges(os.path.join(self._working_dir, name))
+        ranges.append(FileRange(os.path.join(self._world_dir, 'level.dat'), 0, 0))
+        radius = self._radius or self._view_distance()
+        dimensions = dimension_directories(self._world_dir)
+        # Region file -> chunks already planned, players standing together share them
+        planned = defaultdict(set)
+        for dimension, x, z in self.world_areas():
+            directory = dimensions.get(dimension)
+            if directory is None:
+                continue
+            for (region_x, region_z), indices in area_chunks(x, z, radius).items():
+                for kind in ('region', 'entities', 'poi'):
+                    path = os.path.join(directory, kind, f'r.{region_x:d}.{region_z:d}.mca')
+                    wanted = indices - planned[path]
+                    if wanted:
+                        ranges += chunk_ranges(path, wanted, header=not planned[path])
+                        planned[path] |= wanted
+        return ranges
+
+    def run(self) -> PrewarmResult:
+        start = time.perf_counter()
+        files = set()
+        total = 0
+        truncated = False
+        for path, offset, length in self.plan():
+            if total >= self._max_bytes:
+                truncated = True
+                break
+            try:
+                with open(path, 'rb') as f:
+                    if length == 0:
+                        length = max(os.fstat(f.fileno()).st_size - offset, 0)
+                    if length > self._max_bytes - total:
+                        length = self._max_bytes - total
+                        truncated = True
+                    if length == 0:
+                        continue
+                    advise(f, offset, length)
+            except OSError as e:
+                logger.debug(f'Not prewarming {path}: {e}')
+                continue
+            files.add(path)
+            total += length
+        return PrewarmResult(len(files), total, time.perf_counter() - start, truncated)
+
+
+def advise(f, offset: int, length: int) -> None:
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(f.fileno(), offset, length, os.POSIX_FADV_WILLNEED)
+        return
+    f.seek(offset)
+    remaining = length
+    while remaining > 0 and (data := f.read(min(READ_SIZE, remaining))):
+        remaining -= len(data)
@@ -0,0 +1,179 @@
+""" Profiling of the running wrapper itself, for a limited time
+
+Nothing is installed while no profile is running. A "sample" profile looks at the server loop thread's stack
+from a background thread every few milliseconds and writes collapsed stacks (for flamegraph.pl, speedscope or
+inferno). A "cprofile" profile runs cProfile in the server loop thread and writes pstats and a text summary.
+Either can also trace allocations with tracemalloc and write the top allocation sites.
+"""
+import cProfile
+import collections
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ('sample', 'cprofile')
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return '{:s} ({:s}:{:d})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+def collapse_stack(frame) -> str:
+    """ The stack as "outermost;...;innermost", the format of flame graph tools
+    """
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler:
+    """ Counts the stacks of one thread, sampled from a background thread
+    """
+    _thread_id: int = None
+    _interval: float = None
+    _stacks: collections.Counter = None
+    _stop: threading.Event = None
+    _thread: threading.Thread = None
+    samples: int = 0
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stacks = collections.Counter()
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self._stacks[collapse_stack(frame)] += 1
+                self.samples += 1
+            # Don't keep the thread's frames alive until the next sample
+            del frame
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def write_collapsed(self, path: str) -> None:
+        with open(path, 'w') as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f'{stack} {count:d}\n')
+
+
+class ProfileSession:
+    """ One profile of the calling thread (the server loop's), started and stopped from that thread. stop()
+    writes the reports to directory and returns their paths.
+    """
+    _directory: str = None
+    _mode: str = None
+    _memory: bool = False
+    _sample_interval: float = None
+    _prefix: str = None
+    _started_at: float = None
+    _profile: cProfile.Profile = None
+    _sampler: StackSampler = None
+    _snapshot: tracemalloc.Snapshot = None
+    # Whether tracemalloc was started for this session (and not e.g. by PYTHONTRACEMALLOC)
+    _started_tracemalloc: bool = False
+
+    def __init__(self, directory: str, mode: str = 'sample', memory: bool = True, sample_interval: float = 0.005):
+        if mode not in PROFILE_MODES:
+            raise MinecraftServerWrapperException('Unknown profile mode {!r}, use one of {:s}.'.format(mode, ', '.join(PROFILE_MODES)))
+        self._directory = directory
+        self._mode = mode
+        self._memory = memory
+        self._sample_interval = sample_interval
+
+    def mode(self) -> str:
+        return self._mode
+
+    def started_at(self) -> float:
+        return self._started_at
+
+    def start(self) -> None:
+        self._started_at = time.time()
+        self._prefix = os.path.join(self._directory, time.strftime('%Y%m%d-%H%M%S', time.localtime(self._started_at)))
+        if self._memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            self._snapshot = tracemalloc.take_snapshot()
+        if self._mode == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = StackSampler(threading.get_ident(), self._sample_interval)
+            self._sampler.start()
+
+    def stop(self) -> list[str]:
+        reports = []
+        elapsed = time.time() - self._started_at
+        if self._profile is not None:
+            self._profile.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        if self._snapshot is not None:
+            # Before writing the other reports, which allocate plenty
+            snapshot = tracemalloc.take_snapshot()
+            traced = tracemalloc.get_traced_memory()
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+        os.makedirs(self._directory, exist_ok=True)
+        if self._profile is not None:
+            reports.append(self._prefix + '-cprofile.pstats')
+            self._profile.dump_stats(reports[-1])
+            reports.append(self._prefix + '-cprofile.txt')
+            self.write_pstats_summary(reports[-1])
+        if self._sampler is not None:
+            reports.append(self._prefix + '-sample.collapsed')
+            self._sampler.write_collapsed(reports[-1])
+            logger.info('Took {:d} samples in {:.1f}s.'.format(self._sampler.samples, elapsed))
+        if self._snapshot is not None:
+            reports.append(self._prefix + '-memory.txt')
+            self.write_allocations(reports[-1], snapshot, traced, elapsed)
+        return reports
+
+    def write_pstats_summary(self, path: str, limit: int = 60) -> None:
+        output = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=output)
+        stats.strip_dirs()
+        output.write('By cumulative time:\n')
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+        output.write('By own time:\n')
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(limit)
+        with open(path, 'w') as f:
+            f.write(output.getvalue())
+
+    def write_allocations(self, path: str, snapshot: tracemalloc.Snapshot, traced: tuple[int, int], elapsed: float,
+            limit: int = 40) -> None:
+        # Allocations of the profiler itself don't count
+        filters = [tracemalloc.Filter(False, module.__file__) for module in (tracemalloc, cProfile, threading)] \
+            + [tracemalloc.Filter(False, __file__)]
+        snapshot = snapshot.filter_traces(filters)
+        growth = snapshot.compare_to(self._snapshot.filter_traces(filters), 'lineno')
+        with open(path, 'w') as f:
+            f.write('Traced for {:.1f}s, {:.1f} KiB at the end, {:.1f} KiB at peak\n'.format(
+                elapsed, traced[0] / 1024, traced[1] / 1024))
+            f.write('\nGrowth during the profile, by allocation site:\n')
+            for stat in growth[:limit]:
+                f.write(f'{stat}\n')
+            f.write('\nLargest allocation sites at the end of the profile (traced since it started):\n')
+            for stat in snapshot.statistics('lineno')[:limit]:
+                f.write(f'{stat}\n')
@@ -0,0 +1,254 @@
+from collections import deque
+from concurrent.futures import Future
+import errno
+import logging
+import os
+import socket
+import struct
+import time
+
+from minecraft.serverwrapper.serverloop.objects import WaitingObject
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+
+logger = logging.getLogger(__name__)
+
+# Packet types, see https://wiki.vg/RCON
+TYPE_RESPONSE = 0
+TYPE_COMMAND = 2
+TYPE_LOGIN = 3
+# Servers answer unknown types with "Unknown request ...", used to find the end of a fragmented response
+TYPE_MARKER = 200
+
+# The server splits responses into packets with at most this much payload
+MAX_FRAGMENT = 4096
+MAX_PACKET = 1 << 20
+
+RECONNECT_MIN_DELAY = 1.0
+RECONNECT_MAX_DELAY = 30.0
+
+
+class RconError(MinecraftServerWrapperException):
+    pass
+
+
+def encode_packet(request_id: int, packet_type: int, payload: str) -> bytes:
+    body = struct.pack('<ii', request_id, packet_type) + payload.encode('utf-8') + b'\0\0'
+    return struct.pack('<i', len(body)) + body
+
+
+class RconRequest:
+    request_id: int = None
+    command: str = None
+    future: Future = None
+    fragments: list[bytes] = None
+
+    def __init__(self, command: str):
+        self.command = command
+        self.future = Future()
+        self.fragments = []
+
+    def complete(self) -> None:
+        if not self.future.done():
+            self.future.set_result(b''.join(self.fragments).decode('utf-8', errors='replace'))
+
+    def fail(self, reason: str) -> None:
+        if not self.future.done():
+            self.future.set_exception(RconError(reason))
+
+
+class RconClient(WaitingObject):
+    """ RCON client running in the server loop
+    Commands return futures with the server's response. The connection is kept open and re-established after
+    errors; commands sent before a connection is lost fail (they may or may not have run), queued ones are kept.
+
+    Up to max_in_flight commands are sent without waiting for responses. Vanilla servers read exactly one packet
+    per read() call and drop connections that send more, so the default is 1; servers with a proper RCON
+    implementation (e.g. Paper) can take more.
+    """
+    _address: tuple[str, int] = None
+    _password: str = None
+    _max_in_flight: int = 1
+    _sock: socket.socket = None
+    _state: str = 'disconnected'
+    _in: bytearray = None
+    _out: bytearray = None
+    _next_id: int = 1
+    _auth_id: int = None
+    _marker_id: int = None
+    # Sent requests, in order; the server answers them in order
+    _in_flight: deque = None
+    _queue: deque = None
+    _reconnect_delay: float = RECONNECT_MIN_DELAY
+    _target: float = None
+    _closed: bool = False
+
+    def __init__(self, address: tuple[str, int], password: str, max_in_flight: int = 1, name=None):
+        super().__init__(name=name or 'rcon')
+        self._address = address
+        self._password = password
+        self._max_in_flight = max(1, max_in_flight)
+        self._in = bytearray()
+        self._out = bytearray()
+        self._in_flight = deque()
+        self._queue = deque()
+        self._connect()
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def ignore_when_idle(self) -> bool:
+        return True
+
+    def is_waiting_to_receive(self) -> bool:
+        return self._state in ('authenticating', 'ready')
+
+    def is_waiting_to_send(self) -> bool:
+        return self._state == 'connecting' or (self._state in ('authenticating', 'ready') and len(self._out) > 0)
+
+    def is_waiting_for_timeout(self):
+        return self._target
+
+    def is_ready(self) -> bool:
+        return self._state == 'ready'
+
+    def command(self, command: str) -> Future:
+        """ Sends a command, the future's result is the response text
+        """
+        if self._closed:
+            raise RconError('RCON client is closed.')
+        request = RconRequest(command)
+        self._queue.append(request)
+        self._send_queued()
+        return request.future
+
+    def commands(self, commands: list[str]) -> list[Future]:
+        return [self.command(command) for command in commands]
+
+    def _new_id(self) -> int:
+        request_id = self._next_id
+        self._next_id = self._next_id % 0x7FFFFFFF + 1
+        return request_id
+
+    def _connect(self) -> None:
+        self._target = None
+        self._in.clear()
+        self._out.clear()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setblocking(False)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._state = 'connecting'
+        rc = self._sock.connect_ex(self._address)
+        if rc not in (0, errno.EINPROGRESS):
+            self._disconnect(f'connect failed: {os.strerror(rc)}')
+
+    def _disconnect(self, reason: str) -> None:
+        logger.warning(f'{self}: {reason}, reconnecting in {self._reconnect_delay:.0f}s')
+        self._sock.close()
+        self._state = 'disconnected'
+        self._marker_id = None
+        while self._in_flight:
+            self._in_flight.popleft().fail(f'Connection lost: {reason}')
+        self._target = time.time() + self._reconnect_delay
+        self._reconnect_delay = min(self._reconnect_delay * 2, RECONNECT_MAX_DELAY)
+
+    def do_timeout(self) -> None:
+        if self._state == 'disconnected' and not self._closed:
+            self._connect()
+
+    def do_send(self) -> None:
+        if self._state == 'connecting':
+            rc = self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if rc != 0:
+                return self._disconnect(f'connect failed: {os.strerror(rc)}')
+            self._state = 'authenticating'
+            self._auth_id = self._new_id()
+            self._out += encode_packet(self._auth_id, TYPE_LOGIN, self._password)
+        try:
+            sent = self._sock.send(self._out)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            return self._disconnect(str(e))
+        del self._out[:sent]
+
+    def do_receive(self) -> None:
+        try:
+            data = self._sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            return self._disconnect(str(e))
+        if not data:
+            return self._disconnect('connection closed by server')
+        self._in += data
+        offset = 0
+        while len(self._in) - offset >= 4:
+            length = struct.unpack_from('<i', self._in, offset)[0]
+            if length < 10 or length > MAX_PACKET:
+                return self._disconnect(f'invalid packet length {length}')
+            if len(self._in) - offset - 4 < length:
+                break
+            request_id, packet_type = struct.unpack_from('<ii', self._in, offset + 4)
+            payload = bytes(self._in[offset + 12:offset + 4 + length - 2])
+            offset += 4 + length
+            self._handle_packet(request_id, packet_type, payload)
+            if self._state == 'disconnected':
+                return
+        del self._in[:offset]
+        self._send_queued()
+
+    def _handle_packet(self, request_id: int, packet_type: int, payload: bytes) -> None:
+        if self._state == 'authenticating':
+            if request_id == -1:
+                # Not worth retrying quickly, the password comes from server.properties
+                self._reconnect_delay = RECONNECT_MAX_DELAY
+                while self._queue:
+                    self._queue.popleft().fail('RCON authentication failed')
+                return self._disconnect('authentication failed')
+            if request_id == self._auth_id:
+                logger.info(f'{self}: connected to {self._address[0]}:{self._address[1]}')
+                self._state = 'ready'
+                self._reconnect_delay = RECONNECT_MIN_DELAY
+            return
+
+        if request_id == self._marker_id:
+            # Everything before the marker's response is complete
+            self._marker_id = None
+            if self._in_flight:
+                self._in_flight.popleft().complete()
+            return
+        # Responses come in order, so a different id means the current request is complete
+        while self._in_flight and self._in_flight[0].request_id != request_id:
+            self._in_flight.popleft().complete()
+        if not self._in_flight:
+            logger.debug(f'{self}: response to unknown request {request_id}')
+            return
+        request = self._in_flight[0]
+        request.fragments.append(payload)
+        if len(payload) < MAX_FRAGMENT:
+            self._in_flight.popleft().complete()
+        elif self._marker_id is None and (self._max_in_flight == 1 or (len(self._in_flight) == 1 and len(self._queue) == 0)):
+            # Can't tell if more is coming until the server answers something else
+            self._marker_id = self._new_id()
+            self._out += encode_packet(self._marker_id, TYPE_MARKER, '')
+
+    def _send_queued(self) -> None:
+        if self._state != 'ready':
+            return
+        while self._queue and len(self._in_flight) < self._max_in_flight and self._marker_id is None:
+            request = self._queue.popleft()
+            if request.future.cancelled():
+                continue
+            request.request_id = self._new_id()
+            self._out += encode_packet(request.request_id, TYPE_COMMAND, request.command)
+            self._in_flight.append(request)
+
+    def close(self) -> None:
+        self._closed = True
+        self._is_done = True
+        self._target = None
+        if self._sock is not None:
+            self._sock.close()
+        for requests in (self._in_flight, self._queue):
+            while requests:
+                requests.popleft().fail('RCON client closed.')
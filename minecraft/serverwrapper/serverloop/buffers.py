@@ -1,6 +1,11 @@
 
 import logging
 import os
+import queue
+import select
+import stat
+import threading
+import time
 from typing import Any, TextIO
 from minecraft.serverwrapper.serverloop.serverloop import WaitingObject
 
@@ -11,18 +16,23 @@ class LineInputBuffer(WaitingObject):
     _handle: TextIO = None
     _buffer: str = ""
     _callback: callable = None
+    # Called with every chunk as it was read, e.g. to record it
+    _chunk_callback: callable = None
 
-    def __init__(self, handle: TextIO, callback: callable, name=None):
+    def __init__(self, handle: TextIO or None, callback: callable, name=None, chunk_callback: callable = None):
         super().__init__(name=name)
         self._handle = handle
         self._callback = callback
-        os.set_blocking(self._handle.fileno(), False)
+        self._chunk_callback = chunk_callback
+        # Without a handle, data only comes from feed()
+        if self._handle is not None:
+            os.set_blocking(self._handle.fileno(), False)
 
     def fileno(self) -> int:
         return self._handle.fileno()
 
     def is_waiting_to_receive(self) -> bool:
-        return True
+        return self._handle is not None
 
     def do_receive(self) -> None:
         read_bytes = self._handle.read()
@@ -31,6 +41,13 @@ class LineInputBuffer(WaitingObject):
             self._handle.close()
             self._is_done = True
             return
+        if self._chunk_callback is not None:
+            self._chunk_callback(read_bytes)
+        self.feed(read_bytes)
+
+    def feed(self, read_bytes: str) -> None:
+        """ Handles data as if it was read from the handle (used to replay recordings)
+        """
         self._buffer += read_bytes
         while True:
             pos = self._buffer.find('\n')
@@ -42,24 +59,33 @@ class LineInputBuffer(WaitingObject):
 
 
 class OutputBuffer(WaitingObject):
+    """ Writes to a non-blocking file descriptor as it becomes writable. The data is encoded once and written
+    with os.write, so a partial write just leaves the rest for later (a TextIOWrapper would repeat data).
+    """
     _handle: TextIO = None
-    _buffer: str = ""
+    _fd: int = None
+    _encoding: str = 'utf-8'
+    _errors: str = 'strict'
+    _buffer: bytearray = None
     _callback: callable = None
     _error_callback: callable = None
     _close_after_send: bool = False
     _ignore_when_idle: bool = True
 
-    def __init__(self, handle: TextIO, callback: callable = None, name=None):
+    def __init__(self, handle: TextIO, callback: callable = None, name=None, encoding: str = None):
         super().__init__(name=name)
         self._handle = handle
+        self._fd = handle.fileno()
+        self._encoding = encoding or getattr(handle, 'encoding', None) or self._encoding
+        self._buffer = bytearray()
         self._callback = callback
-        os.set_blocking(self._handle.fileno(), False)
+        os.set_blocking(self._fd, False)
 
     def set_error_callback(self, callback: callable) -> None:
         self._error_callback = callback
 
     def fileno(self) -> int:
-        return self._handle.fileno()
+        return self._fd
 
     def is_waiting_to_send(self) -> bool:
         return len(self._buffer) > 0
@@ -69,28 +95,34 @@ class OutputBuffer(WaitingObject):
 
     def do_send(self) -> None:
         try:
-            written_bytes = self._handle.write(self._buffer)
+            written_bytes = os.write(self._fd, self._buffer)
+        except (BlockingIOError, InterruptedError):
+            return
         except BrokenPipeError as e:
+            # Nobody is going to read the rest
+            self._buffer.clear()
             if self._error_callback is not None:
                 self._error_callback(e)
             return
 
-        self._buffer = self._buffer[written_bytes:]
+        del self._buffer[:written_bytes]
         if self._callback is not None:
             self._callback()
         if len(self._buffer) == 0 and self._close_after_send:
+            self._close_handle()
+
+    def _close_handle(self) -> None:
+        if not self._is_done:
             self._handle.close()
             self._is_done = True
 
     def send(self, data: str) -> None:
         if self._close_after_send:
             raise RuntimeError('OutputBuffer: cannot send data after close')
-        self._buffer += data
+        self._buffer += data.encode(self._encoding, self._errors)
 
     def send_line(self, data: str) -> None:
-        if self._close_after_send:
-            raise RuntimeError('OutputBuffer: cannot send data after close')
-        self._buffer += data + '\n'
+        self.send(data + '\n')
 
     def buffer_size(self) -> int:
         return len(self._buffer)
@@ -100,3 +132,118 @@ class OutputBuffer(WaitingObject):
 
     def close(self) -> None:
         self._close_after_send = True
+        if len(self._buffer) == 0:
+            self._close_handle()
+
+
+def open_nonblocking(fd: int) -> tuple[int, bool]:
+    """ A new non-blocking descriptor for writing to what fd refers to. Ttys and pipes are opened again, so
+    other users of fd (the shell, print(), tracebacks) are not affected. Otherwise it's a duplicate that shares
+    the blocking mode with fd; regular files never block and stay blocking, anything else (e.g. a socket) is
+    made non-blocking. Returns the descriptor and whether fd's blocking mode has to be restored when done.
+    """
+    mode = os.fstat(fd).st_mode
+    if stat.S_ISCHR(mode) or stat.S_ISFIFO(mode):
+        try:
+            return os.open(f'/proc/self/fd/{fd:d}', os.O_WRONLY | os.O_NONBLOCK | os.O_CLOEXEC | os.O_NOCTTY), False
+        except OSError:
+            pass
+    new_fd = os.dup(fd)
+    if stat.S_ISREG(mode) or not os.get_blocking(new_fd):
+        return new_fd, False
+    os.set_blocking(new_fd, False)
+    return new_fd, True
+
+
+class ConsoleBuffer(OutputBuffer):
+    """ Terminal output that never blocks the loop: lines are collected and written in one go per loop
+    iteration. If the terminal falls behind by more than max_buffered_bytes, lines are dropped until it has
+    caught up halfway, and a line saying how many were dropped takes their place.
+    Create it in the loop's thread. Lines from other threads are queued, and the loop moves them into the
+    buffer: it may be passing the buffer to os.write() at that moment, and a bytearray can't grow while it does.
+    """
+    _max_buffered_bytes: int = None
+    _restore_blocking: bool = False
+    _loop_thread: int = None
+    _pending: queue.SimpleQueue = None
+    _dropping: bool = False
+    _unreported_drops: int = 0
+    # All lines dropped so far
+    dropped_lines: int = 0
+
+    def __init__(self, stream: TextIO, max_buffered_bytes: int = 256 << 10, name=None):
+        fd, self._restore_blocking = open_nonblocking(stream.fileno())
+        super().__init__(os.fdopen(fd, 'wb', buffering=0), name=name or 'console',
+            encoding=getattr(stream, 'encoding', None))
+        self._errors = 'replace'
+        self._max_buffered_bytes = max_buffered_bytes
+        self._loop_thread = threading.get_ident()
+        self._pending = queue.SimpleQueue()
+
+    def is_waiting_to_send(self) -> bool:
+        self._take_pending()
+        return super().is_waiting_to_send()
+
+    def write_line(self, line: str) -> None:
+        if self._close_after_send:
+            return
+        if threading.get_ident() != self._loop_thread:
+            self._pending.put(line)
+            return
+        self._take_pending()
+        self._add_line(line)
+
+    def _take_pending(self) -> None:
+        while True:
+            try:
+                line = self._pending.get_nowait()
+            except queue.Empty:
+                return
+            self._add_line(line)
+
+    def _add_line(self, line: str) -> None:
+        if self._close_after_send:
+            return
+        if self._dropping:
+            if len(self._buffer) >= self._max_buffered_bytes // 2:
+                self._drop()
+                return
+            self._dropping = False
+            self.send(f'[console: {self._unreported_drops:d} lines dropped, the terminal is too slow]\n')
+            self._unreported_drops = 0
+        elif len(self._buffer) >= self._max_buffered_bytes:
+            self._dropping = True
+            self._drop()
+            return
+        self.send(line + '\n')
+
+    def _drop(self) -> None:
+        self.dropped_lines += 1
+        self._unreported_drops += 1
+
+    def drain(self, timeout: float) -> bool:
+        """ Writes what's buffered, waiting at most timeout seconds for the terminal (e.g. at shutdown).
+        Returns whether everything was written.
+        """
+        deadline = time.time() + timeout
+        self._take_pending()
+        while len(self._buffer) > 0 and not self._is_done:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            _, writable, _ = select.select([], [self._fd], [], remaining)
+            if writable:
+                self.do_send()
+        return len(self._buffer) == 0
+
+    def close(self) -> None:
+        """ Closes right away, anything not written yet is discarded (see drain())
+        """
+        self._buffer.clear()
+        super().close()
+
+    def _close_handle(self) -> None:
+        if self._restore_blocking and not self._is_done:
+            # Shared with the original descriptor
+            os.set_blocking(self._fd, True)
+        super()._close_handle()
@@ -1,7 +1,11 @@
 
+from concurrent.futures import Future
 import logging
+import os
+import threading
 import time
 import traceback
+from typing import Callable
 
 logger = logging.getLogger(__name__)
 
@@ -111,6 +115,10 @@ class WaitingOnetimeCallback(WaitingObject):
         self._callback()
         self._is_done = True
 
+    def cancel(self):
+        self._target = None
+        self._is_done = True
+
 
 class RepeatedCallback(WaitingObject):
     _target = None
@@ -132,3 +140,50 @@ class RepeatedCallback(WaitingObject):
         if r is False:
             self._target = None
             self._is_done = True
+
+    def cancel(self):
+        self._target = None
+        self._is_done = True
+
+
+class WaitingThread(WaitingObject):
+    """ Runs a function in a thread of its own and calls callback with its future, in the loop's thread, when it
+    returns. The thread wakes up the loop through a pipe, so that happens right away.
+    """
+    _callback: Callable[[Future], None] = None
+    _future: Future = None
+    _read_fd: int = None
+    _write_fd: int = None
+    _thread: threading.Thread = None
+
+    def __init__(self, function: Callable, callback: Callable[[Future], None], name=None):
+        super().__init__(name=name)
+        self._callback = callback
+        self._future = Future()
+        self._read_fd, self._write_fd = os.pipe()
+        # Not a daemon: work like a backup should rather delay the exit than stop halfway
+        self._thread = threading.Thread(target=self._run, args=(function,), name=name)
+        self._thread.start()
+
+    def _run(self, function: Callable) -> None:
+        try:
+            self._future.set_result(function())
+        except BaseException as e:
+            self._future.set_exception(e)
+        finally:
+            os.write(self._write_fd, b'\0')
+
+    def fileno(self) -> int:
+        return self._read_fd
+
+    def future(self) -> Future:
+        return self._future
+
+    def is_waiting_to_receive(self) -> bool:
+        return not self._is_done
+
+    def do_receive(self) -> None:
+        self._is_done = True
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+        self._callback(self._future)
@@ -1,4 +1,3 @@
-from asyncio import sleep
 import logging
 import subprocess
 from typing import Callable
@@ -8,6 +7,7 @@ from minecraft.serverwrapper.serverloop.objects import (
     RepeatedCallback,
     neutral_callback,
 )
+from minecraft.serverwrapper.serverloop.recording import STDERR, STDOUT, StreamRecorder
 from minecraft.serverwrapper.serverloop.serverloop import ServerLoop, get_server_loop, run_server_loop
 
 logger = logging.getLogger(__name__)
@@ -23,6 +23,8 @@ class Process:
     _wo_stdout: LineInputBuffer = None
     _wo_stderr: LineInputBuffer = None
     _wo_check_alive: RepeatedCallback = None
+    # Records stdout and stderr, owned (and closed) by the caller
+    _recorder: StreamRecorder = None
 
     stdout_callback: Callable[[str], None] = neutral_callback
     stderr_callback: Callable[[str], None] = neutral_callback
@@ -37,6 +39,7 @@ class Process:
         stdout_callback: Callable[[str], None] = None,
         stderr_callback: Callable[[str], None] = None,
         exit_callback: Callable[[int], None] = None,
+        recorder: StreamRecorder = None,
     ):
         self._serverloop = serverloop or get_server_loop()
         self._name = name or commandline[0]
@@ -45,6 +48,7 @@ class Process:
         self.stdout_callback = stdout_callback or self.stdout_callback
         self.stderr_callback = stderr_callback or self.stderr_callback
         self.exit_callback = exit_callback or self.exit_callback
+        self._recorder = recorder
         self._async_enter()
 
     def _async_enter(self):
@@ -66,6 +70,7 @@ class Process:
                 self._subprocess.stdout,
                 lambda line: self._stdout_callback(line),
                 name=self._name + "-stdout",
+                chunk_callback=self._record_callback(STDOUT),
             )
         )
         self._wo_stderr = sl.add_waiting_object(
@@ -73,6 +78,7 @@ class Process:
                 self._subprocess.stderr,
                 lambda line: self._stderr_callback(line),
                 name=self._name + "-stderr",
+                chunk_callback=self._record_callback(STDERR),
             )
         )
         self._wo_check_alive = sl.call_repeatedly(
@@ -113,6 +119,11 @@ class Process:
         # Process is alive, call again next time
         return True
 
+    def _record_callback(self, stream: int) -> Callable[[str], None] or None:
+        if self._recorder is None:
+            return None
+        return lambda data: self._recorder.record(stream, data)
+
     def _stdout_callback(self, line):
         self.stdout_callback(line)
 
@@ -142,8 +153,16 @@ class Process:
         # _check_alive and _async_exit will handle the rest
 
     def term_kill(self, seconds=5.0) -> None:
-        self._minecraft.terminate()
-        self._serverloop.call_after(seconds, self.kill)
+        if not self.is_running():
+            return
+        self._subprocess.terminate()
+        self._serverloop.call_after(seconds, lambda: self.is_running() and self.kill())
+
+    def is_running(self) -> bool:
+        return self._subprocess.poll() is None
+
+    def pid(self) -> int:
+        return self._subprocess.pid
 
     def returncode(self) -> int:
         return self._subprocess.returncode
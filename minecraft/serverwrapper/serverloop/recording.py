@@ -0,0 +1,196 @@
+""" Recording of a process' output streams, and replaying it into line buffers
+
+A recording keeps every chunk as it was read from the pipe, with the time it arrived, so a replay hands the
+line buffers exactly the same reads in the same order. The file starts with MAGIC and the wall clock time the
+recording started (a little-endian double), followed by one record per chunk: the stream (1 = stdout,
+2 = stderr), the microseconds since the previous record and the length of the UTF-8 data as varints, then
+the data.
+"""
+import gzip
+import logging
+import struct
+import time
+from typing import BinaryIO, Callable, Iterable, Iterator, NamedTuple
+
+from minecraft.serverwrapper.serverloop.objects import WaitingObject, neutral_callback
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MCSWREC\x01'
+STDOUT = 1
+STDERR = 2
+STREAM_NAMES = {STDOUT: 'stdout', STDERR: 'stderr'}
+
+
+def encode_varint(value: int) -> bytes:
+    result = bytearray()
+    while value >= 0x80:
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def read_varint(f: BinaryIO) -> int or None:
+    """ Returns None at the end of the file
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = f.read(1)
+        if not byte:
+            if shift > 0:
+                raise MinecraftServerWrapperException('Recording ends in the middle of a record.')
+            return None
+        value |= (byte[0] & 0x7f) << shift
+        if byte[0] < 0x80:
+            return value
+        shift += 7
+
+
+def open_recording(path: str, mode: str) -> BinaryIO:
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+class RecordedChunk(NamedTuple):
+    # Seconds since the start of the recording
+    offset: float
+    stream: int
+    data: str
+
+
+class StreamRecorder:
+    """ Writes chunks of a process' output to a recording, compressed if the path ends with .gz
+    """
+    _path: str = None
+    _file: BinaryIO = None
+    _started_ns: int = None
+    _last_offset_us: int = 0
+    _chunks: int = 0
+
+    def __init__(self, path: str):
+        self._path = path
+        self._file = open_recording(path, 'wb')
+        self._file.write(MAGIC + struct.pack('<d', time.time()))
+        self._started_ns = time.monotonic_ns()
+
+    def record(self, stream: int, data: str, offset_ns: int = None) -> None:
+        """ offset_ns is the time since the start of the recording, by default now. Pass it to write made-up
+        traffic.
+        """
+        if self._file is None:
+            return
+        if offset_ns is None:
+            offset_ns = time.monotonic_ns() - self._started_ns
+        offset_us = max(self._last_offset_us, offset_ns // 1000)
+        encoded = data.encode('utf-8', errors='surrogateescape')
+        self._file.write(bytes([stream]) + encode_varint(offset_us - self._last_offset_us)
+            + encode_varint(len(encoded)) + encoded)
+        self._last_offset_us = offset_us
+        self._chunks += 1
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.info(f'Recorded {self._chunks:d} chunks of output to {self._path}')
+
+    def path(self) -> str:
+        return self._path
+
+
+def recording_start_time(path: str) -> float:
+    with open_recording(path, 'rb') as f:
+        return _read_header(f)
+
+
+def _read_header(f: BinaryIO) -> float:
+    header = f.read(len(MAGIC) + 8)
+    if len(header) < len(MAGIC) + 8 or header[:len(MAGIC)] != MAGIC:
+        raise MinecraftServerWrapperException('Not a recording of server output.')
+    return struct.unpack('<d', header[len(MAGIC):])[0]
+
+
+def read_recording(path: str) -> Iterator[RecordedChunk]:
+    with open_recording(path, 'rb') as f:
+        _read_header(f)
+        offset_us = 0
+        while True:
+            stream = f.read(1)
+            if not stream:
+                return
+            delay_us = read_varint(f)
+            length = read_varint(f)
+            if delay_us is None or length is None:
+                raise MinecraftServerWrapperException('Recording ends in the middle of a record.')
+            data = f.read(length)
+            if len(data) < length:
+                raise MinecraftServerWrapperException('Recording ends in the middle of a record.')
+            offset_us += delay_us
+            yield RecordedChunk(offset_us / 1e6, stream[0], data.decode('utf-8', errors='surrogateescape'))
+
+
+def feed_recording(chunks: Iterable[RecordedChunk], targets: dict[int, Callable[[str], None]]) -> int:
+    """ Replays at maximum speed, without a server loop. Returns the number of chunks.
+    """
+    count = 0
+    for chunk in chunks:
+        targets.get(chunk.stream, neutral_callback)(chunk.data)
+        count += 1
+    return count
+
+
+class Replay(WaitingObject):
+    """ Replays a recording on the server loop with the recorded timing, sped up by speed. Chunks are fed to
+    the target of their stream (e.g. LineInputBuffer.feed), in order and unchanged, so a replay always sees
+    the same lines. Like any timer on the loop, chunks that are due within 0.1 seconds are fed together.
+    """
+    _chunks: Iterator[RecordedChunk] = None
+    _next: RecordedChunk = None
+    _targets: dict[int, Callable[[str], None]] = None
+    _speed: float = 1.0
+    _started: float = None
+    _done_callback: Callable[[], None] = None
+    # Largest delay of a chunk behind its (sped up) time, in seconds
+    max_lag: float = 0.0
+    chunks: int = 0
+
+    def __init__(self, chunks: Iterable[RecordedChunk], targets: dict[int, Callable[[str], None]], speed: float = 1.0,
+            done_callback: Callable[[], None] = None, name=None):
+        super().__init__(name=name or 'replay')
+        if speed <= 0:
+            raise MinecraftServerWrapperException('Replay speed must be positive.')
+        self._chunks = iter(chunks)
+        self._next = next(self._chunks, None)
+        self._targets = targets
+        self._speed = speed
+        self._started = time.time()
+        self._done_callback = done_callback or neutral_callback
+        if self._next is None:
+            self._is_done = True
+
+    def _due(self, chunk: RecordedChunk) -> float:
+        return self._started + chunk.offset / self._speed
+
+    def is_waiting_for_timeout(self) -> float or bool:
+        if self._next is None:
+            return False
+        return self._due(self._next)
+
+    def do_timeout(self) -> None:
+        now = time.time()
+        while self._next is not None and self._due(self._next) <= now:
+            self.max_lag = max(self.max_lag, now - self._due(self._next))
+            self._targets.get(self._next.stream, neutral_callback)(self._next.data)
+            self.chunks += 1
+            self._next = next(self._chunks, None)
+        if self._next is None and not self._is_done:
+            self._is_done = True
+            self._done_callback()
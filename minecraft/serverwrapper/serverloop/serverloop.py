@@ -1,4 +1,5 @@
 
+import bisect
 import logging
 import select
 import threading
@@ -6,10 +7,33 @@ import time
 import traceback
 from typing import Callable, TypeVar
 
-from minecraft.serverwrapper.serverloop.objects import RepeatedCallback, WaitingObject, WaitingOnetimeCallback
+from minecraft.serverwrapper.serverloop.objects import RepeatedCallback, WaitingObject, WaitingOnetimeCallback, WaitingThread
 
 logger = logging.getLogger(__name__)
 
+# What select() would report as readable, writable and exceptional (see fs/select.c in linux)
+POLL_RECEIVE = select.POLLIN | select.POLLHUP | select.POLLERR
+POLL_SEND = select.POLLOUT | select.POLLERR
+POLL_EXCEPTION = select.POLLPRI
+
+
+class LoopStats:
+    """ How long the loop's iterations take, without the wait for I/O: how late any event gets handled
+    """
+    # Upper bounds of the histogram buckets, in seconds
+    BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.5, 2.5)
+    bucket_counts: list[int] = None
+    iterations: int = 0
+    busy_seconds: float = 0.0
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(self.BUCKETS) + 1)
+
+    def add(self, seconds: float) -> None:
+        self.bucket_counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.iterations += 1
+        self.busy_seconds += seconds
+
 
 class ServerLoop:
 
@@ -17,15 +41,18 @@ class ServerLoop:
     _running: bool = False
     _current_tick: float = None
     _last_tick: float = None
-    _waiting_objects: list[WaitingObject] = []
-    _callbacks: dict[str, list[Callable]] = {
-        'on_idle_timeout': [],
-        'on_keyboard_interrupt': [],
-        'on_shutdown': []
-    }
+    _waiting_objects: list[WaitingObject] = None
+    _callbacks: dict[str, list[Callable]] = None
+    stats: LoopStats = None
 
     def __init__(self):
-        pass
+        self.stats = LoopStats()
+        self._waiting_objects = []
+        self._callbacks = {
+            'on_idle_timeout': [],
+            'on_keyboard_interrupt': [],
+            'on_shutdown': []
+        }
 
     def run(self) -> None:
         self.main_loop()
@@ -62,6 +89,9 @@ class ServerLoop:
     def call_repeatedly(self, interval, callback, name=None) -> WaitingObject:
         return self.add_waiting_object(RepeatedCallback(callback, interval, name=name))
 
+    def call_in_thread(self, function, callback, name=None) -> WaitingThread:
+        return self.add_waiting_object(WaitingThread(function, callback, name=name))
+
     def call_on_idle_timeout(self, callback, name=None):
         # FIXME: Add name to callback
         self._callbacks['on_idle_timeout'].append(callback)
@@ -112,6 +142,33 @@ class ServerLoop:
 
         return total, waiting_r, waiting_w, waiting_x, min_timestamp
 
+    def wait_for_io(self, waiting_r: list, waiting_w: list, waiting_x: list, timeout: float) \
+            -> tuple[list, list, list, list]:
+        """ Like select.select(), but with poll(), which has no limit on the descriptor numbers (select() fails
+        with descriptors from 1024 on). Also returns the objects whose descriptor was closed under them.
+        """
+        fds = {}
+        events = {}
+        for waiting_list, mask in ((waiting_r, select.POLLIN), (waiting_w, select.POLLOUT), (waiting_x, select.POLLPRI)):
+            for waiting_object in waiting_list:
+                fd = fds[waiting_object] = waiting_object.fileno()
+                events[fd] = events.get(fd, 0) | mask
+        poller = select.poll()
+        for fd, mask in events.items():
+            # A closed socket says -1
+            if fd >= 0:
+                poller.register(fd, mask)
+        ready = poller.poll(timeout * 1000)
+        if not ready and -1 not in events:
+            return [], [], [], []
+        revents = dict(ready)
+        # Only POLLNVAL is set for these, so they are in none of the other lists
+        closed = [o for o, fd in fds.items() if fd < 0 or revents.get(fd, 0) & select.POLLNVAL]
+        r = [o for o in waiting_r if revents.get(fds[o], 0) & POLL_RECEIVE]
+        w = [o for o in waiting_w if revents.get(fds[o], 0) & POLL_SEND]
+        x = [o for o in waiting_x if revents.get(fds[o], 0) & POLL_EXCEPTION]
+        return r, w, x, closed
+
     def prune_waiting_list(self) -> None:
         # Remove all waiting objects that are done
         to_process = self._waiting_objects[:]
@@ -151,9 +208,18 @@ class ServerLoop:
                 else:
                     rel_timeout = min(max(0.1, min_timestamp - time.time()), self._idle_timeout)
 
-                # Run select
-                r, w, x = select.select(waiting_r, waiting_w, waiting_x, rel_timeout)
+                # Wait for I/O
+                try:
+                    r, w, x, closed = self.wait_for_io(waiting_r, waiting_w, waiting_x, rel_timeout)
+                except (OSError, ValueError) as e:
+                    # Rather than ending the loop, and the wrapper with it
+                    logger.error(f'Waiting for I/O failed: {e}')
+                    time.sleep(0.1)
+                    continue
                 self._current_tick = time.time()
+                for waiting_object in closed:
+                    logger.error(f'{waiting_object} waits on a closed file descriptor, removing it.')
+                    self.remove_maybe_waiting_object(waiting_object)
 
                 # Handle timeouts
                 count_timeouts = self.handle_timeouts()
@@ -182,6 +248,7 @@ class ServerLoop:
                 # Prune waiting list
                 self.prune_waiting_list()
 
+                self.stats.add(time.time() - self._current_tick)
                 self._last_tick = self._current_tick
                 self._current_tick = None
 
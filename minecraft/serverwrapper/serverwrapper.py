@@ -1,19 +1,49 @@
 
+from concurrent.futures import Future
 import logging
+import math
 from pathlib import Path
+import secrets
+import signal
 import sys
 import os
 import shutil
+import time
 from time import sleep
+from typing import Callable
 from minecraft.serverwrapper import util
+from minecraft.serverwrapper.backup.job import BackupJob, BackupResult
+from minecraft.serverwrapper.backup.repository import BackupRepository, RetentionPolicy
 from minecraft.serverwrapper.broadcaster import MinecraftServerInfo, MinecraftServerLANBroadcaster
-from minecraft.serverwrapper.config import ConfigDict
-from minecraft.serverwrapper.logparser import MinecraftLogParser, MinecraftServerStartMessage
-from minecraft.serverwrapper.serverloop.buffers import LineInputBuffer, OutputBuffer
+from minecraft.serverwrapper.config import ConfigDict, ConfigSection, compile_config, load_config, working_directory
+from minecraft.serverwrapper.configwatch import ConfigChange, ConfigWatcher, diff_config, match_rule, with_values
+from minecraft.serverwrapper.control import ControlConnection, ControlServer, socket_path
+from minecraft.serverwrapper.frontend.frontend import GamePortFrontend
+from minecraft.serverwrapper.frontend.status import StatusCache, StatusQuery
+from minecraft.serverwrapper.jvm.cds import ClassDataSharing
+from minecraft.serverwrapper.jvm.gclog import MIN_UNIFIED_LOGGING_JAVA, GCLogTailer, GCStats, gc_log_args
+from minecraft.serverwrapper.jvm.tuning import TuningProfile, detect_host_resources, detect_java_version, select_profile
+from minecraft.serverwrapper.rcon import RconClient, RconError
+from minecraft.serverwrapper.logparser import MinecraftLogParser, MinecraftPlayerJoinMessage, MinecraftPlayerLeaveMessage, \
+    MinecraftPlayerUUIDMessage, MinecraftServerDoneMessage, MinecraftServerLagMessage, MinecraftServerStartMessage
+from minecraft.serverwrapper.metrics import MetricsServer, WrapperMetrics
+from minecraft.serverwrapper.prewarm import Prewarmer
+from minecraft.serverwrapper.profiler import ProfileSession
+from minecraft.serverwrapper.serverloop.buffers import ConsoleBuffer, LineInputBuffer, OutputBuffer
 from minecraft.serverwrapper.serverloop.process import Process
+from minecraft.serverwrapper.serverloop.recording import StreamRecorder
+from minecraft.serverwrapper.serverloop.objects import WaitingOnetimeCallback
 from minecraft.serverwrapper.serverloop.serverloop import RepeatedCallback, ServerLoop
-from minecraft.serverwrapper.util.archive import copy_mod_from_zip, deepsearch_for_mods_dir
+from minecraft.serverwrapper.startuptimes import StartupTimes
+from minecraft.serverwrapper.statusfile import LagTracker, StatusFile, StatusRecord, process_cpu_seconds, process_rss_bytes, \
+    status_file_path
+from minecraft.serverwrapper.util.archive import deepsearch_for_mods_dir
+from minecraft.serverwrapper.util.download import Artifact, Downloader, default_cache_dir
 from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+from minecraft.serverwrapper.util.logging import ConsoleLogHandler, console_stream
+from minecraft.serverwrapper.util.mods import has_staged_mods, rollback_mods, stage_mods, swap_in_staged_mods
+from minecraft.serverwrapper.util.properties import read_properties, update_properties
+from minecraft.serverwrapper.world.analyze import world_directory
 
 logger = logging.getLogger(__name__)
 
@@ -28,54 +58,118 @@ def fabric_server_jar_name(minecraft_version, loader_version, launcher_version):
     return f'fabric-server-mc.{minecraft_version}-loader.{loader_version}-launcher.{launcher_version}.jar'
 
 
-def java_args_for_memory(memory_mibs: int) -> list[str]:
-    # See https://www.oracle.com/java/technologies/javase/vmoptions-jsp.html
-    memory_mibs = int(memory_mibs)
-    smaller_memory_mibs = memory_mibs >> 4
-    # if smaller_memory_mibs < 128:
-    #     smaller_memory_mibs = 128
-    return \
-        [   f'-Xms{memory_mibs}m'
-        ,   f'-Xmx{memory_mibs}m'
-        ,   f'-Xmn{smaller_memory_mibs}m'
-        ,   '-XX:+UnlockExperimentalVMOptions'
-        ,   '-XX:+DisableExplicitGC'
-        ,   '-XX:+UseG1GC'
-        ,   '-XX:G1NewSizePercent=20'
-        ,   '-XX:G1ReservePercent=20'
-        ,   '-XX:MaxGCPauseMillis=50'
-        ,   '-XX:G1HeapRegionSize=16M'
-        # ,   '-Xnoclassgc'                 # I really don't recommend using this
-        ]
+# How changes to minecraft.yaml are applied while the wrapper runs, by the longest matching key: RELOAD_LIVE
+# settings are read whenever they are used, RELOAD_AT_SERVER_START ones when the server (re)starts, other rules
+# name the method that applies the change. Anything else needs a restart of the wrapper.
+RELOAD_LIVE = 'live'
+RELOAD_AT_SERVER_START = 'server-start'
+RELOAD_RULES = {
+    'minecraft.server.name': 'reload_server_name',
+    'minecraft.server.broadcast-to-lan': 'reload_lan_broadcast',
+    'minecraft.server.lan-broadcast': 'reload_lan_broadcast',
+    'wrapper.java-args': RELOAD_AT_SERVER_START,
+    'wrapper.gc-log': RELOAD_AT_SERVER_START,
+    'wrapper.record-output': RELOAD_AT_SERVER_START,
+    'wrapper.prewarm': RELOAD_AT_SERVER_START,
+    'wrapper.download': RELOAD_LIVE,
+    'wrapper.backup': RELOAD_LIVE,
+    'wrapper.backup.interval-minutes': 'reload_backup_schedule',
+    'wrapper.world-prune': RELOAD_LIVE,
+    'wrapper.frontend.motd-starting': 'reload_motd',
+    'wrapper.frontend.motd-stopped': 'reload_motd',
+    'wrapper.frontend.status-query-interval-seconds': 'reload_status_query',
+    'wrapper.frontend.max-relays': 'reload_max_relays',
+    'wrapper.hibernation.idle-timeout-seconds': RELOAD_LIVE,
+    'wrapper.hibernation.max-hold-seconds': RELOAD_LIVE,
+    'wrapper.hibernation.motd-sleeping': 'reload_motd',
+    'wrapper.rcon.enabled': RELOAD_AT_SERVER_START,
+    'wrapper.rcon.host': RELOAD_AT_SERVER_START,
+    'wrapper.rcon.max-in-flight': RELOAD_AT_SERVER_START,
+}
 
 
 class MinecraftServerWrapper:
     _config: ConfigDict = None
+    # Validated, read-only snapshot of _config, read on the hot paths
+    _settings: ConfigSection = None
+    # minecraft.yaml, if the configuration came from there (and can be reloaded)
+    _config_path: str = None
+    _wo_config_watch: ConfigWatcher = None
+    # Reloaded settings that are used from the next server start on, and ones that need a restart of the wrapper
+    _pending_server_start: set[str] = None
+    _pending_restart: list[ConfigChange] = None
     _serverloop: ServerLoop = None
     _working_dir: str = None
     _current_jar_path: str = None
     _minecraft: Process = None
+    # Recording of the server's output (wrapper.record-output), kept open after the server stops for late output
+    _recorder: StreamRecorder = None
     _wo_tick: RepeatedCallback = None
     _wo_terminal_stdin: OutputBuffer = None
+    # Terminal log output while the loop runs, in place of the logging handler that wrote to it directly
+    _console: ConsoleBuffer = None
     _lan_broadcaster: MinecraftServerLANBroadcaster = None
     _server_info = None
     _logparser: MinecraftLogParser = None
+    # True while a freshly swapped-in mod set has not yet booted successfully
+    _mods_swap_unconfirmed: bool = False
+    # Startup features (like "app-cds") active for the current server run, recorded with its startup time
+    _startup_features: dict[str, bool] = None
+    _gc_stats: GCStats = None
+    _wo_gc_log: GCLogTailer = None
+    # Online players (name -> uuid or None), from the server log
+    _players: dict[str, str] = None
+    _player_uuids: dict[str, str] = None
+    _frontend: GamePortFrontend = None
+    _status_cache: StatusCache = None
+    _wo_status_query: StatusQuery = None
+    _wo_status_query_timer: RepeatedCallback = None
+    _rcon: RconClient = None
+    _control: ControlServer = None
+    # Set when the wrapper itself is shutting down, as opposed to the server going to sleep
+    _shutting_down: bool = False
+    # Set by hibernate() until the server has stopped
+    _hibernating: bool = False
+    # Since when the running server has had no players (for hibernation)
+    _empty_since: float = None
+    _server_ready: bool = False
+    _server_started_at: float = None
+    _lag: LagTracker = None
+    _max_players: int = 0
+    _status_file: StatusFile = None
+    # Running profile of the wrapper itself (wrapper.profiling), and the timer that ends it
+    _profile: ProfileSession = None
+    _wo_profile_timer: WaitingOnetimeCallback = None
+    # Only set if wrapper.metrics is enabled
+    _metrics: WrapperMetrics = None
+    # Running backup, the callbacks waiting for it to finish, and the timer of wrapper.backup.interval-minutes
+    _backup: BackupJob = None
+    _backup_waiters: list = None
+    _wo_backup_timer: RepeatedCallback = None
+    # Set when players want the server while a backup copies the world of the stopped server
+    _wake_after_staging: bool = False
 
     def __init__(self, config: ConfigDict = None):
-        if config is None:
-            # Check if file exists
-            if os.path.exists('minecraft.yaml'):
-                config = ConfigDict.load_from_yaml_file("minecraft.yaml")
-        self._config = ConfigDict.default_config() | (config or {})
-        self._working_dir = self._config['wrapper']['working-directory'] or os.getcwd() + '/.minecraft-server'
-        self._java_executable_path = self._config['wrapper']['java-executable-path']
+        if config is None and os.path.exists('minecraft.yaml'):
+            self._config_path = os.path.abspath('minecraft.yaml')
+        self._config = load_config(config)
+        self._settings = compile_config(self._config)
+        self._pending_server_start = set()
+        self._pending_restart = []
+        self._working_dir = working_directory(self._config)
+        self._java_executable_path = self._settings.wrapper.java_executable_path
         if self._java_executable_path is None:
             self._java_executable_path = shutil.which('java')
         if not os.path.exists(self._java_executable_path):
             raise MinecraftServerWrapperException('Java executable not found.')
-        if self._config['minecraft']['server']['broadcast-to-lan']:
-            self._lan_broadcaster = MinecraftServerLANBroadcaster()
+        self._lan_broadcaster = self.create_lan_broadcaster()
+        if self._settings.wrapper.hibernation.enabled and not self._settings.wrapper.frontend.enabled:
+            raise MinecraftServerWrapperException('Hibernation needs the frontend (wrapper.frontend.enabled).')
         self._logparser = MinecraftLogParser(self.handle_minecraft_log_message)
+        self._players = {}
+        self._player_uuids = {}
+        self._lag = LagTracker()
+        self._backup_waiters = []
 
     def start(self):
         logger.info('Starting Minecraft server wrapper...')
@@ -83,15 +177,73 @@ class MinecraftServerWrapper:
         self.sync_instance()
 
         sl = self._serverloop = ServerLoop()
+        self.start_console()
         self._wo_terminal_stdin = sl.add_waiting_object(LineInputBuffer(sys.stdin, self.handle_terminal_input, name='terminal'))
         self._wo_tick = sl.call_repeatedly(1.0, self.tick, name='tick')
         sl.call_on_keyboard_interrupt(self.stop_minecraft_server, name='keyboard-interrupt')
-
-        sl.call_after(1.0, self.start_minecraft_server)
+        self.start_control()
+        self.start_metrics()
+        self._status_file = StatusFile(self.status_file_path())
+        self.update_status_file()
+        sl.call_repeatedly(1.0, self.update_status_file, name='status-file')
+        sl.call_on_shutdown(lambda: self._status_file.close(self.status_record()), name='close-status-file')
+        sl.call_on_shutdown(self.stop_recorder, name='close-recorder')
         if self._lan_broadcaster is not None:
             sl.add_waiting_object(self._lan_broadcaster)
+        self.start_frontend()
+        self.start_config_watch()
+        if self._settings.wrapper.profiling.signal:
+            signal.signal(signal.SIGUSR1, self.handle_profile_signal)
+        sl.call_on_shutdown(self.stop_profiling, name='stop-profiling')
+        self.reload_backup_schedule()
+        sl.call_on_shutdown(self.abandon_backup, name='abandon-backup')
+
+        if self.hibernation_enabled():
+            logger.info('Hibernation enabled, the server will be started when a player connects.')
+        else:
+            sl.call_after(1.0, self.start_minecraft_server)
         sl.run()
 
+    def start_console(self):
+        """ Moves terminal logging onto the loop, so a slow terminal (or SSH session) can't hold up the loop and,
+        through the stdout pipe, the server
+        """
+        root_logger = logging.getLogger()
+        for handler in root_logger.handlers:
+            stream = console_stream(handler)
+            if stream is None:
+                continue
+            try:
+                console = ConsoleBuffer(stream)
+            except OSError as e:
+                logger.warning(f'Logging to the terminal directly: {e}')
+                return
+            self._console = self._serverloop.add_waiting_object(console)
+            replacement = ConsoleLogHandler(console, handler.level, strip_styles=not stream.isatty())
+            replacement.setFormatter(handler.formatter)
+            root_logger.removeHandler(handler)
+            root_logger.addHandler(replacement)
+
+            def stop_console():
+                root_logger.removeHandler(replacement)
+                root_logger.addHandler(handler)
+                if not console.drain(2.0):
+                    logger.warning('Terminal not keeping up, discarded the last lines of output.')
+                console.close()
+            self._serverloop.call_on_shutdown(stop_console, name='stop-console')
+            return
+
+    def create_lan_broadcaster(self) -> MinecraftServerLANBroadcaster or None:
+        if not self._settings.minecraft.server.broadcast_to_lan:
+            return None
+        lan_config = self._settings.minecraft.server.lan_broadcast
+        return MinecraftServerLANBroadcaster(
+            interval=lan_config.interval_seconds,
+            interfaces=lan_config.interfaces,
+            modes=lan_config.modes,
+            ttl=lan_config.ttl,
+        )
+
     def create_working_dir(self):
         if not os.path.exists(self._working_dir):
             logger.info('Creating working directory: {:s}'.format(self._working_dir))
@@ -101,19 +253,41 @@ class MinecraftServerWrapper:
 
     def sync_instance(self):
         self.sync_config()
-        if self._config['minecraft']['modpack']['auto-load']:
-            self.sync_modpack()
-        self.download_launcher()
+        auto_load = self._settings.minecraft.modpack.auto_load
+        # Fetch launcher and mods in one go, so they are downloaded in parallel
+        self.download_artifacts([self.launcher_artifact()] + (self.mod_artifacts() if auto_load else []))
+        if auto_load:
+            self.sync_modpack(download=False)
 
     def sync_config(self):
-        if self._config['wrapper']['auto-accept-eula']:
+        if self._settings.wrapper.auto_accept_eula:
             self.accept_eula()
         for filename in ["whitelist.json", "ops.json"]:
             if os.path.exists(filename):
                 logger.info(f"Installing link to global {filename}")
                 dest = self._working_dir + "/" + filename
                 util.symlink(filename, self._working_dir, overwrite=True)
-        # TODO: Set stuff in server.properties (like pvp=false)
+        if self._settings.wrapper.frontend.enabled:
+            # The server moves to the backend address, the frontend takes its place
+            backend_host, backend_port = self.backend_address()
+            update_properties(self._working_dir + '/server.properties', {
+                'server-ip': backend_host,
+                'server-port': str(backend_port),
+            })
+        if self._settings.wrapper.rcon.auto_configure:
+            self.configure_rcon()
+        # TODO: Set more stuff in server.properties (like pvp=false)
+
+    def configure_rcon(self):
+        """ Enables RCON in server.properties, with a random password unless one is set already
+        """
+        path = self._working_dir + '/server.properties'
+        properties = read_properties(path)
+        update_properties(path, {
+            'enable-rcon': 'true',
+            'rcon.port': properties.get('rcon.port') or '25575',
+            'rcon.password': properties.get('rcon.password') or secrets.token_urlsafe(24),
+        })
 
     def accept_eula(self):
         # Replace "eula=false" with "eula=true" in eula.txt
@@ -131,83 +305,745 @@ class MinecraftServerWrapper:
             with open(self._working_dir + '/eula.txt', 'w') as f:
                 f.write('eula=true\n')
 
-    def sync_modpack(self):
+    def sync_modpack(self, download=True):
+        """ Stages the modpack's mods, they are swapped in at the next server start
+        Safe to run while the server is running.
+        """
+        modpack_mods = {}
         modpack_mod_dir = deepsearch_for_mods_dir(".")
-        if modpack_mod_dir is None:
-            logger.info('No mods directory or modpack zip found, not syncing mods.')
+        if modpack_mod_dir is not None:
+            logger.info('Syncing mods from {:s}'.format(str(modpack_mod_dir)))
+            modpack_mods.update({x.name: x for x in modpack_mod_dir.iterdir() if x.is_file()})
+        mod_artifacts = self.mod_artifacts()
+        if len(mod_artifacts) > 0:
+            if download:
+                self.download_artifacts(mod_artifacts)
+            logger.info('Syncing {:d} downloaded mods'.format(len(mod_artifacts)))
+            modpack_mods.update({artifact.dest.name: artifact.dest for artifact in mod_artifacts})
+        if modpack_mod_dir is None and len(mod_artifacts) == 0:
+            logger.info('No mods directory, modpack zip or mod URLs found, not syncing mods.')
             return
-        logger.info('Syncing mods from {:s}'.format(str(modpack_mod_dir)))
         mod_dir = Path(self._working_dir) / 'mods'
-        if not mod_dir.exists():
-            logger.info('Creating mods directory: {:s}'.format(str(mod_dir)))
-            os.mkdir(mod_dir)
-        if not mod_dir.is_dir():
+        if mod_dir.exists() and not mod_dir.is_dir():
             raise MinecraftServerWrapperException('"mods" is not a directory.')
 
-        current_mods = [x.name for x in mod_dir.iterdir() if x.is_file()]
-        logger.debug('Current mods:\n    {:s}'.format('\n    '.join(current_mods)))
-        modpack_mods = [x.name for x in modpack_mod_dir.iterdir() if x.is_file()]
         logger.debug('Modpack mods:\n    {:s}'.format('\n    '.join(modpack_mods)))
-        for current_mod in current_mods:
-            if current_mod in modpack_mods:
-                continue
-            logger.info('Removing mod {:s}...'.format(current_mod))
-            # Remove jar file
-            # shutil.rmtree(mod_dir / current_mod)
-            os.remove(mod_dir / current_mod)
-        for modpack_mod in modpack_mods:
-            if modpack_mod in current_mods:
-                continue
-            logger.info('Copying mod {:s}...'.format(modpack_mod))
-            copy_mod_from_zip(modpack_mod_dir / modpack_mod, mod_dir)
-        logger.info('Done syncing mods.')
+        if stage_mods(modpack_mods, self._working_dir):
+            logger.info('Done syncing mods, new mod set will be used at the next server start.')
+        else:
+            logger.info('Done syncing mods, mods are up to date.')
 
-    def download_launcher(self):
-        minecraft_version = self._config['minecraft']['version']
-        fabric_loader_version = self._config['minecraft']['fabric']['loader-version']
-        fabric_launcher_version = self._config['minecraft']['fabric']['launcher-version']
-        if self._current_jar_path is None:
-            self._current_jar_path = self._working_dir + '/' + fabric_server_jar_name(minecraft_version, fabric_loader_version, fabric_launcher_version)
-        if os.path.exists(self._current_jar_path):
-            logger.info('Launcher jar already exists, skipping download.')
+    def swap_staged_mods(self):
+        if not has_staged_mods(self._working_dir):
+            return
+        logger.info('Swapping in staged mod set...')
+        self._mods_swap_unconfirmed = swap_in_staged_mods(self._working_dir)
+        if self._mods_swap_unconfirmed:
+            ClassDataSharing(self._working_dir).invalidate()
+
+    def rollback_mods(self):
+        if rollback_mods(self._working_dir):
+            logger.warning('Rolled back to the previous mod set.')
         else:
-            logger.info('Downloading launcher jar...')
-            r = os.system(f'wget -O "{self._current_jar_path}" "{fabric_server_url(minecraft_version, fabric_loader_version, fabric_launcher_version)}"')
-            if r != 0:
-                raise MinecraftServerWrapperException(f'Failed to download launcher jar (wget returned non-zero exit code: {r}).')
-            # Check if download was successful
-            if not os.path.exists(self._current_jar_path):
-                raise MinecraftServerWrapperException(f'Failed to download launcher jar: File {self._current_jar_path} does not exist.')
+            logger.warning('No previous mod set to roll back to.')
+        self._mods_swap_unconfirmed = False
+
+    def downloader(self) -> Downloader:
+        download_config = self._settings.wrapper.download
+        return Downloader(
+            cache_dir=download_config.cache_directory or default_cache_dir(),
+            max_connections=download_config.max_connections,
+            retries=download_config.retries,
+            timeout=download_config.timeout_seconds,
+        )
+
+    def download_artifacts(self, artifacts: list[Artifact]) -> None:
+        with self.downloader() as downloader:
+            downloader.download_all(artifacts)
+
+    def launcher_artifact(self) -> Artifact:
+        minecraft_version = self._settings.minecraft.version
+        fabric_loader_version = self._settings.minecraft.fabric.loader_version
+        fabric_launcher_version = self._settings.minecraft.fabric.launcher_version
+        url = self._settings.minecraft.jar_url
+        if self._current_jar_path is None:
+            if url:
+                jar_name = Artifact.name_from_url(url)
+            else:
+                jar_name = fabric_server_jar_name(minecraft_version, fabric_loader_version, fabric_launcher_version)
+            self._current_jar_path = self._working_dir + '/' + jar_name
+        if not url:
+            url = fabric_server_url(minecraft_version, fabric_loader_version, fabric_launcher_version)
+        return Artifact(url, self._current_jar_path, sha256=self._settings.minecraft.jar_sha256)
+
+    def mod_artifacts(self) -> list[Artifact]:
+        # Downloaded mods are kept outside of "mods", which is managed by sync_modpack
+        download_dir = Path(self._working_dir) / '.downloads' / 'mods'
+        artifacts = []
+        for entry in self._settings.minecraft.modpack.urls or []:
+            if isinstance(entry, str):
+                entry = {'url': entry}
+            if 'url' not in entry:
+                raise MinecraftServerWrapperException(f'Mod entry without url: {entry}')
+            name = entry.get('name') or Artifact.name_from_url(entry['url'])
+            artifacts.append(Artifact(entry['url'], download_dir / name,
+                sha256=entry.get('sha256'), sha1=entry.get('sha1'), size=entry.get('size')))
+        return artifacts
+
+    def download_launcher(self):
+        logger.info('Downloading launcher jar...')
+        self.download_artifacts([self.launcher_artifact()])
+
+    def java_tuning(self) -> TuningProfile:
+        java_args_config = self._settings.wrapper.java_args
+        return select_profile(
+            java_args_config.optimize_for_memory_mibs,
+            detect_java_version(self._java_executable_path),
+            detect_host_resources(),
+            profile=java_args_config.profile,
+            max_gc_pause_millis=java_args_config.max_gc_pause_millis,
+            pre_touch=not self.hibernation_enabled(),
+        )
 
     def start_minecraft_server(self):
+        if self._minecraft is not None:
+            logger.warning('Minecraft server is already running.')
+            return
+        self._pending_server_start.clear()
+        if self._status_cache is not None:
+            self._status_cache.set_motd_override(self._settings.wrapper.frontend.motd_starting)
+        self.swap_staged_mods()
+        tuning = self.java_tuning()
+        logger.info(f'Using JVM tuning profile {tuning.name}:')
+        for reason in tuning.reasons:
+            logger.info('    {:s}'.format(reason))
+        self._startup_features = {}
+        self._startup_features['prewarm'] = self.start_prewarm()
+        cds_args = []
+        if self._settings.wrapper.java_args.app_cds:
+            cds = ClassDataSharing(self._working_dir, detect_java_version(self._java_executable_path))
+            cds_args, using_archive = cds.java_args(self._current_jar_path)
+            if cds.is_supported():
+                self._startup_features['app-cds'] = using_archive
+        gc_args = self.start_gc_log()
         # commandline = ['cat']
         commandline = [self._java_executable_path] \
-            + java_args_for_memory(int(self._config.wrapper['java-args']['optimize-for-memory-mibs'])) \
+            + tuning.java_args \
+            + cds_args \
+            + gc_args \
             + ['-jar', self._current_jar_path, 'nogui']
         logger.info('Starting Minecraft server with the following command line:')
         for arg in commandline:
             logger.info('    {:s}'.format(arg))
         self._minecraft = Process(
             commandline=commandline,
+            serverloop=self._serverloop,
             working_dir=self._working_dir,
             stdout_callback=self.handle_minecraft_server_output,
             stderr_callback=self.handle_minecraft_server_stderr,
             exit_callback=self.handle_minecraft_server_stop,
+            recorder=self.start_recorder(),
         )
+        self._server_started_at = time.time()
+        if self._metrics is not None:
+            self._metrics.starts.inc()
+            self._metrics.start_time.set(self._server_started_at)
+        self._max_players = int(read_properties(self._working_dir + '/server.properties').get('max-players') or 20)
+        self._lag.reset()
+        self.update_status_file()
+
+    def start_prewarm(self) -> bool:
+        prewarm_config = self._settings.wrapper.prewarm
+        if not prewarm_config.enabled:
+            return False
+        prewarmer = Prewarmer(self._working_dir, self._current_jar_path, self.world_directory(),
+            prewarm_config.max_mibs << 20, prewarm_config.radius_chunks, prewarm_config.max_players)
+        self._serverloop.call_in_thread(prewarmer.run, self.handle_prewarm_done, name='prewarm')
+        return True
+
+    def handle_prewarm_done(self, future: Future):
+        try:
+            logger.info(future.result().summary())
+        except (OSError, MinecraftServerWrapperException) as e:
+            logger.warning(f'Prewarming failed: {e}')
+
+    def start_recorder(self) -> StreamRecorder or None:
+        self.stop_recorder()
+        path = self._settings.wrapper.record_output
+        if not path:
+            return None
+        path = os.path.join(self._working_dir, time.strftime(path))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        logger.info(f'Recording server output to {path}')
+        self._recorder = StreamRecorder(path)
+        return self._recorder
+
+    def stop_recorder(self):
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+
+    def start_gc_log(self) -> list[str]:
+        gc_log_config = self._settings.wrapper.gc_log
+        if not gc_log_config.enabled:
+            return []
+        if detect_java_version(self._java_executable_path).major < MIN_UNIFIED_LOGGING_JAVA:
+            logger.info('GC log analysis needs JDK {:d} or later, disabled.'.format(MIN_UNIFIED_LOGGING_JAVA))
+            return []
+        os.makedirs(self._working_dir + '/logs', exist_ok=True)
+        if self._wo_gc_log is not None:
+            self._wo_gc_log.close()
+        self._gc_stats = GCStats()
+        self._wo_gc_log = self._serverloop.add_waiting_object(GCLogTailer(
+            self._working_dir + '/logs/gc.log',
+            self._gc_stats,
+            pause_target_ms=self._settings.wrapper.java_args.max_gc_pause_millis,
+            warn_interval=gc_log_config.warn_interval_seconds,
+        ))
+        # Relative to the server's working directory
+        return gc_log_args('logs/gc.log', gc_log_config.file_count, gc_log_config.file_size_mibs)
+
+    def backend_address(self) -> tuple[str, int]:
+        frontend_config = self._settings.wrapper.frontend
+        return frontend_config.backend_host, frontend_config.backend_port
+
+    def start_frontend(self):
+        frontend_config = self._settings.wrapper.frontend
+        if not frontend_config.enabled:
+            return
+        properties = read_properties(self._working_dir + '/server.properties')
+        self._status_cache = StatusCache(
+            version_name=self._settings.minecraft.version,
+            motd=properties.get('motd') or self._settings.minecraft.server.name,
+            max_players=int(properties.get('max-players') or 20),
+            path=Path(self._working_dir) / '.status-cache.json',
+        )
+        if self.hibernation_enabled():
+            self._status_cache.set_motd_override(self._settings.wrapper.hibernation.motd_sleeping)
+        else:
+            self._status_cache.set_motd_override(frontend_config.motd_starting)
+        self._frontend = self._serverloop.add_waiting_object(GamePortFrontend(
+            self._serverloop,
+            (frontend_config.host or '', frontend_config.port),
+            self.backend_address(),
+            self._status_cache,
+            proxy_protocol=frontend_config.proxy_protocol,
+        ))
+        self._frontend.max_relays = frontend_config.max_relays
+        if self.hibernation_enabled():
+            self._frontend.login_handler = self.handle_login_while_unavailable
+        # The frontend answers for the server even while it's down, so announce it all the time
+        self._server_info = MinecraftServerInfo(self._settings.minecraft.server.name, frontend_config.port)
+        if self._lan_broadcaster is not None:
+            self._lan_broadcaster.add_server(self._server_info)
+        self._wo_status_query_timer = self._serverloop.call_repeatedly(frontend_config.status_query_interval_seconds,
+            self.query_status, name='status-query')
+
+    def query_status(self):
+        """ Refreshes the cached status from the server, players are kept current from the log in between
+        """
+        if self._frontend is None or not self._frontend.is_backend_available():
+            return
+        if self._wo_status_query is not None and not self._wo_status_query.is_done():
+            return
+        self._wo_status_query = self._serverloop.add_waiting_object(
+            StatusQuery(self.backend_address(), self.handle_status_query_result))
+
+    def handle_status_query_result(self, status):
+        self._wo_status_query = None
+        if status is None:
+            logger.debug('Status query failed, keeping cached status.')
+        elif self._status_cache is not None:
+            self._status_cache.update_from_server(status)
+
+    def control_socket_path(self) -> str:
+        return socket_path(self._config)
+
+    def start_metrics(self):
+        metrics_config = self._settings.wrapper.metrics
+        if not metrics_config.enabled:
+            return
+        self._metrics = WrapperMetrics(self._settings.minecraft.version)
+        server = self._serverloop.add_waiting_object(MetricsServer(
+            self._serverloop,
+            (metrics_config.host or '', metrics_config.port),
+            self._metrics,
+        ))
+        self._serverloop.call_on_shutdown(server.close, name='close-metrics')
+        self.update_metrics()
+        self._serverloop.call_repeatedly(1.0, self.update_metrics, name='metrics')
+
+    def update_metrics(self):
+        """ Polls the values that aren't updated as things happen. Unchanged values don't invalidate the cached page.
+        """
+        metrics = self._metrics
+        running = self._minecraft is not None
+        metrics.set_state(self.server_state())
+        metrics.up.set(1 if running else 0)
+        metrics.ready.set(1 if self._server_ready else 0)
+        metrics.players_online.set(len(self._players))
+        metrics.players_max.set(self._max_players)
+        metrics.tps.set(self._lag.tps() if self._server_ready else math.nan)
+        metrics.server_rss.set(process_rss_bytes(self._minecraft.pid()) if running else 0)
+        if running:
+            metrics.server_cpu.set(process_cpu_seconds(self._minecraft.pid()))
+        p99_pause_ms = self._gc_stats.p99_pause_ms() if running and self._gc_stats is not None else None
+        metrics.gc_p99_pause.set(p99_pause_ms / 1000 if p99_pause_ms is not None else math.nan)
+        metrics.wrapper_rss.set(process_rss_bytes(os.getpid()))
+        times = os.times()
+        metrics.wrapper_cpu.set(times.user + times.system)
+        metrics.set_loop_stats(self._serverloop.stats)
+        if self._console is not None:
+            metrics.console_dropped.set(self._console.dropped_lines)
+
+    def start_control(self):
+        control_config = self._settings.wrapper.control
+        if not control_config.enabled:
+            return
+        self._control = self._serverloop.add_waiting_object(ControlServer(
+            self._serverloop,
+            self.control_socket_path(),
+            self.handle_control_request,
+            max_queued_bytes=control_config.max_queued_kibs * 1024,
+        ))
+        self._serverloop.call_on_shutdown(self._control.close, name='close-control')
+
+    def publish(self, event: dict):
+        if self._control is not None:
+            self._control.publish(event)
+
+    def handle_control_request(self, request: dict, client: ControlConnection):
+        request_id = request.get('id')
+        if request.get('type') == 'command':
+            command = str(request.get('command', ''))
+            logger.info(f'{client}: {command}')
+            future = self.execute(command)
+
+            def respond(future):
+                try:
+                    client.send({'type': 'response', 'id': request_id, 'result': future.result()})
+                except RconError as e:
+                    client.send({'type': 'error', 'id': request_id, 'error': str(e)})
+            future.add_done_callback(respond)
+        elif request.get('type') == 'players':
+            client.send({'type': 'players', 'id': request_id,
+                'players': [{'name': name, 'uuid': uuid} for name, uuid in self._players.items()]})
+        elif request.get('type') == 'profile':
+            action = request.get('action', 'status')
+            reports = []
+            if action == 'start':
+                self.start_profiling(request.get('mode'), request.get('seconds'), request.get('memory'))
+            elif action == 'stop':
+                if self._profile is None:
+                    raise MinecraftServerWrapperException('No profile is running.')
+                reports = self.stop_profiling()
+            elif action != 'status':
+                raise MinecraftServerWrapperException(f'Unknown profile action {action!r}.')
+            client.send({'type': 'profile', 'id': request_id, 'running': self._profile is not None,
+                'mode': self._profile.mode() if self._profile is not None else None,
+                'ends-at': self._wo_profile_timer.is_waiting_for_timeout() if self._profile is not None else None,
+                'directory': self.profile_directory(), 'reports': reports})
+        elif request.get('type') == 'backup':
+            action = request.get('action', 'status')
+            if action == 'start':
+                def respond(result):
+                    if isinstance(result, Exception):
+                        client.send({'type': 'error', 'id': request_id, 'error': f'Backup failed: {result}'})
+                    else:
+                        client.send({'type': 'backup', 'id': request_id, 'running': False, 'result': result.as_event()})
+                self.start_backup(respond)
+            elif action == 'status':
+                client.send({'type': 'backup', 'id': request_id, 'running': self._backup is not None, 'result': None})
+            else:
+                raise MinecraftServerWrapperException(f'Unknown backup action {action!r}.')
+        elif request.get('type') == 'config':
+            client.send({'type': 'config', 'id': request_id,
+                'pending-server-start': sorted(self._pending_server_start),
+                'pending-restart': [change.key for change in self._pending_restart]})
+        else:
+            client.send({'type': 'error', 'id': request_id, 'error': 'unknown request type {!r}'.format(request.get('type'))})
+
+    def profile_directory(self) -> str:
+        return self._working_dir + '/profiles'
+
+    def handle_profile_signal(self, signum, frame):
+        # Interrupts whatever the loop is doing, so only schedule the work
+        self._serverloop.call_after(0.0, self.toggle_profiling, name='profile-signal')
+
+    def toggle_profiling(self):
+        if self._profile is not None:
+            self.stop_profiling()
+            return
+        try:
+            self.start_profiling()
+        except MinecraftServerWrapperException as e:
+            logger.error(f'Not profiling: {e}')
+
+    def start_profiling(self, mode: str = None, seconds: float = None, memory: bool = None) -> ProfileSession:
+        """ Profiles the wrapper for a while (defaults from wrapper.profiling), then writes the reports
+        """
+        if self._profile is not None:
+            raise MinecraftServerWrapperException('A profile is already running.')
+        profiling = self._settings.wrapper.profiling
+        seconds = profiling.duration_seconds if seconds is None else seconds
+        if not isinstance(seconds, (int, float)) or not 0 < seconds <= 3600:
+            raise MinecraftServerWrapperException('Profile duration must be between 0 and 3600 seconds.')
+        session = ProfileSession(
+            self.profile_directory(),
+            mode=profiling.mode if mode is None else mode,
+            memory=profiling.memory if memory is None else bool(memory),
+        )
+        session.start()
+        self._profile = session
+        self._wo_profile_timer = self._serverloop.call_after(seconds, self.stop_profiling, name='profile-stop')
+        logger.info('Profiling the wrapper ({:s}) for {:g}s.'.format(session.mode(), seconds))
+        self.publish({'type': 'event', 'event': 'profile-start', 'mode': session.mode(), 'seconds': seconds})
+        return session
+
+    def stop_profiling(self) -> list[str]:
+        if self._profile is None:
+            return []
+        session, self._profile = self._profile, None
+        self._wo_profile_timer.cancel()
+        self._wo_profile_timer = None
+        try:
+            reports = session.stop()
+        except OSError as e:
+            logger.error(f'Could not write the profile reports: {e}')
+            return []
+        for report in reports:
+            logger.info(f'Wrote profile report {report}')
+        self.publish({'type': 'event', 'event': 'profile-done', 'reports': reports})
+        return reports
+
+    def backup_repository(self) -> BackupRepository:
+        backup_config = self._settings.wrapper.backup
+        return BackupRepository(
+            os.path.join(self._working_dir, backup_config.directory),
+            compression_level=backup_config.compression_level,
+            workers=backup_config.workers or None,
+        )
+
+    def world_directory(self) -> str:
+        return world_directory(self._working_dir)
+
+    def reload_backup_schedule(self):
+        if self._wo_backup_timer is not None:
+            self._wo_backup_timer.cancel()
+            self._wo_backup_timer = None
+        interval = self._settings.wrapper.backup.interval_minutes
+        if interval > 0:
+            self._wo_backup_timer = self._serverloop.call_repeatedly(interval * 60.0, self.scheduled_backup, name='backup')
+
+    def scheduled_backup(self):
+        # The world of a stopped (or sleeping) server doesn't change
+        if not self._server_ready:
+            return
+        try:
+            self.start_backup()
+        except MinecraftServerWrapperException as e:
+            logger.warning(f'Skipping the scheduled backup: {e}')
+
+    def start_backup(self, done_callback: Callable[[BackupResult or Exception], None] = None) -> BackupJob:
+        """ Backs up the world (settings from wrapper.backup), with saving turned off for a moment if the server
+        runs. done_callback is called with the result, or the exception that stopped the backup.
+        """
+        if self._backup is not None:
+            raise MinecraftServerWrapperException('A backup is already running.')
+        if self._minecraft is not None and not self._server_ready:
+            raise MinecraftServerWrapperException('The server is starting, it cannot save yet.')
+        backup_config = self._settings.wrapper.backup
+        retention = backup_config.retention
+        self._backup = BackupJob(
+            self._serverloop,
+            self.execute,
+            self.world_directory(),
+            self.backup_repository(),
+            RetentionPolicy(retention.keep_last, retention.keep_hourly, retention.keep_daily, retention.keep_weekly),
+            backup_config.save_timeout_seconds,
+            self.handle_backup_done,
+            workers=backup_config.workers or None,
+            staged_callback=self.handle_backup_staged,
+        )
+        if done_callback is not None:
+            self._backup_waiters.append(done_callback)
+        logger.info('Backing up the world.')
+        self.publish({'type': 'event', 'event': 'backup-start'})
+        self._backup.start(server_running=self._minecraft is not None)
+        return self._backup
+
+    def handle_backup_staged(self):
+        if not self._wake_after_staging:
+            return
+        self._wake_after_staging = False
+        if self._minecraft is None and not self._shutting_down:
+            logger.info('The backup is done with the world, waking up the server.')
+            self.start_minecraft_server()
+
+    def handle_backup_done(self, result: BackupResult or Exception):
+        self._backup = None
+        waiters, self._backup_waiters = self._backup_waiters, []
+        if isinstance(result, Exception):
+            logger.error(f'Backup failed: {result}')
+            self.publish({'type': 'event', 'event': 'backup-failed', 'error': str(result)})
+            if self._metrics is not None:
+                self._metrics.backups.inc(1, 'error')
+        else:
+            logger.info(result.summary())
+            self.publish(result.as_event())
+            if self._metrics is not None:
+                self._metrics.set_backup(result)
+        for waiter in waiters:
+            waiter(result)
+
+    def abandon_backup(self):
+        if self._backup is None:
+            return
+        # The repository only gets a snapshot once it's complete, and staging starts over next time
+        logger.warning('Shutting down in the middle of a backup, it is not finished.')
+        self.handle_backup_done(MinecraftServerWrapperException('The wrapper shut down.'))
+
+    def start_config_watch(self):
+        if self._config_path is None or not self._settings.wrapper.reload_config:
+            return
+        self._wo_config_watch = self._serverloop.add_waiting_object(ConfigWatcher(self._config_path, self.reload_config))
+        if not self._wo_config_watch.uses_inotify():
+            logger.info('inotify is not available, checking {:s} for changes every few seconds.'.format(self._config_path))
+        self._serverloop.call_on_shutdown(self._wo_config_watch.close, name='close-config-watch')
+
+    def reload_config(self):
+        """ Re-reads minecraft.yaml and applies what changed, as far as possible without restarting anything
+        """
+        try:
+            config = load_config(ConfigDict.load_from_yaml_file(self._config_path))
+            settings = compile_config(config)
+        except (MinecraftServerWrapperException, OSError) as e:
+            logger.error(f'Not reloading the configuration: {e}')
+            return
+        # Settings that need a restart keep their old values until then, so they show up here again
+        changes = diff_config(self._settings.to_dict(), settings.to_dict())
+        if len(changes) == 0:
+            logger.info('Configuration reloaded, nothing changed.')
+            return
+        live, restart, handlers = [], [], []
+        for change in changes:
+            rule = match_rule(RELOAD_RULES, change.key)
+            if rule is None:
+                restart.append(change)
+            elif rule == RELOAD_AT_SERVER_START:
+                self._pending_server_start.add(change.key)
+            else:
+                live.append(change)
+                if rule != RELOAD_LIVE and rule not in handlers:
+                    handlers.append(rule)
+        self._config = ConfigDict(**with_values(settings.to_dict(), restart, 'old'))
+        self._settings = compile_config(self._config)
+        self._pending_restart = restart
+        for change in live:
+            logger.info(f'Configuration reloaded: {change}')
+        for change in changes:
+            if change.key in self._pending_server_start:
+                logger.info(f'Configuration reloaded: {change} (used from the next server start on)')
+        for change in restart:
+            logger.warning(f'Configuration reloaded: {change} (needs a restart of the wrapper, pending)')
+        for handler in handlers:
+            getattr(self, handler)()
+        self.publish({'type': 'event', 'event': 'config-reload',
+            'applied': [change.key for change in live],
+            'pending-server-start': sorted(self._pending_server_start),
+            'pending-restart': [change.key for change in restart]})
+
+    def reload_server_name(self):
+        if self._server_info is None:
+            return
+        server_info = MinecraftServerInfo(self._settings.minecraft.server.name, self._server_info.port)
+        if self._lan_broadcaster is not None:
+            self._lan_broadcaster.remove_server(self._server_info)
+            self._lan_broadcaster.add_server(server_info)
+        self._server_info = server_info
+
+    def reload_lan_broadcast(self):
+        if self._lan_broadcaster is not None:
+            self._lan_broadcaster.close()
+        self._lan_broadcaster = self.create_lan_broadcaster()
+        if self._lan_broadcaster is not None:
+            if self._server_info is not None:
+                self._lan_broadcaster.add_server(self._server_info)
+            self._serverloop.add_waiting_object(self._lan_broadcaster)
+
+    def reload_motd(self):
+        if self._status_cache is None or self._server_ready:
+            return
+        if self._minecraft is not None:
+            self._status_cache.set_motd_override(self._settings.wrapper.frontend.motd_starting)
+        elif self.hibernation_enabled():
+            self._status_cache.set_motd_override(self._settings.wrapper.hibernation.motd_sleeping)
+        else:
+            self._status_cache.set_motd_override(self._settings.wrapper.frontend.motd_stopped)
+
+    def reload_max_relays(self):
+        if self._frontend is not None:
+            self._frontend.max_relays = self._settings.wrapper.frontend.max_relays
+
+    def reload_status_query(self):
+        if self._wo_status_query_timer is None:
+            return
+        self._wo_status_query_timer.cancel()
+        self._wo_status_query_timer = self._serverloop.call_repeatedly(
+            self._settings.wrapper.frontend.status_query_interval_seconds, self.query_status, name='status-query')
+
+    def start_rcon(self):
+        rcon_config = self._settings.wrapper.rcon
+        if not rcon_config.enabled:
+            return
+        properties = read_properties(self._working_dir + '/server.properties')
+        if properties.get('enable-rcon') != 'true' or not properties.get('rcon.password'):
+            logger.info('RCON is not enabled in server.properties, commands go to the console.')
+            return
+        self._rcon = self._serverloop.add_waiting_object(RconClient(
+            (rcon_config.host, int(properties.get('rcon.port') or 25575)),
+            properties['rcon.password'],
+            max_in_flight=rcon_config.max_in_flight,
+        ))
+
+    def stop_rcon(self):
+        if self._rcon is not None:
+            self._rcon.close()
+            self._rcon = None
+
+    def execute(self, command: str) -> Future:
+        """ Runs a command, through RCON if possible. The future's result is the response text, or None if the
+        command had to go to the console (where the response only shows up in the log).
+        """
+        if self._rcon is not None:
+            return self._rcon.command(command.removeprefix('/'))
+        future = Future()
+        self.send_to_mc(command)
+        future.set_result(None)
+        return future
+
+    def execute_many(self, commands: list[str]) -> list[Future]:
+        return [self.execute(command) for command in commands]
+
+    def status_file_path(self) -> str:
+        return status_file_path(self._working_dir)
+
+    def server_state(self) -> str:
+        if self._minecraft is None:
+            return 'sleeping' if self.hibernation_enabled() and not self._shutting_down else 'stopped'
+        if self._shutting_down or (self._frontend is not None and self._server_ready
+                and not self._frontend.is_backend_available()):
+            return 'stopping'
+        return 'running' if self._server_ready else 'starting'
+
+    def status_record(self) -> StatusRecord:
+        running = self._minecraft is not None
+        record = StatusRecord(
+            updated_at=time.time(),
+            wrapper_pid=os.getpid(),
+            server_pid=self._minecraft.pid() if running else 0,
+            state=self.server_state(),
+            players_online=len(self._players),
+            players_max=self._max_players,
+            server_started_at=self._server_started_at or 0.0,
+            rss_bytes=process_rss_bytes(self._minecraft.pid()) if running else 0,
+            tps=self._lag.tps() if self._server_ready else float('nan'),
+            lag_events=self._lag.count,
+            last_lag_at=self._lag.last_at,
+            last_lag_ms=self._lag.last_ms,
+            version=self._settings.minecraft.version,
+            players=list(self._players),
+        )
+        if running and self._gc_stats is not None:
+            record.gc_p99_pause_ms = self._gc_stats.p99_pause_ms() or float('nan')
+        return record
+
+    def update_status_file(self):
+        if self._status_file is not None:
+            self._status_file.write(self.status_record())
+
+    def update_players(self):
+        if self._status_cache is not None:
+            self._status_cache.set_players(list(self._players.items()))
+        if len(self._players) > 0:
+            self._empty_since = None
+        elif self._empty_since is None:
+            self._empty_since = time.time()
+        self.update_status_file()
+
+    def hibernation_enabled(self) -> bool:
+        return self._settings.wrapper.hibernation.enabled
+
+    def handle_login_while_unavailable(self, connection) -> bool:
+        """ Wakes up the server on a login and holds the connection until it's up
+        """
+        if self._frontend.is_backend_available() or self._shutting_down:
+            return False
+        if self._minecraft is None and not self._wake_after_staging:
+            logger.info(f'Login from {connection.peer[0]}, waking up the server.')
+            self.wake_up()
+        self._frontend.hold(connection, self._settings.wrapper.hibernation.max_hold_seconds)
+        return True
+
+    def wake_up(self):
+        """ Starts the sleeping server, unless a backup is copying its world (which it would change underneath
+        the backup, saving isn't turned off for it). Then it's started when the backup is done staging.
+        """
+        if self._backup is not None and self._backup.is_staging():
+            logger.info('A backup is copying the world, the server will start once that is done.')
+            self._wake_after_staging = True
+            return
+        self.start_minecraft_server()
+
+    def hibernate(self):
+        logger.info('No players for {:.0f} seconds, putting the server to sleep.'.format(time.time() - self._empty_since))
+        self._empty_since = None
+        self._hibernating = True
+        self._frontend.set_backend_available(False)
+        self.send_stop_to_mc()
 
     def tick(self):
         logger.debug('tick')
-        pass
+        if self._recorder is not None:
+            self._recorder.flush()
+        if self.hibernation_enabled() and self._minecraft is not None and self._frontend.is_backend_available() \
+                and self._empty_since is not None and self._frontend.held_count() == 0:
+            idle_seconds = self._settings.wrapper.hibernation.idle_timeout_seconds
+            if time.time() - self._empty_since >= idle_seconds:
+                self.hibernate()
 
     def handle_minecraft_server_output(self, line):
         self._logparser.add_line(line)
 
     def handle_minecraft_log_message(self, message):
         logger.log(message.level[0], '{:s}'.format(message.message))
+        self.publish(message.as_event())
+        if self._metrics is not None:
+            self._metrics.log_messages.inc(1, message.level[1])
+        if self._backup is not None:
+            self._backup.handle_log_message(message)
         if isinstance(message, MinecraftServerStartMessage):
             self.handle_minecraft_server_start(message.host, message.port)
+        elif isinstance(message, MinecraftServerDoneMessage):
+            self.handle_minecraft_server_done(message.seconds)
+        elif isinstance(message, MinecraftServerLagMessage):
+            self._lag.add(message.millis, message.ticks)
+            if self._metrics is not None:
+                self._metrics.lag_events.inc()
+                self._metrics.lag_ticks.inc(message.ticks)
+        elif isinstance(message, MinecraftPlayerUUIDMessage):
+            self._player_uuids[message.player] = message.uuid
+        elif isinstance(message, MinecraftPlayerJoinMessage):
+            self._players[message.player] = self._player_uuids.get(message.player)
+            self.update_players()
+        elif isinstance(message, MinecraftPlayerLeaveMessage):
+            self._players.pop(message.player, None)
+            self._player_uuids.pop(message.player, None)
+            self.update_players()
 
     def handle_minecraft_server_stderr(self, line):
+        if self._metrics is not None:
+            self._metrics.stderr_lines.inc()
         logger.error(f'mc-stderr: {line}')
 
     def handle_terminal_input(self, line):
@@ -231,10 +1067,14 @@ class MinecraftServerWrapper:
             self._minecraft.send_line(command)
 
     def stop_minecraft_server(self):
+        self._shutting_down = True
         if self._minecraft is None:
             # FIXME: This does not really belong here but should be an async construct called after the server stops
             self._serverloop.stop()
             return
+        self.send_stop_to_mc()
+
+    def send_stop_to_mc(self):
         try:
             self.send_to_mc('/stop')
         except BrokenPipeError:
@@ -250,21 +1090,87 @@ class MinecraftServerWrapper:
         self._minecraft.kill()
 
     def handle_minecraft_server_start(self, host, port):
+        if self._frontend is not None:
+            # Announced by the frontend
+            return
         if self._server_info is not None and self._lan_broadcaster is not None:
             logger.warn('Server broadcast already started, re-registering.')
             self._lan_broadcaster.remove_server(self._server_info)
 
-        self._server_info = MinecraftServerInfo(self._config['minecraft']['server']['name'], port)
+        self._server_info = MinecraftServerInfo(self._settings.minecraft.server.name, port)
         if self._lan_broadcaster is not None:
             logger.warn('Starting server broadcast: {:s}'.format(str(self._server_info)))
             self._lan_broadcaster.add_server(self._server_info)
 
+    def handle_minecraft_server_done(self, seconds):
+        if self._metrics is not None:
+            self._metrics.startup_seconds.set(seconds)
+        if self._mods_swap_unconfirmed:
+            logger.info('New mod set booted successfully.')
+            self._mods_swap_unconfirmed = False
+        if self._startup_features is not None:
+            startup_times = StartupTimes(Path(self._working_dir) / '.startup-times.json')
+            startup_times.record(seconds, self._startup_features)
+            for feature in self._startup_features:
+                logger.info(startup_times.report(feature, self._startup_features))
+            self._startup_features = None
+        self._server_ready = True
+        self.update_players()
+        self.start_rcon()
+        if self._frontend is not None:
+            self._status_cache.set_motd_override(None)
+            self._frontend.set_backend_available(True)
+            self.query_status()
+
     def handle_minecraft_server_stop(self, rc=None):
-        if self._server_info is not None and self._lan_broadcaster is not None:
+        # Whether this was a start that failed, rather than the server going to sleep or being stopped
+        failed_start = not self._server_ready and not self._hibernating and not self._shutting_down
+        if self._mods_swap_unconfirmed and failed_start:
+            logger.error('Server stopped before finishing startup with the new mod set, rolling back.')
+            self.rollback_mods()
+        if self._frontend is None and self._server_info is not None and self._lan_broadcaster is not None:
             logger.warn('Stopping server broadcast: {:s}'.format(str(self._server_info)))
             self._lan_broadcaster.remove_server(self._server_info)
-        self._server_info = None
+            self._server_info = None
+        self._hibernating = False
         self._minecraft = None
+        self._server_ready = False
+        self._server_started_at = None
+        if self._backup is not None:
+            self._backup.handle_server_stop()
+        if self._metrics is not None:
+            self._metrics.exits.inc(1, str(rc))
+            # Only present while the server runs, like its CPU time
+            self._metrics.start_time.clear()
+            self._metrics.server_cpu.clear()
+        self.stop_rcon()
+        self.publish({'type': 'event', 'event': 'server-stop', 'returncode': rc})
+        self._players = {}
+        self._player_uuids = {}
+        self._empty_since = None
+        if self._frontend is not None:
+            self._frontend.set_backend_available(False)
+            if failed_start:
+                self._frontend.reject_held('The server failed to start.')
+            self._status_cache.set_players([])
+            if self.hibernation_enabled():
+                self._status_cache.set_motd_override(self._settings.wrapper.hibernation.motd_sleeping)
+            else:
+                self._status_cache.set_motd_override(self._settings.wrapper.frontend.motd_stopped)
+        if self._wo_gc_log is not None:
+            self._wo_gc_log.close()
+            self._wo_gc_log = None
+            logger.info('GC summary: {:s}'.format(str(self._gc_stats.summary())))
+        self.update_status_file()
+        if self.hibernation_enabled() and not self._shutting_down:
+            if self._frontend.held_count() > 0:
+                # Logins that came in while it was going to sleep
+                logger.info('Players are waiting, waking the server up again.')
+                self._frontend.extend_held(self._settings.wrapper.hibernation.max_hold_seconds)
+                self.wake_up()
+                return
+            logger.info('Server is sleeping, waiting for players to connect.')
+            return
         # TODO: For now, exit if minecraft exitted - later we might want to re-start or sth
         self._serverloop.stop()
 
@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+from pathlib import Path
+from statistics import median
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimes:
+    """ Keeps a history of server startup times (from "Done (Xs)!"), together with the startup features that
+    were active, so the effect of a feature can be reported.
+    """
+    _path: Path = None
+    _max_entries: int = 100
+    _entries: list[dict] = None
+
+    def __init__(self, path: str or Path, max_entries: int = 100):
+        self._path = Path(path)
+        self._max_entries = max_entries
+        self._entries = self._load()
+
+    def _load(self) -> list[dict]:
+        try:
+            with open(self._path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _store(self) -> None:
+        tmp = self._path.with_name(self._path.name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self._entries, f, indent=1)
+        os.replace(tmp, self._path)
+
+    def record(self, seconds: float, features: dict[str, bool]) -> None:
+        self._entries.append({'time': time.time(), 'seconds': seconds, 'features': features})
+        self._entries = self._entries[-self._max_entries:]
+        self._store()
+
+    def compare(self, feature: str, features: dict[str, bool] = None) -> tuple[list[float], list[float]]:
+        """ Startup times with and without feature. Given features (like those of the current run), only runs
+        with the same other features count, so their effect doesn't end up in the comparison.
+        """
+        others = {name: value for name, value in (features or {}).items() if name != feature}
+        entries = [e for e in self._entries if all(e['features'].get(name) == value for name, value in others.items())]
+        with_feature = [e['seconds'] for e in entries if e['features'].get(feature) is True]
+        without_feature = [e['seconds'] for e in entries if e['features'].get(feature) is False]
+        return with_feature, without_feature
+
+    def report(self, feature: str, features: dict[str, bool] = None) -> str:
+        def describe(times):
+            if len(times) == 0:
+                return 'no runs'
+            return 'median {:.2f}s over {:d} runs'.format(median(times), len(times))
+        with_feature, without_feature = self.compare(feature, features)
+        others = ', '.join('{:s} {:s}'.format(name, 'on' if value else 'off')
+            for name, value in (features or {}).items() if name != feature)
+        s = f'Startup with {feature}' + (f' ({others})' if others else '')
+        s += f': {describe(with_feature)}, without: {describe(without_feature)}'
+        if len(with_feature) > 0 and len(without_feature) > 0:
+            s += ' ({:+.1f}%)'.format((median(with_feature) / median(without_feature) - 1.0) * 100.0)
+        return s
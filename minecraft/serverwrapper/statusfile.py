@@ -0,0 +1,195 @@
+from collections import deque
+import math
+import mmap
+import os
+import struct
+import time
+
+# A fixed-layout status record, memory-mapped by the running wrapper and updated in place. Readers (like the
+# "status" command) map the same file and use the sequence counter like a seqlock: it's odd while the wrapper
+# writes, and a read is only valid if the counter is even and unchanged afterwards.
+
+MAGIC = b'MCSW'
+LAYOUT_VERSION = 1
+MAX_PLAYER_NAMES = 16
+
+_header = struct.Struct('<4sIQ')
+_body = struct.Struct('<dIIB3xIIdQdI4xddd32s' + f'{MAX_PLAYER_NAMES * 16}s')
+RECORD_SIZE = _header.size + _body.size
+
+STATES = ['stopped', 'starting', 'running', 'stopping', 'sleeping']
+
+# Lag is estimated from "Can't keep up!" lines, over this many seconds
+LAG_WINDOW = 60.0
+TICKS_PER_SECOND = 20.0
+
+
+def status_file_path(working_dir: str) -> str:
+    return working_dir + '/.wrapper-status'
+
+
+class StatusRecord:
+    updated_at: float = 0.0
+    wrapper_pid: int = 0
+    server_pid: int = 0
+    state: str = 'stopped'
+    players_online: int = 0
+    players_max: int = 0
+    server_started_at: float = 0.0
+    rss_bytes: int = 0
+    tps: float = math.nan
+    lag_events: int = 0
+    last_lag_at: float = 0.0
+    last_lag_ms: float = 0.0
+    gc_p99_pause_ms: float = math.nan
+    version: str = ''
+    players: list[str] = None
+
+    def __init__(self, **kw):
+        self.players = []
+        for key, value in kw.items():
+            setattr(self, key, value)
+
+    def pack_body(self) -> bytes:
+        names = b''.join(name.encode('ascii', errors='replace')[:16].ljust(16, b'\0') for name in self.players[:MAX_PLAYER_NAMES])
+        return _body.pack(self.updated_at, self.wrapper_pid, self.server_pid, STATES.index(self.state),
+            self.players_online, self.players_max, self.server_started_at, self.rss_bytes, self.tps,
+            self.lag_events, self.last_lag_at, self.last_lag_ms, self.gc_p99_pause_ms,
+            self.version.encode('utf-8')[:32], names)
+
+    @staticmethod
+    def unpack_body(data) -> 'StatusRecord':
+        fields = _body.unpack_from(data, _header.size)
+        names = fields[14]
+        return StatusRecord(
+            updated_at=fields[0], wrapper_pid=fields[1], server_pid=fields[2],
+            state=STATES[fields[3]] if fields[3] < len(STATES) else 'stopped',
+            players_online=fields[4], players_max=fields[5], server_started_at=fields[6], rss_bytes=fields[7],
+            tps=fields[8], lag_events=fields[9], last_lag_at=fields[10], last_lag_ms=fields[11],
+            gc_p99_pause_ms=fields[12], version=fields[13].rstrip(b'\0').decode('utf-8', errors='replace'),
+            players=[names[i:i + 16].rstrip(b'\0').decode('ascii', errors='replace')
+                for i in range(0, len(names), 16) if names[i] != 0],
+        )
+
+    def to_dict(self) -> dict:
+        # NaN (unknown) isn't valid JSON
+        return {key: None if isinstance(value, float) and math.isnan(value) else value
+            for key, value in ((key, getattr(self, key)) for key in StatusRecord.__annotations__)}
+
+    def is_stale(self, max_age: float = 10.0) -> bool:
+        """ True if the wrapper that wrote this is gone (or hasn't updated it for a while)
+        """
+        if time.time() - self.updated_at > max_age:
+            return True
+        try:
+            os.kill(self.wrapper_pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+
+class StatusFile:
+    """ The writing side, used by the wrapper
+    """
+    _path: str = None
+    _fd: int = None
+    _map: mmap.mmap = None
+    _seq: int = 0
+
+    def __init__(self, path: str):
+        self._path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        os.ftruncate(self._fd, RECORD_SIZE)
+        self._map = mmap.mmap(self._fd, RECORD_SIZE)
+        self._seq = 0
+        _header.pack_into(self._map, 0, MAGIC, LAYOUT_VERSION, self._seq)
+
+    def write(self, record: StatusRecord) -> None:
+        body = record.pack_body()
+        self._seq += 1
+        struct.pack_into('<Q', self._map, 8, self._seq)
+        self._map[_header.size:RECORD_SIZE] = body
+        self._seq += 1
+        struct.pack_into('<Q', self._map, 8, self._seq)
+
+    def close(self, record: StatusRecord = None) -> None:
+        if record is not None:
+            self.write(record)
+        self._map.close()
+        os.close(self._fd)
+
+
+def read_status(path: str, retries: int = 1000) -> StatusRecord or None:
+    """ Reads the record written by a wrapper, None if there is none
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        if os.fstat(fd).st_size < RECORD_SIZE:
+            return None
+        with mmap.mmap(fd, RECORD_SIZE, access=mmap.ACCESS_READ) as m:
+            for _ in range(retries):
+                magic, layout_version, seq = _header.unpack_from(m, 0)
+                if magic != MAGIC or layout_version != LAYOUT_VERSION:
+                    return None
+                if seq % 2 == 1:
+                    continue
+                data = m[:RECORD_SIZE]
+                if struct.unpack_from('<Q', m, 8)[0] == seq:
+                    return StatusRecord.unpack_body(data)
+            return None
+    finally:
+        os.close(fd)
+
+
+class LagTracker:
+    """ Estimates ticks per second from the server's "Can't keep up!" lines
+    """
+    _events: deque = None
+    count: int = 0
+    last_at: float = 0.0
+    last_ms: float = 0.0
+
+    def __init__(self):
+        self._events = deque()
+
+    def add(self, ms: float, ticks: int, now: float = None) -> None:
+        now = now or time.time()
+        self._events.append((now, ticks))
+        self.count += 1
+        self.last_at = now
+        self.last_ms = ms
+
+    def tps(self, now: float = None) -> float:
+        now = now or time.time()
+        while self._events and self._events[0][0] < now - LAG_WINDOW:
+            self._events.popleft()
+        skipped = sum(ticks for _, ticks in self._events)
+        return TICKS_PER_SECOND * max(0.0, 1.0 - skipped / (TICKS_PER_SECOND * LAG_WINDOW))
+
+    def reset(self) -> None:
+        self._events.clear()
+
+
+def process_rss_bytes(pid: int) -> int:
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def process_cpu_seconds(pid: int) -> float:
+    """ User and system CPU time of a process, 0.0 if it's gone
+    """
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            # The command name may contain spaces and parentheses, the fields after it don't
+            fields = f.read().rpartition(')')[2].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return 0.0
@@ -0,0 +1,439 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import http.client
+import json
+import os
+from pathlib import Path
+import shutil
+import threading
+import time
+from urllib.parse import unquote, urljoin, urlsplit
+
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+
+logger = logging.getLogger(__name__)
+
+_chunk_size = 1 << 16
+_redirect_codes = (301, 302, 303, 307, 308)
+_max_redirects = 5
+
+
+class DownloadError(MinecraftServerWrapperException):
+    pass
+
+
+class _RetryableDownloadError(DownloadError):
+    pass
+
+
+def default_cache_dir() -> Path:
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return Path(base) / 'minecraft-serverwrapper' / 'downloads'
+
+
+class Artifact:
+    """ A file to download, with optional size and checksums to verify it against
+    """
+    url: str = None
+    dest: Path = None
+    sha256: str = None
+    sha1: str = None
+    size: int = None
+
+    def __init__(self, url: str, dest: str or Path, sha256: str = None, sha1: str = None, size: int = None):
+        self.url = url
+        self.dest = Path(dest)
+        self.sha256 = sha256.lower() if sha256 else None
+        self.sha1 = sha1.lower() if sha1 else None
+        self.size = int(size) if size is not None else None
+
+    @staticmethod
+    def name_from_url(url: str) -> str:
+        return unquote(urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1])
+
+    def has_checksum(self) -> bool:
+        return self.sha256 is not None or self.sha1 is not None
+
+    def new_hashers(self) -> dict:
+        hashers = {}
+        if self.sha256 is not None:
+            hashers['sha256'] = hashlib.sha256()
+        if self.sha1 is not None:
+            hashers['sha1'] = hashlib.sha1()
+        return hashers
+
+    def verify(self, size: int, hashers: dict) -> None:
+        if self.size is not None and size != self.size:
+            raise DownloadError(f'Size mismatch for {self.url}: expected {self.size} bytes, got {size}.')
+        for name, hasher in hashers.items():
+            expected = getattr(self, name)
+            if hasher.hexdigest() != expected:
+                raise DownloadError(f'{name} mismatch for {self.url}: expected {expected}, got {hasher.hexdigest()}.')
+
+    def verify_file(self, path: Path) -> None:
+        hashers = self.new_hashers()
+        size = _hash_file(path, hashers.values())
+        self.verify(size, hashers)
+
+    def __str__(self) -> str:
+        return f'Artifact({self.url} -> {self.dest})'
+
+
+def _hash_file(path: Path, hashers) -> int:
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(_chunk_size)
+            if not chunk:
+                return size
+            size += len(chunk)
+            for hasher in hashers:
+                hasher.update(chunk)
+
+
+def _replace_atomically(src: Path, dest: Path) -> None:
+    """ Places a copy (or hardlink) of src at dest, so that dest is never partially written
+    """
+    tmp = dest.with_name(dest.name + '.tmp')
+    if tmp.exists():
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+
+class ConnectionPool:
+    """ Bounded pool of keep-alive HTTP(S) connections, shared between threads
+    At most max_connections connections exist at the same time, idle ones are reused per host.
+    """
+    _timeout: float = None
+    _semaphore: threading.Semaphore = None
+    _lock: threading.Lock = None
+    _idle: dict[tuple[str, str], list[http.client.HTTPConnection]] = None
+
+    def __init__(self, max_connections: int = 4, timeout: float = 30.0):
+        self._timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def acquire(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        self._semaphore.acquire()
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self._timeout)
+        elif scheme == 'http':
+            return http.client.HTTPConnection(netloc, timeout=self._timeout)
+        self._semaphore.release()
+        raise DownloadError(f'Unsupported URL scheme: {scheme}')
+
+    def release(self, scheme: str, netloc: str, connection: http.client.HTTPConnection, reusable: bool) -> None:
+        if reusable:
+            with self._lock:
+                self._idle.setdefault((scheme, netloc), []).append(connection)
+        else:
+            connection.close()
+        self._semaphore.release()
+
+    def close(self) -> None:
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+
+
+class DownloadCache:
+    """ Persistent download cache, keyed by URL and revalidated with the server's ETag
+    For each URL, <key>.data holds the content and <key>.json the validators. The cache can be shared by several
+    processes (it is by default), <key>.lock keeps them from downloading the same URL at the same time.
+    """
+    _dir: Path = None
+
+    def __init__(self, directory: str or Path):
+        self._dir = Path(directory)
+        self._dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def data_path(self, url: str) -> Path:
+        return self._dir / (self.key(url) + '.data')
+
+    def meta_path(self, url: str) -> Path:
+        return self._dir / (self.key(url) + '.json')
+
+    @contextmanager
+    def locked(self, url: str):
+        """ Holds the entry for url, blocking until no other process (or Downloader) holds it
+        """
+        with open(self._dir / (self.key(url) + '.lock'), 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def load_meta(self, url: str) -> dict:
+        try:
+            with open(self.meta_path(url), 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if meta.get('url') != url:
+            return {}
+        return meta
+
+    def store_meta(self, url: str, meta: dict) -> None:
+        path = self.meta_path(url)
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(dict(meta, url=url), f)
+        os.replace(tmp, path)
+
+    def lookup(self, url: str) -> tuple[Path, dict] or None:
+        meta = self.load_meta(url)
+        data = self.data_path(url)
+        if meta.get('complete') and data.exists():
+            return data, meta
+        return None
+
+
+class Downloader:
+    """ In-process HTTP downloader
+    Downloads go to a ".part" file that is resumed with Range requests after errors and only moved into
+    place once complete and verified. With a cache directory, finished downloads are kept and revalidated
+    with If-None-Match instead of being downloaded again.
+    """
+    _pool: ConnectionPool = None
+    _cache: DownloadCache = None
+    _max_connections: int = 4
+    _retries: int = 3
+    _locks: dict[str, threading.Lock] = None
+    _locks_lock: threading.Lock = None
+
+    def __init__(self, cache_dir: str or Path = None, max_connections: int = 4, retries: int = 3, timeout: float = 30.0):
+        self._pool = ConnectionPool(max_connections=max_connections, timeout=timeout)
+        self._cache = DownloadCache(cache_dir) if cache_dir is not None else None
+        self._max_connections = max_connections
+        self._retries = retries
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def close(self) -> None:
+        self._pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _lock_for(self, url: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(url, threading.Lock())
+
+    def download_all(self, artifacts: list[Artifact]) -> list[Path]:
+        """ Downloads several artifacts concurrently, raises the first error after all downloads finished
+        """
+        if len(artifacts) == 0:
+            return []
+        if len(artifacts) == 1:
+            return [self.download(artifacts[0])]
+        with ThreadPoolExecutor(max_workers=self._max_connections, thread_name_prefix='download') as executor:
+            futures = [executor.submit(self.download, artifact) for artifact in artifacts]
+        return [future.result() for future in futures]
+
+    def download(self, artifact: Artifact) -> Path:
+        with self._lock_for(artifact.url):
+            if self._cache is None:
+                return self._download(artifact)
+            with self._cache.locked(artifact.url):
+                return self._download(artifact)
+
+    def _download(self, artifact: Artifact) -> Path:
+        dest = artifact.dest
+        if dest.exists() and artifact.has_checksum():
+            try:
+                artifact.verify_file(dest)
+                logger.debug(f'{dest} is up to date, skipping download.')
+                return dest
+            except DownloadError as e:
+                logger.warning(f'{dest} exists but is invalid, downloading again: {e}')
+
+        if self._cache is not None:
+            store = self._cache.data_path(artifact.url)
+        elif dest.exists():
+            # Without a cache there is nothing to revalidate against, and dest is only ever written complete
+            logger.debug(f'{dest} already exists, skipping download.')
+            return dest
+        else:
+            store = dest
+        attempt = 0
+        while True:
+            try:
+                self._fetch(artifact, store)
+                break
+            except (_RetryableDownloadError, OSError, http.client.HTTPException) as e:
+                attempt += 1
+                if attempt > self._retries:
+                    if dest.exists():
+                        logger.warning(f'Cannot revalidate {artifact.url} ({e}), keeping existing {dest}.')
+                        return dest
+                    raise DownloadError(f'Failed to download {artifact.url}: {e}') from e
+                delay = 2.0 ** (attempt - 1)
+                logger.warning(f'Download of {artifact.url} failed ({e}), retrying in {delay:.0f}s...')
+                time.sleep(delay)
+        if store != dest:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            _replace_atomically(store, dest)
+        return dest
+
+    def _fetch(self, artifact: Artifact, store: Path) -> None:
+        meta = {}
+        if self._cache is not None:
+            cached = self._cache.lookup(artifact.url)
+            if cached is not None:
+                meta = cached[1]
+        part = store.with_name(store.name + '.part')
+        part_meta = self._load_part_meta(part)
+        offset = part.stat().st_size if part.exists() else 0
+
+        headers = {}
+        if offset > 0 and part_meta.get('etag'):
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = part_meta['etag']
+        elif offset > 0 and part_meta.get('resumable'):
+            headers['Range'] = f'bytes={offset}-'
+        elif meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+
+        url = artifact.url
+        for _ in range(_max_redirects + 1):
+            scheme, netloc = urlsplit(url)[:2]
+            path = urlsplit(url)._replace(scheme='', netloc='', fragment='').geturl() or '/'
+            connection = self._pool.acquire(scheme, netloc)
+            reusable = False
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                if response.status in _redirect_codes:
+                    response.read()
+                    reusable = not response.will_close
+                    url = urljoin(url, response.getheader('Location'))
+                    logger.debug(f'Following redirect to {url}')
+                    continue
+                if response.status == 304:
+                    response.read()
+                    reusable = not response.will_close
+                    logger.info(f'Using cached {artifact.url}')
+                    self._verify_store(artifact, store)
+                    return
+                if response.status == 206:
+                    logger.info(f'Resuming download of {artifact.url} at {offset} bytes...')
+                    self._receive(artifact, response, part, offset)
+                elif response.status == 200:
+                    logger.info(f'Downloading {artifact.url}...')
+                    self._store_part_meta(part, {
+                        'etag': response.getheader('ETag'),
+                        'resumable': response.getheader('Accept-Ranges') == 'bytes',
+                    })
+                    self._receive(artifact, response, part, 0)
+                elif response.status == 416:
+                    # The partial file is not a prefix of the current content, start over
+                    response.read()
+                    os.remove(part)
+                    self._remove_part_meta(part)
+                    raise _RetryableDownloadError(f'HTTP {response.status} {response.reason}')
+                elif response.status >= 500 or response.status == 429:
+                    response.read()
+                    raise _RetryableDownloadError(f'HTTP {response.status} {response.reason}')
+                else:
+                    response.read()
+                    raise DownloadError(f'Failed to download {artifact.url}: HTTP {response.status} {response.reason}')
+                reusable = not response.will_close
+                etag = response.getheader('ETag') or self._load_part_meta(part).get('etag')
+            finally:
+                self._pool.release(scheme, netloc, connection, reusable)
+            break
+        else:
+            raise DownloadError(f'Too many redirects for {artifact.url}')
+
+        self._finish(artifact, part, store, etag)
+
+    def _receive(self, artifact: Artifact, response: http.client.HTTPResponse, part: Path, offset: int) -> None:
+        expected = response.getheader('Content-Length')
+        received = 0
+        with open(part, 'r+b' if offset > 0 else 'wb') as f:
+            f.seek(offset)
+            f.truncate()
+            while True:
+                chunk = response.read(_chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                received += len(chunk)
+        if expected is not None and received != int(expected):
+            # Keep the partial file, the next attempt resumes it
+            raise _RetryableDownloadError(f'Connection closed after {received} of {expected} bytes')
+
+    def _finish(self, artifact: Artifact, part: Path, store: Path, etag: str or None) -> None:
+        hashers = artifact.new_hashers()
+        if self._cache is not None:
+            hashers.setdefault('sha256', hashlib.sha256())
+        size = _hash_file(part, hashers.values())
+        try:
+            artifact.verify(size, {k: v for k, v in hashers.items() if getattr(artifact, k) is not None})
+        except DownloadError:
+            os.remove(part)
+            self._remove_part_meta(part)
+            raise
+        store.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(part, store)
+        self._remove_part_meta(part)
+        if self._cache is not None:
+            self._cache.store_meta(artifact.url, {
+                'etag': etag,
+                'size': size,
+                'sha256': hashers['sha256'].hexdigest(),
+                'complete': True,
+            })
+
+    def _verify_store(self, artifact: Artifact, store: Path) -> None:
+        try:
+            artifact.verify_file(store)
+        except (DownloadError, OSError) as e:
+            # Drop the cache entry, so the next attempt downloads the file again
+            self._cache.store_meta(artifact.url, {})
+            raise _RetryableDownloadError(f'Cached file is invalid: {e}') from e
+
+    @staticmethod
+    def _part_meta_path(part: Path) -> Path:
+        return part.with_name(part.name + '.json')
+
+    def _load_part_meta(self, part: Path) -> dict:
+        try:
+            with open(self._part_meta_path(part), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _store_part_meta(self, part: Path, meta: dict) -> None:
+        part.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._part_meta_path(part), 'w') as f:
+            json.dump(meta, f)
+
+    def _remove_part_meta(self, part: Path) -> None:
+        try:
+            os.remove(self._part_meta_path(part))
+        except FileNotFoundError:
+            pass
@@ -2,6 +2,8 @@
 # click log is not working as i like it to work
 
 import logging
+import sys
+from typing import TextIO
 import click
 import click_log
 
@@ -41,3 +43,32 @@ def setup_root_logger():
     # Also reduce logging of a few other modules
     logging.getLogger('libtmux.common').setLevel(logging.INFO)
     return root_logger
+
+
+class ConsoleLogHandler(logging.Handler):
+    """ Formats each record once and hands it to a ConsoleBuffer (anything with write_line), which writes it
+    without blocking. Records can come from any thread, the ConsoleBuffer takes care of that.
+    """
+    def __init__(self, console, level=logging.NOTSET, strip_styles=False):
+        super().__init__(level)
+        self._console = console
+        self._strip_styles = strip_styles
+
+    def emit(self, record):
+        try:
+            message = self.format(record)
+            if self._strip_styles:
+                message = click.unstyle(message)
+            self._console.write_line(message)
+        except Exception:
+            self.handleError(record)
+
+
+def console_stream(handler: logging.Handler) -> TextIO or None:
+    """ The terminal stream a handler writes to, if it's one that ConsoleLogHandler can take over
+    """
+    if isinstance(handler, click_log.ClickHandler):
+        return sys.stderr if handler._use_stderr else sys.stdout
+    if type(handler) is logging.StreamHandler and handler.stream in (sys.stderr, sys.stdout):
+        return handler.stream
+    return None
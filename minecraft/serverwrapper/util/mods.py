@@ -0,0 +1,150 @@
+import filecmp
+import logging
+from pathlib import Path
+import os
+import shutil
+import zipfile
+import zlib
+
+from minecraft.serverwrapper.util.archive import copy_mod_from_zip
+
+logger = logging.getLogger(__name__)
+
+####################################################################################################
+# Staged mod sets
+#
+# The new mod set is built next to the live "mods" directory while the server keeps running:
+#   mods.staging.tmp  - work in progress, removed if syncing fails halfway
+#   mods.staging      - complete mod set, waiting to be swapped in at the next server start
+#   mods.previous     - the mod set that was live before the last swap (used for rollback)
+#   mods.failed       - the mod set that was rolled back because the server failed to boot
+
+MODS_DIR_NAME = 'mods'
+STAGING_DIR_NAME = 'mods.staging'
+PREVIOUS_DIR_NAME = 'mods.previous'
+FAILED_DIR_NAME = 'mods.failed'
+
+
+def _source_size(path: Path or zipfile.Path) -> int:
+    if isinstance(path, zipfile.Path):
+        return path.root.getinfo(path.at).file_size
+    return path.stat().st_size
+
+
+def _file_crc32(path: Path) -> int:
+    crc = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _is_unchanged(current: Path, source: Path or zipfile.Path) -> bool:
+    """ Whether the live jar has the source's contents. A rebuilt jar often keeps its name and size, so files of
+    the same size are compared by content: against the CRC the zip already has, or byte by byte unless the mtime
+    matches too.
+    """
+    if current.stat().st_size != _source_size(source):
+        return False
+    if isinstance(source, zipfile.Path):
+        return _file_crc32(current) == source.root.getinfo(source.at).CRC
+    return filecmp.cmp(current, source, shallow=True)
+
+
+def _remove_dir(path: Path) -> None:
+    if path.is_symlink() or path.is_file():
+        os.remove(path)
+    elif path.exists():
+        shutil.rmtree(path)
+
+
+def _link_or_copy(src: Path, dest: Path) -> None:
+    try:
+        os.link(src, dest)
+    except OSError as e:
+        # Different filesystem or no hardlink support: fall back to a copy
+        logger.debug(f'Cannot hardlink {src}, copying instead: {e}')
+        shutil.copy2(src, dest)
+
+
+def stage_mods(modpack_mods: dict[str, Path or zipfile.Path], working_dir: str or Path) -> bool:
+    """ Builds the given mod set in the staging directory, hardlinking unchanged jars from the live mods directory
+    Returns True if a new mod set was staged, False if the live mods directory is already up to date.
+    """
+    working_dir = Path(working_dir)
+    mod_dir = working_dir / MODS_DIR_NAME
+    staging_dir = working_dir / STAGING_DIR_NAME
+    tmp_dir = working_dir / (STAGING_DIR_NAME + '.tmp')
+
+    current_mods = {}
+    if mod_dir.is_dir():
+        current_mods = {x.name: x for x in mod_dir.iterdir() if x.is_file()}
+
+    changed = set(current_mods) != set(modpack_mods)
+    _remove_dir(tmp_dir)
+    os.mkdir(tmp_dir)
+    try:
+        for name, source in sorted(modpack_mods.items()):
+            current = current_mods.get(name)
+            if current is not None and _is_unchanged(current, source):
+                logger.debug('Linking unchanged mod {:s}...'.format(name))
+                _link_or_copy(current, tmp_dir / name)
+            elif isinstance(source, zipfile.Path):
+                logger.info('Copying mod {:s}...'.format(name))
+                copy_mod_from_zip(source, tmp_dir)
+                changed = True
+            else:
+                logger.info('Adding mod {:s}...'.format(name))
+                _link_or_copy(source, tmp_dir / name)
+                changed = True
+        for name in sorted(set(current_mods) - set(modpack_mods)):
+            logger.info('Removing mod {:s}...'.format(name))
+    except BaseException:
+        _remove_dir(tmp_dir)
+        raise
+
+    # A staged set from an earlier sync is outdated in any case
+    _remove_dir(staging_dir)
+    if not changed:
+        _remove_dir(tmp_dir)
+        return False
+    os.rename(tmp_dir, staging_dir)
+    return True
+
+
+def has_staged_mods(working_dir: str or Path) -> bool:
+    return (Path(working_dir) / STAGING_DIR_NAME).is_dir()
+
+
+def swap_in_staged_mods(working_dir: str or Path) -> bool:
+    """ Replaces the live mods directory with the staged one, keeping the old one for rollback
+    Must only be called while the server is stopped.
+    """
+    working_dir = Path(working_dir)
+    mod_dir = working_dir / MODS_DIR_NAME
+    staging_dir = working_dir / STAGING_DIR_NAME
+    previous_dir = working_dir / PREVIOUS_DIR_NAME
+    if not staging_dir.is_dir():
+        return False
+    _remove_dir(previous_dir)
+    if mod_dir.exists():
+        os.rename(mod_dir, previous_dir)
+    os.rename(staging_dir, mod_dir)
+    return True
+
+
+def rollback_mods(working_dir: str or Path) -> bool:
+    """ Restores the mod set that was live before the last swap
+    Must only be called while the server is stopped.
+    """
+    working_dir = Path(working_dir)
+    mod_dir = working_dir / MODS_DIR_NAME
+    previous_dir = working_dir / PREVIOUS_DIR_NAME
+    failed_dir = working_dir / FAILED_DIR_NAME
+    if not previous_dir.is_dir():
+        return False
+    _remove_dir(failed_dir)
+    if mod_dir.exists():
+        os.rename(mod_dir, failed_dir)
+    os.rename(previous_dir, mod_dir)
+    return True
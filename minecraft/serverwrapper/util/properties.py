@@ -0,0 +1,77 @@
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Minimal support for java .properties files, as used by server.properties
+
+_unicode_escape = re.compile(r'\\u([0-9a-fA-F]{4})')
+_other_escape = re.compile(r'\\(.)')
+_separator = re.compile(r'(?<!\\)[=:]')
+
+
+def _unescape(value: str) -> str:
+    value = _unicode_escape.sub(lambda m: chr(int(m.group(1), 16)), value)
+    return _other_escape.sub(lambda m: {'n': '\n', 't': '\t', 'r': '\r'}.get(m.group(1), m.group(1)), value)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace(':', '\\:').replace('=', '\\=')
+
+
+def _split_line(line: str) -> tuple[str, str] or None:
+    stripped = line.strip()
+    if stripped == '' or stripped[0] in '#!':
+        return None
+    m = _separator.search(stripped)
+    if m is None:
+        return _unescape(stripped), ''
+    return _unescape(stripped[:m.start()].strip()), _unescape(stripped[m.end():].strip())
+
+
+def read_properties(path: str) -> dict[str, str]:
+    properties = {}
+    if not os.path.exists(path):
+        return properties
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            entry = _split_line(line)
+            if entry is not None:
+                properties[entry[0]] = entry[1]
+    return properties
+
+
+def _loggable(key: str, value) -> str:
+    # Like rcon.password: credentials don't belong in the log
+    return '***' if 'password' in key.lower() else str(value)
+
+
+def update_properties(path: str, updates: dict[str, str]) -> bool:
+    """ Sets properties, keeping all other lines as they are. Returns True if the file was changed.
+    """
+    lines = []
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    remaining = dict(updates)
+    changed = False
+    for i, line in enumerate(lines):
+        entry = _split_line(line)
+        if entry is None or entry[0] not in remaining:
+            continue
+        value = str(remaining.pop(entry[0]))
+        if entry[1] != value:
+            logger.info(f'Setting {entry[0]}={_loggable(entry[0], value)} in {path}')
+            lines[i] = f'{entry[0]}={_escape(value)}'
+            changed = True
+    for key, value in remaining.items():
+        logger.info(f'Setting {key}={_loggable(key, value)} in {path}')
+        lines.append(f'{key}={_escape(str(value))}')
+        changed = True
+    if changed:
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, path)
+    return changed
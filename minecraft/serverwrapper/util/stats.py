@@ -0,0 +1,95 @@
+from array import array
+from bisect import bisect_left
+import math
+
+
+class RingBuffer:
+    """ Fixed-size ring buffer of numbers, backed by an array instead of a list of python objects
+    """
+    _values: array = None
+    _size: int = 0
+    _count: int = 0
+    _next: int = 0
+
+    def __init__(self, size: int, typecode: str = 'd'):
+        self._values = array(typecode, [0] * size)
+        self._size = size
+        self._count = 0
+        self._next = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, value) -> None:
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self._size
+        if self._count < self._size:
+            self._count += 1
+
+    def clear(self) -> None:
+        self._count = 0
+        self._next = 0
+
+    def values(self) -> list:
+        """ All values, oldest first
+        """
+        if self._count < self._size:
+            return self._values[:self._count].tolist()
+        return (self._values[self._next:] + self._values[:self._next]).tolist()
+
+    def last(self, default=None):
+        if self._count == 0:
+            return default
+        return self._values[self._next - 1]
+
+    def percentile(self, p: float, default=None):
+        """ Nearest-rank percentile (0 < p <= 100) of the values currently in the buffer
+        """
+        if self._count == 0:
+            return default
+        values = sorted(self._values[:self._count])
+        return values[max(0, math.ceil(p / 100.0 * self._count) - 1)]
+
+    def mean(self, default=None):
+        if self._count == 0:
+            return default
+        return sum(self._values[:self._count]) / self._count
+
+
+class Histogram:
+    """ Cumulative histogram with fixed bucket upper bounds (the last bucket is unbounded)
+    """
+    _bounds: list[float] = None
+    _counts: array = None
+    _sum: float = 0.0
+
+    def __init__(self, bounds: list[float]):
+        self._bounds = sorted(bounds)
+        self._counts = array('Q', [0] * (len(self._bounds) + 1))
+        self._sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self._counts[bisect_left(self._bounds, value)] += 1
+        self._sum += value
+
+    @property
+    def bounds(self) -> list[float]:
+        return self._bounds
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def buckets(self) -> list[tuple[float, int]]:
+        """ (upper bound, count of values <= bound) pairs, the last bound is infinity
+        """
+        result = []
+        total = 0
+        for bound, count in zip(self._bounds + [math.inf], self._counts):
+            total += count
+            result.append((bound, total))
+        return result
@@ -0,0 +1,170 @@
+""" What a world's region files hold, from their headers only: sizes, chunk counts, free space and how long ago
+chunks were last saved, per dimension and as heat maps
+"""
+import bisect
+import math
+import os
+import time
+from typing import NamedTuple
+
+from minecraft.serverwrapper.util.properties import read_properties
+from minecraft.serverwrapper.world.region import CHUNKS_PER_REGION, SECTOR_SIZE, RegionFile, region_coordinates
+
+# Chunk age buckets (upper bounds in seconds since the last save), the last bucket is everything older
+AGE_BUCKETS = (86400, 7 * 86400, 30 * 86400, 90 * 86400, 365 * 86400)
+AGE_LABELS = ('1 day', '1 week', '30 days', '90 days', '1 year', 'older')
+# Heat map characters, coldest first
+HEAT_CHARS = ' .:-=+*#%@'
+
+VANILLA_DIMENSIONS = {'minecraft:overworld': '', 'minecraft:the_nether': 'DIM-1', 'minecraft:the_end': 'DIM1'}
+
+
+def world_directory(working_dir: str) -> str:
+    properties = read_properties(working_dir + '/server.properties')
+    return os.path.join(working_dir, properties.get('level-name') or 'world')
+
+
+def dimension_directories(world_dir: str) -> dict[str, str]:
+    """ Dimension name -> directory with its region/, entities/ and poi/, for dimensions that have regions
+    """
+    result = {}
+    for name, subdir in VANILLA_DIMENSIONS.items():
+        result[name] = os.path.join(world_dir, subdir) if subdir else world_dir
+    dimensions_dir = os.path.join(world_dir, 'dimensions')
+    if os.path.isdir(dimensions_dir):
+        for namespace in sorted(os.listdir(dimensions_dir)):
+            namespace_dir = os.path.join(dimensions_dir, namespace)
+            if not os.path.isdir(namespace_dir):
+                continue
+            for name in sorted(os.listdir(namespace_dir)):
+                result.setdefault(f'{namespace}:{name}', os.path.join(namespace_dir, name))
+    return {name: path for name, path in result.items() if os.path.isdir(os.path.join(path, 'region'))}
+
+
+def region_paths(dimension_dir: str, kind: str = 'region') -> list[str]:
+    directory = os.path.join(dimension_dir, kind)
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.join(directory, name) for name in names if region_coordinates(name) is not None)
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for directory, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def age_bucket(age: float) -> int:
+    return bisect.bisect_left(AGE_BUCKETS, age)
+
+
+class RegionSummary(NamedTuple):
+    coordinates: tuple[int, int]
+    size: int
+    chunks: int
+    used_bytes: int
+    # Last save of the newest chunk, 0 without chunks
+    newest: int
+    # Chunks per AGE_BUCKETS bucket
+    ages: list[int]
+
+
+def summarize_region(path: str, now: float) -> RegionSummary:
+    with RegionFile(path) as region:
+        ages = [0] * (len(AGE_BUCKETS) + 1)
+        for timestamp, location in zip(region.timestamps, region.locations):
+            if location:
+                ages[age_bucket(now - timestamp)] += 1
+        return RegionSummary(region.coordinates, region.size, region.chunk_count(),
+            min(region.used_sectors() * SECTOR_SIZE, region.size), max(region.timestamps), ages)
+
+
+class DimensionReport:
+    name: str = None
+    directory: str = None
+    regions: list[RegionSummary] = None
+    # Sizes of entities/ and poi/, whose chunks go along with the terrain's
+    entities_bytes: int = 0
+    poi_bytes: int = 0
+
+    def __init__(self, name: str, directory: str, regions: list[RegionSummary]):
+        self.name = name
+        self.directory = directory
+        self.regions = regions
+        self.entities_bytes = directory_size(os.path.join(directory, 'entities'))
+        self.poi_bytes = directory_size(os.path.join(directory, 'poi'))
+
+    def size(self) -> int:
+        return sum(region.size for region in self.regions)
+
+    def chunks(self) -> int:
+        return sum(region.chunks for region in self.regions)
+
+    def free_bytes(self) -> int:
+        return sum(region.size - region.used_bytes for region in self.regions)
+
+    def ages(self) -> list[int]:
+        return [sum(counts) for counts in zip(*(region.ages for region in self.regions))] or [0] * len(AGE_LABELS)
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name, 'regions': len(self.regions), 'chunks': self.chunks(), 'bytes': self.size(),
+            'free-bytes': self.free_bytes(), 'entities-bytes': self.entities_bytes, 'poi-bytes': self.poi_bytes,
+            'chunk-ages': dict(zip(AGE_LABELS, self.ages())),
+        }
+
+
+def analyze_world(world_dir: str, now: float = None) -> list[DimensionReport]:
+    now = time.time() if now is None else now
+    return [DimensionReport(name, directory, [summarize_region(path, now) for path in region_paths(directory)])
+        for name, directory in dimension_directories(world_dir).items()]
+
+
+def heat_map(heat: dict[tuple[int, int], int], max_width: int = 120) -> list[str]:
+    """ Renders cells (x, z) with a heat from 0 to len(HEAT_CHARS) - 1, north up. Wide maps are scaled down,
+    the hottest cell wins. The first line says what the map covers.
+    """
+    if not heat:
+        return []
+    min_x, max_x = min(x for x, _ in heat), max(x for x, _ in heat)
+    min_z, max_z = min(z for _, z in heat), max(z for _, z in heat)
+    scale = max(1, math.ceil((max_x - min_x + 1) / max_width))
+    scaled = {}
+    for (x, z), value in heat.items():
+        key = ((x - min_x) // scale, (z - min_z) // scale)
+        scaled[key] = max(scaled.get(key, 0), value)
+    width = (max_x - min_x) // scale + 1
+    lines = [f'x {min_x:d} to {max_x:d}, z {min_z:d} to {max_z:d}' + (f', {scale:d}x{scale:d} per character' if scale > 1 else '')]
+    for row in range((max_z - min_z) // scale + 1):
+        lines.append(''.join(HEAT_CHARS[scaled[(column, row)]] if (column, row) in scaled else ' ' for column in range(width)).rstrip())
+    return lines
+
+
+def age_heat(now: float, timestamp: int) -> int:
+    """ Recently saved is hot. Empty cells (timestamp 0) aren't on the map at all.
+    """
+    return len(HEAT_CHARS) - 1 - age_bucket(now - timestamp) * (len(HEAT_CHARS) - 2) // len(AGE_BUCKETS)
+
+
+def region_age_map(report: DimensionReport, now: float) -> list[str]:
+    return heat_map({region.coordinates: age_heat(now, region.newest) for region in report.regions if region.chunks})
+
+
+def region_density_map(report: DimensionReport) -> list[str]:
+    return heat_map({region.coordinates: max(1, math.ceil(region.chunks / CHUNKS_PER_REGION * (len(HEAT_CHARS) - 1)))
+        for region in report.regions if region.chunks})
+
+
+def chunk_age_map(path: str, now: float) -> list[str]:
+    """ One region, a character per chunk
+    """
+    with RegionFile(path) as region:
+        return heat_map({(index % 32, index // 32): age_heat(now, region.timestamps[index])
+            for index in region.chunk_indices()})
@@ -0,0 +1,171 @@
+""" What level.dat and playerdata/ say about a world and its players: seed, version, spawn and game rules,
+player positions and inventories, read straight from the files so they're available while the server is
+stopped or sleeping
+
+The server writes player data when it saves, so for players who are online it's as old as the last save.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+from typing import NamedTuple
+
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+from minecraft.serverwrapper.world import nbt
+
+logger = logging.getLogger(__name__)
+
+GAME_TYPES = ('survival', 'creative', 'adventure', 'spectator')
+DIFFICULTIES = ('peaceful', 'easy', 'normal', 'hard')
+# Before 1.16, dimensions were numbered
+DIMENSION_IDS = {0: 'minecraft:overworld', -1: 'minecraft:the_nether', 1: 'minecraft:the_end'}
+
+
+def _name(names: tuple[str], index) -> str or None:
+    return names[index] if isinstance(index, int) and 0 <= index < len(names) else None
+
+
+class LevelInfo(NamedTuple):
+    name: str
+    version: str
+    data_version: int
+    seed: int
+    spawn: tuple[int, int, int]
+    game_type: str
+    difficulty: str
+    hardcore: bool
+    # Ticks since the world was created, and the time of day in ticks
+    time: int
+    day_time: int
+    # Epoch milliseconds
+    last_played: int
+    game_rules: dict[str, str]
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name, 'version': self.version, 'data-version': self.data_version, 'seed': self.seed,
+            'spawn': list(self.spawn), 'game-type': self.game_type, 'difficulty': self.difficulty,
+            'hardcore': self.hardcore, 'time': self.time, 'day-time': self.day_time,
+            'last-played': self.last_played, 'game-rules': self.game_rules,
+        }
+
+
+def read_level(world_dir: str) -> LevelInfo:
+    path = os.path.join(world_dir, 'level.dat')
+    try:
+        data = nbt.load(path).path('Data')
+    except OSError as e:
+        raise MinecraftServerWrapperException(f'Could not read {path}: {e.strerror}')
+    if not isinstance(data, nbt.Compound):
+        raise MinecraftServerWrapperException(f'{path} has no level data.')
+    # The seed moved to the world generation settings in 1.16
+    seed = data.path('WorldGenSettings/seed', data.get('RandomSeed'))
+    game_rules = data.get('GameRules')
+    return LevelInfo(
+        name=data.get('LevelName'),
+        version=data.path('Version/Name'),
+        data_version=data.get('DataVersion'),
+        seed=seed,
+        spawn=(data.get('SpawnX'), data.get('SpawnY'), data.get('SpawnZ')),
+        game_type=_name(GAME_TYPES, data.get('GameType')),
+        difficulty=_name(DIFFICULTIES, data.get('Difficulty')),
+        hardcore=bool(data.get('hardcore', 0)),
+        time=data.get('Time'),
+        day_time=data.get('DayTime'),
+        last_played=data.get('LastPlayed'),
+        game_rules=dict(game_rules) if isinstance(game_rules, nbt.Compound) else {},
+    )
+
+
+class ItemStack(NamedTuple):
+    slot: int
+    id: str
+    count: int
+
+
+class PlayerInfo(NamedTuple):
+    uuid: str
+    # From the server's usercache.json, None for players not in there
+    name: str or None
+    dimension: str
+    # None if the player data has no (complete) position
+    position: tuple[float, float, float] or None
+    health: float
+    food_level: int
+    xp_level: int
+    game_type: str
+    inventory: list[ItemStack]
+    ender_items: list[ItemStack]
+
+    def to_dict(self, items: bool = True) -> dict:
+        result = {
+            'uuid': self.uuid, 'name': self.name, 'dimension': self.dimension,
+            'position': list(self.position) if self.position is not None else None,
+            'health': self.health, 'food-level': self.food_level, 'xp-level': self.xp_level, 'game-type': self.game_type,
+        }
+        if items:
+            result['inventory'] = [item._asdict() for item in self.inventory]
+            result['ender-items'] = [item._asdict() for item in self.ender_items]
+        return result
+
+
+def _items(items) -> list[ItemStack]:
+    if not isinstance(items, nbt.List):
+        return []
+    # The count was a byte "Count" before 1.20.5
+    return [ItemStack(item.get('Slot', -1), item.get('id'), item.get('count', item.get('Count', 1)))
+        for item in items if isinstance(item, nbt.Compound)]
+
+
+def read_player(path: str, names: dict[str, str] = None, items: bool = True) -> PlayerInfo:
+    uuid = os.path.basename(path).removesuffix('.dat')
+    data = nbt.load(path)
+    dimension = data.get('Dimension')
+    if isinstance(dimension, int):
+        dimension = DIMENSION_IDS.get(dimension, str(dimension))
+    position = data.get('Pos')
+    return PlayerInfo(
+        uuid=uuid,
+        name=(names or {}).get(uuid),
+        dimension=dimension,
+        position=tuple(position) if isinstance(position, nbt.List) and len(position) == 3 else None,
+        health=data.get('Health'),
+        food_level=data.get('foodLevel'),
+        xp_level=data.get('XpLevel'),
+        game_type=_name(GAME_TYPES, data.get('playerGameType')),
+        inventory=_items(data.get('Inventory')) if items else [],
+        ender_items=_items(data.get('EnderItems')) if items else [],
+    )
+
+
+def player_names(working_dir: str) -> dict[str, str]:
+    """ UUID -> name of the players the server has seen, from usercache.json
+    """
+    try:
+        with open(os.path.join(working_dir, 'usercache.json'), encoding='utf-8') as f:
+            return {entry['uuid']: entry['name'] for entry in json.load(f) if 'uuid' in entry and 'name' in entry}
+    except (OSError, ValueError, TypeError) as e:
+        logger.debug(f'No player names from usercache.json: {e}')
+        return {}
+
+
+def read_players(world_dir: str, names: dict[str, str] = None, items: bool = True, workers: int = None) -> list[PlayerInfo]:
+    """ All players with data in the world, read in parallel: with a large share of the time in decompressing
+    (which releases the GIL) and only the requested values decoded, threads are enough. Unreadable files are
+    logged and left out.
+    """
+    directory = os.path.join(world_dir, 'playerdata')
+    try:
+        paths = sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.dat'))
+    except FileNotFoundError:
+        return []
+
+    def read(path: str) -> PlayerInfo or None:
+        try:
+            return read_player(path, names, items)
+        except (OSError, MinecraftServerWrapperException) as e:
+            logger.warning(f'Could not read {path}: {e}')
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) + 4)) as pool:
+        return [player for player in pool.map(read, paths) if player is not None]
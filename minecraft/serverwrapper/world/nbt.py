@@ -0,0 +1,301 @@
+""" NBT (Minecraft's binary tag format) for level.dat, player data and chunks, read lazily
+
+A tag is its type (1 byte), its name (2 bytes length, modified UTF-8) and its payload, all big-endian. Files
+are decompressed in pieces as they're read (gzip or zlib, told apart by the zlib header) into one buffer, and
+everything after that works on a memoryview of it: a Compound only scans its children's names and positions
+when it's first used, and only decodes the ones that are looked up. Nested compounds and lists are views again,
+so reading a few values of a large file costs a walk over the tag headers, not a decode of all of it.
+
+find() looks up a single value in one pass, without building anything.
+"""
+from array import array
+from collections.abc import Mapping, Sequence
+import struct
+import sys
+import zlib
+
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+
+TAG_END = 0
+TAG_BYTE = 1
+TAG_SHORT = 2
+TAG_INT = 3
+TAG_LONG = 4
+TAG_FLOAT = 5
+TAG_DOUBLE = 6
+TAG_BYTE_ARRAY = 7
+TAG_STRING = 8
+TAG_LIST = 9
+TAG_COMPOUND = 10
+TAG_INT_ARRAY = 11
+TAG_LONG_ARRAY = 12
+
+_FIXED_SIZES = {TAG_BYTE: 1, TAG_SHORT: 2, TAG_INT: 4, TAG_LONG: 8, TAG_FLOAT: 4, TAG_DOUBLE: 8}
+_ARRAY_ITEM_SIZES = {TAG_BYTE_ARRAY: 1, TAG_INT_ARRAY: 4, TAG_LONG_ARRAY: 8}
+_ARRAY_TYPECODES = {TAG_BYTE_ARRAY: 'b', TAG_INT_ARRAY: 'i', TAG_LONG_ARRAY: 'q'}
+_SCALARS = {TAG_BYTE: struct.Struct('>b'), TAG_SHORT: struct.Struct('>h'), TAG_INT: struct.Struct('>i'),
+    TAG_LONG: struct.Struct('>q'), TAG_FLOAT: struct.Struct('>f'), TAG_DOUBLE: struct.Struct('>d')}
+
+# Compressed bytes read (and decompressed) at a time
+READ_SIZE = 1 << 16
+
+
+class NBTError(MinecraftServerWrapperException):
+    pass
+
+
+def read_file(path: str) -> memoryview:
+    """ The uncompressed NBT of a file, which may be gzip or zlib compressed or not at all
+    """
+    with open(path, 'rb') as f:
+        first = f.read(READ_SIZE)
+        if not first or first[0] == TAG_COMPOUND:
+            return memoryview(first + f.read())
+        decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        data = bytearray()
+        chunk = first
+        try:
+            while chunk:
+                data += decompressor.decompress(chunk)
+                chunk = f.read(READ_SIZE)
+            data += decompressor.flush()
+        except zlib.error as e:
+            raise NBTError(f'{path}: bad compressed NBT: {e}')
+        if not decompressor.eof:
+            raise NBTError(f'{path}: compressed NBT ends early.')
+    return memoryview(data)
+
+
+def _skip(data: bytes or memoryview, pos: int, tag: int) -> int:
+    """ The position after a payload of type tag at pos
+    """
+    if tag in _FIXED_SIZES:
+        return pos + _FIXED_SIZES[tag]
+    if tag in _ARRAY_ITEM_SIZES:
+        return pos + 4 + int.from_bytes(data[pos:pos + 4], 'big', signed=True) * _ARRAY_ITEM_SIZES[tag]
+    if tag == TAG_STRING:
+        return pos + 2 + int.from_bytes(data[pos:pos + 2], 'big')
+    if tag == TAG_LIST:
+        item_tag = data[pos]
+        count = int.from_bytes(data[pos + 1:pos + 5], 'big', signed=True)
+        pos += 5
+        if item_tag in _FIXED_SIZES:
+            return pos + max(count, 0) * _FIXED_SIZES[item_tag]
+        for _ in range(count):
+            pos = _skip(data, pos, item_tag)
+        return pos
+    if tag == TAG_COMPOUND:
+        while (child := data[pos]) != TAG_END:
+            pos = _skip(data, pos + 3 + int.from_bytes(data[pos + 1:pos + 3], 'big'), child)
+        return pos + 1
+    raise NBTError(f'Unknown tag type {tag:d}.')
+
+
+def _string(data: bytes or memoryview, pos: int) -> str:
+    length = int.from_bytes(data[pos:pos + 2], 'big')
+    if pos + 2 + length > len(data):
+        raise IndexError(pos)
+    # Modified UTF-8 only differs in NUL and characters outside the BMP, which names and ids don't have
+    return str(data[pos + 2:pos + 2 + length], 'utf-8', 'replace')
+
+
+def _value(data: memoryview, pos: int, tag: int):
+    """ The payload of type tag at pos: scalars and strings decoded, arrays copied into arrays, compounds and
+    lists as lazy views
+    """
+    if tag in _SCALARS:
+        return _SCALARS[tag].unpack_from(data, pos)[0]
+    if tag == TAG_STRING:
+        return _string(data, pos)
+    if tag == TAG_COMPOUND:
+        return Compound(data, pos)
+    if tag == TAG_LIST:
+        return List(data, pos)
+    if tag in _ARRAY_TYPECODES:
+        count = int.from_bytes(data[pos:pos + 4], 'big', signed=True)
+        end = pos + 4 + count * _ARRAY_ITEM_SIZES[tag]
+        if count < 0 or end > len(data):
+            raise IndexError(pos)
+        values = array(_ARRAY_TYPECODES[tag])
+        values.frombytes(data[pos + 4:end])
+        if sys.byteorder == 'little' and values.itemsize > 1:
+            values.byteswap()
+        return values
+    raise NBTError(f'Unknown tag type {tag:d}.')
+
+
+def to_python(value):
+    """ A value with all compounds and lists below it decoded, into dicts and lists
+    """
+    if isinstance(value, Compound):
+        return {name: to_python(child) for name, child in value.items()}
+    if isinstance(value, List):
+        return [to_python(item) for item in value]
+    return value
+
+
+class Compound(Mapping):
+    """ A compound tag, as a read-only mapping of names to values
+    """
+    __slots__ = ('_data', '_start', '_index')
+
+    def __init__(self, data: memoryview, start: int):
+        self._data = data
+        self._start = start
+        self._index = None
+
+    def _children(self) -> dict[str, tuple[int, int]]:
+        """ Name -> (tag type, payload position), found on first use
+        """
+        if self._index is None:
+            index = {}
+            data = self._data
+            pos = self._start
+            try:
+                while (tag := data[pos]) != TAG_END:
+                    name = _string(data, pos + 1)
+                    pos += 3 + int.from_bytes(data[pos + 1:pos + 3], 'big')
+                    index[name] = (tag, pos)
+                    pos = _skip(data, pos, tag)
+            except (IndexError, struct.error):
+                raise NBTError('NBT data ends early.')
+            self._index = index
+        return self._index
+
+    def __getitem__(self, name: str):
+        tag, pos = self._children()[name]
+        try:
+            return _value(self._data, pos, tag)
+        except (IndexError, struct.error):
+            raise NBTError('NBT data ends early.')
+
+    def __contains__(self, name) -> bool:
+        return name in self._children()
+
+    def __iter__(self):
+        return iter(self._children())
+
+    def __len__(self) -> int:
+        return len(self._children())
+
+    def __repr__(self) -> str:
+        return 'Compound({:s})'.format(', '.join(self._children()))
+
+    def tag_type(self, name: str) -> int:
+        return self._children()[name][0]
+
+    def path(self, path: str, default=None):
+        """ The value at a path like "Data/Version/Name" or "Inventory/0/id" (list items by index), default if
+        there is none
+        """
+        value = self
+        for part in path.split('/'):
+            if isinstance(value, Compound):
+                if part not in value:
+                    return default
+                value = value[part]
+            elif isinstance(value, List) and part.lstrip('-').isdigit() and -len(value) <= int(part) < len(value):
+                value = value[int(part)]
+            else:
+                return default
+        return value
+
+
+class List(Sequence):
+    """ A list tag, as a read-only sequence. Lists of numbers are decoded in one go, items of other lists are
+    found (and decoded) as they're used.
+    """
+    __slots__ = ('_data', '_tag', '_count', '_positions', '_values')
+
+    def __init__(self, data: memoryview, start: int):
+        self._data = data
+        self._tag = data[start]
+        self._count = max(int.from_bytes(data[start + 1:start + 5], 'big', signed=True), 0)
+        self._values = None
+        self._positions = None
+        if self._tag in _SCALARS:
+            item = _SCALARS[self._tag]
+            if start + 5 + self._count * item.size > len(data):
+                raise IndexError(start)
+            self._values = [values[0] for values in item.iter_unpack(data[start + 5:start + 5 + self._count * item.size])]
+        else:
+            self._positions = [start + 5]
+
+    def item_type(self) -> int:
+        return self._tag
+
+    def _position(self, index: int) -> int:
+        try:
+            while len(self._positions) <= index:
+                self._positions.append(_skip(self._data, self._positions[-1], self._tag))
+        except (IndexError, struct.error):
+            raise NBTError('NBT data ends early.')
+        return self._positions[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        if self._values is not None:
+            return self._values[index]
+        try:
+            return _value(self._data, self._position(index), self._tag)
+        except (IndexError, struct.error):
+            raise NBTError('NBT data ends early.')
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __repr__(self) -> str:
+        return f'List({self._count:d} items of type {self._tag:d})'
+
+
+def parse(data: bytes or memoryview) -> Compound:
+    """ The root compound of uncompressed NBT
+    """
+    data = memoryview(data)
+    try:
+        if data[0] != TAG_COMPOUND:
+            raise NBTError('The root tag is not a compound.')
+        return Compound(data, 3 + int.from_bytes(data[1:3], 'big'))
+    except IndexError:
+        raise NBTError('NBT data ends early.')
+
+
+def load(path: str) -> Compound:
+    return parse(read_file(path))
+
+
+def find(data: bytes or memoryview, path: str) -> int or float or str or None:
+    """ The value of a numeric or string tag at a path like "Data/SpawnX" below the root compound, None if
+    there is none
+    """
+    try:
+        if data[0] != TAG_COMPOUND:
+            raise NBTError('The root tag is not a compound.')
+        pos = 3 + int.from_bytes(data[1:3], 'big')
+        tag = TAG_COMPOUND
+        for name in path.split('/'):
+            if tag != TAG_COMPOUND:
+                return None
+            key = name.encode('utf-8')
+            while True:
+                tag = data[pos]
+                if tag == TAG_END:
+                    return None
+                length = int.from_bytes(data[pos + 1:pos + 3], 'big')
+                found = data[pos + 3:pos + 3 + length] == key
+                pos += 3 + length
+                if found:
+                    break
+                pos = _skip(data, pos, tag)
+        if tag in _SCALARS:
+            return _SCALARS[tag].unpack_from(data, pos)[0]
+        if tag == TAG_STRING:
+            return _string(data, pos)
+        return None
+    except (IndexError, struct.error):
+        raise NBTError('NBT data ends early.')
@@ -0,0 +1,208 @@
+""" Removes chunks players have hardly been in, so the server generates them again when someone gets there
+
+A chunk's InhabitedTime counts the ticks players spent near it. Chunks below a threshold that aren't in a
+protected area are dropped from their region file, together with their entities and points of interest, and
+the region file is written again without gaps. Regions are pruned in parallel, in a pool of processes: most of
+the time goes to decompressing and scanning chunk NBT.
+
+Only for stopped servers: locked_world() takes the world's session.lock like the server does, so neither can
+start while the other one has it.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import errno
+import fcntl
+import logging
+import os
+import struct
+from typing import Callable, Iterator, NamedTuple
+
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+from minecraft.serverwrapper.world import nbt
+from minecraft.serverwrapper.world.analyze import dimension_directories, region_paths
+from minecraft.serverwrapper.world.level import read_level
+from minecraft.serverwrapper.world.region import COMPRESSION_EXTERNAL, SECTOR_SIZE, RegionFile, chunk_coordinates, \
+    region_coordinates, write_region
+
+logger = logging.getLogger(__name__)
+
+TICKS_PER_SECOND = 20
+# A long named InhabitedTime: found by a byte search far quicker than by walking the NBT
+_INHABITED_TIME_TAG = bytes([nbt.TAG_LONG]) + len('InhabitedTime').to_bytes(2, 'big') + b'InhabitedTime'
+
+
+class ProtectedArea(NamedTuple):
+    dimension: str
+    # Chunk coordinates, inclusive
+    min_x: int
+    min_z: int
+    max_x: int
+    max_z: int
+
+    def contains(self, x: int, z: int) -> bool:
+        return self.min_x <= x <= self.max_x and self.min_z <= z <= self.max_z
+
+    @staticmethod
+    def from_blocks(dimension: str, x1: int, z1: int, x2: int, z2: int) -> 'ProtectedArea':
+        return ProtectedArea(dimension, min(x1, x2) >> 4, min(z1, z2) >> 4, max(x1, x2) >> 4, max(z1, z2) >> 4)
+
+
+def protected_areas(entries: list, spawn: tuple[int, int] = None, spawn_radius: int = 0) -> list[ProtectedArea]:
+    """ Areas from the configuration ({dimension, from: [x, z], to: [x, z]} in block coordinates), and the
+    square around the overworld spawn
+    """
+    areas = []
+    if spawn is not None and spawn_radius > 0:
+        areas.append(ProtectedArea.from_blocks('minecraft:overworld', spawn[0] - spawn_radius, spawn[1] - spawn_radius,
+            spawn[0] + spawn_radius, spawn[1] + spawn_radius))
+    for entry in entries:
+        try:
+            (x1, z1), (x2, z2) = entry['from'], entry['to']
+            areas.append(ProtectedArea.from_blocks(entry.get('dimension', 'minecraft:overworld'), int(x1), int(z1), int(x2), int(z2)))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise MinecraftServerWrapperException(
+                f'Bad protected area {entry!r}, expected e.g. {{dimension: minecraft:overworld, from: [-100, -100], to: [100, 100]}}.')
+    return areas
+
+
+def world_spawn(world_dir: str) -> tuple[int, int] or None:
+    try:
+        x, _, z = read_level(world_dir).spawn
+    except MinecraftServerWrapperException:
+        return None
+    return (x, z) if isinstance(x, int) and isinstance(z, int) else None
+
+
+def inhabited_ticks(chunk: bytes) -> int or None:
+    pos = chunk.find(_INHABITED_TIME_TAG)
+    if pos >= 0 and chunk.find(_INHABITED_TIME_TAG, pos + 1) < 0:
+        return struct.unpack_from('>q', chunk, pos + len(_INHABITED_TIME_TAG))[0]
+    # Not there, or a string somewhere happens to contain the same bytes: walk the NBT. Before 1.18, chunk
+    # data was below "Level".
+    value = nbt.find(chunk, 'InhabitedTime')
+    if value is None:
+        value = nbt.find(chunk, 'Level/InhabitedTime')
+    return value if isinstance(value, int) else None
+
+
+@contextmanager
+def locked_world(world_dir: str) -> Iterator[None]:
+    path = os.path.join(world_dir, 'session.lock')
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            if e.errno in (errno.EACCES, errno.EAGAIN):
+                raise MinecraftServerWrapperException(f'{world_dir} is in use, stop the server first.')
+            raise
+        yield
+    finally:
+        os.close(fd)
+
+
+class RegionPruneResult(NamedTuple):
+    path: str
+    chunks: int
+    removed: int
+    protected: int
+    # Chunks kept because their InhabitedTime couldn't be read
+    unreadable: int
+    bytes_before: int
+    bytes_after: int
+
+
+def _rewrite(region: RegionFile, removed: set[int], compact: bool) -> int:
+    """ Writes region without the removed chunks (and their external files), returns the new size
+    """
+    if not removed and not (compact and region.used_sectors() * SECTOR_SIZE < region.size):
+        return region.size
+    path = region.path()
+    try:
+        kept = [(index, region.raw_chunk(index), region.timestamps[index])
+            for index in region.chunk_indices() if index not in removed]
+        external = [region.external_chunk_path(index) for index in removed
+            if region.raw_chunk(index)[4] & COMPRESSION_EXTERNAL]
+    except MinecraftServerWrapperException as e:
+        # A chunk we can't copy would be lost
+        logger.warning(f'Leaving {path} as it is: {e}')
+        return region.size
+    try:
+        if kept:
+            size = write_region(path, kept)
+        else:
+            os.unlink(path)
+            size = 0
+    finally:
+        # The raw chunks are views into the map
+        del kept
+        region.close()
+    for external_path in external:
+        try:
+            os.unlink(external_path)
+        except FileNotFoundError:
+            pass
+    return size
+
+
+def prune_region(path: str, companions: list[str], max_inhabited_ticks: int, areas: list[ProtectedArea],
+        dry_run: bool = True, compact: bool = False) -> RegionPruneResult:
+    """ Runs in the process pool. companions are the entities and poi region files of the same region.
+    """
+    coordinates = region_coordinates(path)
+    removed = set()
+    protected = unreadable = 0
+    with RegionFile(path) as region:
+        bytes_before = region.size
+        chunks = region.chunk_count()
+        for index in region.chunk_indices():
+            if any(area.contains(*chunk_coordinates(coordinates, index)) for area in areas):
+                protected += 1
+                continue
+            try:
+                ticks = inhabited_ticks(region.chunk_nbt(index))
+            except (MinecraftServerWrapperException, OSError, ValueError) as e:
+                logger.debug(f'{path}: chunk {index:d}: {e}')
+                ticks = None
+            if ticks is None:
+                unreadable += 1
+            elif ticks < max_inhabited_ticks:
+                removed.add(index)
+        if dry_run:
+            # What the rewrite would leave, not counting the region files deleted when they end up empty
+            bytes_after = bytes_before
+            if removed or compact:
+                bytes_after = min(bytes_before, SECTOR_SIZE * (region.used_sectors()
+                    - sum(region.locations[index] & 0xff for index in removed)))
+        else:
+            bytes_after = _rewrite(region, removed, compact)
+    if not dry_run:
+        for companion in companions:
+            with RegionFile(companion) as region:
+                _rewrite(region, removed & set(region.chunk_indices()), compact)
+    return RegionPruneResult(path, chunks, len(removed), protected, unreadable, bytes_before, bytes_after)
+
+
+def prune_world(world_dir: str, max_inhabited_ticks: int, areas: list[ProtectedArea], dimensions: list[str] = None,
+        dry_run: bool = True, compact: bool = False, workers: int = None,
+        progress: Callable[[RegionPruneResult], None] = None) -> list[RegionPruneResult]:
+    """ Prunes every region of the given dimensions (default: all). Hold locked_world() around it.
+    """
+    results = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        futures = []
+        for name, directory in dimension_directories(world_dir).items():
+            if dimensions is not None and name not in dimensions:
+                continue
+            dimension_areas = [area for area in areas if area.dimension == name]
+            for path in region_paths(directory):
+                companions = [companion for companion in (os.path.join(directory, kind, os.path.basename(path))
+                    for kind in ('entities', 'poi')) if os.path.exists(companion)]
+                futures.append(pool.submit(prune_region, path, companions, max_inhabited_ticks, dimension_areas,
+                    dry_run, compact))
+        for future in futures:
+            result = future.result()
+            results.append(result)
+            if progress is not None:
+                progress(result)
+    return results
@@ -0,0 +1,185 @@
+""" Region files (.mca): 32x32 chunks in 4 KiB sectors, behind an 8 KiB header
+
+The header is the location (3 bytes sector offset, 1 byte sector count) and then the last save time (epoch
+seconds) of each chunk, all big-endian. A chunk starts with its length (4 bytes, including the compression
+type), the compression type (1 byte) and the compressed NBT. Chunks too large for the region are in a file
+c.<x>.<z>.mcc next to it, with the type's high bit set.
+
+Files are memory-mapped: the headers are parsed as arrays in one go, and chunk data is sliced out of the map
+without copying. Chunks, entities (entities/) and points of interest (poi/) all use this format.
+"""
+from array import array
+import gzip
+import mmap
+import os
+import re
+import sys
+import zlib
+
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+
+SECTOR_SIZE = 4096
+CHUNKS_PER_REGION = 1024
+REGION_HEADER_SIZE = 2 * SECTOR_SIZE
+REGION_NAME_PATTERN = re.compile(r'r\.(-?[0-9]+)\.(-?[0-9]+)\.mca$')
+
+COMPRESSION_GZIP = 1
+COMPRESSION_ZLIB = 2
+COMPRESSION_NONE = 3
+COMPRESSION_LZ4 = 4
+COMPRESSION_EXTERNAL = 0x80
+
+
+def region_coordinates(path: str) -> tuple[int, int] or None:
+    m = REGION_NAME_PATTERN.search(os.path.basename(path))
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+
+def chunk_coordinates(region: tuple[int, int], index: int) -> tuple[int, int]:
+    return region[0] * 32 + index % 32, region[1] * 32 + index // 32
+
+
+def parse_header(header: bytes or memoryview) -> tuple[array, array]:
+    """ The locations and timestamps of the 1024 chunks, as unsigned 32 bit arrays
+    """
+    locations = array('I')
+    locations.frombytes(header[:SECTOR_SIZE])
+    timestamps = array('I')
+    timestamps.frombytes(header[SECTOR_SIZE:REGION_HEADER_SIZE])
+    if sys.byteorder == 'little':
+        locations.byteswap()
+        timestamps.byteswap()
+    return locations, timestamps
+
+
+def decompress(compression: int, data: bytes or memoryview) -> bytes:
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(data)
+    if compression == COMPRESSION_GZIP:
+        return gzip.decompress(data)
+    if compression == COMPRESSION_NONE:
+        return bytes(data)
+    if compression == COMPRESSION_LZ4:
+        raise MinecraftServerWrapperException('LZ4 compressed chunks are not supported.')
+    raise MinecraftServerWrapperException(f'Unknown chunk compression {compression:d}.')
+
+
+class RegionFile:
+    """ A region file mapped read-only. Close it (or use it as a context manager) before replacing the file.
+    """
+    _path: str = None
+    _file = None
+    _map: mmap.mmap = None
+    _view: memoryview = None
+    coordinates: tuple[int, int] = None
+    size: int = 0
+    locations: array = None
+    timestamps: array = None
+
+    def __init__(self, path: str):
+        self._path = path
+        self.coordinates = region_coordinates(path)
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        if self.size < REGION_HEADER_SIZE:
+            # Empty files are left behind by the server; too short ones only have chunks we can't find
+            self.locations = array('I', bytes(SECTOR_SIZE))
+            self.timestamps = array('I', bytes(SECTOR_SIZE))
+            return
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self.locations, self.timestamps = parse_header(self._view[:REGION_HEADER_SIZE])
+
+    def __enter__(self) -> 'RegionFile':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def path(self) -> str:
+        return self._path
+
+    def chunk_count(self) -> int:
+        return CHUNKS_PER_REGION - self.locations.count(0)
+
+    def chunk_indices(self) -> list[int]:
+        return [index for index, location in enumerate(self.locations) if location != 0]
+
+    def used_sectors(self) -> int:
+        """ Including the header, so file sectors minus this are free
+        """
+        return REGION_HEADER_SIZE // SECTOR_SIZE + sum(location & 0xff for location in self.locations)
+
+    def raw_chunk(self, index: int) -> memoryview or None:
+        """ The chunk's length, compression type and data as stored, without the padding of its last sector
+        """
+        location = self.locations[index]
+        if location == 0 or self._view is None:
+            return None
+        start = (location >> 8) * SECTOR_SIZE
+        end = start + (location & 0xff) * SECTOR_SIZE
+        if start < REGION_HEADER_SIZE or end > self.size:
+            raise MinecraftServerWrapperException(f'Chunk {index:d} of {self._path} is outside of the file.')
+        length = int.from_bytes(self._view[start:start + 4], 'big')
+        if length < 1 or start + 4 + length > end:
+            raise MinecraftServerWrapperException(f'Chunk {index:d} of {self._path} has a bad length.')
+        return self._view[start:start + 4 + length]
+
+    def external_chunk_path(self, index: int) -> str:
+        x, z = chunk_coordinates(self.coordinates, index)
+        return os.path.join(os.path.dirname(self._path), f'c.{x:d}.{z:d}.mcc')
+
+    def chunk_nbt(self, index: int) -> bytes or None:
+        """ The chunk's uncompressed NBT
+        """
+        raw = self.raw_chunk(index)
+        if raw is None:
+            return None
+        compression = raw[4]
+        if compression & COMPRESSION_EXTERNAL:
+            with open(self.external_chunk_path(index), 'rb') as f:
+                return decompress(compression & ~COMPRESSION_EXTERNAL, f.read())
+        return decompress(compression, raw[5:])
+
+
+def write_region(path: str, chunks: list[tuple[int, bytes or memoryview, int]]) -> int:
+    """ Writes a compacted region file of (index, raw chunk, timestamp), raw chunks as from
+    RegionFile.raw_chunk(). Replaces path atomically, returns the new size.
+    """
+    locations = array('I', bytes(SECTOR_SIZE))
+    timestamps = array('I', bytes(SECTOR_SIZE))
+    sector = REGION_HEADER_SIZE // SECTOR_SIZE
+    for index, raw, timestamp in chunks:
+        sectors = -(-len(raw) // SECTOR_SIZE)
+        if sectors > 0xff:
+            raise MinecraftServerWrapperException(f'Chunk {index:d} is too large for a region file.')
+        locations[index] = (sector << 8) | sectors
+        timestamps[index] = timestamp
+        sector += sectors
+    if sys.byteorder == 'little':
+        locations.byteswap()
+        timestamps.byteswap()
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(locations.tobytes())
+        f.write(timestamps.tobytes())
+        for _, raw, _ in chunks:
+            f.write(raw)
+            padding = -len(raw) % SECTOR_SIZE
+            if padding:
+                f.write(bytes(padding))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return sector * SECTOR_SIZE
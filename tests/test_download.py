@@ -0,0 +1,148 @@
+""" Downloader against a local http.server standing in for the real download hosts
+"""
+import hashlib
+import http.server
+import json
+import threading
+
+import pytest
+
+from minecraft.serverwrapper.util import download
+from minecraft.serverwrapper.util.download import Artifact, DownloadError, Downloader
+
+CONTENT = bytes(range(256)) * 1024
+ETAG = '"v1"'
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """ Serves CONTENT at any path, with an ETag, ranges and conditional requests. The server's drop_next counts
+    down requests to answer with only half of the body, close_next ones to close without any response.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.server.close_next > 0:
+            self.server.close_next -= 1
+            self.close_connection = True
+            return
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.send_header('ETag', ETAG)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = CONTENT
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range', ETAG) == ETAG:
+            start = int(range_header.removeprefix('bytes=').split('-')[0])
+            body = CONTENT[start:]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start:d}-{len(CONTENT) - 1:d}/{len(CONTENT):d}')
+        else:
+            self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.server.drop_next > 0:
+            self.server.drop_next -= 1
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.requests = []
+    httpd.drop_next = 0
+    httpd.close_next = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(download.time, 'sleep', lambda seconds: None)
+
+
+def url(server, name: str = 'mod.jar') -> str:
+    return 'http://127.0.0.1:{:d}/{:s}'.format(server.server_address[1], name)
+
+
+def test_download(server, tmp_path):
+    dest = tmp_path / 'mod.jar'
+    with Downloader() as downloader:
+        assert downloader.download(Artifact(url(server), dest, sha256=hashlib.sha256(CONTENT).hexdigest())) == dest
+    assert dest.read_bytes() == CONTENT
+    assert not (tmp_path / 'mod.jar.part').exists()
+
+
+def test_resume_from_part_file(server, tmp_path):
+    dest = tmp_path / 'mod.jar'
+    (tmp_path / 'mod.jar.part').write_bytes(CONTENT[:1000])
+    (tmp_path / 'mod.jar.part.json').write_text(json.dumps({'etag': ETAG, 'resumable': True}))
+    with Downloader() as downloader:
+        downloader.download(Artifact(url(server), dest))
+    assert dest.read_bytes() == CONTENT
+    assert server.requests[0]['Range'] == 'bytes=1000-'
+    assert server.requests[0]['If-Range'] == ETAG
+
+
+def test_cache_revalidates_with_etag(server, tmp_path):
+    with Downloader(cache_dir=tmp_path / 'cache') as downloader:
+        downloader.download(Artifact(url(server), tmp_path / 'first.jar'))
+        downloader.download(Artifact(url(server), tmp_path / 'second.jar'))
+    assert 'If-None-Match' not in server.requests[0]
+    assert server.requests[1]['If-None-Match'] == ETAG
+    assert (tmp_path / 'second.jar').read_bytes() == CONTENT
+
+
+def test_shared_cache_downloads_once(server, tmp_path):
+    # Two Downloaders on one cache stand in for two processes: they only share the cache's lock files
+    def download(name):
+        with Downloader(cache_dir=tmp_path / 'cache') as downloader:
+            downloader.download(Artifact(url(server), tmp_path / name))
+    threads = [threading.Thread(target=download, args=(f'{i:d}.jar',)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (tmp_path / '0.jar').read_bytes() == CONTENT
+    assert (tmp_path / '1.jar').read_bytes() == CONTENT
+    assert ['If-None-Match' in headers for headers in server.requests] == [False, True]
+
+
+def test_checksum_mismatch_leaves_no_file(server, tmp_path):
+    dest = tmp_path / 'mod.jar'
+    with Downloader(retries=0) as downloader:
+        with pytest.raises(DownloadError):
+            downloader.download(Artifact(url(server), dest, sha256='0' * 64))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_retry_after_dropped_connection(server, tmp_path):
+    server.close_next = 1
+    dest = tmp_path / 'mod.jar'
+    with Downloader(retries=2) as downloader:
+        downloader.download(Artifact(url(server), dest))
+    assert dest.read_bytes() == CONTENT
+    assert len(server.requests) == 2
+
+
+def test_resume_after_connection_dropped_halfway(server, tmp_path):
+    server.drop_next = 1
+    dest = tmp_path / 'mod.jar'
+    with Downloader(retries=2) as downloader:
+        downloader.download(Artifact(url(server), dest))
+    assert dest.read_bytes() == CONTENT
+    assert server.requests[1]['Range'] == 'bytes={:d}-'.format(len(CONTENT) // 2)
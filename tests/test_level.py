@@ -0,0 +1,134 @@
+""" level.dat and playerdata/ of a small world written here
+"""
+import gzip
+import json
+import logging
+import struct
+
+import pytest
+
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+from minecraft.serverwrapper.world import nbt
+from minecraft.serverwrapper.world.level import ItemStack, player_names, read_level, read_players
+
+UUIDS = ['00000000-0000-0000-0000-000000000001', '00000000-0000-0000-0000-000000000002']
+
+
+def name(text: str) -> bytes:
+    return len(text).to_bytes(2, 'big') + text.encode('utf-8')
+
+
+def tag(tag_type: int, tag_name: str, payload: bytes) -> bytes:
+    return bytes([tag_type]) + name(tag_name) + payload
+
+
+def compound(*tags: bytes) -> bytes:
+    return b''.join(tags) + b'\x00'
+
+
+def root(*tags: bytes) -> bytes:
+    return gzip.compress(tag(nbt.TAG_COMPOUND, '', compound(*tags)))
+
+
+def level_dat(*extra: bytes) -> bytes:
+    return root(tag(nbt.TAG_COMPOUND, 'Data', compound(
+        tag(nbt.TAG_STRING, 'LevelName', name('world')),
+        tag(nbt.TAG_COMPOUND, 'Version', compound(tag(nbt.TAG_STRING, 'Name', name('1.21.1')))),
+        tag(nbt.TAG_INT, 'DataVersion', struct.pack('>i', 3955)),
+        tag(nbt.TAG_COMPOUND, 'WorldGenSettings', compound(tag(nbt.TAG_LONG, 'seed', struct.pack('>q', -42)))),
+        tag(nbt.TAG_INT, 'SpawnX', struct.pack('>i', 16)),
+        tag(nbt.TAG_INT, 'SpawnY', struct.pack('>i', 70)),
+        tag(nbt.TAG_INT, 'SpawnZ', struct.pack('>i', -32)),
+        tag(nbt.TAG_INT, 'GameType', struct.pack('>i', 0)),
+        tag(nbt.TAG_BYTE, 'Difficulty', bytes([2])),
+        tag(nbt.TAG_LONG, 'Time', struct.pack('>q', 72000)),
+        tag(nbt.TAG_COMPOUND, 'GameRules', compound(tag(nbt.TAG_STRING, 'keepInventory', name('true')))),
+        *extra,
+    )))
+
+
+def player_dat(x: float, position: bool = True) -> bytes:
+    stone = compound(tag(nbt.TAG_BYTE, 'Slot', bytes([0])), tag(nbt.TAG_STRING, 'id', name('minecraft:stone')),
+        tag(nbt.TAG_INT, 'count', struct.pack('>i', 64)))
+    # Before 1.20.5
+    dirt = compound(tag(nbt.TAG_BYTE, 'Slot', bytes([5])), tag(nbt.TAG_STRING, 'id', name('minecraft:dirt')),
+        tag(nbt.TAG_BYTE, 'Count', bytes([3])))
+    tags = [
+        # Before 1.16
+        tag(nbt.TAG_INT, 'Dimension', struct.pack('>i', -1)),
+        tag(nbt.TAG_FLOAT, 'Health', struct.pack('>f', 20.0)),
+        tag(nbt.TAG_INT, 'foodLevel', struct.pack('>i', 18)),
+        tag(nbt.TAG_INT, 'XpLevel', struct.pack('>i', 5)),
+        tag(nbt.TAG_INT, 'playerGameType', struct.pack('>i', 1)),
+        tag(nbt.TAG_LIST, 'Inventory', bytes([nbt.TAG_COMPOUND]) + struct.pack('>i', 2) + stone + dirt),
+        tag(nbt.TAG_LIST, 'EnderItems', bytes([nbt.TAG_END]) + struct.pack('>i', 0)),
+    ]
+    if position:
+        tags.append(tag(nbt.TAG_LIST, 'Pos', bytes([nbt.TAG_DOUBLE]) + struct.pack('>i3d', 3, x, 64.0, -x)))
+    return root(*tags)
+
+
+def test_read_level(tmp_path):
+    (tmp_path / 'level.dat').write_bytes(level_dat(tag(nbt.TAG_LONG, 'DayTime', struct.pack('>q', 30000))))
+    level = read_level(str(tmp_path))
+    assert level.name == 'world'
+    assert level.version == '1.21.1'
+    assert level.data_version == 3955
+    assert level.seed == -42
+    assert level.spawn == (16, 70, -32)
+    assert level.game_type == 'survival'
+    assert level.difficulty == 'normal'
+    assert not level.hardcore
+    assert level.time == 72000
+    assert level.day_time == 30000
+    assert level.game_rules == {'keepInventory': 'true'}
+    assert json.loads(json.dumps(level.to_dict()))['spawn'] == [16, 70, -32]
+
+
+def test_read_level_without_day_time(tmp_path):
+    (tmp_path / 'level.dat').write_bytes(level_dat())
+    level = read_level(str(tmp_path))
+    assert level.time == 72000
+    assert level.day_time is None
+    assert level.last_played is None
+
+
+def test_read_level_missing(tmp_path):
+    with pytest.raises(MinecraftServerWrapperException):
+        read_level(str(tmp_path))
+
+
+def test_read_players(tmp_path, caplog):
+    playerdata = tmp_path / 'playerdata'
+    playerdata.mkdir()
+    (playerdata / f'{UUIDS[0]}.dat').write_bytes(player_dat(1.5))
+    (playerdata / f'{UUIDS[1]}.dat').write_bytes(player_dat(2.5, position=False))
+    (playerdata / 'broken.dat').write_bytes(player_dat(3.5)[:40])
+    (playerdata / f'{UUIDS[0]}.dat_old').write_bytes(b'')
+    (tmp_path / 'usercache.json').write_text(json.dumps([{'uuid': UUIDS[0], 'name': 'alice'}]))
+
+    with caplog.at_level(logging.WARNING):
+        players = read_players(str(tmp_path), player_names(str(tmp_path)), workers=2)
+    assert 'broken.dat' in caplog.text
+    assert [player.uuid for player in players] == UUIDS
+    first, second = players
+    assert first.name == 'alice'
+    assert first.dimension == 'minecraft:the_nether'
+    assert first.position == (1.5, 64.0, -1.5)
+    assert first.health == 20.0
+    assert first.food_level == 18
+    assert first.xp_level == 5
+    assert first.game_type == 'creative'
+    assert first.inventory == [ItemStack(0, 'minecraft:stone', 64), ItemStack(5, 'minecraft:dirt', 3)]
+    assert first.ender_items == []
+    assert second.name is None
+    assert second.position is None
+    assert second.to_dict()['position'] is None
+
+    players = read_players(str(tmp_path), items=False)
+    assert players[0].inventory == []
+    assert 'inventory' not in players[0].to_dict(items=False)
+
+
+def test_read_players_without_playerdata(tmp_path):
+    assert read_players(str(tmp_path)) == []
@@ -0,0 +1,127 @@
+""" NBT reading against small documents encoded here, raw and compressed
+"""
+import gzip
+import struct
+import zlib
+
+import pytest
+
+from minecraft.serverwrapper.world import nbt
+
+
+def name(text: str) -> bytes:
+    return len(text).to_bytes(2, 'big') + text.encode('utf-8')
+
+
+def tag(tag_type: int, tag_name: str, payload: bytes) -> bytes:
+    return bytes([tag_type]) + name(tag_name) + payload
+
+
+def compound(*tags: bytes) -> bytes:
+    return b''.join(tags) + b'\x00'
+
+
+def document() -> bytes:
+    items = [compound(tag(nbt.TAG_BYTE, 'Slot', bytes([slot])), tag(nbt.TAG_STRING, 'id', name(f'minecraft:item_{slot:d}')))
+        for slot in range(3)]
+    return tag(nbt.TAG_COMPOUND, '', compound(
+        tag(nbt.TAG_INT, 'Int', struct.pack('>i', -7)),
+        tag(nbt.TAG_LONG, 'Long', struct.pack('>q', 1 << 40)),
+        tag(nbt.TAG_STRING, 'Name', name('world')),
+        tag(nbt.TAG_LIST, 'Pos', bytes([nbt.TAG_DOUBLE]) + struct.pack('>i3d', 3, 1.5, 64.0, -2.5)),
+        tag(nbt.TAG_LIST, 'Items', bytes([nbt.TAG_COMPOUND]) + struct.pack('>i', len(items)) + b''.join(items)),
+        tag(nbt.TAG_INT_ARRAY, 'Ints', struct.pack('>i3i', 3, 1, -2, 3)),
+        tag(nbt.TAG_COMPOUND, 'Data', compound(tag(nbt.TAG_COMPOUND, 'Version', compound(
+            tag(nbt.TAG_STRING, 'Name', name('1.21')))))),
+    ))
+
+
+def test_values():
+    root = nbt.parse(document())
+    assert root['Int'] == -7
+    assert root['Long'] == 1 << 40
+    assert root['Name'] == 'world'
+    assert list(root['Pos']) == [1.5, 64.0, -2.5]
+    assert list(root['Ints']) == [1, -2, 3]
+    assert root.tag_type('Items') == nbt.TAG_LIST
+    assert root.path('Data/Version/Name') == '1.21'
+    assert root.path('Items/2/id') == 'minecraft:item_2'
+    assert root.path('Items/-1/Slot') == 2
+    assert root.path('Items/3/id') is None
+    assert root.path('Data/Missing', 'default') == 'default'
+    assert nbt.to_python(root['Items']) == [{'Slot': slot, 'id': f'minecraft:item_{slot:d}'} for slot in range(3)]
+
+
+def test_compounds_and_lists_are_lazy():
+    root = nbt.parse(document())
+    assert root._index is None
+    data = root['Data']
+    assert data._index is None
+    assert set(root) == {'Int', 'Long', 'Name', 'Pos', 'Items', 'Ints', 'Data'}
+    assert data._index is None
+
+    pos = root['Pos']
+    assert pos._values == [1.5, 64.0, -2.5]
+    assert pos._positions is None
+    items = root['Items']
+    assert items._values is None
+    assert len(items._positions) == 1
+    assert items[1]['Slot'] == 1
+    assert len(items._positions) == 2
+    assert items[0]._index is None
+
+
+def test_find():
+    data = document()
+    assert nbt.find(data, 'Int') == -7
+    assert nbt.find(data, 'Data/Version/Name') == '1.21'
+    assert nbt.find(data, 'Missing') is None
+    assert nbt.find(data, 'Int/Below') is None
+    # Only numbers and strings
+    assert nbt.find(data, 'Pos') is None
+
+
+@pytest.mark.parametrize('end', [1, 10, 40, 100])
+def test_truncated_data(end):
+    data = document()[:end]
+    with pytest.raises(nbt.NBTError):
+        root = nbt.parse(data)
+        nbt.to_python(root)
+    with pytest.raises(nbt.NBTError):
+        nbt.find(data, 'Data/Version/Name')
+
+
+def test_not_a_compound():
+    with pytest.raises(nbt.NBTError):
+        nbt.parse(tag(nbt.TAG_INT, '', struct.pack('>i', 1)))
+
+
+@pytest.mark.parametrize('compress', [lambda data: data, gzip.compress, zlib.compress], ids=['raw', 'gzip', 'zlib'])
+def test_read_file(tmp_path, compress):
+    path = tmp_path / 'level.dat'
+    path.write_bytes(compress(document()))
+    assert bytes(nbt.read_file(str(path))) == document()
+    assert nbt.load(str(path)).path('Data/Version/Name') == '1.21'
+
+
+def test_read_file_across_reads(tmp_path, monkeypatch):
+    monkeypatch.setattr(nbt, 'READ_SIZE', 16)
+    path = tmp_path / 'level.dat'
+    path.write_bytes(gzip.compress(document()))
+    assert bytes(nbt.read_file(str(path))) == document()
+
+
+@pytest.mark.parametrize('compress', [gzip.compress, zlib.compress], ids=['gzip', 'zlib'])
+def test_read_truncated_file(tmp_path, compress):
+    path = tmp_path / 'level.dat'
+    data = compress(document())
+    path.write_bytes(data[:len(data) // 2])
+    with pytest.raises(nbt.NBTError, match='ends early'):
+        nbt.read_file(str(path))
+
+
+def test_read_corrupt_file(tmp_path):
+    path = tmp_path / 'level.dat'
+    path.write_bytes(b'\x1f\x8b' + bytes(range(64)))
+    with pytest.raises(nbt.NBTError, match='bad compressed'):
+        nbt.read_file(str(path))
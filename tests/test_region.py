@@ -0,0 +1,152 @@
+""" Region files written with write_region, read back and pruned
+"""
+import os
+import struct
+import zlib
+
+import pytest
+
+from minecraft.serverwrapper.util.exceptions import MinecraftServerWrapperException
+from minecraft.serverwrapper.world.prune import ProtectedArea, prune_region
+from minecraft.serverwrapper.world.region import COMPRESSION_EXTERNAL, COMPRESSION_ZLIB, REGION_HEADER_SIZE, \
+    SECTOR_SIZE, RegionFile, write_region
+
+TIMESTAMP = 1700000000
+
+
+def name(text: str) -> bytes:
+    return len(text).to_bytes(2, 'big') + text.encode('utf-8')
+
+
+def chunk_nbt(index: int, ticks: int, size: int = 100) -> bytes:
+    return (b'\x0a' + name('') + b'\x04' + name('InhabitedTime') + struct.pack('>q', ticks)
+        + b'\x07' + name('Sections') + struct.pack('>i', size) + bytes([index % 256]) * size + b'\x00')
+
+
+def raw_chunk(data: bytes, compression: int = COMPRESSION_ZLIB) -> bytes:
+    compressed = zlib.compress(data) if compression == COMPRESSION_ZLIB else b''
+    return (len(compressed) + 1).to_bytes(4, 'big') + bytes([compression]) + compressed
+
+
+def write(path, ticks: dict[int, int], sizes: dict[int, int] = None) -> dict[int, bytes]:
+    """ A region of chunks with the given InhabitedTime, returns their NBT
+    """
+    chunks = {index: chunk_nbt(index, value, (sizes or {}).get(index, 100)) for index, value in ticks.items()}
+    write_region(str(path), [(index, raw_chunk(data), TIMESTAMP + index) for index, data in chunks.items()])
+    return chunks
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'r.0.0.mca'
+    # One chunk spans several sectors
+    chunks = write(path, {0: 10, 5: 20, 1023: 30}, sizes={5: 3 * SECTOR_SIZE})
+    with RegionFile(str(path)) as region:
+        assert region.coordinates == (0, 0)
+        assert region.chunk_indices() == [0, 5, 1023]
+        assert region.used_sectors() * SECTOR_SIZE == region.size
+        for index, data in chunks.items():
+            assert region.chunk_nbt(index) == data
+            assert bytes(region.raw_chunk(index)) == raw_chunk(data)
+            assert region.timestamps[index] == TIMESTAMP + index
+        assert region.raw_chunk(1) is None
+        assert region.chunk_nbt(1) is None
+
+
+def test_truncated_region(tmp_path):
+    path = tmp_path / 'r.0.0.mca'
+    write(path, {0: 10, 1: 20})
+    with open(path, 'r+b') as f:
+        f.truncate(REGION_HEADER_SIZE + SECTOR_SIZE)
+    with RegionFile(str(path)) as region:
+        assert region.chunk_nbt(0) is not None
+        with pytest.raises(MinecraftServerWrapperException):
+            region.raw_chunk(1)
+
+
+def test_empty_region(tmp_path):
+    path = tmp_path / 'r.0.0.mca'
+    path.write_bytes(b'')
+    with RegionFile(str(path)) as region:
+        assert region.chunk_count() == 0
+        assert region.raw_chunk(0) is None
+
+
+def test_prune_keeps_chunks_intact(tmp_path):
+    path = tmp_path / 'r.-1.2.mca'
+    chunks = write(path, {0: 0, 1: 5000, 2: 10, 3: 20000, 40: 0, 41: 50000})
+    with RegionFile(str(path)) as region:
+        raw = {index: bytes(region.raw_chunk(index)) for index in chunks}
+        size = region.size
+    # Chunk 40 is at x -32 + 8 = -24, z 64 + 1 = 65
+    areas = [ProtectedArea('minecraft:overworld', -24, 65, -24, 65)]
+
+    result = prune_region(str(path), [], 1200, areas, dry_run=True)
+    assert (result.chunks, result.removed, result.protected, result.unreadable) == (6, 2, 1, 0)
+    assert result.bytes_after == size - 2 * SECTOR_SIZE
+    assert os.path.getsize(path) == size
+
+    result = prune_region(str(path), [], 1200, areas, dry_run=False)
+    assert result.removed == 2
+    assert result.bytes_after == os.path.getsize(path) == size - 2 * SECTOR_SIZE
+    with RegionFile(str(path)) as region:
+        assert region.chunk_indices() == [1, 3, 40, 41]
+        for index in region.chunk_indices():
+            assert bytes(region.raw_chunk(index)) == raw[index]
+            assert region.chunk_nbt(index) == chunks[index]
+            assert region.timestamps[index] == TIMESTAMP + index
+
+
+def test_prune_companions_and_external_chunks(tmp_path):
+    path = tmp_path / 'r.0.0.mca'
+    chunks = write(path, {0: 0, 1: 5000})
+    entities = tmp_path / 'entities'
+    entities.mkdir()
+    companion = entities / 'r.0.0.mca'
+    external = entities / 'c.0.0.mcc'
+    external.write_bytes(zlib.compress(b'entities'))
+    kept = raw_chunk(b'entities of chunk 1')
+    write_region(str(companion), [(0, raw_chunk(b'', COMPRESSION_ZLIB | COMPRESSION_EXTERNAL), TIMESTAMP),
+        (1, kept, TIMESTAMP)])
+
+    result = prune_region(str(path), [str(companion)], 1200, [], dry_run=False)
+    assert result.removed == 1
+    assert not external.exists()
+    with RegionFile(str(path)) as region:
+        assert region.chunk_indices() == [1]
+        assert region.chunk_nbt(1) == chunks[1]
+    with RegionFile(str(companion)) as region:
+        assert region.chunk_indices() == [1]
+        assert bytes(region.raw_chunk(1)) == kept
+
+
+def test_prune_everything_removes_the_region(tmp_path):
+    path = tmp_path / 'r.0.0.mca'
+    write(path, {0: 0, 1: 10})
+    result = prune_region(str(path), [], 1200, [], dry_run=False)
+    assert result.removed == 2
+    assert result.bytes_after == 0
+    assert not path.exists()
+
+
+def test_compact(tmp_path):
+    path = tmp_path / 'r.0.0.mca'
+    chunks = write(path, {0: 5000, 1: 5000, 2: 5000})
+    # Leave a hole where the server would have moved a chunk that grew: chunk 1's old sectors stay behind
+    with RegionFile(str(path)) as region:
+        raw = {index: bytes(region.raw_chunk(index)) for index in chunks}
+        size = region.size
+    with open(path, 'r+b') as f:
+        f.seek(4)
+        f.write(((size // SECTOR_SIZE) << 8 | 1).to_bytes(4, 'big'))
+        f.seek(size)
+        f.write(raw[1] + bytes(-len(raw[1]) % SECTOR_SIZE))
+
+    assert prune_region(str(path), [], 1200, [], dry_run=False).bytes_after == size + SECTOR_SIZE
+    result = prune_region(str(path), [], 1200, [], dry_run=False, compact=True)
+    assert result.removed == 0
+    assert result.bytes_after == os.path.getsize(path) == size
+    with RegionFile(str(path)) as region:
+        assert region.used_sectors() * SECTOR_SIZE == region.size
+        for index, data in chunks.items():
+            assert bytes(region.raw_chunk(index)) == raw[index]
+            assert region.chunk_nbt(index) == data